@@ -0,0 +1,168 @@
+# arrow_results.py
+"""
+Arrow-native result path: database -> pyarrow.Table -> Arrow-backed DataFrame -> viz code.
+
+- fetch_arrow(engine, sql) builds a pyarrow.Table column-wise: via connectorx (columnar MySQL
+  reader) when installed, else from the DB-API rows without an intermediate object DataFrame.
+  DuckDB returns Arrow natively (execution_backends).
+- to_frame(table) keeps Arrow memory: strings/numerics become pd.ArrowDtype columns (no Python
+  objects); timestamps stay datetime64 so the usual .dt API (e.g. to_period) works in viz code.
+  DECIMAL is cast to float64. ARROW_DTYPES=0 restores plain numpy dtypes.
+- schema_summary(df) / sample_summary(df) build the prompt context from Arrow metadata (types,
+  null counts) and a 5-row slice instead of DataFrame reprs.
+- to_csv_bytes / to_parquet_bytes write downloads straight from Arrow.
+- Fetch and conversion times and result sizes go to METRICS; `python arrow_results.py [batch_dir]`
+  compares time and peak memory against pd.read_sql on the standard query set.
+"""
+import io
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+from config import ARROW_DTYPES
+from telemetry import METRICS
+
+def _column_array(values) -> pa.Array:
+    try:
+        return pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # mixed Python types in one column (rare): keep it readable as text
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+def rows_to_arrow(names: List[str], rows) -> pa.Table:
+    """DB-API rows -> pyarrow.Table, transposed column by column."""
+    cols = list(zip(*rows)) if rows else [() for _ in names]
+    return pa.Table.from_arrays([_column_array(list(c)) for c in cols], names=names)
+
+def _normalize(table: pa.Table) -> pa.Table:
+    """DECIMAL -> float64 (MySQL money columns); everything else untouched."""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+    return table
+
+def _fetch_connectorx(engine, sql: str) -> Optional[pa.Table]:
+    try:
+        import connectorx as cx
+    except ImportError:
+        return None
+    url = engine.url.set(drivername="mysql").render_as_string(hide_password=False)
+    return cx.read_sql(url, sql, return_type="arrow")
+
+def fetch_arrow(engine, sql: str, on_connect: Optional[Callable] = None) -> pa.Table:
+    """Run `sql` and return the result as a pyarrow.Table.
+    on_connect(conn) runs on the connection first and may return a cleanup callable
+    (used to make the query killable; connectorx is skipped then, it opens its own connection)."""
+    from sqlalchemy import text
+
+    t0 = time.perf_counter()
+    use_cx = engine.dialect.name == "mysql" and on_connect is None
+    table = _fetch_connectorx(engine, sql) if use_cx else None
+    if table is None:
+        with engine.connect() as conn:
+            cleanup = on_connect(conn) if on_connect else None
+            try:
+                result = conn.execute(text(sql))
+                names = list(result.keys())
+                rows = result.fetchall()
+            finally:
+                if cleanup:
+                    cleanup()
+        table = rows_to_arrow(names, rows)
+    METRICS.observe("result_fetch_seconds", time.perf_counter() - t0)
+    return _normalize(table)
+
+def _types_mapper(arrow_type: pa.DataType):
+    if pa.types.is_temporal(arrow_type):
+        return None  # numpy datetime64: cheap fixed-width copy, full .dt API
+    return pd.ArrowDtype(arrow_type)
+
+def to_frame(table: pa.Table) -> pd.DataFrame:
+    """Arrow table -> DataFrame (Arrow-backed unless ARROW_DTYPES=0)."""
+    t0 = time.perf_counter()
+    table = _normalize(table)
+    df = table.to_pandas(types_mapper=_types_mapper) if ARROW_DTYPES else table.to_pandas()
+    METRICS.observe("result_convert_seconds", time.perf_counter() - t0)
+    METRICS.observe("result_arrow_bytes", table.nbytes)
+    return df
+
+def as_arrow(df: pd.DataFrame) -> pa.Table:
+    """DataFrame -> Arrow (zero-copy for ArrowDtype columns)."""
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+# ---------------- Prompt summaries ----------------
+def schema_summary(df: pd.DataFrame) -> str:
+    """One line per column: name, Arrow type, null count; plus the row count."""
+    if df is None or df.empty:
+        return "EMPTY"
+    table = as_arrow(df)
+    lines = [f"{f.name}: {f.type} (nulls={table.column(i).null_count})" for i, f in enumerate(table.schema)]
+    return "\n".join(lines + [f"rows: {table.num_rows}"])
+
+def sample_summary(df: pd.DataFrame, n: int = 5) -> str:
+    """First `n` rows as pipe-separated text (a slice; nothing is copied)."""
+    if df is None or df.empty:
+        return "EMPTY"
+    head = as_arrow(df).slice(0, n)
+    cols = head.column_names
+    rows = [" | ".join(cols)]
+    for rec in head.to_pylist():
+        rows.append(" | ".join("NULL" if rec[c] is None else str(rec[c]) for c in cols))
+    return "\n".join(rows)
+
+# ---------------- Downloads ----------------
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    import pyarrow.csv as pacsv
+
+    sink = io.BytesIO()
+    pacsv.write_csv(as_arrow(df), sink)
+    return sink.getvalue()
+
+def to_parquet_bytes(df: pd.DataFrame) -> bytes:
+    import pyarrow.parquet as pq
+
+    sink = io.BytesIO()
+    pq.write_table(as_arrow(df), sink)
+    return sink.getvalue()
+
+# ---------------- Benchmark ----------------
+def _measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = fn()
+    secs = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, secs, peak
+
+def benchmark(engine, queries: Dict[str, str]) -> List[dict]:
+    """Per query: time and peak Python heap of pd.read_sql vs the Arrow path, and frame sizes.
+    (tracemalloc sees Python allocations only; Arrow buffers are reported via arrow_bytes.)"""
+    from sqlalchemy import text
+
+    report = []
+    for name, sql in queries.items():
+        old, old_s, old_peak = _measure(lambda: pd.read_sql(text(sql), con=engine))
+        new, new_s, new_peak = _measure(lambda: to_frame(fetch_arrow(engine, sql)))
+        report.append({
+            "query": name, "rows": len(new),
+            "read_sql_s": round(old_s, 4), "arrow_s": round(new_s, 4),
+            "read_sql_peak_mb": round(old_peak / 2**20, 2), "arrow_peak_mb": round(new_peak / 2**20, 2),
+            "read_sql_frame_mb": round(old.memory_usage(deep=True).sum() / 2**20, 2),
+            "arrow_frame_mb": round(new.memory_usage(deep=True).sum() / 2**20, 2),
+        })
+    return report
+
+if __name__ == "__main__":
+    from config import get_engine
+    from execution_backends import standard_sql_set
+
+    batch_dir = sys.argv[1] if len(sys.argv) > 1 else None
+    for r in benchmark(get_engine(), standard_sql_set(batch_dir)):
+        print(f"{r['query']:<28} rows={r['rows']:<6} time {r['read_sql_s']:.4f}s -> {r['arrow_s']:.4f}s  "
+              f"peak {r['read_sql_peak_mb']}MB -> {r['arrow_peak_mb']}MB  "
+              f"frame {r['read_sql_frame_mb']}MB -> {r['arrow_frame_mb']}MB")
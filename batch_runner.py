@@ -0,0 +1,225 @@
+# batch_runner.py
+"""
+Batch mode for pre-generating answers.
+
+Reads questions from CSV/JSONL, runs nlq_to_viz_workflow.run with bounded concurrency
+(LLM client, DB engine and DISTINCT-value cache are shared process-wide), checkpoints
+every finished question so a rerun resumes where it stopped, and writes per question:
+  <out_dir>/<id>/query.sql, result.parquet, figure.json   (ids made path-safe, duplicates rejected)
+plus <out_dir>/summary.json (throughput, failure rate, per-stage latency percentiles).
+
+CLI:
+  python batch_runner.py questions.csv --out batch_out --concurrency 4
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from rate_limiter import priority_class
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+SUMMARY_FILE = "summary.json"
+
+def _question_id(question: str) -> str:
+    return hashlib.sha1(question.strip().encode("utf-8")).hexdigest()[:12]
+
+def _safe_id(qid: str) -> str:
+    """An id usable as one directory name under out_dir (no separators, no "..", bounded length)."""
+    safe = re.sub(r"[^A-Za-z0-9._-]+", "_", qid).strip("._")[:100]
+    return safe or _question_id(qid)
+
+def load_questions(path: str) -> List[Dict[str, str]]:
+    """Read [{"id", "question"}, ...] from a .csv (column `question`, optional `id`) or .jsonl file.
+    Ids are made path-safe; duplicate ids (after that) are rejected with ValueError."""
+    rows: List[Dict[str, Any]] = []
+    if path.lower().endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    rows.append(json.loads(line))
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+
+    out: List[Dict[str, str]] = []
+    seen: Dict[str, str] = {}
+    duplicates: List[str] = []
+    for r in rows:
+        q = str(r.get("question") or "").strip()
+        if not q:
+            continue
+        raw = str(r.get("id") or "").strip()
+        qid = _safe_id(raw) if raw else _question_id(q)
+        if qid in seen:
+            duplicates.append(f"{raw or q[:60]!r} (as {qid})")
+            continue
+        seen[qid] = raw
+        out.append({"id": qid, "question": q})
+    if duplicates:
+        raise ValueError(f"duplicate question ids in {path}: {', '.join(duplicates[:10])}")
+    return out
+
+def _load_checkpoint(out_dir: str) -> Dict[str, Dict[str, Any]]:
+    path = os.path.join(out_dir, CHECKPOINT_FILE)
+    done: Dict[str, Dict[str, Any]] = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a torn last line from an interrupted run
+            done[rec["id"]] = rec
+    return done
+
+def _write_outputs(qdir: str, state: Dict[str, Any]) -> None:
+    import pandas as pd
+
+    os.makedirs(qdir, exist_ok=True)
+    with open(os.path.join(qdir, "query.sql"), "w", encoding="utf-8") as f:
+        f.write(state.get("sql", "") or "")
+
+    df = state.get("df")
+    if isinstance(df, pd.DataFrame):
+        df.to_parquet(os.path.join(qdir, "result.parquet"), index=False)
+
+    fig_json = (state.get("python_code_store_variables_dict") or {}).get("fig_json")
+    if fig_json:
+        with open(os.path.join(qdir, "figure.json"), "w", encoding="utf-8") as f:
+            f.write(fig_json)
+
+def _percentiles(values: List[float], ps=(50, 90, 95, 99)) -> Dict[str, float]:
+    if not values:
+        return {}
+    s = sorted(values)
+    out = {}
+    for p in ps:
+        k = min(len(s) - 1, max(0, int(round(p / 100.0 * (len(s) - 1)))))
+        out[f"p{p}"] = round(s[k], 4)
+    return out
+
+def summarize(records: Iterable[Dict[str, Any]], wall_s: Optional[float] = None) -> Dict[str, Any]:
+    """Throughput, failure rates and per-stage latency percentiles over checkpoint records."""
+    recs = list(records)
+    statuses: Dict[str, int] = {}
+    stage_times: Dict[str, List[float]] = {}
+    durations: List[float] = []
+    for r in recs:
+        statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+        durations.append(r.get("duration_s", 0.0))
+        for stage, secs in (r.get("timings") or {}).items():
+            stage_times.setdefault(stage, []).append(secs)
+
+    n = len(recs)
+    failed = n - statuses.get("ok", 0)
+    summary: Dict[str, Any] = {
+        "questions": n,
+        "statuses": statuses,
+        "failure_rate": round(failed / n, 4) if n else 0.0,
+        "latency_s": _percentiles(durations),
+        "stage_latency_s": {k: _percentiles(v) for k, v in sorted(stage_times.items())},
+    }
+    if wall_s:
+        summary["wall_s"] = round(wall_s, 3)
+        summary["throughput_per_min"] = round(n / wall_s * 60.0, 3)
+    return summary
+
+def run_batch(
+    questions: List[Dict[str, str]],
+    out_dir: str,
+    *,
+    concurrency: int = 4,
+    max_retries: int = 3,
+    retry_failed: bool = False,
+    runner: Optional[Callable[..., Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    Run questions with at most `concurrency` in flight. Questions already in the checkpoint
+    are skipped (failed ones are rerun when retry_failed=True). Returns the summary dict.
+    Ids must be unique (load_questions guarantees it); each gets <out_dir>/<safe id>/.
+    """
+    if runner is None:
+        from nlq_to_viz_workflow import run as runner
+
+    ids = [_safe_id(q["id"]) for q in questions]
+    if len(set(ids)) != len(ids):
+        raise ValueError("question ids must be unique: two questions would share an output directory")
+    os.makedirs(out_dir, exist_ok=True)
+    done = _load_checkpoint(out_dir)
+    pending = [
+        q for q in questions
+        if q["id"] not in done or (retry_failed and done[q["id"]]["status"] != "ok")
+    ]
+    ckpt_lock = threading.Lock()
+    ckpt_path = os.path.join(out_dir, CHECKPOINT_FILE)
+
+    def _one(item: Dict[str, str]) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        rec: Dict[str, Any] = {"id": item["id"], "question": item["question"]}
+        try:
+            with priority_class("batch"):
+                state = runner(item["question"], max_retries=max_retries)
+            _write_outputs(os.path.join(out_dir, _safe_id(item["id"])), state)
+            rec["viz_status"] = state.get("result_debug_python_code_data_visualization", "")
+            if state.get("status", "ok") != "ok":  # timeout / cancelled / budget: not an SQL or viz failure
+                rec["status"] = state["status"]
+                rec["error"] = str(state.get("status_detail", ""))[:600]
+            elif state.get("result_debug_sql") != "Pass":
+                rec["status"] = "sql_failed"
+            else:
+                rec["status"] = "viz_failed" if rec["viz_status"] == "Not Pass" else "ok"
+            rec["timings"] = state.get("timings", {})
+            rec["trace_id"] = state.get("trace_id", "")
+        except Exception as e:
+            rec["status"] = "error"
+            rec["error"] = f"{type(e).__name__}: {e}"[:600]
+        rec["duration_s"] = round(time.perf_counter() - t0, 4)
+        with ckpt_lock, open(ckpt_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False, default=str) + "\n")
+        return rec
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, int(concurrency))) as pool:
+        futures = [pool.submit(_one, q) for q in pending]
+        for fut in as_completed(futures):
+            rec = fut.result()
+            done[rec["id"]] = rec
+            print(f"[{len(done)}/{len(questions)}] {rec['status']:<10} {rec['id']}  {rec['duration_s']}s")
+    wall = time.perf_counter() - t0
+
+    wanted = {q["id"] for q in questions}
+    summary = summarize((r for k, r in done.items() if k in wanted), wall_s=wall if pending else None)
+    summary["ran_this_invocation"] = len(pending)
+    with open(os.path.join(out_dir, SUMMARY_FILE), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Run many NL questions through the SQL/viz pipeline.")
+    ap.add_argument("input", help="CSV (column 'question', optional 'id') or JSONL file")
+    ap.add_argument("--out", default="batch_out", help="output directory (also holds the checkpoint)")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--max-retries", type=int, default=3)
+    ap.add_argument("--retry-failed", action="store_true", help="rerun questions that failed previously")
+    args = ap.parse_args(argv)
+
+    summary = run_batch(
+        load_questions(args.input),
+        args.out,
+        concurrency=args.concurrency,
+        max_retries=args.max_retries,
+        retry_failed=args.retry_failed,
+    )
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -10,13 +10,17 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableMap
 from langchain_core.output_parsers import StrOutputParser
 
-from config import get_llm, get_engine
+from config import KB_SAMPLE_SEED, get_llm, get_engine
+from rate_limiter import priority_class
+from table_sampling import sample_table
+from telemetry import METRICS
+from utils_parsing import extract_json
 
 # ---- LLM & DB (centralized; defaults keep original behavior) ----
 llm = get_llm()
 engine = get_engine()
 
-# Human-written base descriptions (kept)
+# Human-written base descriptions (kept); other discovered tables start from their COMMENT
 table_description = {
     'order_items': """Contains item-level rows for each order, including seller_id, product_id, item price, and freight value. Each order can have multiple items (and sellers).""",
     'customer': """Contains customer records and their location (city, state).""",
@@ -28,10 +32,13 @@ table_description = {
     'category_translation': """Maps Portuguese product_category_name to English in product_category_name_english."""
 }
 
-# ---- Helpers (unchanged logic) ----
+# ---- Helpers ----
 def sample_table_df(table: str, limit: int = 100) -> pd.DataFrame:
-    q = text(f"SELECT * FROM {table} ORDER BY RAND() LIMIT {limit}")
-    return pd.read_sql(q, con=engine)
+    # Key-range / block / bounded reservoir sampling (table_sampling.py) instead of ORDER BY RAND(),
+    # which sorted the whole table; reproducible via KB_SAMPLE_SEED.
+    res = sample_table(engine, table, limit, seed=KB_SAMPLE_SEED)
+    tqdm.tqdm.write(f"  sampled {res.summary()}")
+    return res.df
 
 def column_specs(table: str, df: pd.DataFrame):
     cols = []
@@ -111,28 +118,40 @@ chain = (
     | StrOutputParser()
 )
 
+# Tables come from INFORMATION_SCHEMA (schema_catalog.py), not from the dict above
+from schema_catalog import build_catalog
+from config import SCHEMA_CATALOG_PATH
+
+catalog = build_catalog(engine)
+tables_to_describe = {
+    t: table_description.get(t) or info["comment"] or f"Table {t}."
+    for t, info in catalog["tables"].items()
+}
+print(f"🔎 Discovered {len(catalog['tables'])} tables, {len(catalog['join_keys'])} join keys, "
+      f"{len(catalog['groups'])} routing groups -> {SCHEMA_CATALOG_PATH}")
+
 kb_final = {}
-for table, tdesc in tqdm.tqdm(table_description.items()):
+for table, tdesc in tqdm.tqdm(tables_to_describe.items()):
     df = sample_table_df(table, limit=100)
     specs = column_specs(table, df)
     specs_json = json.dumps(specs, ensure_ascii=False)
     sample_json = df.head(10).to_json(orient="records", force_ascii=False)
 
-    raw = chain.invoke({
-        "table_desc": tdesc,
-        "column_specs": specs_json,
-        "table_samples": sample_json
-    }).strip()
+    with priority_class("knowledgebase"):
+        raw = chain.invoke({
+            "table_desc": tdesc,
+            "column_specs": specs_json,
+            "table_samples": sample_json
+        }).strip()
 
-    # Parse strict JSON (robust but unchanged logic)
+    # Parse strict JSON; fall back to the first JSON object embedded in the text
     try:
         obj = json.loads(raw)
     except json.JSONDecodeError:
-        import re
-        m = re.search(r"\{.*\}", raw, re.S)
-        if not m:
+        obj = extract_json(raw, dict)
+        METRICS.inc("llm_parse_total", stage="knowledgebase", outcome="failed" if obj is None else "extracted")
+        if obj is None:
             raise
-        obj = json.loads(m.group(0))
 
     table_desc_final = obj.get("table_description", "").strip()
     columns_pairs = obj.get("columns", [])
@@ -145,3 +164,12 @@ with open(OUT_PATH, "wb") as f:
     pickle.dump(kb_final, f)
 
 print(f"✅ Wrote knowledgebase to: {OUT_PATH}  (tables: {len(kb_final)})")
+
+# Column statistics sidecar (column_stats.py): recomputed only for tables that changed
+from column_stats import refresh_catalog
+from config import COLUMN_STATS_PATH
+
+stats_status = refresh_catalog(engine, list(tables_to_describe))
+print(f"✅ Column statistics in: {COLUMN_STATS_PATH}  "
+      f"(refreshed: {sum(s == 'refreshed' for s in stats_status.values())}, "
+      f"unchanged: {sum(s == 'fresh' for s in stats_status.values())})")
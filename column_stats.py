@@ -0,0 +1,407 @@
+# column_stats.py
+"""
+Column statistics catalog, stored next to the knowledgebase (COLUMN_STATS_PATH, JSON).
+
+- Per column: kind (numeric / temporal / text), cardinality (NDV), null fraction, min / max,
+  top-k values with frequencies and an equi-depth histogram. Text columns with few values also
+  keep the complete value list when the whole table was read.
+- Computed from one sampled read per table (table_sampling.sample_table, about
+  COLUMN_STATS_SAMPLE_ROWS rows). NDV is scaled up from the sample with the Haas-Stokes (Duj1) estimator; tables that fit in the sample
+  are read whole and are exact.
+- refresh_catalog(engine) is incremental: a table is recomputed only when its signature
+  (row count + INFORMATION_SCHEMA UPDATE_TIME) changed. build_knowledgebase.py and the
+  tables_creation loader call it.
+- Lookups used downstream:
+    column_stats(table, column)  ColumnStats or None
+    is_categorical(table, column) fuzzy_wuzzy: fuzzy-match the predicate, or pass it through?
+    known_values(table, column)  fuzzy_wuzzy: match choices without a DISTINCT scan
+    column_kind(name)            heuristic chart planner: temporal / numeric / text by result column name
+    estimate_result_rows(sql)    estimated result rows (GROUP BY NDVs, date buckets, WHERE selectivity from
+                                 top-k values / histograms), used to size the result LIMIT
+                                 (sql_viz_workflow) instead of a fixed 2000
+  None / False means "no statistics": callers keep their previous heuristics.
+
+CLI:
+  python column_stats.py refresh [--force] [table ...]
+  python column_stats.py show [table[.column]]
+"""
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+
+from config import COLUMN_STATS_PATH, COLUMN_STATS_SAMPLE_ROWS, RESULT_ROW_LIMIT, RESULT_ROW_LIMIT_MAX
+from table_sampling import sample_table
+from telemetry import METRICS, span
+from shared_state import freeze, shared_resource
+
+TOP_K = 20
+HISTOGRAM_BUCKETS = 20
+MAX_KNOWN_VALUES = 200        # complete value lists are kept up to this many distinct values
+CATEGORICAL_MAX_NDV = 5000    # text columns above this are identifiers / free text, not categories
+
+_NUMERIC = {"tinyint", "smallint", "mediumint", "int", "integer", "bigint", "decimal", "numeric",
+            "float", "double", "real", "bit"}
+_TEMPORAL = {"date", "datetime", "timestamp", "time", "year"}
+
+@dataclass
+class ColumnStats:
+    table: str
+    column: str
+    dtype: str
+    kind: str                       # "numeric" | "temporal" | "text"
+    ndv: int                        # estimated distinct non-null values
+    null_frac: float
+    min: Optional[Any] = None       # temporal values as ISO strings
+    max: Optional[Any] = None
+    top_k: List[Tuple[str, float]] = field(default_factory=list)  # (value, fraction of non-null rows)
+    histogram: List[Any] = field(default_factory=list)            # HISTOGRAM_BUCKETS + 1 bounds
+    values: Optional[List[str]] = None                            # complete list (small, exact only)
+    exact: bool = False             # computed from every row
+
+# ---------------- Computation ----------------
+def _kind(dtype: str) -> str:
+    d = dtype.lower()
+    return "numeric" if d in _NUMERIC else "temporal" if d in _TEMPORAL else "text"
+
+def _estimate_ndv(sample: pd.Series, population: int) -> int:
+    """Haas-Stokes Duj1 (as PostgreSQL's ANALYZE): n*d / (n - f1 + f1*n/N), f1 = values seen once."""
+    n = len(sample)
+    if n == 0:
+        return 0
+    counts = sample.value_counts()
+    d, f1 = len(counts), int((counts == 1).sum())
+    if n >= population:
+        return d
+    return int(min(population, max(d, round(n * d / (n - f1 + f1 * n / population)))))
+
+def _scalar(v: Any, kind: str) -> Any:
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return None
+    if kind == "temporal":
+        return pd.Timestamp(v).isoformat()
+    if kind == "numeric":
+        return float(v)
+    return str(v)
+
+def compute_column_stats(table: str, column: str, dtype: str, sample: pd.Series, rows: int) -> ColumnStats:
+    kind = _kind(dtype)
+    exact = len(sample) >= rows
+    non_null = sample.dropna()
+    null_frac = 1.0 - len(non_null) / len(sample) if len(sample) else 0.0
+    if kind == "numeric":
+        non_null = pd.to_numeric(non_null, errors="coerce").dropna()
+    elif kind == "temporal":
+        non_null = pd.to_datetime(non_null, errors="coerce").dropna()
+    stats = ColumnStats(table, column, dtype.lower(), kind,
+                        ndv=_estimate_ndv(non_null, int(rows * (1 - null_frac))), null_frac=round(null_frac, 4),
+                        exact=exact)
+    if non_null.empty:
+        return stats
+    if kind != "text":
+        stats.min, stats.max = _scalar(non_null.min(), kind), _scalar(non_null.max(), kind)
+        qs = non_null.quantile([i / HISTOGRAM_BUCKETS for i in range(HISTOGRAM_BUCKETS + 1)],
+                               interpolation="nearest")
+        stats.histogram = [_scalar(v, kind) for v in qs.tolist()]
+    as_text = non_null.astype(str)
+    counts = as_text.value_counts()
+    stats.top_k = [(str(v), round(c / len(as_text), 5)) for v, c in counts.head(TOP_K).items()]
+    if kind == "text":
+        stats.min, stats.max = str(as_text.min()), str(as_text.max())
+        if exact and len(counts) <= MAX_KNOWN_VALUES:
+            stats.values = sorted(counts.index.tolist())
+    return stats
+
+def _table_signature(conn, table: str) -> Dict[str, Any]:
+    rows = int(conn.execute(text(f"SELECT COUNT(*) FROM `{table}`")).scalar() or 0)
+    updated = conn.execute(text(
+        "SELECT UPDATE_TIME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t"
+    ), {"t": table}).scalar()
+    return {"rows": rows, "updated": str(updated) if updated else None}
+
+def _column_types(conn, table: str) -> List[Tuple[str, str]]:
+    return [(r[0], r[1]) for r in conn.execute(text(
+        "SELECT COLUMN_NAME, DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t ORDER BY ORDINAL_POSITION"), {"t": table})]
+
+def compute_table_stats(engine, table: str, sample_rows: int = COLUMN_STATS_SAMPLE_ROWS) -> Dict[str, Any]:
+    """One sampled read of `table` -> {"signature", "rows", "sampled_rows", "computed_at", "columns"}."""
+    with engine.connect() as conn:
+        signature = _table_signature(conn, table)
+        types = _column_types(conn, table)
+    rows = signature["rows"]
+    with span("db.column_stats_sample", table=table):
+        sample = sample_table(engine, table, sample_rows)
+    df = sample.df
+    if sample.complete:
+        rows = len(df)  # exact even if rows changed since the COUNT
+    columns = {c: asdict(compute_column_stats(table, c, t, df[c], rows)) for c, t in types if c in df.columns}
+    METRICS.inc("column_stats_tables_computed_total")
+    return {"signature": signature, "rows": rows, "sampled_rows": len(df),
+            "computed_at": datetime.now().isoformat(timespec="seconds"), "columns": columns}
+
+# ---------------- Storage ----------------
+_write_lock = threading.Lock()
+
+def _load(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {"version": 1, "tables": {}}
+
+def _save(catalog: Dict[str, Any], path: str) -> None:
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, ensure_ascii=False, indent=1, default=str)
+    os.replace(tmp, path)
+
+def refresh_catalog(engine, tables: Optional[List[str]] = None, *, force: bool = False,
+                    path: str = COLUMN_STATS_PATH) -> Dict[str, str]:
+    """Recompute stale tables (default: every base table); returns {table: "refreshed"|"fresh"|error}."""
+    with engine.connect() as conn:
+        if tables is None:
+            tables = [r[0] for r in conn.execute(text(
+                "SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'"))
+                if not re.search(r"__(?:new|old|stage|sample)$|^rollup_", r[0])]
+        signatures = {t: _table_signature(conn, t) for t in tables}
+    with _write_lock:
+        catalog = _load(path)
+        out: Dict[str, str] = {}
+        for t in tables:
+            current = catalog["tables"].get(t)
+            if not force and current is not None and current.get("signature") == signatures[t]:
+                out[t] = "fresh"
+                continue
+            try:
+                catalog["tables"][t] = compute_table_stats(engine, t)
+                out[t] = "refreshed"
+            except Exception as e:
+                out[t] = f"error: {type(e).__name__}: {e}"[:200]
+        catalog["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        _save(catalog, path)
+    get_catalog.cache_clear()
+    _table_rows.cache_clear()
+    try:
+        from fuzzy_wuzzy import clear_values
+    except ImportError:  # rapidfuzz not installed: there is no value cache to drop
+        pass
+    else:
+        clear_values()
+    return out
+
+# ---------------- Lookups ----------------
+@shared_resource
+def get_catalog() -> Mapping[Tuple[str, str], ColumnStats]:
+    """{(table, column): ColumnStats} from COLUMN_STATS_PATH (read-only); empty when it doesn't exist yet."""
+    out: Dict[Tuple[str, str], ColumnStats] = {}
+    for t, entry in _load(COLUMN_STATS_PATH).get("tables", {}).items():
+        for c, d in entry.get("columns", {}).items():
+            d = dict(d, top_k=[tuple(x) for x in d.get("top_k", [])])
+            out[(t, c)] = ColumnStats(**d)
+    return freeze(out)
+
+@shared_resource
+def _table_rows() -> Dict[str, int]:
+    return {t: int(e.get("rows", 0)) for t, e in _load(COLUMN_STATS_PATH).get("tables", {}).items()}
+
+def column_stats(table: str, column: str) -> Optional[ColumnStats]:
+    return get_catalog().get((table, column))
+
+def is_categorical(table: str, column: str) -> Optional[bool]:
+    """True for text columns with a bounded set of values; None when there are no statistics."""
+    s = column_stats(table, column)
+    if s is None:
+        return None
+    return s.kind == "text" and s.ndv <= CATEGORICAL_MAX_NDV
+
+def known_values(table: str, column: str) -> Optional[Tuple[str, ...]]:
+    s = column_stats(table, column)
+    return tuple(s.values) if s is not None and s.values is not None else None
+
+def column_kind(name: str) -> Optional[str]:
+    """Kind of a result column by name ("table.column" or a column name unique across tables)."""
+    name = str(name).strip("`").lower()
+    if "." in name:
+        s = get_catalog().get(tuple(name.split(".", 1)))
+        return s.kind if s is not None else None
+    kinds = {s.kind for (t, c), s in get_catalog().items() if c.lower() == name}
+    return kinds.pop() if len(kinds) == 1 else None
+
+_BUCKET_DAYS = {"%Y": 365.25, "%Y-%m": 30.44, "%Y-%m-%d": 1.0, "%Y-%u": 7.0, "%Y-%v": 7.0, "%x-%v": 7.0}
+_PART_CARD = {"year": None, "quarter": 4, "month": 12, "week": 53, "weekday": 7, "dayofweek": 7,
+              "hour": 24, "day": 31, "dayofmonth": 31}
+
+def _span_buckets(s: ColumnStats, days: float) -> Optional[int]:
+    if s.kind != "temporal" or not s.min or not s.max:
+        return None
+    span_days = (pd.Timestamp(s.max) - pd.Timestamp(s.min)).total_seconds() / 86400
+    return max(1, math.ceil(span_days / days) + 1)
+
+def _expr_ndv(expr: str) -> Optional[int]:
+    m = re.fullmatch(r"(\w+)\.(\w+)", expr)
+    if m:
+        s = column_stats(m.group(1), m.group(2))
+        return max(1, s.ndv) if s is not None else None
+    m = re.fullmatch(r"date_format\((\w+)\.(\w+),'([^']+)'\)", expr)
+    if m and m.group(3) in _BUCKET_DAYS:
+        s = column_stats(m.group(1), m.group(2))
+        return _span_buckets(s, _BUCKET_DAYS[m.group(3)]) if s is not None else None
+    m = re.fullmatch(r"(\w+)\((\w+)\.(\w+)\)", expr)
+    if m and m.group(1) in _PART_CARD:
+        s = column_stats(m.group(2), m.group(3))
+        if s is None:
+            return None
+        return _span_buckets(s, 365.25) if m.group(1) == "year" else _PART_CARD[m.group(1)]
+    return None
+
+_LIT = r"('(?:[^']|'')*'|-?\d+(?:\.\d+)?)"
+
+def _literal(v: str) -> str:
+    v = v.strip()
+    return v[1:-1].replace("''", "'") if v.startswith("'") else v
+
+def _eq_selectivity(s: ColumnStats, value: str) -> float:
+    non_null = 1.0 - s.null_frac
+    for v, frac in s.top_k:
+        if v.lower() == value.lower():  # the schema's collation is case-insensitive
+            return frac * non_null
+    rest = 1.0 - sum(f for _, f in s.top_k) if len(s.top_k) < s.ndv else 0.0
+    return non_null * max(0.0, rest) / max(1, s.ndv - len(s.top_k))
+
+def _position(s: ColumnStats, value: str) -> Optional[float]:
+    """Fraction of non-null rows below `value` (equi-depth histogram)."""
+    if len(s.histogram) < 2:
+        return None
+    try:
+        conv = pd.Timestamp if s.kind == "temporal" else float
+        x, bounds = conv(value), [conv(b) for b in s.histogram]
+    except (TypeError, ValueError):
+        return None
+    below = sum(1 for b in bounds[1:] if b <= x) if x >= bounds[0] else 0
+    return min(1.0, below / (len(bounds) - 1))
+
+def _selectivity(pred: str) -> Optional[float]:
+    """Fraction of rows one normalized WHERE conjunct keeps; None when statistics can't tell."""
+    m = re.fullmatch(r"(\w+)\.(\w+) ?(.*)", pred)
+    s = column_stats(m.group(1), m.group(2)) if m else None
+    if s is None:
+        return None
+    rest = m.group(3)
+    if rest == "is null":
+        return s.null_frac
+    if rest == "is not null":
+        return 1.0 - s.null_frac
+    m = re.fullmatch(r"(=|<>|!=) ?" + _LIT, rest)
+    if m:
+        eq = _eq_selectivity(s, _literal(m.group(2)))
+        return eq if m.group(1) == "=" else 1.0 - s.null_frac - eq
+    m = re.fullmatch(r"in ?\((.+)\)", rest)
+    if m:
+        values = re.findall(_LIT, m.group(1))
+        return min(1.0, sum(_eq_selectivity(s, _literal(v)) for v in values)) if values else None
+    m = re.fullmatch(r"between " + _LIT + " and " + _LIT, rest)
+    if m:
+        lo, hi = _position(s, _literal(m.group(1))), _position(s, _literal(m.group(2)))
+        return None if lo is None or hi is None else (1.0 - s.null_frac) * max(0.0, hi - lo)
+    m = re.fullmatch(r"(>=|<=|>|<) ?" + _LIT, rest)
+    if m:
+        pos = _position(s, _literal(m.group(2)))
+        if pos is None:
+            return None
+        return (1.0 - s.null_frac) * (pos if m.group(1).startswith("<") else 1.0 - pos)
+    return None
+
+def _where_selectivity(where: List[str]) -> Optional[float]:
+    """Combined selectivity of the AND-ed conjuncts (independence assumed); None if any is unknown."""
+    preds = []
+    for w in where:  # the normalizer splits "x between a and b" at its AND
+        if preds and re.search(r" between " + _LIT + "$", preds[-1]) and re.fullmatch(_LIT, w):
+            preds[-1] += f" and {w}"
+        else:
+            preds.append(w)
+    sel = 1.0
+    for p in preds:
+        f = _selectivity(p)
+        if f is None:
+            return None
+        sel *= f
+    return sel
+
+def estimate_result_rows(sql: str) -> Optional[int]:
+    """Estimate of the rows `sql` returns, or None when it can't be estimated (e.g. a WHERE
+    conjunct the statistics can't size on a non-aggregate query)."""
+    from summary_tables import parse_query
+
+    if not get_catalog():
+        return None
+    q = parse_query(sql)
+    if q is None:
+        return None
+    rows = _table_rows()
+    table_rows = [rows[t] for t in q["tables"] if t in rows]
+    if not table_rows:
+        return None
+    cap = max(table_rows)
+    if q["where"]:
+        sel = _where_selectivity(q["where"])
+        if sel is None and not q["group_by"]:
+            return None
+        if sel is not None:
+            cap = max(1, math.ceil(cap * sel))
+    items = " ".join(e for e, _ in q["items"])
+    if not q["group_by"]:
+        est = 1 if re.search(r"\b(?:sum|count|avg|min|max)\(", items) else cap
+    else:
+        select_exprs = {alias: e for e, alias in q["items"] if alias}
+        est = 1
+        for g in q["group_by"]:
+            if g.isdigit() and 0 < int(g) <= len(q["items"]):
+                g = q["items"][int(g) - 1][0]  # GROUP BY 1
+            ndv = _expr_ndv(select_exprs.get(g, g))
+            if ndv is None:
+                return None
+            est = min(cap, est * ndv)
+    if q["limit"]:
+        est = min(est, int(q["limit"].split(",")[-1]))
+    return est
+
+def result_limit(sql: str, default: int = RESULT_ROW_LIMIT, cap: int = RESULT_ROW_LIMIT_MAX) -> int:
+    """Row limit for a generated query: the default, raised (up to `cap`) when the estimate says the
+    complete result is larger, so charts over e.g. every city aren't cut off at 2000 rows."""
+    est = estimate_result_rows(sql)
+    if est is None or est <= default:
+        return default
+    METRICS.inc("result_limit_raised_total")
+    return min(cap, int(est * 1.1) + 1)
+
+if __name__ == "__main__":
+    from config import get_engine
+
+    args = sys.argv[1:] or ["show"]
+    if args[0] == "refresh":
+        force = "--force" in args
+        names = [a for a in args[1:] if a != "--force"] or None
+        t0 = time.perf_counter()
+        for t, status in refresh_catalog(get_engine(), names, force=force).items():
+            print(f"{t}: {status}")
+        print(f"✅ Column statistics in {COLUMN_STATS_PATH} ({time.perf_counter() - t0:.1f}s)")
+    elif args[0] == "show":
+        target = args[1] if len(args) > 1 else ""
+        for (t, c), s in sorted(get_catalog().items()):
+            if target in ("", t, f"{t}.{c}"):
+                print(f"{t}.{c}: {s.kind} ndv={s.ndv} nulls={s.null_frac:.1%} min={s.min} max={s.max} "
+                      f"top={s.top_k[:3]}{' exact' if s.exact else ''}")
+    else:
+        sys.exit(f"unknown command {args[0]!r}; use 'refresh' or 'show'")
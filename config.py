@@ -1,8 +1,11 @@
 # config.py
 import os
-from functools import lru_cache
+from typing import TYPE_CHECKING
 from sqlalchemy import create_engine
-from langchain_openai import AzureChatOpenAI
+from shared_state import shared_resource
+
+if TYPE_CHECKING:  # imported inside get_llm(): langchain_openai is slow to import
+    from langchain_openai import AzureChatOpenAI
 
 # --- Load .env (so your .env file is actually used) ---
 try:
@@ -31,23 +34,160 @@ DB_URL = os.getenv(
 # --- Knowledgebase path (optional override via .env) ---
 DEFAULT_KB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledgebase.pkl")
 KNOWLEDGEBASE_PATH = os.getenv("KNOWLEDGEBASE_PATH", DEFAULT_KB)
+# Column statistics catalog (column_stats.py), stored next to the knowledgebase by default
+COLUMN_STATS_PATH = os.getenv(
+    "COLUMN_STATS_PATH", os.path.join(os.path.dirname(os.path.abspath(KNOWLEDGEBASE_PATH)), "column_stats.json")
+)
+COLUMN_STATS_SAMPLE_ROWS = int(os.getenv("COLUMN_STATS_SAMPLE_ROWS", "20000") or 20000)
+# How long fuzzy_wuzzy keeps a column's DISTINCT values before rescanning (also cleared on a stats refresh)
+DISTINCT_VALUES_TTL_S = max(1, int(os.getenv("DISTINCT_VALUES_TTL_S", "3600") or 3600))
+# Table sampling for KB/statistics builds (table_sampling.py): seed, and the most rows a streamed scan reads
+KB_SAMPLE_SEED = int(os.getenv("KB_SAMPLE_SEED", "0") or 0)
+SAMPLE_MAX_SCAN_ROWS = int(os.getenv("SAMPLE_MAX_SCAN_ROWS", "200000") or 200000)
+# Schema catalog (schema_catalog.py): discovered tables, join keys and routing groups
+SCHEMA_CATALOG_PATH = os.getenv(
+    "SCHEMA_CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(KNOWLEDGEBASE_PATH)), "schema_catalog.json")
+)
+ROUTING_GROUP_MAX_TABLES = int(os.getenv("ROUTING_GROUP_MAX_TABLES", "8") or 8)
+ROUTING_MIN_LINKAGE = float(os.getenv("ROUTING_MIN_LINKAGE", "0.5") or 0.5)
+ROUTER_MAX_TABLES = int(os.getenv("ROUTER_MAX_TABLES", "12") or 0)  # tables handed to the subquestion step
+# Result rows fetched per generated query; raised up to the max when statistics predict more groups
+RESULT_ROW_LIMIT = int(os.getenv("RESULT_ROW_LIMIT", "2000") or 2000)
+RESULT_ROW_LIMIT_MAX = int(os.getenv("RESULT_ROW_LIMIT_MAX", "20000") or 20000)
+# Memory caps (result_memory.py): one request's result, and the results a service session retains
+REQUEST_MEMORY_CAP_MB = float(os.getenv("REQUEST_MEMORY_CAP_MB", "64") or 0)
+SESSION_MEMORY_CAP_MB = float(os.getenv("SESSION_MEMORY_CAP_MB", "256") or 0)
+
+# --- Telemetry: JSONL trace file (opt-in: traces hold users' questions and SQL) and /metrics port (0 disables) ---
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)
+
+# --- Shared LLM rate limiter (0 = no TPM/RPM cap; concurrency adapts on 429s) ---
+LLM_TPM = int(os.getenv("LLM_TPM", "0") or 0)
+LLM_RPM = int(os.getenv("LLM_RPM", "0") or 0)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8") or 8)
+LLM_EST_COMPLETION_TOKENS = int(os.getenv("LLM_EST_COMPLETION_TOKENS", "1024") or 1024)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4") or 4)
+
+# --- Successful generated SQL is appended here (index_manager mines it for filter/group columns);
+#     opt-in like TRACE_FILE: the SQL carries users' filter values ---
+QUERY_LOG_FILE = os.getenv("QUERY_LOG_FILE", "")
+
+# --- Execution backend for generated SQL: "mysql" (default) or "duckdb" (Parquet snapshots) ---
+EXECUTION_BACKEND = os.getenv("EXECUTION_BACKEND", "mysql").strip().lower()
+DUCKDB_SNAPSHOT_DIR = os.getenv(
+    "DUCKDB_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshots")
+)
+
+# --- Federated execution (federated.py, EXECUTION_BACKEND=federated): region shards as name=url pairs;
+#     DATABASE_URL must still be a full copy (knowledgebase, column stats, fuzzy scans, export) ---
+SHARD_URLS = os.getenv("SHARD_URLS", "")
+FEDERATED_MAX_WORKERS = int(os.getenv("FEDERATED_MAX_WORKERS", "0") or 0)  # 0 = 4 per shard
+# Columns whose values never repeat across shards (COUNT DISTINCT is then an exact sum), and tables
+# copied to every shard (queries on them alone run on one shard)
+SHARD_DISJOINT_COLUMNS = {
+    c.strip().lower() for c in os.getenv("SHARD_DISJOINT_COLUMNS", "order_id,customer_id").split(",") if c.strip()
+}
+SHARD_REPLICATED_TABLES = {
+    t.strip().lower()
+    for t in os.getenv("SHARD_REPLICATED_TABLES", "products,sellers,category_translation").split(",") if t.strip()
+}
+HLL_PRECISION = int(os.getenv("HLL_PRECISION", "12") or 12)  # other COUNT DISTINCTs: HyperLogLog, 2^p registers
+
+# --- Keep query results Arrow-backed (pd.ArrowDtype) end to end; 0 = plain numpy dtypes ---
+ARROW_DTYPES = os.getenv("ARROW_DTYPES", "1") == "1"
+
+# --- Full-result export (result_export.py): chunk size, default caps, per-user JSON overrides ---
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "20000") or 20000)
+EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", "1000000") or 1000000)
+EXPORT_MAX_BYTES = int(os.getenv("EXPORT_MAX_BYTES", str(500 * 2**20)) or 500 * 2**20)
+EXPORT_USER_LIMITS = os.getenv("EXPORT_USER_LIMITS", "")
+
+# --- Who is asking: Streamlit's login (st.user) or this header from an authenticating reverse proxy;
+#     without either every browser is "anonymous" (per-user caps/budgets are never typed in) ---
+AUTH_USER_HEADER = os.getenv("AUTH_USER_HEADER", "").strip()
+
+# --- Startup: background warm-up (runtime.py) of KB, pool, chains/graphs and fuzzy-match values ---
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1") == "1"
+WARMUP_POOL_CONNECTIONS = int(os.getenv("WARMUP_POOL_CONNECTIONS", "2") or 2)
+WARMUP_DISTINCT_COLUMNS = [
+    tuple(item.strip().split(".", 1))
+    for item in os.getenv(
+        "WARMUP_DISTINCT_COLUMNS",
+        "customer.customer_city,customer.customer_state,sellers.seller_city,sellers.seller_state,"
+        "orders.order_status,order_payments.payment_type,products.product_category_name,"
+        "category_translation.product_category_name_english",
+    ).split(",")
+    if "." in item
+]
+
+# --- Per-request deadline (deadline.py): total seconds (0 = none) and per-stage shares as JSON ---
+REQUEST_TIMEOUT_S = float(os.getenv("REQUEST_TIMEOUT_S", "120") or 0)
+STAGE_BUDGETS = os.getenv("STAGE_BUDGETS", "")
+
+# --- LLM cost accounting (cost_accounting.py): USD per 1M tokens (reasoning is billed as completion) ---
+LLM_PRICE_PROMPT_PER_1M = float(os.getenv("LLM_PRICE_PROMPT_PER_1M", "1.10") or 0)
+LLM_PRICE_COMPLETION_PER_1M = float(os.getenv("LLM_PRICE_COMPLETION_PER_1M", "4.40") or 0)
+# Budgets (0 = none); as spend nears them the pipeline degrades at these fractions:
+# fewer retries, heuristic chart instead of the BI expert, smaller column context.
+REQUEST_COST_BUDGET_USD = float(os.getenv("REQUEST_COST_BUDGET_USD", "0") or 0)
+REQUEST_TOKEN_BUDGET = int(os.getenv("REQUEST_TOKEN_BUDGET", "0") or 0)
+USER_DAILY_COST_BUDGET_USD = float(os.getenv("USER_DAILY_COST_BUDGET_USD", "0") or 0)
+COST_DEGRADE_THRESHOLDS = [
+    float(x) for x in os.getenv("COST_DEGRADE_THRESHOLDS", "0.5,0.7,0.85").split(",") if x.strip()
+]
+
+# --- HTTP job service (service.py); SERVICE_URL empty = the Streamlit client starts one in-process ---
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8765") or 8765)
+SERVICE_URL = os.getenv("SERVICE_URL", "").rstrip("/")
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "4") or 4)
+SERVICE_WORKER_MODE = os.getenv("SERVICE_WORKER_MODE", "thread").strip().lower()  # thread | process
+SERVICE_USER_CONCURRENCY = int(os.getenv("SERVICE_USER_CONCURRENCY", "2") or 2)
+SERVICE_USER_MAX_PENDING = int(os.getenv("SERVICE_USER_MAX_PENDING", "10") or 10)
+SERVICE_JOB_TTL_S = int(os.getenv("SERVICE_JOB_TTL_S", "3600") or 3600)
+
+# --- Rewrite matching aggregate queries onto pre-built rollup tables (summary_tables.py) ---
+SUMMARY_TABLES_ENABLED = os.getenv("SUMMARY_TABLES_ENABLED", "1") == "1"
+
+# --- Preview on <table>__sample tables first, full query in the background (sample_tables.py) ---
+PREVIEW_ENABLED = os.getenv("PREVIEW_ENABLED", "1") == "1"
+SAMPLE_FRACTION = float(os.getenv("SAMPLE_FRACTION", "0.01") or 0.01)
+
+# --- Extraction chains answer through a strict JSON schema (structured_output.py); 0 = free text only ---
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "1") == "1"
+
+# --- Coalesce identical in-flight work (singleflight.py); empty = off ---
+SINGLEFLIGHT_LEVELS = [
+    x.strip() for x in os.getenv("SINGLEFLIGHT_LEVELS", "question,prompt,sql,distinct").split(",") if x.strip()
+]
 
-@lru_cache(maxsize=1)
-def get_llm() -> AzureChatOpenAI:
-    """Singleton AzureChatOpenAI configured exactly like your original code."""
-    return AzureChatOpenAI(
+@shared_resource
+def get_llm() -> "AzureChatOpenAI":
+    """
+    Singleton AzureChatOpenAI configured exactly like your original code, routed through the
+    process-wide rate limiter (which owns retries, so the SDK's own retries are disabled).
+    """
+    from telemetry import LLMMetricsCallback
+    from rate_limiter import RateLimitedAzureChatOpenAI
+    return RateLimitedAzureChatOpenAI(
         azure_endpoint=AZURE_ENDPOINT,
         azure_deployment=AZURE_DEPLOYMENT,
         api_version=AZURE_API_VERSION,
         api_key=AZURE_API_KEY,
+        max_retries=0,
+        callbacks=[LLMMetricsCallback()],
     )
 
-@lru_cache(maxsize=1)
+@shared_resource
 def get_engine():
     """Singleton SQLAlchemy engine identical to your original create_engine usage."""
-    return create_engine(DB_URL)
+    from telemetry import instrument_engine
+    engine = create_engine(DB_URL)
+    instrument_engine(engine)
+    return engine
 
-@lru_cache(maxsize=1)
+@shared_resource
 def get_knowledgebase_path() -> str:
     """Path to knowledgebase.pkl; uses .env override when provided."""
     return KNOWLEDGEBASE_PATH
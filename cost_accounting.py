@@ -0,0 +1,212 @@
+# cost_accounting.py
+"""
+LLM token and cost accounting with budget-driven degrade modes.
+
+- record_llm_usage(usage) is called by the rate-limited LLM wrapper after every call. It
+  splits prompt / completion / reasoning tokens and prices them (LLM_PRICE_*_PER_1M;
+  reasoning tokens are part of completion_tokens and billed as such). The result goes to:
+  * the current request's CostLedger, per stage (the enclosing telemetry span);
+  * process-wide per-user totals for the current UTC day (for USER_DAILY_COST_BUDGET_USD;
+    they roll over at midnight, so only today's users are held);
+  * METRICS: llm_cost_usd_total{stage}, llm_user_tokens_total{user,kind} (the first
+    _MAX_USER_LABELS users by name, the rest as "other") and the request_cost_usd histogram.
+- cost_scope(user) opens the ledger for one request (nlq_to_viz_workflow.run / run_followup);
+  `user` is the authenticated identity the service/UI resolved (AUTH_USER_HEADER, Streamlit
+  login, else the shared "anonymous"), never a typed-in name. FinalState["cost"] is
+  ledger.summary().
+- Spend is the largest of cost / REQUEST_COST_BUDGET_USD, tokens / REQUEST_TOKEN_BUDGET and the
+  user's cost today / USER_DAILY_COST_BUDGET_USD. Crossing COST_DEGRADE_THRESHOLDS switches the
+  request into cheaper modes (cumulative):
+    fewer_retries    SQL / viz fix loops stop after one retry
+    heuristic_chart  BI expert + viz generator are replaced by a rule-based chart
+    small_context    column selection sees names only; selected columns are trimmed
+  At 100% further LLM calls raise BudgetExceeded (a RequestAborted, status "budget"), so the
+  request ends with what it has.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config import (
+    COST_DEGRADE_THRESHOLDS, LLM_PRICE_COMPLETION_PER_1M, LLM_PRICE_PROMPT_PER_1M,
+    REQUEST_COST_BUDGET_USD, REQUEST_TOKEN_BUDGET, USER_DAILY_COST_BUDGET_USD,
+)
+from deadline import RequestAborted
+from telemetry import METRICS, current_span_name
+
+MODES = ("full", "fewer_retries", "heuristic_chart", "small_context")
+_MAX_USER_LABELS = 50  # distinct user label values on llm_user_tokens_total
+
+class BudgetExceeded(RequestAborted):
+    status = "budget"
+
+def price(prompt_tokens: int, completion_tokens: int) -> float:
+    return (prompt_tokens * LLM_PRICE_PROMPT_PER_1M + completion_tokens * LLM_PRICE_COMPLETION_PER_1M) / 1e6
+
+def _split_usage(usage: Dict[str, Any]) -> Tuple[int, int, int]:
+    """(prompt, completion, reasoning) from an OpenAI token_usage dict."""
+    details = usage.get("completion_tokens_details") or {}
+    reasoning = details.get("reasoning_tokens") if isinstance(details, dict) else getattr(details, "reasoning_tokens", 0)
+    return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0), int(reasoning or 0)
+
+# ---------------- Per-user totals (current UTC day) ----------------
+class _UserTotals:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day = ""
+        self._totals: Dict[str, List[float]] = {}  # user -> [usd, tokens] for self._day
+
+    def _roll(self) -> None:
+        day = time.strftime("%Y-%m-%d", time.gmtime())
+        if day != self._day:
+            self._day, self._totals = day, {}
+
+    def add(self, user: str, usd: float, tokens: int) -> None:
+        with self._lock:
+            self._roll()
+            t = self._totals.setdefault(user, [0.0, 0])
+            t[0] += usd
+            t[1] += tokens
+
+    def totals(self, user: str) -> Dict[str, float]:
+        with self._lock:
+            self._roll()
+            usd, tokens = self._totals.get(user, (0.0, 0))
+            return {"usd": round(usd, 6), "tokens": int(tokens)}
+
+USER_TOTALS = _UserTotals()
+
+# ---------------- Per-request ledger ----------------
+class CostLedger:
+    def __init__(self, user: str = "anonymous", budget_usd: float = REQUEST_COST_BUDGET_USD,
+                 budget_tokens: int = REQUEST_TOKEN_BUDGET, user_budget_usd: float = USER_DAILY_COST_BUDGET_USD):
+        self.user = user
+        self.budget_usd, self.budget_tokens, self.user_budget_usd = budget_usd, budget_tokens, user_budget_usd
+        self.calls = 0
+        self.prompt_tokens = self.completion_tokens = self.reasoning_tokens = 0
+        self.usd = 0.0
+        self.by_stage: Dict[str, Dict[str, float]] = {}
+        self.mode = "full"
+        self.degraded: list = []  # [{"mode", "stage", "spent"}] in the order they kicked in
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, prompt: int, completion: int, reasoning: int) -> float:
+        usd = price(prompt, completion)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt
+            self.completion_tokens += completion
+            self.reasoning_tokens += reasoning
+            self.usd += usd
+            s = self.by_stage.setdefault(stage, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                                 "reasoning_tokens": 0, "usd": 0.0})
+            s["calls"] += 1
+            s["prompt_tokens"] += prompt
+            s["completion_tokens"] += completion
+            s["reasoning_tokens"] += reasoning
+            s["usd"] = round(s["usd"] + usd, 6)
+        return usd
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def spent(self) -> float:
+        """Fraction of the tightest budget used (0 when no budget is set)."""
+        fracs = [0.0]
+        if self.budget_usd > 0:
+            fracs.append(self.usd / self.budget_usd)
+        if self.budget_tokens > 0:
+            fracs.append(self.tokens / self.budget_tokens)
+        if self.user_budget_usd > 0:
+            fracs.append(USER_TOTALS.totals(self.user)["usd"] / self.user_budget_usd)
+        return max(fracs)
+
+    def current_mode(self) -> str:
+        """Cheapest mode reached so far; modes only ever get cheaper within a request."""
+        spent = self.spent()
+        level = sum(1 for t in COST_DEGRADE_THRESHOLDS[:len(MODES) - 1] if spent >= t)
+        with self._lock:
+            if level > MODES.index(self.mode):
+                self.mode = MODES[level]
+                self.degraded.append({"mode": self.mode, "stage": current_span_name() or "", "spent": round(spent, 3)})
+                METRICS.inc("cost_degrade_total", mode=self.mode)
+            return self.mode
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "user": self.user, "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens,
+                "reasoning_tokens": self.reasoning_tokens, "usd": round(self.usd, 6),
+                "budget_usd": self.budget_usd, "budget_tokens": self.budget_tokens,
+                "mode": self.mode, "degraded": list(self.degraded),
+                "by_stage": {k: dict(v) for k, v in self.by_stage.items()},
+            }
+
+_current: contextvars.ContextVar[Optional[CostLedger]] = contextvars.ContextVar("cost_ledger", default=None)
+
+def current_ledger() -> Optional[CostLedger]:
+    return _current.get()
+
+@contextmanager
+def cost_scope(user: Optional[str] = None, **budgets):
+    """Account the LLM calls of one request; nested scopes reuse the outer ledger."""
+    outer = _current.get()
+    if outer is not None:
+        yield outer
+        return
+    ledger = CostLedger(user or "anonymous", **budgets)
+    token = _current.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current.reset(token)
+        METRICS.observe("request_cost_usd", ledger.usd)
+        METRICS.observe("request_llm_tokens", ledger.tokens)
+
+_labelled_users: Set[str] = set()
+_labelled_lock = threading.Lock()
+
+def _user_label(user: str) -> str:
+    """Bound the per-user metric cardinality: the first _MAX_USER_LABELS users keep their name."""
+    with _labelled_lock:
+        if user not in _labelled_users and len(_labelled_users) >= _MAX_USER_LABELS:
+            return "other"
+        _labelled_users.add(user)
+        return user
+
+def record_llm_usage(usage: Dict[str, Any]) -> float:
+    """Account one LLM call (works outside a request too: user "none"); returns its USD cost."""
+    prompt, completion, reasoning = _split_usage(usage or {})
+    stage = current_span_name() or "none"
+    ledger = _current.get()
+    user = ledger.user if ledger is not None else "none"
+    usd = ledger.add(stage, prompt, completion, reasoning) if ledger is not None else price(prompt, completion)
+    USER_TOTALS.add(user, usd, prompt + completion)
+    METRICS.inc("llm_cost_usd_total", usd, stage=stage)
+    label = _user_label(user)
+    for kind, n in (("prompt", prompt), ("completion", completion), ("reasoning", reasoning)):
+        if n:
+            METRICS.inc("llm_user_tokens_total", n, user=label, kind=kind)
+    return usd
+
+def check_budget() -> None:
+    """Raise BudgetExceeded before an LLM call once the request (or user) budget is used up."""
+    ledger = _current.get()
+    if ledger is not None and ledger.spent() >= 1.0:
+        METRICS.inc("cost_budget_exceeded_total")
+        raise BudgetExceeded(f"LLM budget used up (${ledger.usd:.4f}, {ledger.tokens} tokens) "
+                             f"before {current_span_name() or 'the next call'}")
+
+def degrade_mode() -> str:
+    ledger = _current.get()
+    return ledger.current_mode() if ledger is not None else "full"
+
+def at_least(mode: str) -> bool:
+    return MODES.index(degrade_mode()) >= MODES.index(mode)
+
+def allowed_retries(max_retries: int) -> int:
+    return min(max_retries, 1) if at_least("fewer_retries") else max_retries
@@ -1,31 +1,32 @@
 # customer_agent.py
 import os
 import pickle
-import re
-from typing import Dict, Any, TypedDict, Annotated
+from typing import Any, Mapping, TypedDict, Annotated
 from operator import add
 
 from langgraph.graph import StateGraph, START, END
 
-from customer_helper import chain_subquestion, chain_column_extractor
+from customer_helper import get_chain
+from cost_accounting import at_least
 from utils_parsing import parse_nested_list, normalize_subquestions
+from telemetry import span, traced_node
+from shared_state import freeze, shared_resource
 
-# Load knowledgebase (try CWD first, then module dir for robustness)
 _KB_FILENAME = "knowledgebase.pkl"
-try:
-    with open(_KB_FILENAME, 'rb') as f:
-        loaded_dict = pickle.load(f)
-except FileNotFoundError:
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    with open(os.path.join(base_dir, _KB_FILENAME), 'rb') as f:
-        loaded_dict = pickle.load(f)
 
-# Table groups for router → tables
-d_store = {
-    "customer": ['customer', 'sellers'],
-    "orders": ['order_items', 'order_payments', 'order_reviews', 'orders'],
-    "product": ["products", "category_translation"],
-}
+@shared_resource
+def get_knowledgebase() -> Mapping[str, Any]:
+    """
+    Load knowledgebase.pkl once, on first use (try CWD first, then module dir for robustness).
+    Shared by every request thread, so it is returned read-only (shared_state.freeze).
+    """
+    try:
+        with open(_KB_FILENAME, 'rb') as f:
+            return freeze(pickle.load(f))
+    except FileNotFoundError:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(base_dir, _KB_FILENAME), 'rb') as f:
+            return freeze(pickle.load(f))
 
 class overallstate(TypedDict):
     user_query: str
@@ -34,14 +35,15 @@ class overallstate(TypedDict):
     column_extract: Annotated[list[str], add]
 
 def agent_subquestion(q: str, v: str) -> str:
-    response = chain_subquestion.invoke({"tables": v, "user_query": q}).replace("\n", "")
+    with span("chain.subquestion"):
+        response = get_chain("chain_subquestion").invoke({"tables": v, "user_query": q}).replace("\n", "")
     # Return raw; parsing happens downstream
     return response
 
 def solve_subquestion(q: str, lst: list[str]) -> str:
     final = []
     for tab in lst:
-        desc = loaded_dict[tab][0]
+        desc = get_knowledgebase()[tab][0]
         final.append([tab, desc])
     result_dict = {item[0]: item[1] for item in final}
     return agent_subquestion(q, str(result_dict))
@@ -50,27 +52,28 @@ def sq_node(state: overallstate):
     q = state['user_query']
     lst = state['table_lst']
     raw = solve_subquestion(q, lst) or "[]"
-    parsed = parse_nested_list(raw)
+    parsed = parse_nested_list(raw, stage="subquestion")
     return {"table_extract": normalize_subquestions(parsed)}
 
 def agent_column_selection(mq: str, q: str, c: str) -> str:
-    response = chain_column_extractor.invoke({
-        "columns": c, "query": q, "main_question": mq
-    }).replace("\n", "")
-    match = re.search(r"\[\s*\[.*?\]\s*(,\s*\[.*?\]\s*)*\]", response, re.DOTALL)
-    return match.group(0) if match else "[]"
+    with span("chain.column_extractor"):
+        response = get_chain("chain_column_extractor").invoke({
+            "columns": c, "query": q, "main_question": mq
+        }).replace("\n", "")
+    return response
 
 def solve_column_selection(main_q: str, list_sub: list[list[str]]) -> list[list[str]]:
-    from utils_parsing import parse_nested_list  # keep local to mirror original
     final_col: list[list[str]] = []
     for tab in list_sub:
         if not tab:
             continue
         table_name = tab[-1]                           # robust: last is table
         question = " | ".join(tab[:-1]) or ""          # handles grouped or single
-        columns = loaded_dict[table_name][1]
+        columns = get_knowledgebase()[table_name][1]
+        if at_least("small_context"):  # LLM budget nearly used: names only, no descriptions
+            columns = [c[0] if isinstance(c, (list, tuple)) and c else c for c in columns]
         out_column = agent_column_selection(main_q, question, str(columns))
-        trans_col = parse_nested_list(out_column)      # safe parsing
+        trans_col = parse_nested_list(out_column, stage="column")  # single-pass, no regex backtracking
         for col_selec in trans_col:
             if not isinstance(col_selec, list) or len(col_selec) < 2:
                 continue
@@ -83,10 +86,24 @@ def column_node(state: overallstate):
     o = solve_column_selection(mq, subq)
     return {"column_extract": o}
 
-builder_final = StateGraph(overallstate)
-builder_final.add_node("subquestion", sq_node)
-builder_final.add_node("column_e", column_node)
-builder_final.add_edge(START, "subquestion")
-builder_final.add_edge("subquestion", "column_e")
-builder_final.add_edge("column_e", END)
-graph_final = builder_final.compile()
+@shared_resource
+def get_customer_graph():
+    """Compile the subquestion → column-selection graph once, on first use."""
+    builder_final = StateGraph(overallstate)
+    builder_final.add_node("subquestion", traced_node("customer.subquestion", sq_node))
+    builder_final.add_node("column_e", traced_node("customer.column_e", column_node))
+    builder_final.add_edge(START, "subquestion")
+    builder_final.add_edge("subquestion", "column_e")
+    builder_final.add_edge("column_e", END)
+    return builder_final.compile()
+
+def __getattr__(name: str):
+    # keeps `from customer_agent import loaded_dict / graph_final / d_store` working, resolved lazily
+    if name == "loaded_dict":
+        return get_knowledgebase()
+    if name == "graph_final":
+        return get_customer_graph()
+    if name == "d_store":  # router group -> tables, now discovered (schema_catalog.routing_groups)
+        from schema_catalog import routing_groups
+        return {g.name: list(g.tables) for g in routing_groups()}
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
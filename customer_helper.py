@@ -1,12 +1,48 @@
 # customer_helper.py
+import re
+
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnableMap
 
 from config import get_llm
+from structured_output import extraction_chain
+from shared_state import shared_resource
 
-# ---------------- LLM ----------------
-llm = get_llm()
+# ===========================
+# Known join keys (single source for the SQL prompt, local SQL repair and index management).
+# The discovered ones (schema_catalog) win; this list is the Olist fallback without a catalog.
+# ===========================
+KNOWN_JOIN_KEYS = [
+    ("orders.order_id", "order_items.order_id", "order_payments.order_id", "order_reviews.order_id"),
+    ("orders.customer_id", "customer.customer_id"),
+    ("order_items.product_id", "products.product_id"),
+    ("products.product_category_name", "category_translation.product_category_name"),
+    ("order_items.seller_id", "sellers.seller_id"),
+]
+
+def known_join_keys():
+    from schema_catalog import known_join_keys as discovered
+    return discovered() or KNOWN_JOIN_KEYS
+
+def join_key_pairs():
+    """Yield (table_a, column_a, table_b, column_b) for every pair of joinable columns."""
+    for group in known_join_keys():
+        refs = [g.split(".", 1) for g in group]
+        for i, (ta, ca) in enumerate(refs):
+            for tb, cb in refs[i + 1:]:
+                yield ta, ca, tb, cb
+
+def join_keys_text(columns: str = "") -> str:
+    """Join-key lines for the SQL prompt: only keys linking 2+ tables named in `columns` (all when empty),
+    so the prompt doesn't grow with the schema."""
+    lines = []
+    for group in known_join_keys():
+        tables = {g.split(".", 1)[0] for g in group}
+        if columns and sum(1 for t in tables if re.search(rf"\b{re.escape(t)}\b", columns)) < 2:
+            continue
+        lines.append("- " + " ↔ ".join(group))
+    return "\n".join(lines) or "- (none among the provided tables)"
 
 # ===========================
 # Subquestion selection
@@ -69,15 +105,15 @@ User question:
 ''')
 ])
 
-chain_subquestion = (
-    RunnableMap({
-        "tables": lambda x: x["tables"],
-        "user_query": lambda x: x["user_query"]
-    })
-    | template_subquestion
-    | llm
-    | StrOutputParser()
-)
+def _build_chain_subquestion():
+    return extraction_chain(
+        RunnableMap({
+            "tables": lambda x: x["tables"],
+            "user_query": lambda x: x["user_query"]
+        })
+        | template_subquestion,
+        "subquestion",
+    )
 
 # ===========================
 # Column selection
@@ -125,16 +161,16 @@ Main question:
 ''')
 ])
 
-chain_column_extractor = (
-    RunnableMap({
-        "columns": lambda x: x["columns"],
-        "query": lambda x: x["query"],
-        "main_question": lambda x: x["main_question"]
-    })
-    | template_column
-    | llm
-    | StrOutputParser()
-)
+def _build_chain_column_extractor():
+    return extraction_chain(
+        RunnableMap({
+            "columns": lambda x: x["columns"],
+            "query": lambda x: x["query"],
+            "main_question": lambda x: x["main_question"]
+        })
+        | template_column,
+        "column",
+    )
 
 # ===========================
 # Filter decision
@@ -164,15 +200,15 @@ Available tables and columns (with sample values):
 ''')
 ])
 
-chain_filter_extractor = (
-    RunnableMap({
-        "columns": lambda x: x["columns"],
-        "query": lambda x: x["query"]
-    })
-    | template_filter_check
-    | llm
-    | StrOutputParser()
-)
+def _build_chain_filter_extractor():
+    return extraction_chain(
+        RunnableMap({
+            "columns": lambda x: x["columns"],
+            "query": lambda x: x["query"]
+        })
+        | template_filter_check,
+        "filter",
+    )
 
 # ===========================
 # SQL generation
@@ -192,11 +228,7 @@ SCHEMA COMPLIANCE
 - If a needed field is reachable via JOIN across the provided tables, join them using the identifiers described in those columns. Do not reference tables/columns outside the provided set.
 
 KNOWN JOIN KEYS (helpful guidance, use only when present in the provided columns):
-- orders.order_id ↔ order_items.order_id ↔ order_payments.order_id ↔ order_reviews.order_id
-- orders.customer_id ↔ customer.customer_id
-- order_items.product_id ↔ products.product_id
-- products.product_category_name ↔ category_translation.product_category_name
-- order_items.seller_id ↔ sellers.seller_id
+{join_keys}
 
 SCHEMA MAPPING HINTS
 - Customer city/state come from customer.customer_city / customer.customer_state via orders.customer_id = customer.customer_id. Do NOT use non-existent columns like orders.city or orders.state.
@@ -234,16 +266,18 @@ Applicable filters:
 ''')
 ])
 
-chain_query_extractor = (
-    RunnableMap({
-        "columns": lambda x: x["columns"],
-        "query": lambda x: x["query"],
-        "filters": lambda x: x["filters"]
-    })
-    | template_sql_query
-    | llm
-    | StrOutputParser()
-)
+def _build_chain_query_extractor():
+    return (
+        RunnableMap({
+            "columns": lambda x: x["columns"],
+            "query": lambda x: x["query"],
+            "filters": lambda x: x["filters"],
+            "join_keys": lambda x: join_keys_text(str(x["columns"])),
+        })
+        | template_sql_query
+        | get_llm()
+        | StrOutputParser()
+    )
 
 # ===========================
 # SQL validation
@@ -293,14 +327,40 @@ Return ONLY the final SQL statement.
 ''')
 ])
 
-chain_query_validator = (
-    RunnableMap({
-        "columns": lambda x: x["columns"],
-        "query": lambda x: x["query"],
-        "filters": lambda x: x["filters"],
-        "sql_query": lambda x: x["sql_query"],
-    })
-    | template_validation
-    | llm
-    | StrOutputParser()
-)
+def _build_chain_query_validator():
+    return (
+        RunnableMap({
+            "columns": lambda x: x["columns"],
+            "query": lambda x: x["query"],
+            "filters": lambda x: x["filters"],
+            "sql_query": lambda x: x["sql_query"],
+        })
+        | template_validation
+        | get_llm()
+        | StrOutputParser()
+    )
+
+# ===========================
+# Lazy access: chains (and the LLM client) are built on first use, not at import
+# ===========================
+_CHAIN_BUILDERS = {
+    "chain_subquestion": _build_chain_subquestion,
+    "chain_column_extractor": _build_chain_column_extractor,
+    "chain_filter_extractor": _build_chain_filter_extractor,
+    "chain_query_extractor": _build_chain_query_extractor,
+    "chain_query_validator": _build_chain_query_validator,
+}
+CHAIN_NAMES = tuple(_CHAIN_BUILDERS)
+
+@shared_resource
+def get_chain(name: str):
+    """Build (once) and return one of the chains above, e.g. get_chain("chain_query_extractor")."""
+    return _CHAIN_BUILDERS[name]()
+
+def __getattr__(name: str):
+    # keeps `from customer_helper import chain_*` / `customer_helper.llm` working, resolved lazily
+    if name in _CHAIN_BUILDERS:
+        return get_chain(name)
+    if name == "llm":
+        return get_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
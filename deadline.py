@@ -0,0 +1,212 @@
+# deadline.py
+"""
+Per-request deadlines and cancellation.
+
+- deadline_scope(timeout_s, key=...) opens a Deadline for one request and makes it current
+  (contextvar, so it follows the request into both LangGraph graphs, the LLM wrapper and the
+  execution backends). Opening a scope with the key of a still-running request cancels that
+  request ("superseded"), so a resubmit stops the old run instead of letting it burn tokens.
+- stage(name) narrows the deadline to the stage's share of the total (STAGE_BUDGETS, fractions
+  of REQUEST_TIMEOUT_S) without extending it; cancellation is shared with the request.
+- check_deadline() raises DeadlineExceeded / Cancelled (both RequestAborted, with .status
+  "timeout" / "cancelled"); callers turn that into a partial result.
+- Deadline.on_cancel(fn) registers abort hooks (KILL QUERY for MySQL, interrupt() for DuckDB).
+- sleep(s) is a cancel-aware time.sleep for retry backoff.
+"""
+import contextvars
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from config import REQUEST_TIMEOUT_S, STAGE_BUDGETS
+from telemetry import METRICS
+
+# Max share of the request budget a single stage may use (a stage never outlives the request).
+DEFAULT_STAGE_BUDGETS: Dict[str, float] = {
+    "route": 0.15,
+    "customer_graph": 0.35,
+    "filters": 0.2,
+    "generate_sql": 0.2,
+    "followup_classifier": 0.15,
+    "refine_sql": 0.2,
+    "sql_validate_and_execute": 0.5,
+    "bi_expert": 0.2,
+    "viz_code_generator": 0.25,
+    "viz_code_validator": 0.35,
+    "await_full_result": 0.5,
+}
+
+def stage_budgets() -> Dict[str, float]:
+    """Defaults, overridden by the STAGE_BUDGETS JSON ({"stage": fraction})."""
+    over = {}
+    if STAGE_BUDGETS:
+        try:
+            over = {k: float(v) for k, v in json.loads(STAGE_BUDGETS).items()}
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
+            pass
+    return {**DEFAULT_STAGE_BUDGETS, **over}
+
+class RequestAborted(Exception):
+    status = "error"
+
+class DeadlineExceeded(RequestAborted):
+    status = "timeout"
+
+class Cancelled(RequestAborted):
+    status = "cancelled"
+
+class Deadline:
+    """Absolute expiry (monotonic) plus a cancel flag shared by the request and its stages."""
+
+    def __init__(self, timeout_s: Optional[float] = None, key: Optional[str] = None):
+        self.key = key
+        self.timeout_s = float(timeout_s) if timeout_s and timeout_s > 0 else None
+        self.started = time.monotonic()
+        self.expires_at = self.started + self.timeout_s if self.timeout_s else float("inf")
+        self.stage: Optional[str] = None
+        self.reason = ""
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._hooks: Dict[int, Callable[[], None]] = {}
+        self._ids = itertools.count()
+
+    def child(self, stage: str, fraction: float) -> "Deadline":
+        """Same request, shorter expiry: min(request expiry, now + fraction * total)."""
+        d = Deadline.__new__(Deadline)
+        d.__dict__.update(self.__dict__)  # shares _event, _lock and _hooks with the request
+        d.stage = stage
+        if self.timeout_s:
+            d.expires_at = min(self.expires_at, time.monotonic() + fraction * self.timeout_s)
+        d._root = getattr(self, "_root", self)
+        return d
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self, where: str = "") -> None:
+        where = where or self.stage or "request"
+        if self._event.is_set():
+            raise Cancelled(f"cancelled during {where}: {getattr(self, '_root', self).reason or 'cancelled'}")
+        if self.expired:
+            METRICS.inc("deadline_exceeded_total", stage=where)
+            budget = f"{self.expires_at - self.started:.1f}s" if self.timeout_s else "?"
+            raise DeadlineExceeded(f"deadline exceeded during {where} (budget {budget})")
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """Flag the request as cancelled and run the abort hooks (errors in hooks are ignored)."""
+        root = getattr(self, "_root", self)
+        with self._lock:
+            if self._event.is_set():
+                return
+            root.reason = reason
+            self._event.set()
+            hooks = list(self._hooks.values())
+        METRICS.inc("requests_cancelled_total", reason=reason)
+        for fn in hooks:
+            try:
+                fn()
+            except Exception:
+                pass
+
+    def on_cancel(self, fn: Callable[[], None]) -> Callable[[], None]:
+        """Register an abort hook; returns a function that unregisters it."""
+        with self._lock:
+            hid = next(self._ids)
+            self._hooks[hid] = fn
+
+        def _remove() -> None:
+            with self._lock:
+                self._hooks.pop(hid, None)
+        return _remove
+
+    def wait(self, seconds: float) -> bool:
+        """Sleep up to `seconds` (capped at the remaining time); True if cancelled meanwhile."""
+        return self._event.wait(min(seconds, self.remaining()))
+
+_current: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("deadline", default=None)
+_active: Dict[str, Deadline] = {}
+_active_lock = threading.Lock()
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+def check_deadline(where: str = "") -> None:
+    """No-op outside a deadline_scope."""
+    d = _current.get()
+    if d is not None:
+        d.check(where)
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left for the current stage/request, or `default` when there is no finite deadline."""
+    d = _current.get()
+    if d is None or not d.timeout_s:
+        return default
+    return d.remaining()
+
+def sleep(seconds: float) -> None:
+    """time.sleep that wakes up on cancel and refuses to sleep past the deadline."""
+    d = _current.get()
+    if d is None:
+        time.sleep(seconds)
+        return
+    d.check()
+    if seconds >= d.remaining():  # waiting would only end in a timeout
+        where = d.stage or "request"
+        METRICS.inc("deadline_exceeded_total", stage=where)
+        raise DeadlineExceeded(f"deadline exceeded during {where} (backoff of {seconds:.1f}s does not fit)")
+    d.wait(seconds)
+    d.check()
+
+def cancel_request(key: str, reason: str = "cancelled") -> bool:
+    """Cancel the running request registered under `key`; False if there is none."""
+    with _active_lock:
+        d = _active.get(key)
+    if d is None:
+        return False
+    d.cancel(reason)
+    return True
+
+@contextmanager
+def deadline_scope(timeout_s: Optional[float] = None, key: Optional[str] = None):
+    """Run a request under a deadline (default REQUEST_TIMEOUT_S); a same-key request is superseded."""
+    d = Deadline(REQUEST_TIMEOUT_S if timeout_s is None else timeout_s, key=key)
+    if key:
+        with _active_lock:
+            previous, _active[key] = _active.get(key), d
+        if previous is not None:
+            previous.cancel("superseded")
+    token = _current.set(d)
+    try:
+        yield d
+    finally:
+        _current.reset(token)
+        if key:
+            with _active_lock:
+                if _active.get(key) is d:
+                    del _active[key]
+
+@contextmanager
+def stage(name: str):
+    """Check the deadline, then run the block under the stage's slice of the request budget."""
+    d = _current.get()
+    if d is None:
+        yield None
+        return
+    d.check(name)
+    child = d.child(name, stage_budgets().get(name, 1.0))
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        _current.reset(token)
@@ -0,0 +1,430 @@
+# execution_backends.py
+"""
+Pluggable execution backends for generated SQL.
+
+- MySQLBackend: the row store behind get_engine() (default).
+- DuckDBBackend: embedded columnar engine over Parquet snapshots of the MySQL tables
+  (one <table>.parquet per table in DUCKDB_SNAPSHOT_DIR, exposed as views).
+- transpile_mysql_to_duckdb(sql) rewrites the MySQL dialect the prompts ask for into DuckDB
+  SQL, raising UnsupportedSQL for constructs it can't translate faithfully. The schema's
+  utf8mb4_unicode_ci collation is matched with DuckDB's nocase.noaccent default collation
+  (DUCKDB_COLLATION), so string =, IN, LIKE, GROUP BY and DISTINCT don't silently differ.
+- FederatedBackend (federated.py, EXECUTION_BACKEND=federated): fans the query out to the region
+  shards in SHARD_URLS and merges partial aggregates locally.
+- execute(sql) runs on the configured backend and falls back to MySQL on UnsupportedSQL or any
+  DuckDB error, so errors fed to the SQL fixer are always MySQL errors. The federated backend
+  falls back only for shapes it can't split, and only when DATABASE_URL holds all the data.
+- Backends return pyarrow Tables (read_arrow); execute() converts once via arrow_results.to_frame.
+- Under a request deadline (deadline.py) MySQL queries carry a MAX_EXECUTION_TIME hint for the
+  remaining budget and are KILL QUERY'd on cancel; DuckDB queries are interrupted instead.
+
+CLI:
+  python execution_backends.py snapshot                 # export MySQL tables to Parquet
+  python execution_backends.py bench [--from-batch DIR] # MySQL vs DuckDB on a standard set
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import threading
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+from sqlalchemy import text
+
+from arrow_results import fetch_arrow, to_frame
+from config import get_engine, EXECUTION_BACKEND, DUCKDB_SNAPSHOT_DIR
+from deadline import DeadlineExceeded, RequestAborted, check_deadline, current_deadline
+from telemetry import METRICS, span
+from shared_state import shared_resource
+
+class UnsupportedSQL(ValueError):
+    """The MySQL statement uses syntax the target backend can't run with the same semantics."""
+
+# DuckDB's closest match to the schema's utf8mb4_unicode_ci (case- and accent-insensitive)
+DUCKDB_COLLATION = "nocase.noaccent"
+
+# ---------------- Backends ----------------
+def with_max_execution_time(sql: str, ms: int) -> str:
+    """Add a MAX_EXECUTION_TIME optimizer hint to a SELECT (MySQL aborts it server-side)."""
+    return re.sub(r"(?is)^(\s*select)\b", rf"\1 /*+ MAX_EXECUTION_TIME({max(1, int(ms))}) */", sql, count=1)
+
+def _kill_query(connection_id: int, engine=None) -> None:
+    with (engine or get_engine()).connect() as conn:
+        conn.execute(text(f"KILL QUERY {int(connection_id)}"))
+    METRICS.inc("db_queries_killed_total")
+
+# ER_QUERY_INTERRUPTED (KILL QUERY) and ER_QUERY_TIMEOUT (the MAX_EXECUTION_TIME hint)
+_ABORT_ERRNOS = (1317, 3024)
+
+def raise_if_query_aborted(err: Exception) -> None:
+    """Re-raise a MySQL error that only says the query was stopped (killed on cancel, or out of
+    time) as RequestAborted: it's no SQL error for the fixer, and single-flight followers retry."""
+    args = getattr(getattr(err, "orig", err), "args", ())
+    if not args or args[0] not in _ABORT_ERRNOS:
+        return
+    check_deadline()  # our own cancel / expiry: Cancelled or DeadlineExceeded
+    if args[0] == 3024:
+        raise DeadlineExceeded(f"query stopped by MAX_EXECUTION_TIME: {err}") from err
+    raise RequestAborted(f"query killed on the server: {err}") from err
+
+def killable(deadline, engine=None):
+    """on_connect hook: remember the MySQL connection id and KILL QUERY it (through `engine`,
+    default get_engine()) if the request is cancelled."""
+    def hook(conn):
+        cid = conn.execute(text("SELECT CONNECTION_ID()")).scalar()
+        return deadline.on_cancel(lambda: _kill_query(cid, engine))
+    return hook
+
+class MySQLBackend:
+    name = "mysql"
+
+    def read_arrow(self, sql: str):
+        engine = get_engine()
+        dl = current_deadline()
+        if dl is None or engine.dialect.name != "mysql":
+            return fetch_arrow(engine, sql)
+        dl.check()
+        if dl.timeout_s:
+            sql = with_max_execution_time(sql, dl.remaining() * 1000)
+        try:
+            return fetch_arrow(engine, sql, on_connect=killable(dl))
+        except Exception as e:
+            raise_if_query_aborted(e)
+            raise
+
+    def read_sql(self, sql: str) -> pd.DataFrame:
+        return to_frame(self.read_arrow(sql))
+
+class DuckDBBackend:
+    name = "duckdb"
+    fallback_on_unsupported = True
+    fallback_on_error = True  # errors reaching the SQL fixer stay MySQL errors
+
+    def __init__(self, snapshot_dir: str = DUCKDB_SNAPSHOT_DIR):
+        import duckdb
+
+        self.snapshot_dir = snapshot_dir
+        self._con = duckdb.connect(":memory:")
+        self._local = threading.local()
+        self.tables: List[str] = []
+        for fname in sorted(os.listdir(snapshot_dir)):
+            if fname.endswith(".parquet"):
+                table = fname[:-len(".parquet")]
+                path = os.path.join(snapshot_dir, fname).replace("'", "''")
+                # Views re-read the file, so a refreshed snapshot is picked up without a restart.
+                self._con.execute(f"CREATE VIEW \"{table}\" AS SELECT * FROM read_parquet('{path}')")
+                self.tables.append(table)
+        self._con.execute(f"SET GLOBAL default_collation = '{DUCKDB_COLLATION}'")
+
+    def _cursor(self):
+        cur = getattr(self._local, "cur", None)
+        if cur is None:
+            cur = self._local.cur = self._con.cursor()  # one connection per thread, shared catalog
+        return cur
+
+    def read_arrow(self, sql: str):
+        sql = transpile_mysql_to_duckdb(sql)
+        cur = self._cursor()
+        dl = current_deadline()
+        if dl is None:
+            return cur.execute(sql).fetch_arrow_table()
+        dl.check()
+        # DuckDB has no statement timeout: interrupt on cancel and when the budget runs out
+        remove = dl.on_cancel(cur.interrupt)
+        timer = threading.Timer(dl.remaining(), cur.interrupt) if dl.timeout_s else None
+        if timer:
+            timer.daemon = True
+            timer.start()
+        try:
+            return cur.execute(sql).fetch_arrow_table()
+        finally:
+            remove()
+            if timer:
+                timer.cancel()
+
+    def read_sql(self, sql: str) -> pd.DataFrame:
+        return to_frame(self.read_arrow(sql))
+
+@shared_resource
+def get_backend():
+    """Configured backend (EXECUTION_BACKEND); MySQL when DuckDB, its snapshot or the shards are unavailable."""
+    if EXECUTION_BACKEND == "federated":
+        try:
+            from federated import FederatedBackend
+            return FederatedBackend()
+        except Exception as e:
+            print(f"[execution_backends] federated execution unavailable ({type(e).__name__}: {e}); using MySQL")
+    if EXECUTION_BACKEND == "duckdb":
+        try:
+            return DuckDBBackend(DUCKDB_SNAPSHOT_DIR)
+        except Exception as e:
+            print(f"[execution_backends] DuckDB unavailable ({type(e).__name__}: {e}); using MySQL")
+    return MySQLBackend()
+
+@shared_resource
+def _mysql() -> MySQLBackend:
+    return MySQLBackend()
+
+def execute(sql: str) -> pd.DataFrame:
+    """Run `sql` (MySQL dialect) on the configured backend, falling back to MySQL where the
+    backend allows it (fallback_on_unsupported / fallback_on_error)."""
+    backend = get_backend()
+    if backend.name != "mysql":
+        try:
+            with span(f"db.{backend.name}"):
+                table = backend.read_arrow(sql)
+            METRICS.inc("backend_queries_total", backend=backend.name)
+            return to_frame(table)
+        except UnsupportedSQL:
+            if not backend.fallback_on_unsupported:
+                raise
+            METRICS.inc("backend_fallbacks_total", backend=backend.name, reason="unsupported")
+        except RequestAborted:
+            raise
+        except Exception:
+            check_deadline()  # interrupted by the deadline/cancel: don't retry on MySQL
+            if not backend.fallback_on_error:
+                raise
+            METRICS.inc("backend_fallbacks_total", backend=backend.name, reason="error")
+    METRICS.inc("backend_queries_total", backend="mysql")
+    return _mysql().read_sql(sql)
+
+# ---------------- MySQL -> DuckDB ----------------
+_UNSUPPORTED = re.compile(
+    r"(?i)\b(?:field|find_in_set|convert_tz|period_diff|period_add|yearweek|week|weekofyear|"
+    r"timestampadd|sec_to_time|time_to_sec|inet_aton|inet_ntoa|match|sql_calc_found_rows|"
+    r"straight_join|elt|format|str_to_date)\s*\(|@\w|\bwith\s+rollup\b|\bsql_\w+\b"
+)
+_DATE_FMT = {
+    "%Y": "%Y", "%y": "%y", "%m": "%m", "%c": "%-m", "%d": "%d", "%e": "%-d", "%H": "%H",
+    "%k": "%-H", "%h": "%I", "%I": "%I", "%i": "%M", "%s": "%S", "%S": "%S", "%p": "%p",
+    "%M": "%B", "%b": "%b", "%W": "%A", "%a": "%a", "%j": "%j", "%T": "%H:%M:%S", "%%": "%%",
+}
+_UNITS = {"microsecond", "second", "minute", "hour", "day", "week", "month", "quarter", "year"}
+
+def _mask(sql: str):
+    """Replace string literals with placeholders; returns (masked, literals)."""
+    literals: List[str] = []
+
+    def keep(m):
+        literals.append(m.group(0))
+        return f"\x00{len(literals) - 1}\x00"
+
+    return re.sub(r"'(?:[^'\\]|\\.|'')*'", keep, sql), literals
+
+def _unmask(sql: str, literals: List[str]) -> str:
+    return re.sub(r"\x00(\d+)\x00", lambda m: literals[int(m.group(1))], sql)
+
+def _call_args(s: str, open_idx: int):
+    """Split the top-level args of the call whose '(' is at open_idx; returns (args, close_idx)."""
+    depth, start, args = 0, open_idx + 1, []
+    for i in range(open_idx, len(s)):
+        ch = s[i]
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth == 0:
+                args.append(s[start:i].strip())
+                return args, i
+        elif ch == "," and depth == 1:
+            args.append(s[start:i].strip())
+            start = i + 1
+    raise UnsupportedSQL("unbalanced parentheses")
+
+def _rewrite_calls(s: str, name: str, fn) -> str:
+    """Replace every NAME(...) call (innermost first) with fn(args)."""
+    pattern = re.compile(rf"(?i)\b{name}\s*\(")
+    bound = len(s)
+    while True:
+        matches = list(pattern.finditer(s, 0, bound))
+        if not matches:
+            return s
+        m = matches[-1]  # the last call has no unrewritten NAME( calls inside it
+        args, close = _call_args(s, m.end() - 1)
+        s = s[:m.start()] + fn(args) + s[close + 1:]
+        bound = m.start()  # never rescan the replacement
+
+def _date_format(literals: List[str]):
+    def fn(args):
+        if len(args) != 2 or not re.fullmatch(r"\x00\d+\x00", args[1]):
+            raise UnsupportedSQL("DATE_FORMAT with a non-literal format")
+        idx = int(args[1].strip("\x00"))
+        fmt = literals[idx][1:-1]
+        out = re.sub(r"%.", lambda m: _DATE_FMT.get(m.group(0)) or _raise(f"DATE_FORMAT {m.group(0)}"), fmt)
+        literals[idx] = "'" + out + "'"
+        return f"strftime({args[0]}, {args[1]})"
+    return fn
+
+def _raise(msg: str):
+    raise UnsupportedSQL(msg)
+
+def _unit(u: str) -> str:
+    u = u.strip().lower()
+    if u not in _UNITS:
+        raise UnsupportedSQL(f"unit {u}")
+    return u
+
+def _interval_fn(op: str):
+    def fn(args):
+        if len(args) != 2:
+            raise UnsupportedSQL("DATE_ADD/DATE_SUB form")
+        m = re.fullmatch(r"(?is)interval\s+(.+?)\s+(\w+)", args[1])
+        if not m:
+            raise UnsupportedSQL("DATE_ADD/DATE_SUB without INTERVAL")
+        return f"({args[0]} {op} INTERVAL ({m.group(1)}) {_unit(m.group(2)).upper()})"
+    return fn
+
+def _group_concat(args):
+    if len(args) != 1 or re.search(r"(?i)\border\s+by\b", args[0]):
+        raise UnsupportedSQL("GROUP_CONCAT form")
+    m = re.fullmatch(r"(?is)(distinct\s+)?(.+?)(?:\s+separator\s+(\x00\d+\x00))?", args[0])
+    distinct, expr, sep = m.group(1) or "", m.group(2), m.group(3) or "','"
+    return f"string_agg({distinct}{expr}, {sep})"
+
+def _count(args):
+    if len(args) > 1:
+        raise UnsupportedSQL("COUNT(DISTINCT a, b)")
+    m = re.fullmatch(r"(?is)distinct\s+(.+)", args[0])
+    if m:  # aggregate DISTINCT ignores the collation: fold case/accents by hand (same count for non-strings)
+        return f"count(DISTINCT lower(strip_accents(CAST({m.group(1)} AS VARCHAR))))"
+    return f"count({args[0]})"
+
+def transpile_mysql_to_duckdb(sql: str) -> str:
+    """
+    Translate the MySQL subset generated by the prompts into DuckDB SQL with the same results.
+    Raises UnsupportedSQL when that isn't guaranteed.
+    """
+    s, literals = _mask(sql.strip().rstrip(";"))
+    if _UNSUPPORTED.search(s):
+        raise UnsupportedSQL(_UNSUPPORTED.search(s).group(0))
+
+    s = s.replace("`", '"')
+    s = _rewrite_calls(s, "date_format", _date_format(literals))
+    s = _rewrite_calls(s, "date_add", _interval_fn("+"))
+    s = _rewrite_calls(s, "adddate", _interval_fn("+"))
+    s = _rewrite_calls(s, "date_sub", _interval_fn("-"))
+    s = _rewrite_calls(s, "subdate", _interval_fn("-"))
+    # MySQL TIMESTAMPDIFF counts complete units, like DuckDB date_sub (date_diff counts boundaries).
+    s = _rewrite_calls(s, "timestampdiff", lambda a: f"date_sub('{_unit(a[0])}', {a[1]}, {a[2]})")
+    s = _rewrite_calls(s, "datediff", lambda a: f"date_diff('day', CAST({a[1]} AS DATE), CAST({a[0]} AS DATE))")
+    s = _rewrite_calls(s, "dayofweek", lambda a: f"(dayofweek({a[0]}) + 1)")  # MySQL: Sunday = 1
+    s = _rewrite_calls(s, "group_concat", _group_concat)
+    s = _rewrite_calls(s, "count", _count)
+    s = re.sub(r"(?i)\bcurdate\s*\(\s*\)", "current_date", s)
+    s = re.sub(r"(?i)\bdiv\b", "//", s)
+    # =, IN, GROUP BY, DISTINCT and ORDER BY follow DUCKDB_COLLATION (set on every connection);
+    # LIKE ignores the default collation, so the pattern literal carries it explicitly.
+    s = re.sub(r"(?i)\blike\s+(\x00\d+\x00)", rf"LIKE (\1 COLLATE {DUCKDB_COLLATION})", s)
+    if re.search(r"(?i)\blike\b(?!\s+\(\x00)", s):
+        raise UnsupportedSQL("LIKE with a non-literal pattern")
+    s = re.sub(r"(?i)\blimit\s+(\d+)\s*,\s*(\d+)", r"LIMIT \2 OFFSET \1", s)
+    return _unmask(s, literals)
+
+# ---------------- Snapshots ----------------
+def snapshot_tables(engine, snapshot_dir: str = DUCKDB_SNAPSHOT_DIR,
+                    tables: Optional[List[str]] = None) -> Dict[str, int]:
+    """Export MySQL tables (default: all in the schema) to <snapshot_dir>/<table>.parquet."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    if tables is None:
+        with engine.connect() as conn:
+            tables = [r[0] for r in conn.execute(text(
+                "SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'"
+            ))]
+    counts = {}
+    for t in tables:
+        if t.endswith("__new") or t.endswith("__stage"):
+            continue
+        df = pd.read_sql(text(f"SELECT * FROM `{t}`"), con=engine)
+        for c in df.columns:  # DECIMAL columns arrive as Python Decimals
+            if df[c].dtype == object and df[c].map(lambda v: v is None or hasattr(v, "as_tuple")).all():
+                df[c] = pd.to_numeric(df[c])
+        tmp = os.path.join(snapshot_dir, f"{t}.parquet.tmp")
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, os.path.join(snapshot_dir, f"{t}.parquet"))
+        counts[t] = len(df)
+    with open(os.path.join(snapshot_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "rows": counts}, f, indent=2)
+    return counts
+
+# ---------------- Benchmark ----------------
+def standard_sql_set(batch_dir: Optional[str] = None) -> Dict[str, str]:
+    """index_manager.STANDARD_QUERIES + summary_tables.VERIFY_QUERIES, or the query.sql files
+    a batch_runner run produced for a standard question set."""
+    if batch_dir:
+        out = {}
+        for qid in sorted(os.listdir(batch_dir)):
+            path = os.path.join(batch_dir, qid, "query.sql")
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    sql = f.read().strip()
+                if sql:
+                    out[qid] = sql
+        return out
+    from index_manager import STANDARD_QUERIES
+    from summary_tables import VERIFY_QUERIES
+    out = dict(STANDARD_QUERIES)
+    out.update({f"verify_{i}": q for i, q in enumerate(VERIFY_QUERIES)})
+    return out
+
+def _median_time(fn, repeats: int):
+    times, result = [], None
+    for _ in range(max(1, repeats)):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), result
+
+def benchmark(queries: Dict[str, str], snapshot_dir: str = DUCKDB_SNAPSHOT_DIR, repeats: int = 3) -> List[dict]:
+    """Median time per query on MySQL and DuckDB, plus whether row counts agree."""
+    mysql, duck = MySQLBackend(), DuckDBBackend(snapshot_dir)
+    report = []
+    for name, sql in queries.items():
+        entry = {"query": name}
+        try:
+            entry["mysql_s"], a = _median_time(lambda: mysql.read_sql(sql), repeats)
+        except Exception as e:
+            entry.update(mysql_s=None, error=f"mysql: {e}"[:200])
+            report.append(entry)
+            continue
+        try:
+            entry["duckdb_s"], b = _median_time(lambda: duck.read_sql(sql), repeats)
+            entry["same_shape"] = a.shape == b.shape
+        except UnsupportedSQL as e:
+            entry.update(duckdb_s=None, fallback=f"unsupported: {e}")
+        except Exception as e:
+            entry.update(duckdb_s=None, fallback=f"error: {str(e).splitlines()[0][:200]}")
+        report.append(entry)
+    return report
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Columnar execution backend tools.")
+    ap.add_argument("cmd", choices=["snapshot", "bench"])
+    ap.add_argument("--snapshot-dir", default=DUCKDB_SNAPSHOT_DIR)
+    ap.add_argument("--from-batch", help="benchmark the query.sql files of a batch_runner output dir")
+    ap.add_argument("--repeats", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "snapshot":
+        for t, n in snapshot_tables(get_engine(), args.snapshot_dir).items():
+            print(f"✅ {t}: {n} rows")
+        return
+
+    report = benchmark(standard_sql_set(args.from_batch), args.snapshot_dir, args.repeats)
+    print(f"{'query':<30} {'mysql_s':>9} {'duckdb_s':>9} {'speedup':>8}  note")
+    for r in report:
+        m, d = r.get("mysql_s"), r.get("duckdb_s")
+        speed = f"{m / d:.1f}x" if m and d else "-"
+        note = r.get("fallback") or r.get("error") or ("" if r.get("same_shape", True) else "shape differs")
+        print(f"{r['query']:<30} {m if m is not None else '-':>9.4} {d if d is not None else '-':>9.4} {speed:>8}  {note}")
+    ran = [r for r in report if r.get("mysql_s") and r.get("duckdb_s")]
+    if ran:
+        print(f"total: mysql {sum(r['mysql_s'] for r in ran):.3f}s, duckdb {sum(r['duckdb_s'] for r in ran):.3f}s "
+              f"over {len(ran)} queries; {len(report) - len(ran)} fell back / failed")
+
+if __name__ == "__main__":
+    main()
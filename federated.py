@@ -0,0 +1,737 @@
+# federated.py
+"""
+Federated execution of generated SQL across region shards, merging aggregates locally.
+
+Production data is split by region over several databases (SHARD_URLS). With
+EXECUTION_BACKEND=federated, execution_backends.execute() hands each generated query to
+FederatedBackend, which plans it once (plan_query) and fans it out to every shard in parallel:
+
+- rows: no aggregates. Every shard runs the query with its ORDER BY and LIMIT offset+n, the
+  union is sorted and limited again locally (ORDER BY expressions that aren't selected ride
+  along as hidden columns). DISTINCT is applied on both sides.
+- aggregate: GROUP BY and/or aggregates. Every shard returns one partial row per group and the
+  final phase re-aggregates them: SUM -> SUM, COUNT -> SUM of counts, MIN/MAX -> MIN/MAX,
+  AVG(x) -> SUM(sum x) / SUM(count x). COUNT(DISTINCT x) is a sum of per-shard counts when x
+  never repeats across shards (SHARD_DISJOINT_COLUMNS, e.g. the shard key); otherwise shards
+  return a HyperLogLog sketch computed in SQL (group, register, max rank of a 32-bit hash),
+  merged by max per register: ~1.04/sqrt(2^HLL_PRECISION) relative error. Expressions over
+  aggregates, HAVING and ORDER BY are evaluated on the merged values.
+- single: only replicated tables (SHARD_REPLICATED_TABLES, copied to every shard); the query
+  runs unchanged on one shard.
+
+The final phase runs in an in-process DuckDB over the shards' Arrow tables (the MySQL
+expressions go through execution_backends.transpile_mysql_to_duckdb). Joins are pushed down
+as they are, so they must be shard-local: facts live with their parent rows (an order, its
+items, payments and reviews on the customer's region shard), reference tables are replicated.
+
+Shapes that can't be split faithfully raise UnsupportedSQL: window functions, CTEs, UNION,
+aggregates or LIMIT inside subqueries, SUM/AVG(DISTINCT), GROUP_CONCAT, STDDEV, WITH ROLLUP.
+execute() runs those on DATABASE_URL when it is a full copy (not one of the shards); otherwise
+the error goes to the SQL fixer. A failing shard fails the query: a partial answer would be
+silently wrong.
+
+Everything except generated-query execution still reads DATABASE_URL, which must therefore be
+a full copy of every region (e.g. a read replica of all shards): the knowledgebase build, column
+statistics, fuzzy-match DISTINCT scans, full-result export, and the rollup (summary_tables) and
+sample (sample_tables) tables. sql_viz_workflow skips the rollup and sample rewrites under this
+backend, because those tables don't exist on the shards.
+
+Shards run under the request deadline (MAX_EXECUTION_TIME hint and KILL QUERY on cancel for
+MySQL). Metrics: federated_queries_total{kind}, federated_shard_seconds{shard},
+federated_shard_errors_total{shard}, federated_partial_rows_total{shard},
+federated_approx_distinct_total.
+
+Local testing: split one database into SQLite (or DuckDB) shards, then compare both ways.
+
+CLI:
+  python federated.py plan "<sql>" [--dialect sqlite]                # shard and merge SQL
+  python federated.py split <source_url> <shard_url> [<shard_url> ...]
+  python federated.py verify [--single URL] [--queries file.sql]     # DATABASE_URL vs SHARD_URLS
+"""
+import argparse
+import contextvars
+import hashlib
+import itertools
+import re
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import create_engine, event, inspect, text
+
+from arrow_results import fetch_arrow, to_frame
+from config import (
+    DB_URL, FEDERATED_MAX_WORKERS, HLL_PRECISION, SHARD_DISJOINT_COLUMNS, SHARD_REPLICATED_TABLES, SHARD_URLS,
+)
+from deadline import check_deadline, current_deadline
+from execution_backends import (
+    DUCKDB_COLLATION, UnsupportedSQL, killable, raise_if_query_aborted, transpile_mysql_to_duckdb,
+    with_max_execution_time,
+)
+from telemetry import METRICS, instrument_engine, span
+from shared_state import shared_resource
+
+# ---------------- Lexing helpers ----------------
+_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_CLAUSE = re.compile(r"(?i)\b(select|from|where|group\s+by|having|order\s+by|limit)\b")
+_CLAUSE_ORDER = ["select", "from", "where", "group by", "having", "order by", "limit"]
+_AGG = re.compile(r"(?i)\b(sum|count|min|max|avg|any_value|group_concat|std|stddev|stddev_pop|stddev_samp|"
+                  r"variance|var_pop|var_samp|bit_and|bit_or|bit_xor|json_arrayagg|json_objectagg)\s*\(")
+_MERGEABLE = {"sum", "count", "min", "max", "avg", "any_value"}
+_WORDS = {
+    "and", "or", "not", "null", "is", "in", "like", "between", "case", "when", "then", "else", "end", "as",
+    "distinct", "asc", "desc", "interval", "true", "false", "div", "mod", "xor", "regexp", "rlike", "escape",
+    "binary", "collate", "unsigned", "signed", "char", "date", "datetime", "time", "decimal", "integer",
+    "microsecond", "second", "minute", "hour", "day", "week", "month", "quarter", "year",
+}
+_IDENT = re.compile(r"(?i)(?<![\w.\x00\x01])`?[a-z_]\w*`?(?:\.`?\w+`?)?(?![\w.(\x00\x01])")
+
+def _mask(sql: str) -> Tuple[str, List[str]]:
+    """String literals -> \\x00i\\x00 placeholders, so parentheses and keywords inside them are ignored."""
+    literals: List[str] = []
+
+    def keep(m):
+        literals.append(m.group(0))
+        return f"\x00{len(literals) - 1}\x00"
+
+    return _LITERAL.sub(keep, sql), literals
+
+def _unmask(s: str, literals: List[str]) -> str:
+    return re.sub(r"\x00(\d+)\x00", lambda m: literals[int(m.group(1))], s)
+
+def _depths(s: str) -> List[int]:
+    """Parenthesis depth at each character."""
+    out, d = [], 0
+    for ch in s:
+        d -= ch == ")"
+        out.append(d)
+        d += ch == "("
+    return out
+
+def _split_top(s: str, sep: str = ",") -> List[str]:
+    out, depth, start = [], 0, 0
+    for i, ch in enumerate(s):
+        depth += (ch == "(") - (ch == ")")
+        if ch == sep and depth == 0:
+            out.append(s[start:i].strip())
+            start = i + 1
+    if s[start:].strip():
+        out.append(s[start:].strip())
+    return out
+
+def _close_paren(s: str, open_idx: int) -> int:
+    depth = 0
+    for i in range(open_idx, len(s)):
+        depth += (s[i] == "(") - (s[i] == ")")
+        if depth == 0:
+            return i
+    raise UnsupportedSQL("unbalanced parentheses")
+
+def _column_name(expr: str) -> Optional[str]:
+    """`o.order_id` -> "order_id"; None for anything but a plain column reference."""
+    if not re.fullmatch(r"`?\w+`?(?:\.`?\w+`?)*", expr.strip()):
+        return None
+    return expr.strip().split(".")[-1].strip("`").lower()
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+# ---------------- Planning ----------------
+@dataclass(frozen=True)
+class FederatedPlan:
+    kind: str                        # "rows" | "aggregate" | "single"
+    shard_sql: str                   # runs on every shard (on one, for "single")
+    merge_sql: str = ""              # DuckDB over `partials` and est<j> (one per sketch)
+    sketches: Tuple[str, ...] = ()   # per approximate COUNT(DISTINCT): its shard SQL
+    group_columns: Tuple[str, ...] = ()
+    approximate: Tuple[str, ...] = ()  # output columns estimated with HyperLogLog
+
+class _Planner:
+    def __init__(self, sql: str, dialect: str):
+        self.sql = sql.strip().rstrip(";")
+        self.dialect = dialect
+        self.masked, self.literals = _mask(self.sql)
+        self.partial_items: List[str] = []  # "<expr> AS fed_a<i>"
+        self.merges: Dict[str, str] = {}    # aggregate key -> final expression
+        self.sketch_args: List[str] = []
+        self.names: List[str] = []
+
+    def u(self, s: str) -> str:
+        return _unmask(s, self.literals)
+
+    def name_ref(self, name: str) -> str:
+        """Placeholder for an output column name, so transpiling the merge SQL leaves it alone."""
+        self.names.append(name)
+        return f"\x03{len(self.names) - 1}\x03"
+
+    def to_duckdb(self, merge: str) -> str:
+        return re.sub(r"\x03(\d+)\x03", lambda m: _quote(self.names[int(m.group(1))]),
+                      transpile_mysql_to_duckdb(merge))
+
+    def key(self, s: str) -> str:
+        """Comparison key of an expression: case, backticks and whitespace don't matter."""
+        s = re.sub(r"\s+", " ", s.replace("`", "")).strip().lower()
+        return self.u(re.sub(r"\s*([(),=<>+\-*/])\s*", r"\1", s))
+
+    # -------- structure --------
+    def clauses(self, masked: str) -> Dict[str, str]:
+        depth = _depths(masked)
+        marks = [(m.start(), m.end(), re.sub(r"\s+", " ", m.group(1).lower()))
+                 for m in _CLAUSE.finditer(masked) if depth[m.start()] == 0]
+        names = [n for _, _, n in marks]
+        if not names or names[0] != "select" or len(set(names)) != len(names) \
+                or names != sorted(names, key=_CLAUSE_ORDER.index) or "from" not in names:
+            raise UnsupportedSQL("not a single SELECT ... FROM statement")
+        out = {}
+        for i, (_, end, name) in enumerate(marks):
+            stop = marks[i + 1][0] if i + 1 < len(marks) else len(masked)
+            out[name] = masked[end:stop].strip()
+        return out
+
+    def check_subqueries(self, masked: str) -> None:
+        """Subqueries are pushed down with the rest, so only row-level ones are shard-safe."""
+        depth = _depths(masked)
+        for m in re.finditer(r"(?i)\bselect\b", masked):
+            level = depth[m.start()]
+            if level == 0:
+                continue
+            end = next((j for j in range(m.start(), len(masked)) if masked[j] == ")" and depth[j] == level - 1),
+                       len(masked))
+            sub = masked[m.start():end]
+            if _AGG.search(sub) or re.search(r"(?i)\b(?:group\s+by|limit|distinct)\b", sub):
+                raise UnsupportedSQL("aggregate, DISTINCT or LIMIT inside a subquery")
+
+    def items(self, select: str) -> List[Tuple[str, str]]:
+        """[(masked expression, output name)]"""
+        out = []
+        for raw in _split_top(select):
+            m = re.fullmatch(r"(?is)(.*?\S)\s+(?:(as)\s+)?(`[^`]+`|\x00\d+\x00|\w+)", raw)
+            if m and (m.group(2) or (m.group(3).lower() not in _WORDS
+                                     and not m.group(1).rstrip().endswith(tuple("+-*/=<>,(")))):
+                expr, name = m.group(1).strip(), self.u(m.group(3)).strip("`\"'")
+            else:
+                expr = raw.strip()
+                name = _column_name(expr) or self.u(expr).replace("`", "")
+            out.append((expr, name))
+        return out
+
+    def limit(self, lim: str) -> Tuple[int, Optional[int]]:
+        """(offset, count) of a LIMIT clause; count None without one."""
+        if not lim:
+            return 0, None
+        m = re.fullmatch(r"(?is)(\d+)\s*(?:,\s*(\d+)|\s+offset\s+(\d+))?", lim.strip())
+        if not m:
+            raise UnsupportedSQL("LIMIT form")
+        if m.group(2):
+            return int(m.group(1)), int(m.group(2))
+        return int(m.group(3) or 0), int(m.group(1))
+
+    @staticmethod
+    def limit_sql(limit: Tuple[int, Optional[int]]) -> str:
+        off, n = limit
+        return "" if n is None else f" LIMIT {n}" + (f" OFFSET {off}" if off else "")
+
+    @staticmethod
+    def order_items(ob: str) -> List[Tuple[str, str]]:
+        out = []
+        for item in _split_top(ob):
+            m = re.fullmatch(r"(?is)(.+?)(?:\s+(asc|desc))?", item.strip())
+            direction = (m.group(2) or "asc").upper()
+            # MySQL sorts NULLs first ascending and last descending; DuckDB puts them last
+            out.append((m.group(1).strip(), f"{direction} NULLS {'FIRST' if direction == 'ASC' else 'LAST'}"))
+        return out
+
+    # -------- aggregates --------
+    def find_aggs(self, masked: str) -> List[Tuple[int, int, str, bool, str]]:
+        """Top-level aggregate calls: (start, end, function, distinct, masked argument)."""
+        out, pos = [], 0
+        while True:
+            m = _AGG.search(masked, pos)
+            if not m:
+                return out
+            close = _close_paren(masked, m.end() - 1)
+            arg = masked[m.end():close].strip()
+            dm = re.match(r"(?is)distinct\s+(.+)", arg)
+            out.append((m.start(), close + 1, m.group(1).lower(), bool(dm), dm.group(1).strip() if dm else arg))
+            pos = close + 1
+
+    def approximate(self, func: str, distinct: bool, arg: str) -> bool:
+        return func == "count" and distinct and _column_name(arg) not in SHARD_DISJOINT_COLUMNS
+
+    def merge_of(self, func: str, distinct: bool, arg: str) -> str:
+        """Final-phase expression of one aggregate call, adding its partial columns on first use."""
+        k = f"{func}|{distinct}|{self.key(arg)}"
+        if k in self.merges:
+            return self.merges[k]
+        if func not in _MERGEABLE:
+            raise UnsupportedSQL(f"{func.upper()} across shards")
+        if distinct and func != "count":
+            raise UnsupportedSQL(f"{func.upper()}(DISTINCT ...) across shards")
+        if _AGG.search(arg):
+            raise UnsupportedSQL("nested aggregate")
+        n, e = len(self.partial_items), self.u(arg)
+        col = f"fed_a{n}"
+        if func in ("sum", "min", "max"):
+            self.partial_items.append(f"{func.upper()}({e}) AS {col}")
+            merge = f"{func.upper()}({col})"
+        elif func == "any_value":
+            self.partial_items.append(f"MIN({e}) AS {col}")
+            merge = f"MIN({col})"
+        elif func == "avg":
+            self.partial_items += [f"SUM({e}) AS {col}", f"COUNT({e}) AS fed_a{n + 1}"]
+            merge = f"(SUM({col}) / NULLIF(SUM(fed_a{n + 1}), 0))"
+        elif not distinct:
+            self.partial_items.append(f"COUNT({e}) AS {col}")
+            merge = f"CAST(COALESCE(SUM({col}), 0) AS BIGINT)"
+        elif len(_split_top(arg)) > 1:
+            raise UnsupportedSQL("COUNT(DISTINCT a, b) across shards")
+        elif not self.approximate(func, distinct, arg):
+            self.partial_items.append(f"COUNT(DISTINCT {e}) AS {col}")
+            merge = f"CAST(COALESCE(SUM({col}), 0) AS BIGINT)"
+        else:
+            j = len(self.sketch_args)
+            self.sketch_args.append(arg)
+            merge = f"CAST(COALESCE(MAX(fed_d{j}), 0) AS BIGINT)"
+        self.merges[k] = merge
+        return merge
+
+    def rewrite(self, expr: str, groups: Dict[str, str], columns: Dict[str, str],
+                require_aggregate: bool = True) -> Optional[str]:
+        """Final-phase form of a select/HAVING/ORDER BY expression (masked), or None when it is
+        neither a group key nor contains an aggregate (and `require_aggregate`)."""
+        if self.key(expr) in groups:
+            return groups[self.key(expr)]
+        found = self.find_aggs(expr)
+        if not found and require_aggregate:
+            return None
+        merged, parts, pos = [], [], 0
+        for start, end, func, distinct, arg in found:
+            parts += [expr[pos:start], f"\x01{len(merged)}\x01"]
+            merged.append(self.merge_of(func, distinct, arg))
+            pos = end
+        rest = "".join(parts) + expr[pos:]
+
+        def column(m):
+            name = m.group(0)
+            if name.lower() in _WORDS:
+                return name
+            if self.key(name) in groups:
+                return groups[self.key(name)]
+            if name.strip("`").lower() in columns:
+                return columns[name.strip("`").lower()]
+            raise UnsupportedSQL(f"{self.u(name)} is neither grouped nor aggregated")
+
+        rest = _IDENT.sub(column, rest)
+        return self.u(re.sub(r"\x01(\d+)\x01", lambda m: merged[int(m.group(1))], rest))
+
+    # -------- plans --------
+    def plan(self) -> FederatedPlan:
+        masked = self.masked
+        if re.match(r"(?is)^\s*with\b", masked):
+            raise UnsupportedSQL("WITH (CTE) across shards")
+        if re.search(r"(?i)\bover\s*\(|\bunion\b|\bwith\s+rollup\b|\binto\b|\bfor\s+update\b", masked):
+            raise UnsupportedSQL("window function / UNION / WITH ROLLUP across shards")
+        tables = {t.lower() for t in re.findall(r"(?i)\b(?:from|join)\s+`?(\w+)`?", masked)}
+        if tables and tables <= SHARD_REPLICATED_TABLES:
+            return FederatedPlan("single", self.sql)
+
+        # SELECT * FROM (<query>) AS t LIMIT n, the wrapper sql_viz_workflow adds
+        w = re.match(r"(?is)^\s*select\s+\*\s+from\s*\(", masked)
+        if w:
+            close = _close_paren(masked, w.end() - 1)
+            tail = re.fullmatch(r"(?is)\s*(?:as\s+)?\w+\s*(?:limit\s+(.+?))?\s*", masked[close + 1:])
+            if tail:
+                inner = masked[w.end():close]
+                if tail.group(1) is None:
+                    return _Planner(self.u(inner), self.dialect).plan()
+                if "limit" not in self.clauses(inner):  # same rows: let the shards apply the limit
+                    return _Planner(f"{self.u(inner)} LIMIT {tail.group(1)}", self.dialect).plan()
+                plan = _Planner(self.u(inner), self.dialect).plan()
+                if plan.kind == "single":
+                    return FederatedPlan("single", self.sql)
+                outer = self.limit_sql(self.limit(tail.group(1)))
+                return FederatedPlan(plan.kind, plan.shard_sql, f"SELECT * FROM ({plan.merge_sql}) AS t{outer}",
+                                     plan.sketches, plan.group_columns, plan.approximate)
+
+        self.check_subqueries(masked)
+        c = self.clauses(masked)
+        select = c["select"]
+        distinct = bool(re.match(r"(?i)distinct\b", select))
+        if distinct:
+            select = select[len("distinct"):].strip()
+        items = self.items(select)
+        group_by = _split_top(c["group by"]) if "group by" in c else []
+        aggregate = bool(group_by) or any(self.find_aggs(c.get(k, "")) for k in ("select", "having", "order by"))
+        limit = self.limit(c.get("limit", ""))
+        if not aggregate:
+            if "having" in c:
+                raise UnsupportedSQL("HAVING without GROUP BY")
+            return self.plan_rows(c, select, items, distinct, limit)
+        if distinct:
+            raise UnsupportedSQL("SELECT DISTINCT with aggregates across shards")
+        return self.plan_aggregate(c, items, group_by, limit)
+
+    def plan_rows(self, c: Dict[str, str], select: str, items, distinct: bool, limit) -> FederatedPlan:
+        by_key = {self.key(e): name for e, name in items}
+        by_name = {name.lower(): name for _, name in items}
+        hidden, order = [], []
+        for i, (expr, direction) in enumerate(self.order_items(c.get("order by", ""))):
+            if re.fullmatch(r"\d+", expr):
+                order.append(f"{expr} {direction}")
+            elif self.key(expr) in by_key:
+                order.append(f"{self.name_ref(by_key[self.key(expr)])} {direction}")
+            elif expr.strip("`").lower() in by_name:
+                order.append(f"{self.name_ref(by_name[expr.strip('`').lower()])} {direction}")
+            elif distinct:
+                raise UnsupportedSQL("SELECT DISTINCT ordered by an unselected expression")
+            else:
+                hidden.append(f"fed_o{i}")
+                order.append(f"fed_o{i} {direction}")
+                select += f", {expr} AS fed_o{i}"
+        off, n = limit
+        shard = f"SELECT {'DISTINCT ' if distinct else ''}{select} FROM {c['from']}"
+        shard += f" WHERE {c['where']}" if "where" in c else ""
+        shard += f" ORDER BY {c['order by']}" if "order by" in c else ""
+        shard += f" LIMIT {off + n}" if n is not None else ""
+        merge = f"SELECT {'DISTINCT ' if distinct else ''}*"
+        merge += f" EXCLUDE ({', '.join(hidden)})" if hidden else ""
+        merge += " FROM partials"
+        merge += f" ORDER BY {', '.join(order)}" if order else ""
+        merge += self.limit_sql(limit)
+        return FederatedPlan("rows", self.u(shard), self.to_duckdb(self.u(merge)))
+
+    def plan_aggregate(self, c: Dict[str, str], items, group_by: List[str], limit) -> FederatedPlan:
+        by_alias = {name.lower(): e for e, name in items}
+        gexprs = []
+        for g in group_by:
+            g = re.sub(r"(?is)\s+(?:asc|desc)$", "", g.strip())
+            if re.fullmatch(r"\d+", g):
+                if not 0 < int(g) <= len(items):
+                    raise UnsupportedSQL("GROUP BY position out of range")
+                g = items[int(g) - 1][0]
+            elif "." not in g and g.strip("`").lower() in by_alias:
+                g = by_alias[g.strip("`").lower()]
+            if self.find_aggs(g):
+                raise UnsupportedSQL("GROUP BY an aggregate")
+            gexprs.append(g)
+        groups: Dict[str, str] = {}
+        columns: Dict[str, str] = {}  # bare column names of the group keys
+        for i, g in enumerate(gexprs):
+            groups.setdefault(self.key(g), f"fed_g{i}")
+            if _column_name(g):
+                columns.setdefault(_column_name(g), f"fed_g{i}")
+
+        out, aliases = [], {}
+        for expr, name in items:
+            r = self.rewrite(expr, groups, columns)
+            if r is None:  # neither grouped nor aggregated: any value of the group, as MySQL returns
+                r = self.merge_of("any_value", False, expr)
+            out.append(f"{r} AS {self.name_ref(name)}")
+            aliases[name.lower()] = f"({r})"
+        # HAVING and ORDER BY may name output aliases (MySQL allows both)
+        named = {**{k: v for k, v in aliases.items() if k not in columns}, **columns}
+        having = None
+        if "having" in c:
+            having = self.rewrite(c["having"], groups, named, require_aggregate=False)
+        order = []
+        for expr, direction in self.order_items(c.get("order by", "")):
+            if re.fullmatch(r"\d+", expr):
+                order.append(f"{expr} {direction}")
+            elif "." not in expr and expr.strip("`").lower() in aliases:
+                order.append(f"{aliases[expr.strip('`').lower()]} {direction}")
+            else:
+                r = self.rewrite(expr, groups, named)
+                order.append(f"{r if r is not None else self.merge_of('any_value', False, expr)} {direction}")
+
+        gcols = [f"fed_g{i}" for i in range(len(gexprs))]
+        cols = [f"{self.u(g)} AS fed_g{i}" for i, g in enumerate(gexprs)] + self.partial_items
+        shard = f"SELECT {', '.join(cols or ['COUNT(*) AS fed_a0'])} FROM {self.u(c['from'])}"
+        shard += f" WHERE {self.u(c['where'])}" if "where" in c else ""
+        shard += f" GROUP BY {', '.join(self.u(g) for g in gexprs)}" if gexprs else ""
+
+        source = "partials"
+        for j in range(len(self.sketch_args)):
+            on = " AND ".join(f"partials.{g} IS NOT DISTINCT FROM est{j}.{g}" for g in gcols)
+            source += f" LEFT JOIN est{j} ON {on}" if gcols else f" CROSS JOIN est{j}"
+
+        def qualify(s: str) -> str:  # est<j> has fed_g columns too
+            return re.sub(r"(?<![\w.])(fed_g\d+)\b", r"partials.\1", s) if self.sketch_args else s
+
+        merge = f"SELECT {', '.join(qualify(o) for o in out)} FROM {source}"
+        merge += f" GROUP BY {', '.join(qualify(g) for g in gcols)}" if gcols else ""
+        merge += f" HAVING {qualify(having)}" if having else ""
+        merge += f" ORDER BY {', '.join(qualify(o) for o in order)}" if order else ""
+        merge += self.limit_sql(limit)
+        approximate = tuple(name for expr, name in items
+                            if any(self.approximate(f, d, a) for _, _, f, d, a in self.find_aggs(expr)))
+        sketches = tuple(self.sketch_sql(arg, gexprs, c) for arg in self.sketch_args)
+        return FederatedPlan("aggregate", shard, self.to_duckdb(merge), sketches,
+                             tuple(gcols), approximate)
+
+    # -------- HyperLogLog --------
+    def sketch_sql(self, arg: str, gexprs: List[str], c: Dict[str, str]) -> str:
+        """Shard query of one COUNT(DISTINCT arg): the max rank per group and register."""
+        p = HLL_PRECISION
+        h = _HASH32.get(self.dialect, _HASH32["mysql"]).format(x=self.u(arg))
+        w = f"(fed_h >> {p})"  # the 32 - p bits left after the register index
+        log2 = _FLOOR_LOG2.get(self.dialect, _FLOOR_LOG2["mysql"]).format(w=w)
+        gcols = [f"fed_g{i}" for i in range(len(gexprs))]
+        where = f"({self.u(c['where'])}) AND " if "where" in c else ""
+        inner = (f"SELECT {', '.join([f'{self.u(g)} AS fed_g{i}' for i, g in enumerate(gexprs)] + [f'{h} AS fed_h'])}"
+                 f" FROM {self.u(c['from'])} WHERE {where}({self.u(arg)}) IS NOT NULL")
+        register = f"(fed_h & {2 ** p - 1})"
+        return (f"SELECT {', '.join(gcols + [f'{register} AS fed_r'])}, "
+                f"MAX(CASE WHEN {w} = 0 THEN {33 - p} ELSE {32 - p} - {log2} END) AS fed_k "
+                f"FROM ({inner}) AS s GROUP BY {', '.join(gcols + [register])}")
+
+# 32-bit hash of a value (the same on every shard) and FLOOR(LOG2(w)), per shard dialect;
+# SQLite has neither, the fed_* functions are registered on its connections (shard_engine)
+_HASH32 = {
+    "mysql": "CAST(CONV(SUBSTRING(MD5(CAST({x} AS CHAR)), 1, 8), 16, 10) AS UNSIGNED)",
+    "sqlite": "fed_hash32({x})",
+    "duckdb": "(hash(CAST({x} AS VARCHAR)) & 4294967295)",
+}
+_FLOOR_LOG2 = {
+    "mysql": "FLOOR(LOG2({w}))",
+    "sqlite": "fed_floor_log2({w})",
+    "duckdb": "FLOOR(LOG2({w}))",
+}
+
+def _hash32(v) -> Optional[int]:
+    return None if v is None else int(hashlib.md5(str(v).encode("utf-8")).hexdigest()[:8], 16)
+
+def _floor_log2(w) -> Optional[int]:
+    return None if w is None or w <= 0 else int(w).bit_length() - 1
+
+def hll_estimate_sql(j: int, group_columns: Tuple[str, ...], p: int = HLL_PRECISION) -> str:
+    """Merge sketch j (every shard's rows, table sk<j>) by max rank per register: one estimate per group."""
+    m = 2 ** p
+    alpha = 0.7213 / (1 + 1.079 / m)
+    g = "".join(f"{c}, " for c in group_columns)
+    registers = f"SELECT {g}fed_r, MAX(fed_k) AS fed_k FROM sk{j} GROUP BY ALL"
+    zeros = f"({m} - COUNT(*))"
+    raw = f"(CAST({alpha * m * m} AS DOUBLE) / (SUM(POWER(2.0, -fed_k)) + {zeros}))"
+    estimate = f"CASE WHEN {raw} <= {2.5 * m} AND {zeros} > 0 THEN {m} * LN({m} / {zeros}) ELSE {raw} END"
+    return (f"SELECT {g}ROUND({estimate}) AS fed_d{j} FROM ({registers}) AS r"
+            + (f" GROUP BY {', '.join(group_columns)}" if group_columns else ""))
+
+@lru_cache(maxsize=256)
+def plan_query(sql: str, dialect: str = "mysql") -> FederatedPlan:
+    """Split `sql` (MySQL dialect) into its shard and merge phases; raises UnsupportedSQL."""
+    return _Planner(sql, dialect).plan()
+
+def merge(plan: FederatedPlan, partials: pa.Table, sketches: List[pa.Table]) -> pa.Table:
+    """Run the merge phase of `plan` in DuckDB over the shards' combined partial tables."""
+    import duckdb
+
+    con = duckdb.connect(":memory:")
+    try:
+        con.execute(f"SET default_collation = '{DUCKDB_COLLATION}'")  # shards group case-insensitively
+        con.register("partials", partials)
+        for j, sketch in enumerate(sketches):
+            con.register(f"sk{j}", sketch)
+            con.execute(f"CREATE TEMP TABLE est{j} AS {hll_estimate_sql(j, plan.group_columns)}")
+        return con.execute(plan.merge_sql).fetch_arrow_table()
+    finally:
+        con.close()
+
+# ---------------- Shards ----------------
+def parse_shard_urls(spec: str = SHARD_URLS) -> Dict[str, str]:
+    """"eu=mysql+...,us=mysql+..." -> {name: url}; bare URLs are named shard0, shard1, ..."""
+    out: Dict[str, str] = {}
+    for i, part in enumerate(p.strip() for p in spec.split(",") if p.strip()):
+        name, sep, url = part.partition("=")
+        if not sep or "://" in name:
+            name, url = f"shard{i}", part
+        out[name.strip()] = url.strip()
+    return out
+
+def shard_engine(url: str):
+    engine = create_engine(url)
+    instrument_engine(engine)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _functions(dbapi_conn, _record):
+            dbapi_conn.create_function("fed_hash32", 1, _hash32, deterministic=True)
+            dbapi_conn.create_function("fed_floor_log2", 1, _floor_log2, deterministic=True)
+    return engine
+
+@shared_resource
+def _shard_pool() -> ThreadPoolExecutor:
+    workers = FEDERATED_MAX_WORKERS or 4 * max(1, len(parse_shard_urls()))
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard")
+
+class FederatedBackend:
+    name = "federated"
+    fallback_on_error = False  # shard errors are real SQL errors: they go to the SQL fixer
+
+    def __init__(self, shards: Optional[Dict[str, str]] = None):
+        shards = parse_shard_urls() if shards is None else shards
+        if not shards:
+            raise RuntimeError("SHARD_URLS is empty")
+        self.engines = {name: shard_engine(url) for name, url in shards.items()}
+        dialects = {e.dialect.name for e in self.engines.values()}
+        if len(dialects) != 1:
+            raise RuntimeError(f"shards use different dialects: {sorted(dialects)}")
+        self.dialect = dialects.pop()
+        # shapes that can't be split may run on DATABASE_URL only when it holds every region
+        self.fallback_on_unsupported = DB_URL not in shards.values()
+        self._next_single = itertools.count()
+
+    def _fetch(self, name: str, sql: str) -> pa.Table:
+        engine = self.engines[name]
+        dl = current_deadline()
+        on_connect = None
+        if dl is not None and engine.dialect.name == "mysql":
+            dl.check()
+            if dl.timeout_s:
+                sql = with_max_execution_time(sql, dl.remaining() * 1000)
+            on_connect = killable(dl, engine)
+        t0 = time.perf_counter()
+        try:
+            with span("db.shard", shard=name):
+                table = fetch_arrow(engine, sql, on_connect=on_connect)
+        except Exception as e:
+            METRICS.inc("federated_shard_errors_total", shard=name)
+            check_deadline()
+            raise_if_query_aborted(e)
+            raise RuntimeError(f"shard {name}: {e}") from e
+        METRICS.observe("federated_shard_seconds", time.perf_counter() - t0, shard=name)
+        METRICS.inc("federated_partial_rows_total", table.num_rows, shard=name)
+        return table
+
+    def _fan_out(self, sql: str) -> pa.Table:
+        pool = _shard_pool()
+        futures = [pool.submit(contextvars.copy_context().run, self._fetch, name, sql) for name in self.engines]
+        return pa.concat_tables([f.result() for f in futures], promote_options="permissive")
+
+    def read_arrow(self, sql: str) -> pa.Table:
+        plan = plan_query(sql, self.dialect)
+        METRICS.inc("federated_queries_total", kind=plan.kind)
+        if plan.kind == "single":
+            names = list(self.engines)
+            return self._fetch(names[next(self._next_single) % len(names)], plan.shard_sql)
+        partials = self._fan_out(plan.shard_sql)
+        sketches = [self._fan_out(s) for s in plan.sketches]
+        if plan.approximate:
+            METRICS.inc("federated_approx_distinct_total", len(plan.approximate))
+        with span("db.merge", kind=plan.kind, shards=len(self.engines)):
+            return merge(plan, partials, sketches)
+
+    def read_sql(self, sql: str) -> pd.DataFrame:
+        return to_frame(self.read_arrow(sql))
+
+# ---------------- Local shards for testing ----------------
+# Olist by customer region: customers by state, orders follow their customer, order facts follow
+# their order; every other table is copied to each shard. table -> (column, parent table, key)
+OLIST_SHARDING: Dict[str, Tuple[str, Optional[str], str]] = {
+    "customer": ("customer_state", None, "customer_id"),
+    "orders": ("customer_id", "customer", "order_id"),
+    "order_items": ("order_id", "orders", "order_id"),
+    "order_payments": ("order_id", "orders", "order_id"),
+    "order_reviews": ("order_id", "orders", "order_id"),
+}
+
+def split_database(source, shard_urls: List[str], sharding=OLIST_SHARDING) -> Dict[str, Dict[str, int]]:
+    """Copy `source` (an engine) into len(shard_urls) databases: sharded tables by crc32 of the
+    region column or with their parent row, all other tables to every shard. Returns row counts."""
+    targets = [create_engine(u) for u in shard_urls]
+    placement: Dict[str, Dict[object, int]] = {}  # table -> key value -> shard
+    counts: Dict[str, Dict[str, int]] = {u: {} for u in shard_urls}
+    for table in list(sharding) + [t for t in inspect(source).get_table_names() if t not in sharding]:
+        with source.connect() as conn:
+            df = pd.read_sql(text(f"SELECT * FROM {table}"), conn)
+        if table in sharding:
+            col, parent, key = sharding[table]
+            if parent is None:
+                shard = df[col].map(lambda v: zlib.crc32(str(v).encode("utf-8")) % len(targets))
+            else:  # orphans go to the first shard
+                shard = df[col].map(placement[parent]).fillna(0).astype(int)
+            placement[table] = dict(zip(df[key], shard))
+        for i, engine in enumerate(targets):
+            part = df[shard == i] if table in sharding else df
+            part.to_sql(table, engine, if_exists="replace", index=False)
+            counts[shard_urls[i]][table] = len(part)
+    return counts
+
+def verify(single, backend: FederatedBackend, queries: Dict[str, str], rel_tol: float = 0.05) -> List[dict]:
+    """Run each query on the single database and federated; HyperLogLog columns within rel_tol."""
+    results = []
+    for qid, sql in queries.items():
+        row = {"id": qid}
+        try:
+            plan = plan_query(sql, backend.dialect)
+            row["kind"] = plan.kind
+            expected = to_frame(fetch_arrow(single, sql))
+            got = backend.read_sql(sql)
+            row.update(ok=_same(expected, got, plan.approximate, rel_tol), rows=len(got))
+        except UnsupportedSQL as e:
+            row.update(kind="unsupported", ok=None, error=str(e))
+        except Exception as e:
+            row.update(ok=False, error=f"{type(e).__name__}: {e}"[:300])
+        results.append(row)
+    return results
+
+def _same(a: pd.DataFrame, b: pd.DataFrame, approximate, rel_tol: float) -> bool:
+    if list(a.columns) != list(b.columns) or len(a) != len(b):
+        return False
+    exact = [c for c in a.columns if c not in approximate]
+    if exact:  # rows compared as a set: ties under ORDER BY may come back in another order
+        a = a.iloc[a[exact].astype(str).apply(tuple, axis=1).argsort()]
+        b = b.iloc[b[exact].astype(str).apply(tuple, axis=1).argsort()]
+    a, b = a.reset_index(drop=True), b.reset_index(drop=True)
+    for col in a.columns:
+        x, y = a[col], b[col]
+        if pd.api.types.is_numeric_dtype(x) and pd.api.types.is_numeric_dtype(y):
+            x, y = x.astype("float64"), y.astype("float64")
+            tol = (rel_tol if col in approximate else 1e-9) * x.abs().clip(lower=1)
+            if not (((x - y).abs() <= tol) | (x.isna() & y.isna())).all():
+                return False
+        elif not ((x.astype(str) == y.astype(str)) | (x.isna() & y.isna())).all():
+            return False
+    return True
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Federated execution across SHARD_URLS.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_plan = sub.add_parser("plan", help="show the shard and merge SQL of a query")
+    p_plan.add_argument("sql")
+    p_plan.add_argument("--dialect", default="mysql", choices=sorted(_HASH32))
+    p_split = sub.add_parser("split", help="split a database into shards (Olist layout)")
+    p_split.add_argument("source")
+    p_split.add_argument("shards", nargs="+")
+    p_verify = sub.add_parser("verify", help="compare the single database with the shards")
+    p_verify.add_argument("--single", default=DB_URL)
+    p_verify.add_argument("--queries", default="", help="file of ;-separated queries (default: standard set)")
+    args = ap.parse_args()
+
+    if args.cmd == "plan":
+        plan = plan_query(args.sql, args.dialect)
+        print(f"kind: {plan.kind}\n\nshards:\n  {plan.shard_sql}")
+        for j, s in enumerate(plan.sketches):
+            print(f"\nsketch {j} (HyperLogLog, p={HLL_PRECISION}):\n  {s}")
+        if plan.merge_sql:
+            print(f"\nmerge (DuckDB):\n  {plan.merge_sql}")
+        if plan.approximate:
+            print(f"\napproximate: {', '.join(plan.approximate)}")
+    elif args.cmd == "split":
+        for url, c in split_database(create_engine(args.source), args.shards).items():
+            print(url, c)
+    else:
+        if args.queries:
+            with open(args.queries, encoding="utf-8") as f:
+                queries = {f"q{i}": q.strip() for i, q in enumerate(f.read().split(";")) if q.strip()}
+        else:
+            from execution_backends import standard_sql_set
+            queries = standard_sql_set()
+        rows = verify(create_engine(args.single), FederatedBackend(), queries)
+        for r in rows:
+            status = {True: "ok  ", False: "FAIL", None: "skip"}[r["ok"]]
+            print(f"{status} {r['id']:<28} {r.get('kind', ''):<11} {r.get('error', '')}")
+        sys.exit(1 if any(r["ok"] is False for r in rows) else 0)
@@ -1,17 +1,47 @@
 # fuzzy_wuzzy.py
 import re
+import time
+from functools import lru_cache
+
 import pandas as pd
-from sqlalchemy import create_engine
 from rapidfuzz import process, fuzz
 
-from config import DB_URL
-
-engine = create_engine(DB_URL)
+from config import DISTINCT_VALUES_TTL_S, get_engine
+from column_stats import is_categorical, known_values
+from singleflight import DISTINCT_SCANS
+from telemetry import record_result, span
 
 def _get_values(table_name: str, column_name: str):
+    """DISTINCT values of a column; cached process-wide so repeated questions skip the scan.
+    Entries expire after DISTINCT_VALUES_TTL_S (reloads change the values) and clear_values() drops
+    them all; refresh_catalog calls it, as the sample/rollup builders clear their caches."""
+    return _cached_values(table_name, column_name, int(time.time() // DISTINCT_VALUES_TTL_S))
+
+@lru_cache(maxsize=512)
+def _cached_values(table_name: str, column_name: str, period: int):
+    # lru_cache doesn't coalesce concurrent misses: the first caller scans, the others wait for it
+    return DISTINCT_SCANS.do((table_name, column_name), lambda: _scan_values(table_name, column_name))
+
+def clear_values() -> None:
+    _cached_values.cache_clear()
+
+def _scan_values(table_name: str, column_name: str):
     query = f"SELECT DISTINCT {column_name} AS v FROM {table_name}"
-    df = pd.read_sql(query, con=engine)
-    return df["v"].dropna().astype(str).tolist()
+    with span("db.distinct_scan", table=table_name, column=column_name):
+        df = pd.read_sql(query, con=get_engine())
+    record_result(df)
+    return tuple(df["v"].dropna().astype(str).tolist())
+
+def preload_values(columns) -> int:
+    """Warm the DISTINCT-value cache for (table, column) pairs; returns how many loaded."""
+    loaded = 0
+    for table_name, column_name in columns:
+        try:
+            _get_values(table_name, column_name)
+            loaded += 1
+        except Exception:
+            pass  # a missing table/column just stays cold
+    return loaded
 
 def _best_fuzzy_match(input_value: str, choices):
     match, score, _ = process.extractOne(input_value, choices, scorer=fuzz.token_set_ratio)
@@ -37,6 +67,17 @@ def _flatten_filters_structure(filters):
         return ["yes", *filters[1]]
     return filters
 
+def _is_equality_on_category(table: str, column: str, predicate: str) -> bool:
+    """Fuzzy-match only equality-like text on a categorical column. The statistics catalog decides
+    what is categorical (numeric/date/ID-like columns pass through); without it, the regex guesses."""
+    if not re.search(r"[A-Za-z]", predicate) or re.search(r"\bbetween\b|<=|>=|<|>", predicate, re.I):
+        return False
+    categorical = is_categorical(table, column)
+    if categorical is not None:
+        return categorical
+    # Detect equality-like text (no operators/ranges/dates)
+    return not re.search(r"before|after|\d{4}-\d{2}-\d{2}", predicate, re.I)
+
 def call_match(filters):
     """
     filters = ["yes", ["table","column","predicate"], ...]  or
@@ -58,13 +99,9 @@ def call_match(filters):
             # skip malformed entries rather than failing
             continue
         table, column, predicate = t[0], t[1], str(t[2]).strip()
-        # Detect equality-like text (no operators/ranges/dates)
-        if re.search(r"[A-Za-z]", predicate) and not re.search(
-            r"\bbetween\b|<=|>=|<|>|before|after|\d{4}-\d{2}-\d{2}",
-            predicate,
-            re.I,
-        ):
-            choices = _get_values(table, column)
+        if _is_equality_on_category(table, column, predicate):
+            # complete value list from the statistics catalog when it has one, else a DISTINCT scan
+            choices = known_values(table, column) or _get_values(table, column)
             best, _ = _best_fuzzy_match(predicate, choices) if choices else (predicate, 0)
             out.append([table, column, best])
         else:
@@ -0,0 +1,287 @@
+# index_manager.py
+"""
+Primary keys and secondary indexes for the generated schema.
+
+- PRIMARY_KEYS are the natural keys of the Olist tables (the loader creates tables bare).
+- Join-key indexes come from customer_helper.join_key_pairs() (discovered keys, else
+  KNOWN_JOIN_KEYS), i.e. the same joins the SQL-generation prompt tells the LLM to use.
+- Filter/group indexes come from the query log (QUERY_LOG_FILE, off unless set): columns that
+  successful generated queries use in WHERE / GROUP BY at least `min_uses` times.
+- ensure_indexes(engine) creates whatever is missing and refreshes statistics; it is
+  idempotent, so the loader runs it after every load.
+- benchmark(engine) times STANDARD_QUERIES; `python index_manager.py apply` reports
+  before/after timings.
+
+CLI:
+  python index_manager.py plan     # show what would be created
+  python index_manager.py apply    # create missing keys/indexes, print before/after timings
+  python index_manager.py bench    # time STANDARD_QUERIES only
+"""
+import json
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+
+from config import QUERY_LOG_FILE
+from customer_helper import join_key_pairs
+from sql_repair import table_aliases
+
+PRIMARY_KEYS: Dict[str, Tuple[str, ...]] = {
+    "orders": ("order_id",),
+    "order_items": ("order_id", "order_item_id"),
+    "order_payments": ("order_id", "payment_sequential"),
+    "order_reviews": ("review_id", "order_id"),
+    "customer": ("customer_id",),
+    "products": ("product_id",),
+    "sellers": ("seller_id",),
+    "category_translation": ("product_category_name",),
+}
+
+MIN_USES = 3
+_UNINDEXABLE_TYPES = {"text", "tinytext", "mediumtext", "longtext", "blob", "json"}
+
+class IndexSpec(NamedTuple):
+    table: str
+    columns: Tuple[str, ...]
+    reason: str            # "primary_key" | "join_key" | "query_log"
+
+    @property
+    def name(self) -> str:
+        return ("ix_" + self.table + "_" + "_".join(self.columns))[:64]
+
+# ---------------- Query log ----------------
+_log_lock = threading.Lock()
+
+def log_query(sql: str, duration_s: float, rows: int, path: Optional[str] = None) -> None:
+    """Append one successful query to the query log (no-op when the log is disabled)."""
+    path = QUERY_LOG_FILE if path is None else path
+    if not path:
+        return
+    rec = {"ts": round(time.time(), 3), "sql": " ".join(sql.split()),
+           "duration_s": round(duration_s, 4), "rows": int(rows)}
+    try:
+        with _log_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    except OSError:
+        pass  # logging must never fail a query
+
+def read_query_log(path: Optional[str] = None) -> List[str]:
+    path = QUERY_LOG_FILE if path is None else path
+    if not path or not os.path.exists(path):
+        return []
+    out = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                out.append(json.loads(line)["sql"])
+            except (json.JSONDecodeError, KeyError):
+                continue
+    return out
+
+_CLAUSES = {
+    "where": r"(?is)\bwhere\b(.*?)(?=\bgroup\s+by\b|\border\s+by\b|\bhaving\b|\blimit\b|\bunion\b|$)",
+    "group": r"(?is)\bgroup\s+by\b(.*?)(?=\border\s+by\b|\bhaving\b|\blimit\b|\bunion\b|$)",
+}
+
+def column_usage(sqls: Iterable[str]) -> Counter:
+    """Counter[(table, column)] of columns used in WHERE / GROUP BY across `sqls`."""
+    usage: Counter = Counter()
+    for sql in sqls:
+        masked = re.sub(r"'(?:[^'\\]|\\.|'')*'", "''", sql)
+        aliases = table_aliases(masked)
+        tables = set(aliases.values())
+        single = next(iter(tables)) if len(tables) == 1 else None
+        seen = set()
+        for pattern in _CLAUSES.values():
+            for clause in re.findall(pattern, masked):
+                for alias, col in re.findall(r"`?(\w+)`?\.`?(\w+)`?", clause):
+                    if alias in aliases:
+                        seen.add((aliases[alias], col))
+                if single:
+                    for col in re.findall(r"(?<![.\w`])`?([a-z_][a-z0-9_]*)`?(?![.(\w])", clause, re.I):
+                        seen.add((single, col))
+        usage.update(seen)  # count each query once per column
+    return usage
+
+# ---------------- Planning ----------------
+def _schema_columns(conn) -> Dict[str, Dict[str, str]]:
+    """{table: {column: data_type}} for the current database."""
+    rows = conn.execute(text(
+        "SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE()"
+    )).fetchall()
+    out: Dict[str, Dict[str, str]] = {}
+    for t, c, dt in rows:
+        out.setdefault(t, {})[c] = str(dt).lower()
+    return out
+
+def existing_indexes(conn) -> Dict[str, Dict[str, List[str]]]:
+    """{table: {index_name: [columns in order]}} for the current database."""
+    rows = conn.execute(text(
+        "SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME FROM INFORMATION_SCHEMA.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX"
+    )).fetchall()
+    out: Dict[str, Dict[str, List[str]]] = {}
+    for t, ix, c in rows:
+        out.setdefault(t, {}).setdefault(ix, []).append(c)
+    return out
+
+def _covered(spec: IndexSpec, indexes: Dict[str, List[str]]) -> bool:
+    """An index whose leading columns equal spec.columns already serves it."""
+    n = len(spec.columns)
+    return any(tuple(cols[:n]) == spec.columns for cols in indexes.values())
+
+def desired_indexes(sqls: Optional[Iterable[str]] = None, min_uses: int = MIN_USES) -> List[IndexSpec]:
+    """Primary keys, then join-key indexes, then frequently filtered/grouped columns."""
+    specs: List[IndexSpec] = [IndexSpec(t, cols, "primary_key") for t, cols in PRIMARY_KEYS.items()]
+    for ta, ca, tb, cb in join_key_pairs():
+        specs.append(IndexSpec(ta, (ca,), "join_key"))
+        specs.append(IndexSpec(tb, (cb,), "join_key"))
+    usage = column_usage(read_query_log() if sqls is None else sqls)
+    for (t, c), n in usage.most_common():
+        if n >= min_uses:
+            specs.append(IndexSpec(t, (c,), "query_log"))
+
+    out, seen = [], set()
+    for s in specs:
+        if (s.table, s.columns) not in seen:
+            seen.add((s.table, s.columns))
+            out.append(s)
+    return out
+
+def plan_indexes(engine, sqls: Optional[Iterable[str]] = None, min_uses: int = MIN_USES) -> List[IndexSpec]:
+    """Desired indexes that don't exist yet (and whose table/columns do)."""
+    with engine.connect() as conn:
+        schema = _schema_columns(conn)
+        existing = existing_indexes(conn)
+    todo, planned = [], {}
+    for s in desired_indexes(sqls, min_uses):
+        cols = schema.get(s.table)
+        if not cols or any(c not in cols or cols[c] in _UNINDEXABLE_TYPES for c in s.columns):
+            continue
+        if s.reason == "primary_key" and "PRIMARY" in existing.get(s.table, {}):
+            continue
+        current = dict(existing.get(s.table, {}), **planned.get(s.table, {}))
+        if s.reason != "primary_key" and _covered(s, current):
+            continue
+        todo.append(s)
+        planned.setdefault(s.table, {})[s.name] = list(s.columns)
+    return todo
+
+# ---------------- Applying ----------------
+def ensure_indexes(engine, sqls: Optional[Iterable[str]] = None, min_uses: int = MIN_USES,
+                   dry_run: bool = False) -> List[dict]:
+    """
+    Create missing primary keys and indexes, then ANALYZE the touched tables.
+    A primary key that fails (e.g. duplicate keys in the data) falls back to a plain index;
+    DDL that still fails is recorded as "failed" and the run carries on.
+    """
+    actions = []
+    for s in plan_indexes(engine, sqls, min_uses):
+        cols = ", ".join(f"`{c}`" for c in s.columns)
+        if s.reason == "primary_key":
+            ddl = f"ALTER TABLE `{s.table}` ADD PRIMARY KEY ({cols})"
+        else:
+            ddl = f"CREATE INDEX `{s.name}` ON `{s.table}` ({cols})"
+        action = {"table": s.table, "columns": list(s.columns), "reason": s.reason, "ddl": ddl}
+        if not dry_run:
+            t0 = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(ddl))
+                action["status"] = "created"
+            except Exception as e:
+                if s.reason != "primary_key":
+                    action.update(status="failed", error=str(e).splitlines()[0][:300])
+                else:
+                    fallback = f"CREATE INDEX `{s.name}` ON `{s.table}` ({cols})"
+                    action.update(ddl=fallback, error=str(e).splitlines()[0][:300])
+                    try:
+                        with engine.begin() as conn:
+                            conn.execute(text(fallback))
+                        action["status"] = "created_non_unique"
+                    except Exception as e2:
+                        action.update(status="failed", fallback_error=str(e2).splitlines()[0][:300])
+            action["seconds"] = round(time.perf_counter() - t0, 2)
+        actions.append(action)
+
+    touched = sorted({a["table"] for a in actions if a.get("status", "").startswith("created")})
+    if touched:
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE TABLE " + ", ".join(f"`{t}`" for t in touched)))
+    return actions
+
+# ---------------- Benchmark ----------------
+STANDARD_QUERIES: Dict[str, str] = {
+    "orders_with_customer_state": """
+        SELECT c.customer_state, COUNT(DISTINCT o.order_id) AS num_orders
+        FROM orders o JOIN customer c ON o.customer_id = c.customer_id
+        GROUP BY c.customer_state ORDER BY num_orders DESC""",
+    "revenue_by_category": """
+        SELECT ct.product_category_name_english AS category, SUM(oi.price) AS revenue
+        FROM order_items oi JOIN products p ON oi.product_id = p.product_id
+        JOIN category_translation ct ON p.product_category_name = ct.product_category_name
+        GROUP BY ct.product_category_name_english ORDER BY revenue DESC LIMIT 10""",
+    "seller_orders_in_state": """
+        SELECT s.seller_id, COUNT(DISTINCT oi.order_id) AS order_count
+        FROM order_items oi JOIN sellers s ON oi.seller_id = s.seller_id
+        WHERE s.seller_state = 'SP'
+        GROUP BY s.seller_id ORDER BY order_count DESC LIMIT 10""",
+    "monthly_sales": """
+        SELECT DATE_FORMAT(o.order_purchase_timestamp, '%Y-%m') AS month, SUM(p.payment_value) AS total_sales
+        FROM orders o JOIN order_payments p ON o.order_id = p.order_id
+        GROUP BY month ORDER BY month""",
+    "review_score_by_status": """
+        SELECT o.order_status, AVG(r.review_score) AS avg_score
+        FROM orders o JOIN order_reviews r ON o.order_id = r.order_id
+        GROUP BY o.order_status""",
+    "single_order_lookup": """
+        SELECT oi.*, p.product_category_name
+        FROM order_items oi JOIN products p ON oi.product_id = p.product_id
+        WHERE oi.order_id = (SELECT order_id FROM orders ORDER BY order_purchase_timestamp DESC LIMIT 1)""",
+}
+
+def benchmark(engine, queries: Optional[Dict[str, str]] = None, repeats: int = 3) -> Dict[str, float]:
+    """Median wall time (seconds) per query; runs the raw SQL (no rollup rewriting)."""
+    out = {}
+    with engine.connect() as conn:
+        for name, sql in (queries or STANDARD_QUERIES).items():
+            times = []
+            for _ in range(max(1, repeats)):
+                t0 = time.perf_counter()
+                conn.execute(text(sql)).fetchall()
+                times.append(time.perf_counter() - t0)
+            out[name] = round(statistics.median(times), 4)
+    return out
+
+def _print_comparison(before: Dict[str, float], after: Dict[str, float]) -> None:
+    print(f"{'query':<30} {'before_s':>10} {'after_s':>10} {'speedup':>8}")
+    for name in before:
+        b, a = before[name], after.get(name, float("nan"))
+        print(f"{name:<30} {b:>10.4f} {a:>10.4f} {(b / a if a else float('inf')):>7.1f}x")
+
+if __name__ == "__main__":
+    from config import get_engine
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "plan"
+    engine = get_engine()
+    if cmd == "plan":
+        for a in ensure_indexes(engine, dry_run=True):
+            print(f"[{a['reason']}] {a['ddl']}")
+    elif cmd == "apply":
+        before = benchmark(engine)
+        for a in ensure_indexes(engine):
+            print(f"[{a['reason']}] {a['status']:<18} {a['ddl']}  ({a['seconds']}s)")
+        _print_comparison(before, benchmark(engine))
+    elif cmd == "bench":
+        for name, secs in benchmark(engine).items():
+            print(f"{name:<30} {secs:.4f}s")
+    else:
+        sys.exit(f"unknown command {cmd!r}; use 'plan', 'apply' or 'bench'")
@@ -0,0 +1,549 @@
+# load_test.py
+"""
+Concurrency load test: how many simultaneous users one app process handles, and where it serializes.
+
+N simulated users loop over a weighted question mix with exponential think times, against
+nlq_to_viz_workflow.run (in-process) or the job service (service.py), at each concurrency level
+in turn. The LLM is stubbed under the real rate limiter / cost accounting / single-flight layers
+(StubLLM: canned answers per prompt, log-normal latency), and the database is a synthetic
+Olist-like SQLite file built in a work directory, or any local DB given with --db-url.
+
+Per level it reports throughput, p50/p95/p99 latency, error rate by kind, connection-pool
+checkout waits and peak occupancy, and per-stage p50/p95 from the request traces. Stages whose
+median grows with concurrency while the stubbed LLM latency stays flat are where requests queue
+(pool, locks, the GIL around viz `exec`); they are listed as "slowest growth".
+
+CLI:
+  python load_test.py --users 1,4,16 --duration 30 --think 1 --llm-latency 0.8
+  python load_test.py --target service --users 8,32          # embedded service (or --service-url)
+  python load_test.py --db-url mysql+mysqlconnector://...     # local DB + its knowledgebase.pkl
+  python load_test.py --mix mix.json --out report.json        # [{"question", "sql", "tables", "weight"}]
+  python load_test.py --isolation --users 32 --rounds 10      # thread-safety stress test, exit 1 on failure
+"""
+import argparse
+import json
+import math
+import os
+import pickle
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+# Portable (MySQL and SQLite) questions with the SQL the stubbed generator "writes" for them
+DEFAULT_MIX: List[Dict[str, Any]] = [
+    {"question": "Total payment value by payment type", "tables": ["order_payments"], "weight": 3,
+     "sql": "SELECT p.payment_type, SUM(p.payment_value) AS total FROM order_payments p "
+            "GROUP BY p.payment_type ORDER BY total DESC"},
+    {"question": "Number of orders per order status", "tables": ["orders"], "weight": 2,
+     "sql": "SELECT o.order_status, COUNT(*) AS orders FROM orders o GROUP BY o.order_status"},
+    {"question": "Monthly revenue trend", "tables": ["orders", "order_payments"], "weight": 3,
+     "sql": "SELECT SUBSTR(o.order_purchase_timestamp, 1, 7) AS month, SUM(p.payment_value) AS revenue "
+            "FROM orders o JOIN order_payments p ON p.order_id = o.order_id GROUP BY month ORDER BY month"},
+    {"question": "Top 10 customer states by number of orders", "tables": ["orders", "customer"], "weight": 2,
+     "sql": "SELECT c.customer_state, COUNT(DISTINCT o.order_id) AS orders FROM orders o "
+            "JOIN customer c ON c.customer_id = o.customer_id GROUP BY c.customer_state ORDER BY orders DESC LIMIT 10"},
+    {"question": "Top 10 sellers by revenue", "tables": ["order_items"], "weight": 1,
+     "sql": "SELECT i.seller_id, SUM(i.price) AS revenue FROM order_items i GROUP BY i.seller_id "
+            "ORDER BY revenue DESC LIMIT 10"},
+    {"question": "Average review score by product category",
+     "tables": ["order_reviews", "order_items", "products", "category_translation"], "weight": 1,
+     "sql": "SELECT t.product_category_name_english AS category, AVG(r.review_score) AS avg_score "
+            "FROM order_reviews r JOIN order_items i ON i.order_id = r.order_id "
+            "JOIN products pr ON pr.product_id = i.product_id "
+            "JOIN category_translation t ON t.product_category_name = pr.product_category_name "
+            "GROUP BY category ORDER BY avg_score DESC LIMIT 20"},
+]
+
+# ---------------- Synthetic database + knowledgebase ----------------
+_SCHEMA = {
+    "orders": ["order_id", "customer_id", "order_status", "order_purchase_timestamp"],
+    "customer": ["customer_id", "customer_city", "customer_state"],
+    "order_items": ["order_id", "order_item_id", "product_id", "seller_id", "price", "freight_value"],
+    "order_payments": ["order_id", "payment_sequential", "payment_type", "payment_value"],
+    "order_reviews": ["review_id", "order_id", "review_score"],
+    "products": ["product_id", "product_category_name"],
+    "sellers": ["seller_id", "seller_city", "seller_state"],
+    "category_translation": ["product_category_name", "product_category_name_english"],
+}
+
+def build_sqlite_db(path: str, orders: int, seed: int = 0) -> None:
+    """Olist-shaped tables with `orders` orders (items, payments, reviews scale with it)."""
+    rng = random.Random(seed)
+    states = ["SP", "RJ", "MG", "RS", "PR", "SC", "BA", "GO", "PE", "CE"]
+    cats = [f"categoria_{i}" for i in range(20)]
+    n_cust, n_prod, n_sell = max(1, orders // 3), 2000, 300
+    con = sqlite3.connect(path)
+    for t, cols in _SCHEMA.items():
+        con.execute(f"DROP TABLE IF EXISTS {t}")
+        con.execute(f"CREATE TABLE {t} ({', '.join(cols)})")
+    con.executemany("INSERT INTO category_translation VALUES (?, ?)", [(c, f"category_{i}") for i, c in enumerate(cats)])
+    con.executemany("INSERT INTO customer VALUES (?, ?, ?)",
+                    [(f"c{i}", f"city_{i % 500}", rng.choice(states)) for i in range(n_cust)])
+    con.executemany("INSERT INTO products VALUES (?, ?)", [(f"p{i}", rng.choice(cats)) for i in range(n_prod)])
+    con.executemany("INSERT INTO sellers VALUES (?, ?, ?)",
+                    [(f"s{i}", f"city_{i % 80}", rng.choice(states)) for i in range(n_sell)])
+    rows: Dict[str, list] = defaultdict(list)
+    for i in range(orders):
+        oid = f"o{i}"
+        ts = f"{rng.choice([2016, 2017, 2018])}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 10:00:00"
+        rows["orders"].append((oid, f"c{rng.randrange(n_cust)}", rng.choice(["delivered"] * 8 + ["shipped", "canceled"]), ts))
+        for k in range(1 + (rng.random() < 0.2)):
+            rows["order_items"].append((oid, k + 1, f"p{rng.randrange(n_prod)}", f"s{rng.randrange(n_sell)}",
+                                        round(rng.uniform(5, 500), 2), round(rng.uniform(5, 50), 2)))
+        rows["order_payments"].append((oid, 1, rng.choice(["credit_card"] * 3 + ["boleto", "voucher"]),
+                                       round(rng.uniform(10, 600), 2)))
+        rows["order_reviews"].append((f"r{i}", oid, rng.randint(1, 5)))
+    for t, data in rows.items():
+        con.executemany(f"INSERT INTO {t} VALUES ({', '.join('?' * len(_SCHEMA[t]))})", data)
+    con.commit()
+    con.close()
+
+def build_knowledgebase(path: str) -> None:
+    kb = {t: [f"Synthetic Olist {t} table.", [[c, f"{c} of the {t} row"] for c in cols]] for t, cols in _SCHEMA.items()}
+    with open(path, "wb") as f:
+        pickle.dump(kb, f)
+
+# ---------------- Stubbed LLM ----------------
+_STRUCTURED_ANSWERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "routed_agents": lambda e: {"agents": StubLLM.groups_for(e["tables"])},
+    "subquestions": lambda e: {"subquestions": [{"subquestion": e["question"], "table": t} for t in e["tables"]]},
+    "selected_columns": lambda e: {"columns": []},  # filled from the prompt's column list
+    "filters": lambda e: {"has_filters": False, "filters": []},
+}
+
+class StubLLM:
+    """Canned answers per prompt kind, after a log-normal delay (median `latency_s`)."""
+
+    def __init__(self, mix: List[Dict[str, Any]], latency_s: float = 0.8, sigma: float = 0.4, seed: int = 0):
+        self.mix = mix
+        self.latency_s = latency_s
+        self.sigma = sigma
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    @staticmethod
+    def groups_for(tables: List[str]) -> List[str]:
+        from schema_catalog import routing_groups
+        return [g.name for g in routing_groups() if set(g.tables) & set(tables)]
+
+    def _entry(self, text: str) -> Dict[str, Any]:
+        return next((e for e in self.mix if e["question"] in text), self.mix[0])
+
+    def respond(self, text: str, schema_name: Optional[str] = None) -> str:
+        from utils_parsing import extract_json
+        e = self._entry(text)
+        if schema_name == "selected_columns" or (schema_name is None and "Column list:" in text):
+            listed = extract_json(text.split("Column list:", 1)[-1], list) or []
+            cols = [c for c in listed if isinstance(c, list) and c][:2]
+            if schema_name:
+                return json.dumps({"columns": [{"column": str(c[0]), "description": "used"} for c in cols]})
+            return json.dumps([[str(c[0]), "used"] for c in cols])
+        if schema_name:
+            return json.dumps(_STRUCTURED_ANSWERS[schema_name](e))
+        if "intelligent router" in text:
+            return str(self.groups_for(e["tables"]))
+        if "subquestion generator" in text:
+            return json.dumps([[e["question"], t] for t in e["tables"]])
+        if "decide WHAT filters" in text:
+            return '["no"]'
+        if "classify a user's follow-up" in text:
+            return "new"
+        if "MySQL query" in text:  # generator, validator, fixer, refiner
+            return e["sql"]
+        if "Business Intelligence" in text:
+            return "A bar chart of the metric by the first column."
+        if "visualization assistant" in text:
+            return "```python\nimport plotly.express as px\nfig = px.bar(df, x=df.columns[0], y=df.columns[-1])\n```"
+        if "silently" in text:  # viz fixer
+            return "df_viz = df"
+        return "[]"
+
+    def delay(self) -> float:
+        with self._lock:
+            self.calls += 1
+            return self.latency_s * self._rng.lognormvariate(0.0, self.sigma)
+
+    def install(self) -> None:
+        """Replace the HTTP call under RateLimitedAzureChatOpenAI (limiter, costs, coalescing stay)."""
+        from langchain_core.messages import AIMessage
+        from langchain_core.outputs import ChatGeneration, ChatResult
+        from langchain_openai import AzureChatOpenAI
+        stub = self
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            text = "\n".join(str(m.content) for m in messages)
+            rf = kwargs.get("response_format")
+            name = rf.get("json_schema", {}).get("name") if isinstance(rf, dict) else None
+            out = stub.respond(text, name)
+            time.sleep(stub.delay())
+            usage = {"prompt_tokens": len(text) // 4, "completion_tokens": len(out) // 4}
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=out))],
+                              llm_output={"token_usage": usage})
+
+        AzureChatOpenAI._generate = _generate
+
+# ---------------- Probes ----------------
+class PoolProbe:
+    """Checkout wait per connection and sampled pool occupancy of the shared engine."""
+
+    def __init__(self, engine, interval_s: float = 0.05):
+        self.engine = engine
+        self.interval_s = interval_s
+        self.waits: List[float] = []
+        self.occupancy: List[int] = []
+        self._stop = threading.Event()
+        raw_connection = engine.raw_connection
+
+        def _probe(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return raw_connection(*args, **kwargs)
+            finally:
+                self.waits.append(time.perf_counter() - t0)
+
+        engine.raw_connection = _probe
+
+    def capacity(self) -> Optional[int]:
+        pool = self.engine.pool
+        size = getattr(pool, "size", None)
+        overflow = getattr(pool, "_max_overflow", 0)
+        return size() + max(0, overflow) if callable(size) else None
+
+    def reset(self) -> None:
+        self.waits, self.occupancy = [], []
+        self._stop.clear()
+        threading.Thread(target=self._sample, name="pool-probe", daemon=True).start()
+
+    def _sample(self) -> None:
+        checkedout = getattr(self.engine.pool, "checkedout", None)
+        while not self._stop.wait(self.interval_s):
+            if callable(checkedout):
+                self.occupancy.append(checkedout())
+
+    def stop(self) -> None:
+        self._stop.set()
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    s = sorted(values)
+    k = (len(s) - 1) * p / 100.0
+    lo, hi = math.floor(k), math.ceil(k)
+    return round(s[lo] + (s[hi] - s[lo]) * (k - lo), 4)
+
+# ---------------- Driver ----------------
+def classify(state: Dict[str, Any]) -> str:
+    status = state.get("status") or "ok"
+    if status != "ok":
+        return status
+    if state.get("result_debug_sql") != "Pass":
+        return "sql_error"
+    if state.get("result_debug_python_code_data_visualization") != "Pass":
+        return "viz_error"
+    return "ok"
+
+def run_level(target: Callable[[str, int], Dict[str, Any]], mix: List[Dict[str, Any]], users: int,
+              duration_s: float, think_s: float, seed: int, unique: bool) -> List[Dict[str, Any]]:
+    stop_at = time.perf_counter() + duration_s
+    weights = [float(e.get("weight", 1)) for e in mix]
+    records: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+
+    def user(uid: int) -> None:
+        rng = random.Random(seed * 1000 + uid)
+        time.sleep(rng.uniform(0, min(think_s, duration_s / 4)))  # stagger the first requests
+        i = 0
+        while time.perf_counter() < stop_at:
+            e = rng.choices(mix, weights)[0]
+            q = f"{e['question']} [user {uid} #{i}]" if unique else e["question"]
+            t0 = time.perf_counter()
+            try:
+                state = target(q, uid)
+                rec = {"outcome": classify(state), "timings": state.get("timings") or {}}
+            except Exception as ex:
+                rec = {"outcome": f"exception:{type(ex).__name__}", "timings": {}}
+            rec.update(user=uid, question=e["question"], latency_s=time.perf_counter() - t0)
+            with lock:
+                records.append(rec)
+            i += 1
+            if think_s > 0:
+                time.sleep(rng.expovariate(1.0 / think_s))
+
+    threads = [threading.Thread(target=user, args=(u,), name=f"user-{u}", daemon=True) for u in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return records
+
+def summarize(users: int, records: List[Dict[str, Any]], wall_s: float, probe: PoolProbe,
+              llm_calls: int) -> Dict[str, Any]:
+    lat = [r["latency_s"] for r in records]
+    outcomes = Counter(r["outcome"] for r in records)
+    stages: Dict[str, List[float]] = defaultdict(list)
+    for r in records:
+        for name, secs in r["timings"].items():
+            stages[name].append(secs)
+    cap = probe.capacity()
+    return {
+        "users": users,
+        "requests": len(records),
+        "throughput_rps": round(len(records) / wall_s, 3) if wall_s else 0.0,
+        "latency_s": {"p50": percentile(lat, 50), "p95": percentile(lat, 95), "p99": percentile(lat, 99)},
+        "error_rate": round(1 - outcomes.get("ok", 0) / len(records), 4) if records else 0.0,
+        "outcomes": dict(outcomes),
+        "pool": {
+            "checkouts": len(probe.waits),
+            "wait_p50_ms": _ms(percentile(probe.waits, 50)),
+            "wait_p95_ms": _ms(percentile(probe.waits, 95)),
+            "wait_max_ms": _ms(max(probe.waits) if probe.waits else None),
+            "peak_checked_out": max(probe.occupancy) if probe.occupancy else 0,
+            "capacity": cap,
+        },
+        "llm_calls": llm_calls,
+        "stages": {n: {"p50": percentile(v, 50), "p95": percentile(v, 95)} for n, v in sorted(stages.items())},
+    }
+
+def _ms(v: Optional[float]) -> Optional[float]:
+    return round(v * 1000, 2) if v is not None else None
+
+def growth(levels: List[Dict[str, Any]], top: int = 5) -> List[Dict[str, Any]]:
+    """Stages whose p50 grew the most from the first to the last level."""
+    if len(levels) < 2:
+        return []
+    first, last = levels[0]["stages"], levels[-1]["stages"]
+    out = []
+    for name, s in last.items():
+        base = (first.get(name) or {}).get("p50")
+        if base and s["p50"] is not None and base > 0.001:
+            out.append({"stage": name, "p50_first": base, "p50_last": s["p50"], "ratio": round(s["p50"] / base, 2)})
+    return sorted(out, key=lambda x: -x["ratio"])[:top]
+
+def print_report(levels: List[Dict[str, Any]]) -> None:
+    print(f"\n{'users':>5} {'req':>6} {'rps':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'err%':>6} "
+          f"{'pool p95ms':>10} {'pool peak':>9}")
+    for lv in levels:
+        l, p = lv["latency_s"], lv["pool"]
+        print(f"{lv['users']:>5} {lv['requests']:>6} {lv['throughput_rps']:>7.2f} {l['p50'] or 0:>7.2f} "
+              f"{l['p95'] or 0:>7.2f} {l['p99'] or 0:>7.2f} {lv['error_rate'] * 100:>6.1f} "
+              f"{p['wait_p95_ms'] or 0:>10.1f} {p['peak_checked_out']:>4}/{p['capacity'] or '?'}")
+        errors = {k: v for k, v in lv["outcomes"].items() if k != "ok"}
+        if errors:
+            print(f"      errors: {errors}")
+    g = growth(levels)
+    if g:
+        print("\nslowest growth (stage p50, first -> last level):")
+        for s in g:
+            print(f"  {s['stage']:<40} {s['p50_first']:.3f}s -> {s['p50_last']:.3f}s  (x{s['ratio']})")
+
+# ---------------- Setup ----------------
+def prepare_environment(args) -> None:
+    """Env for config.py, set before any app module is imported."""
+    os.environ.setdefault("AZURE_OPENAI_API_KEY", "stub")
+    os.environ["WARMUP_ON_START"] = "0"
+    if args.db_url:
+        os.environ["DATABASE_URL"] = args.db_url
+        return
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="load_test_"))
+    os.makedirs(workdir, exist_ok=True)
+    db = os.path.join(workdir, "olist.db")
+    if not os.path.exists(db):
+        print(f"building synthetic database ({args.rows} orders) in {workdir} ...")
+        build_sqlite_db(db, args.rows, args.seed)
+    build_knowledgebase(os.path.join(workdir, "knowledgebase.pkl"))
+    os.environ.update(DATABASE_URL=f"sqlite:///{db}", KNOWLEDGEBASE_PATH=os.path.join(workdir, "knowledgebase.pkl"))
+    for var, name in (("TRACE_FILE", "traces.jsonl"), ("QUERY_LOG_FILE", "query_log.jsonl")):
+        os.environ.setdefault(var, os.path.join(workdir, name))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)  # customer_agent loads knowledgebase.pkl from the working directory first
+
+def make_target(args) -> Callable[[str, int], Dict[str, Any]]:
+    if args.target == "service":
+        from service import ServiceClient, start_embedded
+        url = args.service_url or start_embedded()
+        client = ServiceClient(url, timeout_s=max(30.0, args.timeout or 0))
+        return lambda q, uid: client.run(q, user=f"load-{uid}", max_retries=args.retries, timeout_s=args.timeout)
+    from runtime import get_runtime
+    rt = get_runtime()
+    return lambda q, uid: rt.run(q, user=f"load-{uid}", max_retries=args.retries, timeout_s=args.timeout)
+
+# ---------------- Isolation stress test ----------------
+def _getters() -> Dict[str, Callable[[], Any]]:
+    from config import get_engine, get_llm
+    from customer_agent import get_customer_graph, get_knowledgebase
+    from customer_helper import get_chain
+    from rate_limiter import get_limiter
+    from runtime import get_runtime
+    from schema_catalog import get_catalog, routing_groups
+    from sql_viz_workflow import get_sql_viz_graph
+    return {
+        "engine": get_engine, "llm": get_llm, "limiter": get_limiter, "knowledgebase": get_knowledgebase,
+        "schema_catalog": get_catalog, "routing_groups": routing_groups, "runtime": get_runtime,
+        "customer_graph": get_customer_graph, "sql_viz_graph": get_sql_viz_graph,
+        "query_chain": lambda: get_chain("chain_query_extractor"),
+    }
+
+def check_isolation(args, mix: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    The runtime's thread-safety guarantees, under load (runtime.py, "Threading model"):
+    1. cold start: `users` threads (the highest --users level) hit every shared getter at the same moment -> one object each;
+    2. shared data is read-only: editing the knowledgebase raises, and it is unchanged afterwards;
+    3. `users` threads x `--rounds` requests, neighbours asking different questions at the same
+       time -> every result belongs to its own question (question text, result columns and row
+       count, unique trace id) and nothing fails.
+    """
+    import pandas as pd
+    from sqlalchemy import text
+
+    users = max(int(x) for x in args.users.split(",") if x.strip())  # the highest level
+    failures: List[str] = []
+    getters = _getters()
+    barrier = threading.Barrier(users)
+    seen: Dict[str, set] = defaultdict(set)
+
+    def cold(uid: int) -> None:
+        barrier.wait()
+        for name, fn in (list(getters.items())[uid % len(getters):] + list(getters.items())[:uid % len(getters)]):
+            try:
+                seen[name].add(id(fn()))
+            except Exception as ex:
+                failures.append(f"cold start {name}: {type(ex).__name__}: {ex}")
+
+    threads = [threading.Thread(target=cold, args=(u,)) for u in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    failures += [f"{n}: {len(ids)} instances after concurrent first use" for n, ids in seen.items() if len(ids) > 1]
+
+    kb = getters["knowledgebase"]()
+    kb_before = repr(kb)
+    table = next(iter(kb))
+    for label, edit in (("add a table", lambda: kb.__setitem__("x", [])),
+                        ("edit a column list", lambda: kb[table][1].append(["x", "y"]))):
+        try:
+            edit()
+            failures.append(f"knowledgebase: '{label}' was allowed")
+        except (TypeError, AttributeError):
+            pass
+
+    engine = getters["engine"]()
+    expected = {}
+    for e in mix:
+        df = pd.read_sql(text(e["sql"]), engine)
+        expected[e["question"]] = (list(df.columns), len(df))
+
+    target = make_target(args)
+    trace_ids: List[str] = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(users)
+
+    def user(uid: int) -> None:
+        barrier.wait()
+        for i in range(args.rounds):
+            e = mix[(uid + i) % len(mix)]  # neighbours ask different questions at the same time
+            q = f"{e['question']} [user {uid} #{i}]"
+            try:
+                st = target(q, uid)
+            except Exception as ex:
+                with lock:
+                    failures.append(f"{q}: {type(ex).__name__}: {ex}")
+                continue
+            cols, rows = expected[e["question"]]
+            df = st.get("df")
+            problems = []
+            if classify(st) != "ok":
+                problems.append(f"outcome {classify(st)}: {st.get('error_msg_debug_sql') or st.get('status_detail')}")
+            if st.get("question") != q:
+                problems.append(f"answered {st.get('question')!r}")
+            if not isinstance(df, pd.DataFrame) or list(df.columns) != cols or len(df) != rows:
+                got = (list(df.columns), len(df)) if isinstance(df, pd.DataFrame) else None
+                problems.append(f"result {got} != expected {(cols, rows)}")
+            with lock:
+                trace_ids.append(st.get("trace_id", ""))
+                failures.extend(f"{q}: {p}" for p in problems)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(u,), name=f"user-{u}") for u in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if len(set(trace_ids)) != len(trace_ids):
+        failures.append(f"{len(trace_ids) - len(set(trace_ids))} duplicated trace ids")
+    if repr(getters["knowledgebase"]()) != kb_before:
+        failures.append("knowledgebase changed during the run")
+    return {"users": users, "requests": len(trace_ids), "seconds": round(time.perf_counter() - t0, 2),
+            "instances": {n: len(ids) for n, ids in seen.items()}, "failures": failures, "ok": not failures}
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    ap = argparse.ArgumentParser(description="Simulated-user load test with a stubbed LLM.")
+    ap.add_argument("--users", default="1,2,4,8,16", help="comma-separated concurrency levels")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds per level")
+    ap.add_argument("--think", type=float, default=1.0, help="mean think time between a user's questions (s)")
+    ap.add_argument("--llm-latency", type=float, default=0.8, help="median stubbed LLM call latency (s)")
+    ap.add_argument("--llm-sigma", type=float, default=0.4, help="log-normal spread of the LLM latency")
+    ap.add_argument("--target", choices=["run", "service"], default="run")
+    ap.add_argument("--service-url", default="", help="existing service; default: start one in-process")
+    ap.add_argument("--db-url", default="", help="local database instead of the synthetic SQLite file")
+    ap.add_argument("--rows", type=int, default=20000, help="synthetic orders")
+    ap.add_argument("--workdir", default="", help="where the synthetic DB/knowledgebase live (default: temp)")
+    ap.add_argument("--mix", default="", help="JSON question mix: [{question, sql, tables, weight}]")
+    ap.add_argument("--repeat-questions", action="store_true",
+                    help="send identical question texts (lets single-flight coalesce them)")
+    ap.add_argument("--retries", type=int, default=3)
+    ap.add_argument("--timeout", type=float, default=None, help="per-request deadline (s)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="", help="write the report as JSON")
+    ap.add_argument("--isolation", action="store_true",
+                    help="stress-test thread safety instead (cold start, read-only data, per-request results)")
+    ap.add_argument("--rounds", type=int, default=10, help="--isolation: requests per user")
+    args = ap.parse_args(argv)
+
+    mix = DEFAULT_MIX
+    if args.mix:
+        with open(args.mix, encoding="utf-8") as f:
+            mix = json.load(f)
+    prepare_environment(args)
+    stub = StubLLM(mix, args.llm_latency, args.llm_sigma, args.seed)
+    stub.install()
+    if args.isolation:
+        report = check_isolation(args, mix)
+        print(json.dumps({k: v for k, v in report.items() if k != "failures"}))
+        for f in report["failures"][:20]:
+            print(f"  FAIL {f}")
+        print("isolation: " + ("ok" if report["ok"] else f"{len(report['failures'])} failure(s)"))
+        if not report["ok"]:
+            sys.exit(1)
+        return report
+    from config import get_engine
+    probe = PoolProbe(get_engine())
+    target = make_target(args)
+
+    levels = []
+    for users in [int(x) for x in args.users.split(",") if x.strip()]:
+        probe.reset()
+        calls0 = stub.calls
+        t0 = time.perf_counter()
+        records = run_level(target, mix, users, args.duration, args.think, args.seed, not args.repeat_questions)
+        wall = time.perf_counter() - t0
+        probe.stop()
+        levels.append(summarize(users, records, wall, probe, stub.calls - calls0))
+        lv = levels[-1]
+        print(f"[{users} users] {lv['requests']} requests, {lv['throughput_rps']} req/s, "
+              f"p95 {lv['latency_s']['p95']}s, errors {lv['error_rate'] * 100:.1f}%")
+    print_report(levels)
+    report = {"config": {k: v for k, v in vars(args).items()}, "levels": levels, "slowest_growth": growth(levels)}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1, default=str)
+    return report
+
+if __name__ == "__main__":
+    main()
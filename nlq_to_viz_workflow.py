@@ -1,15 +1,27 @@
 # nlq_to_viz_workflow.py
-from typing import Dict, Any, TypedDict, List
-import ast, json
+from typing import Callable, Dict, Any, TypedDict, List, Optional
+import json, re
 import pandas as pd
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
 
 from router_agent import agent_2 as route_agents
-from customer_agent import graph_final as customer_graph, d_store as AGENT_TABLES
-from customer_helper import chain_filter_extractor, chain_query_extractor
+from customer_agent import get_customer_graph
+from customer_helper import get_chain
 from utils_parsing import parse_nested_list
 from fuzzy_wuzzy import call_match as fuzzy_match_filters
+from config import get_llm
+from prompts import system_prompt_followup_classifier, system_prompt_sql_refiner
+from cost_accounting import at_least, cost_scope, current_ledger
+from deadline import RequestAborted, deadline_scope, stage
+from singleflight import QUESTIONS
+from result_memory import account_request
+from schema_catalog import tables_for_groups
+from telemetry import METRICS, request_trace, span
 
 from sql_viz_workflow import run_workflow as run_sql_viz  # validates SQL, executes, BI, viz gen/validate
+from sql_viz_workflow import progress_scope, run_viz_only
+from shared_state import shared_resource
 
 class FinalState(TypedDict):
     question: str
@@ -21,65 +33,66 @@ class FinalState(TypedDict):
     error_msg_debug_sql: str
     result_debug_python_code_data_visualization: str
     error_msg_debug_python_code_data_visualization: str
+    num_retries_debug_sql: int
+    num_retries_debug_python_code_data_visualization: int
+    trace_id: str
+    timings: Dict[str, float]
+    followup_kind: str   # "new" | "viz_only" | "sql_refine"
+    status: str          # "ok" | "timeout" | "cancelled" | "budget": the other fields hold what finished
+    status_detail: str
+    cost: Dict[str, Any]  # tokens / USD per request and stage, degrade mode (cost_accounting)
+    result_source: str    # "full" | "sample": "sample" only when the full query ran out of time / was cancelled
+    sample_fraction: float
     df: pd.DataFrame
     visualization_request: str
     python_code_data_visualization: str
-    python_code_store_variables_dict: dict
+    python_code_store_variables_dict: dict  # fig_json / df_viz / string_viz_result
+    memory: Dict[str, Any]  # bytes held per part + total, "trimmed" when over REQUEST_MEMORY_CAP_MB
 
 def _pick_tables_for_question(question: str) -> List[str]:
     raw = route_agents(question)  # e.g., "['customer','orders']"
-    try:
-        agents = ast.literal_eval(raw)
-        if not isinstance(agents, list):
-            agents = []
-    except Exception:
-        agents = []
-    tables: List[str] = []
-    for a in agents:
-        tables.extend(AGENT_TABLES.get(a, []))
-    if not tables:
-        tables = AGENT_TABLES.get("orders", [])
-    seen = set()
-    deduped = [t for t in tables if not (t in seen or seen.add(t))]
-    return deduped
+    agents = parse_nested_list(raw, stage="router")
+    # group -> tables; the subquestion step then picks tables and the column extractor columns
+    return tables_for_groups([str(a) for a in agents])
+
+def _columns_context(columns_selected) -> str:
+    """Selected columns for prompts; trimmed to table, column and a short note in small_context mode."""
+    if not isinstance(columns_selected, list) or not at_least("small_context"):
+        return str(columns_selected)
+    return str([[str(x)[:60] for x in c[:3]] if isinstance(c, list) else c for c in columns_selected])
 
 def _subquestions_and_columns(question: str, tables: List[str]) -> List[list]:
-    st = customer_graph.invoke({"user_query": question, "table_lst": tables})
+    st = get_customer_graph().invoke({"user_query": question, "table_lst": tables})
     return st.get("column_extract", []) or []
 
 def _filters(question: str, columns_selected: list):
-    raw = chain_filter_extractor.invoke({
-        "query": question,
-        "columns": str(columns_selected)
-    }).strip()
-    as_list = parse_nested_list(raw)
+    with span("chain.filter_extractor"):
+        raw = get_chain("chain_filter_extractor").invoke({
+            "query": question,
+            "columns": _columns_context(columns_selected)
+        }).strip()
+    as_list = parse_nested_list(raw, stage="filter")
     if as_list:
-        matched = fuzzy_match_filters(as_list)
+        with span("fuzzy_match"):
+            matched = fuzzy_match_filters(as_list)
         return raw, matched
     return raw, raw
 
 def _generate_sql(question: str, columns_selected: list, filters_any) -> str:
     filters_str = json.dumps(filters_any) if isinstance(filters_any, (list, dict)) else str(filters_any)
-    sql = chain_query_extractor.invoke({
-        "query": question,
-        "columns": str(columns_selected),
-        "filters": filters_str
-    }).strip()
+    with span("chain.query_extractor"):
+        sql = get_chain("chain_query_extractor").invoke({
+            "query": question,
+            "columns": _columns_context(columns_selected),
+            "filters": filters_str
+        }).strip()
     return sql
 
-def run(question: str, *, max_retries: int = 3) -> FinalState:
-    tables = _pick_tables_for_question(question)
-    columns_selected = _subquestions_and_columns(question, tables)
-    filters_raw, filters_matched = _filters(question, columns_selected)
-    sql = _generate_sql(question, columns_selected, filters_matched)
-    state = run_sql_viz(
-        question=question,
-        sql=sql,
-        columns=str(columns_selected),
-        filters=json.dumps(filters_matched) if not isinstance(filters_matched, str) else filters_matched,
-        max_retries=max_retries
-    )
-    combined: FinalState = {
+def _final_state(question: str, state: Dict[str, Any], trace, *, columns_selected, filters_raw,
+                 filters_matched, followup_kind: str = "new") -> FinalState:
+    METRICS.observe("sql_retries_per_request", state.get("num_retries_debug_sql", 0))
+    METRICS.observe("viz_retries_per_request", state.get("num_retries_debug_python_code_data_visualization", 0))
+    final: FinalState = {
         "question": question,
         "sql": state["sql"],
         "columns_selected": columns_selected,
@@ -93,5 +106,214 @@ def run(question: str, *, max_retries: int = 3) -> FinalState:
         "error_msg_debug_sql": state.get("error_msg_debug_sql", ""),
         "result_debug_python_code_data_visualization": state.get("result_debug_python_code_data_visualization",""),
         "error_msg_debug_python_code_data_visualization": state.get("error_msg_debug_python_code_data_visualization",""),
+        "num_retries_debug_sql": state.get("num_retries_debug_sql", 0),
+        "num_retries_debug_python_code_data_visualization": state.get("num_retries_debug_python_code_data_visualization", 0),
+        "trace_id": trace.trace_id,
+        "timings": trace.timings(),
+        "followup_kind": followup_kind,
+        "status": state.get("status", "ok"),
+        "status_detail": state.get("status_detail", ""),
+        "cost": current_ledger().summary() if current_ledger() is not None else {},
+        "result_source": state.get("result_source", "full"),
+        "sample_fraction": state.get("sample_fraction", 1.0),
     }
-    return combined
+    final["memory"] = account_request(final)
+    return final
+
+def _aborted(sql: str, err: RequestAborted) -> Dict[str, Any]:
+    """Partial state for an abort before/outside the SQL → viz graph."""
+    return {"sql": sql, "status": err.status, "status_detail": str(err)}
+
+def run(question: str, *, max_retries: int = 3, timeout_s: Optional[float] = None,
+        cancel_key: Optional[str] = None, user: Optional[str] = None,
+        on_progress: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> FinalState:
+    """
+    Full pipeline under a deadline (default REQUEST_TIMEOUT_S). A newer run with the same
+    cancel_key (e.g. the user's session) cancels this one; either way the result carries
+    status "timeout"/"cancelled" and whatever finished before that. LLM spend is accounted
+    to `user` and can degrade the run or end it with status "budget" (cost_accounting).
+    on_progress("preview", state) receives the chart built on the sample tables while the
+    full query is still running (sample_tables.py).
+    """
+    with deadline_scope(timeout_s, key=cancel_key), cost_scope(user), progress_scope(on_progress):
+        return _run_coalesced(question, max_retries)
+
+def _run_coalesced(question: str, max_retries: int) -> FinalState:
+    """
+    _run, shared with identical questions already in flight (singleflight.py). Only complete
+    results are shared; a follower gets its own copy with its own (zero) cost.
+    """
+    key = (" ".join(question.lower().split()), int(max_retries))
+
+    def _copy(final: FinalState) -> FinalState:  # runs in the follower's context: its own ledger
+        out = dict(final, df=final["df"].copy() if isinstance(final.get("df"), pd.DataFrame) else final.get("df"))
+        out["python_code_store_variables_dict"] = dict(final.get("python_code_store_variables_dict") or {})
+        out["cost"] = current_ledger().summary() if current_ledger() is not None else {}
+        return out
+
+    return QUESTIONS.do(key, lambda: _run(question, max_retries),
+                        shareable=lambda f: f.get("status", "ok") == "ok", clone=_copy)
+
+def _run(question: str, max_retries: int) -> FinalState:
+    columns_selected, filters_raw, filters_matched, sql = [], "", "", ""
+    with request_trace(question=question) as trace:
+        try:
+            with span("route"), stage("route"):
+                tables = _pick_tables_for_question(question)
+            with span("customer_graph"), stage("customer_graph"):
+                columns_selected = _subquestions_and_columns(question, tables)
+            with span("filters"), stage("filters"):
+                filters_raw, filters_matched = _filters(question, columns_selected)
+            with span("generate_sql"), stage("generate_sql"):
+                sql = _generate_sql(question, columns_selected, filters_matched)
+            with span("sql_viz_graph"):
+                state = run_sql_viz(
+                    question=question,
+                    sql=sql,
+                    columns=_columns_context(columns_selected),
+                    filters=_filters_str(filters_matched),
+                    max_retries=max_retries
+                )
+        except RequestAborted as e:
+            state = _aborted(sql, e)
+        trace.attrs["status"] = state.get("status", "ok")
+        trace.attrs["cost_usd"] = round(current_ledger().usd, 6)
+    return _final_state(question, state, trace, columns_selected=columns_selected,
+                        filters_raw=filters_raw, filters_matched=filters_matched)
+
+# ===========================
+# Follow-up questions: reuse the previous FinalState, run only the stages that change
+# ===========================
+FOLLOWUP_KINDS = ("viz_only", "sql_refine", "new")
+
+def _filters_str(filters_matched) -> str:
+    return json.dumps(filters_matched) if not isinstance(filters_matched, str) else filters_matched
+
+@shared_resource
+def _get_followup_classifier_chain():
+    prompt = ChatPromptTemplate.from_messages([("system", system_prompt_followup_classifier)])
+    return prompt | get_llm() | StrOutputParser()
+
+@shared_resource
+def _get_sql_refiner_chain():
+    prompt = ChatPromptTemplate.from_messages([("system", system_prompt_sql_refiner)])
+    return prompt | get_llm() | StrOutputParser()
+
+def classify_followup(question: str, previous: Optional[FinalState]) -> str:
+    """"viz_only" | "sql_refine" | "new"; anything without a usable previous result is "new"."""
+    if not previous or previous.get("result_debug_sql") != "Pass" or not previous.get("sql"):
+        return "new"
+    df = previous.get("df")
+    with span("chain.followup_classifier"):
+        raw = _get_followup_classifier_chain().invoke({
+            "previous_question": previous.get("question", ""),
+            "previous_sql": previous["sql"],
+            "previous_columns": ", ".join(map(str, df.columns)) if isinstance(df, pd.DataFrame) else "",
+            "question": question,
+        }).strip().lower()
+    m = re.search(r"viz_only|sql_refine|new", raw)
+    kind = m.group(0) if m else "new"
+    if kind == "viz_only" and not (isinstance(df, pd.DataFrame) and not df.empty):
+        kind = "sql_refine"  # nothing to re-chart
+    elif kind == "viz_only" and previous.get("result_source") == "sample":
+        kind = "sql_refine"  # only a sample was shown: re-run for the full data
+    METRICS.inc("followups_total", kind=kind)
+    return kind
+
+def run_followup(question: str, previous: Optional[FinalState], *, max_retries: int = 3,
+                 timeout_s: Optional[float] = None, cancel_key: Optional[str] = None,
+                 user: Optional[str] = None,
+                 on_progress: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> FinalState:
+    """
+    Answer `question` in the context of the previous answer:
+      viz_only   → re-chart previous df (BI + viz only)
+      sql_refine → extract the delta's columns/filters and merge them into the previous context,
+                   edit previous SQL with the delta, then validate/execute + BI + viz
+      new        → full pipeline (run)
+    Same deadline/cancel/cost/progress semantics as run(); the classification counts against the budgets.
+    """
+    with deadline_scope(timeout_s, key=cancel_key), cost_scope(user), progress_scope(on_progress):
+        try:
+            with stage("followup_classifier"):
+                kind = classify_followup(question, previous)
+        except RequestAborted:
+            kind = "new"  # no time left to decide: the full pipeline reports the abort
+        if kind == "new":
+            return _run_coalesced(question, max_retries)
+        return _run_followup(question, previous, kind, max_retries)
+
+def _merge_columns(previous, delta) -> list:
+    """Previous selected columns plus the follow-up's new ones (same table+column kept once)."""
+    out = list(previous) if isinstance(previous, list) else []
+    seen = {tuple(map(str, c[:2])) for c in out if isinstance(c, list)}
+    for c in delta or []:
+        if isinstance(c, list) and tuple(map(str, c[:2])) not in seen:
+            seen.add(tuple(map(str, c[:2])))
+            out.append(c)
+    return out
+
+def _filter_items(filters) -> list:
+    if not isinstance(filters, list) or filters[:1] != ["yes"]:
+        return []
+    return [f for f in filters[1:] if isinstance(f, list) and len(f) >= 3]
+
+def _merge_filters(previous, delta):
+    """Previous filters plus the follow-up's; a follow-up filter on the same column replaces the old one."""
+    new = _filter_items(delta)
+    if not new:
+        return previous
+    replaced = {tuple(map(str, f[:2])) for f in new}
+    return ["yes", *[f for f in _filter_items(previous) if tuple(map(str, f[:2])) not in replaced], *new]
+
+def _run_followup(question: str, previous: FinalState, kind: str, max_retries: int) -> FinalState:
+    context_q = f"{previous['question']}\nFollow-up: {question}"
+    columns_selected = previous.get("columns_selected", [])
+    filters_raw = previous.get("filters_raw", "")
+    filters_matched = previous.get("filters_matched", "")
+    sql = previous["sql"]
+    with request_trace(question=question, followup=kind) as trace:
+        try:
+            if kind == "viz_only":
+                with span("viz_only_graph"):
+                    state = run_viz_only(
+                        question=context_q,
+                        sql=sql,
+                        df=previous["df"],
+                        columns=_columns_context(columns_selected),
+                        filters=_filters_str(filters_matched),
+                        max_retries=max_retries
+                    )
+            else:
+                # the delta may bring new tables/columns/filters ("by state", "only for SP")
+                with span("route"), stage("route"):
+                    tables = _pick_tables_for_question(question)
+                with span("customer_graph"), stage("customer_graph"):
+                    columns_selected = _merge_columns(columns_selected, _subquestions_and_columns(question, tables))
+                with span("filters"), stage("filters"):
+                    delta_raw, delta_matched = _filters(question, columns_selected)
+                if _filter_items(delta_matched):
+                    filters_raw = f"{filters_raw}\nFollow-up: {delta_raw}" if filters_raw else delta_raw
+                    filters_matched = _merge_filters(filters_matched, delta_matched)
+                with span("refine_sql"), stage("refine_sql"), span("chain.sql_refiner"):
+                    sql = _get_sql_refiner_chain().invoke({
+                        "previous_question": previous["question"],
+                        "previous_sql": previous["sql"],
+                        "columns": _columns_context(columns_selected),
+                        "filters": _filters_str(filters_matched),
+                        "question": question,
+                    }).strip()
+                with span("sql_viz_graph"):
+                    state = run_sql_viz(
+                        question=context_q,
+                        sql=sql,
+                        columns=_columns_context(columns_selected),
+                        filters=_filters_str(filters_matched),
+                        max_retries=max_retries
+                    )
+        except RequestAborted as e:
+            state = _aborted(sql, e)
+        trace.attrs["status"] = state.get("status", "ok")
+        trace.attrs["cost_usd"] = round(current_ledger().usd, 6)
+    return _final_state(context_q, state, trace, columns_selected=columns_selected,
+                        filters_raw=filters_raw, filters_matched=filters_matched,
+                        followup_kind=kind)
@@ -1,12 +1,14 @@
 # prompts.py
 # -*- coding: utf-8 -*-
 """
-Prompts used by the BI + Visualization agents.
+Prompts used by the BI + Visualization agents and the follow-up handling.
 
 Exports:
 - system_prompt_agent_bi_expert_node
 - system_prompt_agent_python_code_data_visualization_generator_node
 - system_prompt_agent_python_code_data_visualization_validator_node
+- system_prompt_followup_classifier
+- system_prompt_sql_refiner
 """
 
 # ----------------------------------------------------------------------
@@ -137,8 +139,66 @@ Error:
 {error_msg_debug}
 """
 
+# ----------------------------------------------------------------------
+# Follow-up Classifier: decides which stages a follow-up question needs
+# ----------------------------------------------------------------------
+system_prompt_followup_classifier = """
+You classify a user's follow-up message in a conversation with a text-to-SQL + visualization agent.
+
+Previous question:
+{previous_question}
+
+Previous SQL:
+{previous_sql}
+
+Previous result columns:
+{previous_columns}
+
+Follow-up message:
+{question}
+
+Answer with EXACTLY one label (no prose, no quotes):
+- viz_only    → only the presentation changes; the existing result already has every needed column and row (e.g., "show it as a line chart", "sort descending", "use a pie chart", "label the axes").
+- sql_refine  → same analysis, but the data must change: add/remove a filter, grouping, breakdown, metric, limit or time range (e.g., "now break that down by state", "only for 2018", "top 5 instead").
+- new         → an unrelated question, or one that needs a different analysis rather than an edit of the previous SQL.
+"""
+
+# ----------------------------------------------------------------------
+# SQL Refiner: applies only the follow-up delta to the previous SQL
+# ----------------------------------------------------------------------
+system_prompt_sql_refiner = """
+You are a precise MySQL query editor. Edit the previous query so it answers the follow-up, changing ONLY what the follow-up asks for.
+
+STRICT OUTPUT:
+- Return ONLY a single MySQL SELECT statement. No prose, no markdown.
+
+RULES:
+- Keep the previous query's tables, joins, filters and metrics unless the follow-up changes them.
+- Use only tables/columns from "Relevant context" or already present in the previous SQL.
+- If city/state is referenced for customers, it comes from customer.customer_city / customer.customer_state via orders.customer_id = customer.customer_id.
+- Avoid reserved words as aliases. Balance parentheses.
+
+Previous question:
+{previous_question}
+
+Previous SQL:
+{previous_sql}
+
+Relevant context:
+Columns:
+{columns}
+
+Filters:
+{filters}
+
+Follow-up:
+{question}
+"""
+
 __all__ = [
     "system_prompt_agent_bi_expert_node",
     "system_prompt_agent_python_code_data_visualization_generator_node",
     "system_prompt_agent_python_code_data_visualization_validator_node",
+    "system_prompt_followup_classifier",
+    "system_prompt_sql_refiner",
 ]
@@ -0,0 +1,308 @@
+# rate_limiter.py
+"""
+Process-wide LLM rate limiter shared by every caller of config.get_llm().
+
+- Token buckets for tokens-per-minute (estimated prompt + completion) and requests-per-minute.
+- Strict priority classes: interactive > batch > knowledgebase (FIFO within a class).
+- Adaptive concurrency (AIMD): halve the in-flight limit on HTTP 429, grow it back by one
+  after a run of successes.
+- Retry-After / retry-after-ms is honored with a process-wide pause plus jittered backoff.
+- Queue depth, wait time and the current concurrency limit are exported via telemetry.METRICS.
+- Calls honor the request deadline (deadline.py): queue waits and backoff stop on cancel, the
+  HTTP timeout is capped at the remaining budget, and a cancelled request's answer is dropped.
+- Every successful call's token usage is priced and accounted (cost_accounting.py); calls are
+  refused once the request's LLM budget is used up.
+- Identical prompts already in flight are coalesced (singleflight.py, level "prompt"): followers
+  get a copy of the leader's answer with empty token usage, so they are not billed twice.
+- Every call path goes through the limiter: async calls (ainvoke/agenerate) run the sync
+  _generate in an executor thread, streaming holds a limiter slot for the whole stream (not
+  coalesced: each caller consumes its own chunks), and astream wraps the sync stream.
+"""
+import contextvars
+import copy
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+import openai
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_openai import AzureChatOpenAI
+
+from config import (
+    LLM_TPM,
+    LLM_RPM,
+    LLM_MAX_CONCURRENCY,
+    LLM_EST_COMPLETION_TOKENS,
+    LLM_MAX_RETRIES,
+)
+from cost_accounting import check_budget, record_llm_usage
+from deadline import check_deadline, current_deadline, sleep
+from singleflight import PROMPTS, digest
+from telemetry import METRICS
+from shared_state import shared_resource
+
+PRIORITIES = {"interactive": 0, "batch": 1, "knowledgebase": 2}
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("llm_priority", default="interactive")
+
+@contextmanager
+def priority_class(name: str):
+    """Run LLM calls in this block under the given priority class."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown priority class {name!r}; expected one of {sorted(PRIORITIES)}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class TokenBucket:
+    """Continuous-refill bucket; capacity == per-minute limit. limit <= 0 means unlimited."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = float(per_minute) / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)  # oversize requests wait for a full bucket
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float, now: float) -> None:
+        if self.capacity > 0:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        """Correct an earlier estimate once the real usage is known (delta > 0 charges more)."""
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level - delta)
+
+class LLMRateLimiter:
+    def __init__(self, tpm: float = 0, rpm: float = 0, max_concurrency: int = 8, min_concurrency: int = 1,
+                 increase_after: int = 10):
+        self._cond = threading.Condition()
+        self._tokens = TokenBucket(tpm)
+        self._requests = TokenBucket(rpm)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.min_concurrency = max(1, int(min_concurrency))
+        self.concurrency = self.max_concurrency
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._increase_after = increase_after
+        self._successes = 0
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._depth: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        METRICS.set_gauge("llm_limiter_concurrency", self.concurrency)
+
+    # ---- queueing ----
+    def _publish_depth(self) -> None:
+        for p, n in self._depth.items():
+            METRICS.set_gauge("llm_limiter_queue_depth", n, priority=p)
+        METRICS.set_gauge("llm_limiter_in_flight", self.in_flight)
+
+    def acquire(self, est_tokens: int, priority: Optional[str] = None, deadline=None) -> float:
+        """Block until this caller may issue a request. Returns the time spent waiting.
+        With a deadline, gives up the queue slot (DeadlineExceeded / Cancelled) instead of waiting past it."""
+        priority = priority or _priority.get()
+        ticket = (PRIORITIES.get(priority, 0), next(self._seq))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._heap, ticket)
+            self._depth[priority] = self._depth.get(priority, 0) + 1
+            self._publish_depth()
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if self._heap[0] == ticket and self.in_flight < self.concurrency:
+                        wait = max(
+                            self.paused_until - now,
+                            self._tokens.wait_time(est_tokens, now),
+                            self._requests.wait_time(1, now),
+                        )
+                        if wait <= 0:
+                            self._tokens.take(est_tokens, now)
+                            self._requests.take(1, now)
+                            self.in_flight += 1
+                            break
+                    timeout = wait if wait else 1.0
+                    if deadline is not None:
+                        deadline.check()
+                        timeout = min(timeout, max(0.01, deadline.remaining()))
+                    self._cond.wait(timeout=timeout)
+            finally:
+                self._heap.remove(ticket)
+                heapq.heapify(self._heap)
+                self._depth[priority] -= 1
+                self._publish_depth()
+                self._cond.notify_all()
+        waited = time.monotonic() - start
+        METRICS.observe("llm_limiter_wait_seconds", waited, priority=priority)
+        return waited
+
+    def release(self, *, est_tokens: int, actual_tokens: Optional[int] = None,
+                throttled: bool = False, retry_after: Optional[float] = None) -> None:
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            if actual_tokens is not None:
+                self._tokens.adjust(actual_tokens - est_tokens)
+            if throttled:
+                self._successes = 0
+                self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+                if retry_after:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                METRICS.inc("llm_throttled_total")
+            else:
+                self._successes += 1
+                if self._successes >= self._increase_after and self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+                    self._successes = 0
+            METRICS.set_gauge("llm_limiter_concurrency", self.concurrency)
+            self._publish_depth()
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "concurrency": self.concurrency,
+                "in_flight": self.in_flight,
+                "queue_depth": dict(self._depth),
+                "paused_for_s": max(0.0, round(self.paused_until - time.monotonic(), 3)),
+            }
+
+@shared_resource
+def get_limiter() -> LLMRateLimiter:
+    return LLMRateLimiter(tpm=LLM_TPM, rpm=LLM_RPM, max_concurrency=LLM_MAX_CONCURRENCY)
+
+# ---------------- helpers ----------------
+def estimate_tokens(messages) -> int:
+    """Rough prompt size (≈4 chars/token) plus the expected completion budget."""
+    chars = sum(len(str(getattr(m, "content", m))) for m in messages)
+    return chars // 4 + LLM_EST_COMPLETION_TOKENS
+
+def _retry_after_seconds(err: Exception) -> Optional[float]:
+    headers = getattr(getattr(err, "response", None), "headers", None) or {}
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000.0
+        except ValueError:
+            pass
+    ra = headers.get("retry-after")
+    if not ra:
+        return None
+    try:
+        return float(ra)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(ra).timestamp() - time.time())
+        except Exception:
+            return None
+
+def _backoff(attempt: int, retry_after: Optional[float], base: float = 1.0, cap: float = 60.0) -> float:
+    delay = retry_after if retry_after is not None else min(cap, base * (2 ** attempt))
+    return delay + random.uniform(0, 0.25 * delay + 0.1)
+
+_RETRYABLE = (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+def _coalesced_result(result):
+    """A follower's copy of the leader's ChatResult; no tokens were spent on it."""
+    result = copy.deepcopy(result)
+    result.llm_output = dict(result.llm_output or {}, token_usage={})
+    return result
+
+class RateLimitedAzureChatOpenAI(AzureChatOpenAI):
+    """AzureChatOpenAI whose requests go through the shared LLMRateLimiter."""
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        key = digest(self._identifying_params, [(m.type, m.content, m.additional_kwargs) for m in messages],
+                     stop, sorted((k, repr(v)) for k, v in kwargs.items() if k != "timeout"))
+        return PROMPTS.do(key, lambda: self._generate_once(messages, stop, run_manager, **kwargs),
+                          clone=_coalesced_result)
+
+    def _generate_once(self, messages, stop=None, run_manager=None, **kwargs):
+        limiter = get_limiter()
+        est = estimate_tokens(messages)
+        dl = current_deadline()
+        last_err: Optional[Exception] = None
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            check_deadline()
+            check_budget()
+            limiter.acquire(est, deadline=dl)
+            if dl is not None and dl.timeout_s:
+                # the HTTP call is aborted (APITimeoutError) once the stage/request budget runs out
+                kwargs["timeout"] = max(0.1, dl.remaining())
+            try:
+                result = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except openai.RateLimitError as e:
+                retry_after = _retry_after_seconds(e)
+                limiter.release(est_tokens=est, throttled=True, retry_after=retry_after)
+                last_err = e
+                if attempt < LLM_MAX_RETRIES:  # no wait after the final attempt
+                    sleep(_backoff(attempt, retry_after))
+                continue
+            except _RETRYABLE as e:
+                limiter.release(est_tokens=est)
+                last_err = e
+                check_deadline()  # a timeout caused by the deadline is not retried
+                if attempt < LLM_MAX_RETRIES:
+                    METRICS.inc("llm_retries_total", error=type(e).__name__)
+                    sleep(_backoff(attempt, None))
+                continue
+            except Exception:
+                limiter.release(est_tokens=est)
+                raise
+            usage = (result.llm_output or {}).get("token_usage") or {}
+            limiter.release(est_tokens=est, actual_tokens=usage.get("total_tokens"))
+            record_llm_usage(usage)
+            check_deadline()  # cancelled while the call was in flight: drop the answer
+            return result
+        raise last_err
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        limiter = get_limiter()
+        est = estimate_tokens(messages)
+        dl = current_deadline()
+        check_deadline()
+        check_budget()
+        limiter.acquire(est, deadline=dl)
+        if dl is not None and dl.timeout_s:
+            kwargs["timeout"] = max(0.1, dl.remaining())
+        usage: Dict[str, Any] = {}
+        try:
+            for chunk in super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                meta = getattr(chunk.message, "usage_metadata", None) or {}
+                for ours, theirs in (("prompt_tokens", "input_tokens"), ("completion_tokens", "output_tokens"),
+                                     ("total_tokens", "total_tokens")):
+                    usage[ours] = usage.get(ours, 0) + int(meta.get(theirs) or 0)
+                check_deadline()  # cancelled mid-stream: stop reading
+                yield chunk
+        except openai.RateLimitError as e:
+            limiter.release(est_tokens=est, throttled=True, retry_after=_retry_after_seconds(e))
+            raise
+        except BaseException:
+            limiter.release(est_tokens=est)
+            raise
+        limiter.release(est_tokens=est, actual_tokens=usage.get("total_tokens") or None)
+        record_llm_usage(usage)
+
+    # The native async paths of AzureChatOpenAI would bypass the limiter, coalescing and cost
+    # accounting: run the sync paths above in an executor instead (context vars are copied).
+    _agenerate = BaseChatModel._agenerate
+    _astream = BaseChatModel._astream
@@ -0,0 +1,239 @@
+# result_export.py
+"""
+Full-result export, independent of the 2000-row preview.
+
+- Re-runs the validated SQL without the preview LIMIT on a streaming (server-side) cursor and
+  writes CSV, Parquet or JSONL chunk by chunk, so memory stays at one chunk regardless of size.
+- export_to_file(...) writes to a temp file that the caller owns (ExportResult.remove() deletes
+  it once served); iter_export(...) yields encoded bytes for an HTTP response. Both report
+  progress via progress(rows, bytes) after every chunk.
+- Row/byte caps come from EXPORT_MAX_ROWS / EXPORT_MAX_BYTES, overridable per user through
+  EXPORT_USER_LIMITS (JSON: {"alice": {"max_rows": 5000000, "max_bytes": 2000000000}}), keyed on
+  the authenticated identity (AUTH_USER_HEADER / Streamlit login), never on a typed-in name.
+  Each chunk is sized before it is written (exactly for CSV/JSONL, by its Arrow size for
+  Parquet) and trimmed to what fits, so a cap stops the export cleanly and marks it truncated.
+"""
+import json
+import os
+import re
+import tempfile
+import time
+from typing import Callable, Iterator, List, NamedTuple, Optional
+
+import pyarrow as pa
+from sqlalchemy import text
+
+from config import (
+    get_engine, EXPORT_CHUNK_ROWS, EXPORT_MAX_BYTES, EXPORT_MAX_ROWS, EXPORT_USER_LIMITS,
+    SUMMARY_TABLES_ENABLED,
+)
+from arrow_results import rows_to_arrow
+from telemetry import METRICS, span
+
+EXPORT_FORMATS = ("csv", "parquet", "jsonl")
+_MIME = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet", "jsonl": "application/x-ndjson"}
+
+class ExportLimits(NamedTuple):
+    max_rows: int
+    max_bytes: int
+
+class ExportResult(NamedTuple):
+    path: str
+    fmt: str
+    rows: int
+    bytes: int
+    truncated: bool
+    seconds: float
+
+    @property
+    def mime(self) -> str:
+        return _MIME[self.fmt]
+
+    def remove(self) -> None:
+        """Delete the exported file (the caller's job once it has been served)."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def limits_for(user: Optional[str] = None) -> ExportLimits:
+    """Default caps, with per-user overrides from EXPORT_USER_LIMITS (`user`: authenticated identity)."""
+    over = {}
+    if user and EXPORT_USER_LIMITS:
+        try:
+            over = json.loads(EXPORT_USER_LIMITS).get(user, {}) or {}
+        except json.JSONDecodeError:
+            pass
+    return ExportLimits(int(over.get("max_rows", EXPORT_MAX_ROWS)), int(over.get("max_bytes", EXPORT_MAX_BYTES)))
+
+class _CountingSink:
+    """Binary sink that counts bytes and can be drained (for streaming responses)."""
+
+    def __init__(self, fh=None):
+        self._fh = fh
+        self._pending: List[bytes] = []
+        self.written = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        if self._fh is not None:
+            self._fh.write(data)
+        else:
+            self._pending.append(data)
+        self.written += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.written
+
+    def flush(self) -> None:
+        if self._fh is not None:
+            self._fh.flush()
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        out, self._pending = b"".join(self._pending), []
+        return out
+
+def _conform(table: pa.Table, schema: Optional[pa.Schema]) -> pa.Table:
+    """Cast a chunk to the export schema (fixed by the first chunk; all-NULL columns become strings)."""
+    if schema is None:
+        return table
+    cols = []
+    for field, col in zip(schema, table.columns):
+        if not col.type.equals(field.type):
+            try:
+                col = col.cast(field.type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                col = pa.array([None if v is None else str(v) for v in col.to_pylist()], type=field.type)
+        cols.append(col)
+    return pa.Table.from_arrays(cols, schema=schema)
+
+class _Writer:
+    def __init__(self, fmt: str, sink: _CountingSink):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format {fmt!r}; use one of {EXPORT_FORMATS}.")
+        self.fmt, self.sink = fmt, sink
+        self.schema: Optional[pa.Schema] = None
+        self._w = None
+        self._header = True  # CSV: the first chunk carries the header
+
+    def prepare(self, table: pa.Table) -> pa.Table:
+        if self.schema is None:
+            self.schema = pa.schema([pa.field(f.name, pa.string() if pa.types.is_null(f.type) else f.type)
+                                     for f in table.schema])
+        return _conform(table, self.schema)
+
+    def encode(self, table: pa.Table) -> Optional[bytes]:
+        """The prepared chunk's bytes for CSV/JSONL; None for Parquet (written through its writer)."""
+        if self.fmt == "jsonl":
+            return b"".join((json.dumps(rec, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+                            for rec in table.to_pylist())
+        if self.fmt == "csv":
+            import io
+            import pyarrow.csv as pacsv
+            buf = io.BytesIO()
+            pacsv.write_csv(table, buf, pacsv.WriteOptions(include_header=self._header))
+            return buf.getvalue()
+        return None
+
+    def write(self, table: pa.Table, data: Optional[bytes] = None) -> None:
+        """Write a prepared chunk (`data`: its encode() bytes, when already computed)."""
+        if self.fmt != "parquet":
+            self.sink.write(self.encode(table) if data is None else data)
+            self._header = False
+            return
+        if self._w is None:
+            import pyarrow.parquet as pq
+            self._w = pq.ParquetWriter(self.sink, self.schema)
+        self._w.write_table(table)
+
+    def close(self) -> None:
+        if self._w is not None:
+            self._w.close()
+
+def _prepare_sql(sql: str) -> str:
+    s = (sql or "").strip().rstrip(";")
+    if not re.match(r"(?is)^\s*(select|with)\b", s):
+        raise ValueError("Only SELECT statements can be exported.")
+    if SUMMARY_TABLES_ENABLED:
+        from summary_tables import rewrite_with_rollups
+        s = rewrite_with_rollups(s)
+    return s
+
+def _run(sql: str, fmt: str, sink: _CountingSink, limits: ExportLimits, chunk_rows: int,
+         progress: Optional[Callable[[int, int], None]], stats: dict) -> Iterator[None]:
+    """Stream `sql` into `sink`, yielding after every chunk; fills stats["rows"/"truncated"]."""
+    writer = _Writer(fmt, sink)
+    rows, truncated = 0, False
+    with get_engine().connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_rows).execute(text(sql))
+        names = list(result.keys())
+        while not truncated:
+            batch = result.fetchmany(chunk_rows)
+            if not batch:
+                break
+            if rows + len(batch) > limits.max_rows:
+                batch, truncated = batch[:limits.max_rows - rows], True
+            table = writer.prepare(rows_to_arrow(names, batch))
+            data = writer.encode(table)
+            size = table.nbytes if data is None else len(data)
+            budget = max(0, limits.max_bytes - sink.written)
+            while size > budget and table.num_rows:  # trim to the rows that fit before writing
+                table, truncated = table.slice(0, table.num_rows * budget // size), True
+                data = writer.encode(table)
+                size = table.nbytes if data is None else len(data)
+            if table.num_rows or not rows:
+                writer.write(table, data)
+            rows += table.num_rows
+            truncated = truncated or sink.written >= limits.max_bytes
+            if progress:
+                progress(rows, sink.written)
+            yield
+        result.close()
+    if writer.schema is None:  # empty result: still a valid file (CSV header / Parquet schema)
+        writer.write(pa.Table.from_arrays([pa.array([], type=pa.null()) for _ in names], names=names))
+    writer.close()
+    stats.update(rows=rows, truncated=truncated)
+    METRICS.inc("export_rows_total", rows, fmt=fmt)
+    METRICS.inc("export_bytes_total", sink.written, fmt=fmt)
+    if truncated:
+        METRICS.inc("export_truncated_total", fmt=fmt)
+    yield
+
+def export_to_file(sql: str, fmt: str = "csv", *, user: Optional[str] = None, path: Optional[str] = None,
+                   chunk_rows: int = EXPORT_CHUNK_ROWS,
+                   progress: Optional[Callable[[int, int], None]] = None) -> ExportResult:
+    """Export the full result of `sql` to `path` (default: a new temp file). The caller owns the
+    file and deletes it (ExportResult.remove()) once served; a failed export leaves nothing behind."""
+    sql = _prepare_sql(sql)
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix="export_", suffix=f".{fmt}")
+        os.close(fd)
+    stats: dict = {}
+    t0 = time.perf_counter()
+    try:
+        with span("export", fmt=fmt), open(path, "wb") as fh:
+            sink = _CountingSink(fh)
+            for _ in _run(sql, fmt, sink, limits_for(user), chunk_rows, progress, stats):
+                pass
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return ExportResult(path, fmt, stats["rows"], sink.written, stats["truncated"],
+                        round(time.perf_counter() - t0, 3))
+
+def iter_export(sql: str, fmt: str = "csv", *, user: Optional[str] = None,
+                chunk_rows: int = EXPORT_CHUNK_ROWS,
+                progress: Optional[Callable[[int, int], None]] = None) -> Iterator[bytes]:
+    """Yield the encoded export chunk by chunk (for streaming HTTP responses)."""
+    sql = _prepare_sql(sql)
+    sink = _CountingSink()
+    for _ in _run(sql, fmt, sink, limits_for(user), chunk_rows, progress, {}):
+        data = sink.drain()
+        if data:
+            yield data
@@ -0,0 +1,97 @@
+# result_memory.py
+"""
+Slim visualization result contract and memory accounting for results.
+
+- slim_viz_result(exec_globals) keeps only what the UI needs from the executed chart code:
+    {"fig_json": Plotly JSON or None, "df_viz": DataFrame or None, "string_viz_result": str or None}
+  The exec globals (the df, modules, every intermediate frame the code built) are cleared, so they
+  are released right away instead of travelling in FinalState / the Streamlit session.
+- figure(viz) rebuilds the Plotly figure from fig_json for rendering (cached per JSON string).
+- state_memory(state) reports the bytes a result holds (df, df_viz, fig_json, other fields).
+  nlq_to_viz_workflow puts it in FinalState["memory"] and trims results above
+  REQUEST_MEMORY_CAP_MB (trim_state: rows are dropped from df, then df_viz).
+- The service (service.py) adds up retained job results per session and evicts the oldest beyond
+  SESSION_MEMORY_CAP_MB; GET /jobs reports it under "memory".
+"""
+import json
+import sys
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+from config import REQUEST_MEMORY_CAP_MB
+from telemetry import METRICS
+
+VIZ_KEYS = ("fig_json", "df_viz", "string_viz_result")
+
+def slim_viz_result(exec_globals: Dict[str, Any]) -> Dict[str, Any]:
+    fig = exec_globals.get("fig")
+    df_viz = exec_globals.get("df_viz")
+    text = exec_globals.get("string_viz_result")
+    out = {
+        "fig_json": fig.to_json() if hasattr(fig, "to_json") else None,
+        "df_viz": df_viz if isinstance(df_viz, pd.DataFrame) else None,
+        "string_viz_result": str(text) if text is not None else None,
+    }
+    exec_globals.clear()  # drops the references to every temporary the chart code created
+    return out
+
+@lru_cache(maxsize=8)
+def _figure_from_json(fig_json: str):
+    import plotly.io as pio
+    return pio.from_json(fig_json)
+
+def figure(viz: Optional[Dict[str, Any]]):
+    """The Plotly figure of a slim viz result, or None (a copy: the parsed figure is cached process-wide)."""
+    import plotly.graph_objects as go
+    fig_json = (viz or {}).get("fig_json")
+    return go.Figure(_figure_from_json(fig_json)) if fig_json else None
+
+# ---------------- Accounting ----------------
+def frame_nbytes(df: Any) -> int:
+    if not isinstance(df, pd.DataFrame):
+        return 0
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def state_memory(state: Dict[str, Any]) -> Dict[str, int]:
+    """Approximate bytes held by a (Final)State: {"df", "df_viz", "fig_json", "other", "total"}."""
+    viz = state.get("python_code_store_variables_dict") or {}
+    out = {
+        "df": frame_nbytes(state.get("df")),
+        "df_viz": frame_nbytes(viz.get("df_viz")),
+        "fig_json": len(viz.get("fig_json") or ""),
+    }
+    other = {k: v for k, v in state.items() if k not in ("df", "python_code_store_variables_dict", "memory")}
+    out["other"] = len(json.dumps(other, default=str)) + sys.getsizeof(viz.get("string_viz_result") or "")
+    out["total"] = sum(out.values())
+    return out
+
+def _head_within(df: pd.DataFrame, budget: int) -> pd.DataFrame:
+    size = frame_nbytes(df)
+    if size <= budget or df.empty:
+        return df
+    return df.head(max(0, int(len(df) * budget / size))).copy()
+
+def trim_state(state: Dict[str, Any], cap_bytes: int) -> bool:
+    """Drop rows from df (then df_viz) until the state fits cap_bytes; True if anything was cut."""
+    mem = state_memory(state)
+    if cap_bytes <= 0 or mem["total"] <= cap_bytes:
+        return False
+    fixed = mem["fig_json"] + mem["other"]
+    viz = state.get("python_code_store_variables_dict") or {}
+    budget_viz = min(mem["df_viz"], max(0, (cap_bytes - fixed) // 2))
+    if isinstance(viz.get("df_viz"), pd.DataFrame) and mem["df_viz"] > budget_viz:
+        viz["df_viz"] = _head_within(viz["df_viz"], budget_viz)
+    if isinstance(state.get("df"), pd.DataFrame):
+        state["df"] = _head_within(state["df"], max(0, cap_bytes - fixed - frame_nbytes(viz.get("df_viz"))))
+    METRICS.inc("result_trimmed_total")
+    return True
+
+def account_request(state: Dict[str, Any], cap_mb: float = REQUEST_MEMORY_CAP_MB) -> Dict[str, Any]:
+    """state_memory after enforcing the per-request cap; also observed as request_result_mb."""
+    trimmed = trim_state(state, int(cap_mb * 2**20))
+    mem: Dict[str, Any] = state_memory(state)
+    mem["trimmed"] = trimmed
+    METRICS.observe("request_result_mb", mem["total"] / 2**20)
+    return mem
@@ -1,11 +1,13 @@
 # router_agent.py
+
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnableMap
 
 from config import get_llm
-
-llm = get_llm()
+from schema_catalog import routing_groups
+from structured_output import extraction_chain
+from telemetry import span
+from shared_state import shared_resource
 
 template = ChatPromptTemplate.from_messages([
     ("system", """
@@ -15,33 +17,52 @@ Dont give any explanation or any other verbose in the output.
 """),
     ("human", '''
 Below are descriptions of different agents.
-customer agent : It contains all the details about customer and seller locations and their unique identifiers
-orders agent : It contains details about all the orders like product identifier, order identifier, products in an order, no. of items of a product in order, price of order, frieght value, order time, delivery status and its time, payment etc.
-product agent : It contains details about product like product identifier, product category, description, dimensions of product
+{agents}
 
 STEP BY STEP TABLE SELECTION PROCESS:
 - Split the question into different subquestions.
 - For each subquestion, very carefully go through each and every AGENT description, think which agent might have answer to this subquestion.
 - At the end collect all the agents that you thought can answer the whole question in form of list of strings
-- For a give question, if customer and orders agents can answer question, give output like below without any verbose.
-['customer', 'orders']
-- If only customer can answer a question , give output like below with one table in list
-['customer']
-- For a give question, if customer and orders and product agent can answer question, give output like below without any verbose.
-['customer', 'orders', 'product']
+- For a give question, if two agents can answer question, give output like below without any verbose.
+{example_two}
+- If only one agent can answer a question , give output like below with one agent in list
+{example_one}
      
 User question:
 {question}
 ''')
 ])
 
-chain = (
-    RunnableMap({"question": lambda x: x["question"]})
-    | template
-    | llm
-    | StrOutputParser()
-)
+def agents_text() -> str:
+    """One line per routing group (schema_catalog): the only schema the router sees."""
+    return "\n".join(f"{g.name} agent : {g.description}" for g in routing_groups())
+
+def _example(n: int) -> str:
+    return str([g.name for g in routing_groups()][:n])
+
+@shared_resource
+def get_router_chain():
+    """Router chain, built on first use (so importing this module doesn't create the LLM client)."""
+    return extraction_chain(
+        RunnableMap({
+            "question": lambda x: x["question"],
+            "agents": lambda x: agents_text(),
+            "example_one": lambda x: _example(1),
+            "example_two": lambda x: _example(2),
+        })
+        | template,
+        "router",
+    )
+
+def __getattr__(name: str):
+    # keeps `router_agent.chain` / `router_agent.llm` working, resolved lazily
+    if name == "chain":
+        return get_router_chain()
+    if name == "llm":
+        return get_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def agent_2(q: str) -> str:
-    response = chain.invoke({"question": q}).replace("\n", "")
+    with span("chain.router"):
+        response = get_router_chain().invoke({"question": q}).replace("\n", "")
     return response
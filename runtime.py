@@ -0,0 +1,290 @@
+# runtime.py
+"""
+Process runtime context: lazy resources, optional background warm-up, readiness, startup report.
+
+- Importing the app no longer touches the LLM, the DB or the knowledgebase: every heavy object is
+  a shared_resource getter (config.get_llm/get_engine, customer_agent.get_knowledgebase /
+  get_customer_graph, customer_helper.get_chain, sql_viz_workflow.get_sql_viz_graph) built on
+  first use. get_runtime() tracks which of them are initialized and how long each took.
+- get_runtime().warm_up() preloads them in a background thread (knowledgebase, connection pool,
+  chains, graphs, column statistics, DISTINCT values for the fuzzy matcher) so the first question doesn't pay for it;
+  failures are recorded, never raised.
+- readiness() probes DB / knowledgebase / LLM config and reports ready + per-check details.
+- startup_report() breaks import cost down by module (python -X importtime in a subprocess)
+  and adds the init timings.
+
+Threading model: one process serves parallel requests (Streamlit sessions, service workers in
+thread mode); get_runtime().run / run_followup are the entry points and may be called from any
+number of threads at once.
+- Shared, built once and read-only: LLM client, engine (and its pool), knowledgebase, schema
+  catalog, column statistics, compiled chains/graphs. The getters build under a lock
+  (shared_state.shared_resource), so concurrent first use still creates one of each; loaded data
+  is frozen (shared_state.freeze), so an in-place edit raises instead of leaking into other requests.
+- Shared, mutable, internally locked: METRICS, the LLM rate limiter, single-flight groups,
+  DISTINCT-value cache, per-user daily spend, the deadline registry, the query log.
+- Per request, never shared: graph state (a fresh dict per run), deadline, cost ledger, progress
+  callback and trace (contextvars, copied into the background full query), the DataFrame chart code
+  runs on (a copy), the result. Single-flight followers get their own copy of a shared result.
+- Not safe: mutating objects returned by the getters, and module globals set by callers.
+load_test.py --isolation stress-tests this: concurrent cold start, then many threads asking
+different questions, each result checked against its own question.
+
+CLI:
+  python runtime.py report [module]   # import-cost breakdown (default: nlq_to_viz_workflow)
+  python runtime.py warm              # warm everything in the foreground, print timings
+  python runtime.py ready             # readiness JSON; exit 1 when not ready
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+from config import WARMUP_DISTINCT_COLUMNS, WARMUP_POOL_CONNECTIONS
+from telemetry import METRICS
+from shared_state import shared_resource
+
+def _warm_pool(n: int = WARMUP_POOL_CONNECTIONS) -> int:
+    """Check out `n` pooled connections at once (SELECT 1) so they stay open for reuse."""
+    from sqlalchemy import text
+    from config import get_engine
+
+    engine = get_engine()
+    conns = []
+    try:
+        for _ in range(max(1, n)):
+            conn = engine.connect()
+            conn.execute(text("SELECT 1"))
+            conns.append(conn)
+    finally:
+        for conn in conns:
+            conn.close()  # back to the pool, still open
+    return len(conns)
+
+def _build_chains() -> int:
+    from customer_helper import CHAIN_NAMES, get_chain
+    from router_agent import get_router_chain
+    from sql_viz_workflow import get_sql_fixer_chain
+
+    for name in CHAIN_NAMES:
+        get_chain(name)
+    get_router_chain()
+    get_sql_fixer_chain()
+    return len(CHAIN_NAMES) + 2
+
+def _knowledgebase() -> int:
+    from customer_agent import get_knowledgebase
+    return len(get_knowledgebase())
+
+def _routing_groups() -> int:
+    from schema_catalog import routing_groups
+    return len(routing_groups())
+
+def _column_stats() -> int:
+    from column_stats import get_catalog
+    return len(get_catalog())
+
+def _llm():
+    from config import get_llm
+    return type(get_llm()).__name__
+
+def _customer_graph():
+    from customer_agent import get_customer_graph
+    return type(get_customer_graph()).__name__
+
+def _sql_viz_graph():
+    from sql_viz_workflow import get_sql_viz_graph
+    return type(get_sql_viz_graph()).__name__
+
+def _distinct_values() -> int:
+    from fuzzy_wuzzy import preload_values
+    return preload_values(WARMUP_DISTINCT_COLUMNS)
+
+# Warm-up order: cheap/local first, then DB-bound work.
+RESOURCES: Dict[str, Callable[[], Any]] = {
+    "knowledgebase": _knowledgebase,
+    "column_stats": _column_stats,
+    "routing_groups": _routing_groups,
+    "llm": _llm,
+    "chains": _build_chains,
+    "customer_graph": _customer_graph,
+    "sql_viz_graph": _sql_viz_graph,
+    "db_pool": _warm_pool,
+    "distinct_values": _distinct_values,
+}
+
+class Runtime:
+    """Tracks initialization of the process-wide resources in RESOURCES."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.status: Dict[str, Dict[str, Any]] = {n: {"state": "lazy"} for n in RESOURCES}
+        self._warm_started = False
+        self._warm_thread: Optional[threading.Thread] = None
+        self.requests_in_flight = 0
+
+    def ensure(self, name: str) -> Dict[str, Any]:
+        """Initialize one resource (idempotent: the getters are cached) and record how long it took."""
+        t0 = time.perf_counter()
+        try:
+            detail = RESOURCES[name]()
+            entry = {"state": "ready", "detail": detail}
+        except Exception as e:
+            entry = {"state": "error", "error": f"{type(e).__name__}: {e}"[:300]}
+            METRICS.inc("runtime_init_errors_total", resource=name)
+        entry["seconds"] = round(time.perf_counter() - t0, 4)
+        METRICS.set_gauge("runtime_init_seconds", entry["seconds"], resource=name)
+        with self._lock:
+            self.status[name] = entry
+        return entry
+
+    def warm_up(self, names: Optional[List[str]] = None, background: bool = True) -> Optional[threading.Thread]:
+        """Preload resources once per process; later calls are no-ops (returning the same thread)."""
+        names = list(names or RESOURCES)
+        with self._lock:
+            if self._warm_started:
+                return self._warm_thread
+            self._warm_started = True
+            for n in names:
+                self.status[n] = {"state": "warming"}
+
+        def _run():
+            for n in names:
+                self.ensure(n)
+
+        if not background:
+            _run()
+            return None
+        self._warm_thread = threading.Thread(target=_run, name="runtime-warmup", daemon=True)
+        self._warm_thread.start()
+        return self._warm_thread
+
+    def run(self, question: str, **kw):
+        """nlq_to_viz_workflow.run; thread-safe (see the threading model above)."""
+        from nlq_to_viz_workflow import run
+        with self._in_flight():
+            return run(question, **kw)
+
+    def run_followup(self, question: str, previous, **kw):
+        """nlq_to_viz_workflow.run_followup; `previous` is only read."""
+        from nlq_to_viz_workflow import run_followup
+        with self._in_flight():
+            return run_followup(question, previous, **kw)
+
+    @contextmanager
+    def _in_flight(self):
+        with self._lock:
+            self.requests_in_flight += 1
+            METRICS.set_gauge("runtime_requests_in_flight", self.requests_in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.requests_in_flight -= 1
+                METRICS.set_gauge("runtime_requests_in_flight", self.requests_in_flight)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {k: dict(v) for k, v in self.status.items()}
+
+@shared_resource
+def get_runtime() -> Runtime:
+    return Runtime()
+
+# ---------------- Readiness ----------------
+def _check(fn: Callable[[], Any]) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    try:
+        detail = fn()
+        out = {"ok": True, "detail": detail}
+    except Exception as e:
+        out = {"ok": False, "error": f"{type(e).__name__}: {e}"[:300]}
+    out["seconds"] = round(time.perf_counter() - t0, 4)
+    return out
+
+def _db_ping() -> str:
+    from sqlalchemy import text
+    from config import get_engine
+
+    with get_engine().connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return "SELECT 1 ok"
+
+def _llm_configured() -> str:
+    from config import AZURE_API_KEY, AZURE_DEPLOYMENT
+    if not AZURE_API_KEY:
+        raise RuntimeError("AZURE_OPENAI_API_KEY is not set")
+    _llm()
+    return AZURE_DEPLOYMENT
+
+def readiness() -> Dict[str, Any]:
+    """{"ready": bool, "checks": {...}, "warmup": {...}}; probes run now, nothing is cached."""
+    checks = {
+        "database": _check(_db_ping),
+        "knowledgebase": _check(_knowledgebase),
+        "llm_config": _check(_llm_configured),
+    }
+    ready = all(c["ok"] for c in checks.values())
+    METRICS.set_gauge("runtime_ready", 1 if ready else 0)
+    return {"ready": ready, "checks": checks, "warmup": get_runtime().snapshot()}
+
+# ---------------- Startup report ----------------
+def import_cost(module: str = "nlq_to_viz_workflow") -> Dict[str, Any]:
+    """Import `module` in a fresh interpreter with -X importtime; per-module self/cumulative seconds."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=here, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cum_us, name = (p.strip() for p in line[len("import time:"):].split("|"))
+            rows.append((name.strip(), int(self_us) / 1e6, int(cum_us) / 1e6))
+        except ValueError:
+            continue
+    by_package: Dict[str, float] = {}
+    for name, self_s, _ in rows:
+        pkg = name.split(".")[0]
+        by_package[pkg] = by_package.get(pkg, 0.0) + self_s
+    project = {os.path.splitext(f)[0] for f in os.listdir(here) if f.endswith(".py")}
+    return {
+        "module": module,
+        "ok": proc.returncode == 0,
+        "error": proc.stderr.strip().splitlines()[-1] if proc.returncode else "",
+        "total_s": round(max((c for _, _, c in rows), default=0.0), 3),
+        "project_modules": sorted(((n, round(c, 4)) for n, _, c in rows if n in project),
+                                  key=lambda x: -x[1]),
+        "by_package": sorted(((p, round(s, 4)) for p, s in by_package.items()), key=lambda x: -x[1]),
+    }
+
+def startup_report(module: str = "nlq_to_viz_workflow", top: int = 15) -> Dict[str, Any]:
+    rep = import_cost(module)
+    rep["by_package"] = rep["by_package"][:top]
+    rep["init"] = get_runtime().snapshot()
+    return rep
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "report"
+    if cmd == "report":
+        rep = startup_report(sys.argv[2] if len(sys.argv) > 2 else "nlq_to_viz_workflow")
+        print(f"import {rep['module']}: {rep['total_s']}s" + ("" if rep["ok"] else f"  (failed: {rep['error']})"))
+        print("\nproject modules (cumulative):")
+        for n, s in rep["project_modules"]:
+            print(f"  {n:<28} {s:8.3f}s")
+        print("\nby package (self):")
+        for n, s in rep["by_package"]:
+            print(f"  {n:<28} {s:8.3f}s")
+    elif cmd == "warm":
+        rt = get_runtime()
+        rt.warm_up(background=False)
+        print(json.dumps(rt.snapshot(), indent=2, default=str))
+    elif cmd == "ready":
+        r = readiness()
+        print(json.dumps(r, indent=2, default=str))
+        sys.exit(0 if r["ready"] else 1)
+    else:
+        sys.exit(f"unknown command {cmd!r}; use 'report', 'warm' or 'ready'")
@@ -0,0 +1,197 @@
+# sample_tables.py
+"""
+Small sample copies of the base tables for progressive (preview-first) execution.
+
+- SAMPLES defines one <table>__sample per base table. The samples are key-consistent, so
+  joins behave as on the full data:
+    orders                                       SAMPLE_FRACTION of the rows in every purchase
+                                                 month (at least one per month), picked by a
+                                                 deterministic hash of order_id
+    order_items / order_payments / order_reviews rows of the sampled orders
+    customer                                     customers of the sampled orders
+    products / sellers / category_translation    copied whole (small dimension tables)
+- build_sample_tables(engine) rebuilds them and swaps them in with one atomic RENAME. The
+  tables_creation loader calls it after every load, so samples never drift from the raw
+  tables. The fraction is kept in the table comment.
+- rewrite_to_samples(sql) points every base-table reference at its sample (keeping aliases).
+  It returns None when the query can't be previewed faithfully: a table without a sample,
+  comma joins, or schema-qualified names.
+- sql_viz_workflow runs that rewrite first, which validates syntax and result shape and gives
+  an early chart of the sample. Its values are the sample's own (sums and counts are not
+  scaled up), so it is labelled as such, never as an estimate. The full query runs in the
+  background and replaces the preview.
+
+CLI:
+  python sample_tables.py build [fraction]
+  python sample_tables.py show
+"""
+import re
+import sys
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional
+
+from sqlalchemy import text
+
+from config import SAMPLE_FRACTION
+from telemetry import METRICS
+from shared_state import shared_resource
+
+SUFFIX = "__sample"
+
+@dataclass(frozen=True)
+class SampleSpec:
+    table: str
+    method: str          # "stratified" | "semi_join" | "copy"
+    key: str             # join key (semi-join column, index column)
+    strata: str = ""     # stratified: partition expression
+    parent: str = ""     # semi_join: sampled table providing the keys
+
+_MONTH = "DATE_FORMAT(order_purchase_timestamp, '%Y-%m')"
+
+# Build order matters: parents before the tables that semi-join on them.
+SAMPLES: Dict[str, SampleSpec] = {s.table: s for s in [
+    SampleSpec("orders", "stratified", key="order_id", strata=_MONTH),
+    SampleSpec("order_items", "semi_join", key="order_id", parent="orders"),
+    SampleSpec("order_payments", "semi_join", key="order_id", parent="orders"),
+    SampleSpec("order_reviews", "semi_join", key="order_id", parent="orders"),
+    SampleSpec("customer", "semi_join", key="customer_id", parent="orders"),
+    SampleSpec("products", "copy", key="product_id"),
+    SampleSpec("sellers", "copy", key="seller_id"),
+    SampleSpec("category_translation", "copy", key="product_category_name"),
+]}
+
+# ---------------- Build / refresh ----------------
+def _build_sql(spec: SampleSpec, columns: List[str], fraction: float, seed: int) -> str:
+    if spec.method == "stratified":
+        cols = ", ".join(f"`{c}`" for c in columns)
+        return f"""
+            SELECT {cols} FROM (
+                SELECT t.*,
+                       ROW_NUMBER() OVER (PARTITION BY {spec.strata}
+                                          ORDER BY CRC32(CONCAT(t.{spec.key}, ':{seed}'))) AS _rn,
+                       COUNT(*) OVER (PARTITION BY {spec.strata}) AS _n
+                FROM {spec.table} t
+            ) s
+            WHERE _rn <= GREATEST(1, CEIL(_n * {float(fraction)}))
+        """
+    if spec.method == "semi_join":
+        return (f"SELECT t.* FROM {spec.table} t WHERE t.{spec.key} IN "
+                f"(SELECT {spec.key} FROM {spec.parent}{SUFFIX}__new)")
+    return f"SELECT * FROM {spec.table}"
+
+def build_sample_tables(engine, fraction: float = SAMPLE_FRACTION, seed: int = 0,
+                        names: Optional[List[str]] = None) -> Dict[str, int]:
+    """(Re)build the samples as <t>__sample__new, then swap all of them in one RENAME. Returns row counts."""
+    names = [n for n in SAMPLES if n in (names or list(SAMPLES))]
+    for n in names:  # a semi-join needs its parent's fresh sample
+        parent = SAMPLES[n].parent
+        if parent and parent not in names:
+            names.insert(0, parent)
+    counts: Dict[str, int] = {}
+    with engine.begin() as conn:
+        existing = {r[0] for r in conn.execute(text(
+            "SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = DATABASE()")).fetchall()}
+        for n in names:
+            spec = SAMPLES[n]
+            if n not in existing:
+                continue
+            new = f"{n}{SUFFIX}__new"
+            columns = list(conn.execute(text(f"SELECT * FROM {n} LIMIT 0")).keys())
+            conn.execute(text(f"DROP TABLE IF EXISTS {new}"))
+            conn.execute(text(f"CREATE TABLE {new} AS {_build_sql(spec, columns, fraction, seed).strip()}"))
+            conn.execute(text(f"ALTER TABLE {new} ADD INDEX ix_{n}_sample_key ({spec.key}), "
+                              f"COMMENT = 'sample fraction={fraction} method={spec.method}'"))
+            counts[n] = int(conn.execute(text(f"SELECT COUNT(*) FROM {new}")).scalar() or 0)
+        renames, drops = [], []
+        for n in counts:
+            live = f"{n}{SUFFIX}"
+            if live in existing:
+                renames.append(f"{live} TO {live}__old")
+                drops.append(f"{live}__old")
+            renames.append(f"{live}__new TO {live}")
+        if renames:
+            conn.execute(text("RENAME TABLE " + ", ".join(renames)))  # all samples switch together
+        for d in drops:
+            conn.execute(text(f"DROP TABLE {d}"))
+    for n, c in counts.items():
+        print(f"✅ Built sample table: {n}{SUFFIX} ({c} rows)")
+    available_samples.cache_clear()
+    return counts
+
+@shared_resource
+def available_samples() -> Dict[str, float]:
+    """{base table: fraction} for samples present in the connected database (cached; cleared on rebuild)."""
+    from config import get_engine
+    try:
+        with get_engine().connect() as conn:
+            rows = conn.execute(text(
+                "SELECT TABLE_NAME, TABLE_COMMENT FROM INFORMATION_SCHEMA.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE '%\\_\\_sample'")).fetchall()
+    except Exception:
+        return {}
+    out: Dict[str, float] = {}
+    for name, comment in rows:
+        base = name[:-len(SUFFIX)]
+        if base in SAMPLES:
+            m = re.search(r"fraction=([\d.eE-]+)", comment or "")
+            out[base] = float(m.group(1)) if m else SAMPLE_FRACTION
+    return out
+
+def sample_fraction(available: Optional[Dict[str, float]] = None) -> float:
+    """Fraction of the stratified (fact) sample: roughly how much of SUM/COUNT a preview shows."""
+    available = available_samples() if available is None else available
+    return min((f for t, f in available.items() if SAMPLES[t].method == "stratified"), default=SAMPLE_FRACTION)
+
+# ---------------- Rewriting ----------------
+_LITERAL = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NOT_ALIAS = {"on", "where", "join", "inner", "left", "right", "cross", "full", "natural", "straight_join",
+              "group", "order", "limit", "having", "using", "union", "window", "for", "lock"}
+_TABLE_REF = re.compile(r"(?i)\b(from|join)(\s+)`?(\w+)`?(?![\w.])")
+
+def rewrite_to_samples(sql: str, available: Optional[FrozenSet[str]] = None) -> Optional[str]:
+    """SQL reading from the samples, or None when a faithful preview isn't possible."""
+    available = frozenset(available_samples()) if available is None else available
+    if not available:
+        return None
+    literals: List[str] = []
+
+    def _mask(m):
+        literals.append(m.group(0))
+        return f"'__lit{len(literals) - 1}__'"
+
+    masked = _LITERAL.sub(_mask, sql)
+    if re.search(r"(?i)\b(?:from|join)\s+`?\w+`?\s*\.", masked):
+        return None  # schema-qualified
+    if re.search(r"(?i)\bfrom\s+`?\w+`?(?:\s+(?:as\s+)?`?\w+`?)?\s*,", masked):
+        return None  # comma join: second table wouldn't be rewritten
+    ctes = {m.lower() for m in re.findall(r"(?i)\b(\w+)\s+as\s*\(", masked)}
+    refs = [m.group(3) for m in _TABLE_REF.finditer(masked)]
+    bases = [r for r in refs if r.lower() not in ctes]
+    if not bases or any(r not in available for r in bases):
+        return None
+
+    def _swap(m):
+        kw, ws, table = m.group(1), m.group(2), m.group(3)
+        if table.lower() in ctes:
+            return m.group(0)
+        nxt = re.match(r"\s+(?:as\s+)?`?(\w+)", masked[m.end():], re.I)
+        has_alias = nxt is not None and nxt.group(1).lower() not in _NOT_ALIAS
+        # keep the original name visible as an alias so `orders.col` references still resolve
+        return f"{kw}{ws}{table}{SUFFIX}" + ("" if has_alias else f" AS {table}")
+
+    out = _TABLE_REF.sub(_swap, masked)
+    out = re.sub(r"'__lit(\d+)__'", lambda m: literals[int(m.group(1))], out)
+    METRICS.inc("sample_rewrites_total")
+    return out
+
+if __name__ == "__main__":
+    from config import get_engine
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "show"
+    if cmd == "build":
+        build_sample_tables(get_engine(), float(sys.argv[2]) if len(sys.argv) > 2 else SAMPLE_FRACTION)
+    elif cmd == "show":
+        for t, f in sorted(available_samples().items()):
+            print(f"{t}{SUFFIX}: fraction={f} ({SAMPLES[t].method})")
+    else:
+        sys.exit(f"unknown command {cmd!r}; use 'build' or 'show'")
@@ -0,0 +1,297 @@
+# schema_catalog.py
+"""
+Schema discovery and routing groups, so adding a table no longer means editing the knowledgebase
+builder, the router prompt and customer_agent.d_store by hand.
+
+- discover_schema(engine) reads INFORMATION_SCHEMA: base tables (derived *__sample / *__new /
+  rollup_* tables excluded), columns, primary keys and declared foreign keys.
+- infer_join_keys(schema) adds the joins nobody declared: a column whose name is another table's
+  single-column primary key (orders.customer_id -> customer.customer_id), or `<x>_id` when a table
+  `<x>` / `<x>s` has that column (for schemas loaded without keys).
+- cluster_tables(schema) groups tables into routing groups: greedy average-linkage over the join
+  graph (declared FK = 2, inferred = 1 per key), ties broken by shared neighbours, groups capped at
+  ROUTING_GROUP_MAX_TABLES and only merged while linkage >= ROUTING_MIN_LINKAGE. Tables that join
+  a single other table then join that table's group. Each group is named after its most-referenced
+  table.
+- build_catalog(engine) writes all of it to SCHEMA_CATALOG_PATH (JSON, next to the knowledgebase).
+
+Routing is hierarchical, group -> table -> column, so every prompt stays bounded as the schema grows:
+the router (router_agent) sees one line per group, the subquestion step sees the tables of the chosen
+groups (at most ROUTER_MAX_TABLES), the column extractor one table at a time.
+Without a catalog the hand-written Olist groups (DEFAULT_GROUPS) are used, as before.
+
+CLI:
+  python schema_catalog.py build     # discover + cluster, write SCHEMA_CATALOG_PATH
+  python schema_catalog.py show      # print groups and join keys
+"""
+import json
+import os
+import re
+import sys
+import tempfile
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+
+from config import ROUTER_MAX_TABLES, ROUTING_GROUP_MAX_TABLES, ROUTING_MIN_LINKAGE, SCHEMA_CATALOG_PATH
+from shared_state import freeze, shared_resource
+
+DERIVED_TABLE = re.compile(r"__(?:new|old|stage|sample)$|^rollup_")
+
+class RoutingGroup(NamedTuple):
+    name: str
+    tables: List[str]
+    description: str
+
+# Hand-written Olist groups, used until a catalog has been built
+DEFAULT_GROUPS = [
+    RoutingGroup("customer", ["customer", "sellers"],
+                 "It contains all the details about customer and seller locations and their unique identifiers"),
+    RoutingGroup("orders", ["order_items", "order_payments", "order_reviews", "orders"],
+                 "It contains details about all the orders like product identifier, order identifier, products in "
+                 "an order, no. of items of a product in order, price of order, frieght value, order time, delivery "
+                 "status and its time, payment etc."),
+    RoutingGroup("product", ["products", "category_translation"],
+                 "It contains details about product like product identifier, product category, description, "
+                 "dimensions of product"),
+]
+
+# ---------------- Discovery ----------------
+def discover_schema(engine) -> Dict[str, Any]:
+    """{"tables": {t: {"rows", "comment", "columns": [[name, type]], "primary_key": [...]}},
+        "foreign_keys": [[t, c, ref_t, ref_c]]}"""
+    with engine.connect() as conn:
+        tables = {
+            r[0]: {"rows": int(r[1] or 0), "comment": r[2] or "", "columns": [], "primary_key": []}
+            for r in conn.execute(text(
+                "SELECT TABLE_NAME, TABLE_ROWS, TABLE_COMMENT FROM INFORMATION_SCHEMA.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE' ORDER BY TABLE_NAME"))
+            if not DERIVED_TABLE.search(r[0])
+        }
+        for t, c, dtype in conn.execute(text(
+                "SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() ORDER BY TABLE_NAME, ORDINAL_POSITION")):
+            if t in tables:
+                tables[t]["columns"].append([c, str(dtype).lower()])
+        fks = []
+        for t, c, constraint, rt, rc in conn.execute(text(
+                "SELECT TABLE_NAME, COLUMN_NAME, CONSTRAINT_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME "
+                "FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE WHERE TABLE_SCHEMA = DATABASE() "
+                "ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION")):
+            if t not in tables:
+                continue
+            if constraint == "PRIMARY":
+                tables[t]["primary_key"].append(c)
+            elif rt in tables:
+                fks.append([t, c, rt, rc])
+    return {"tables": tables, "foreign_keys": fks}
+
+def infer_join_keys(schema: Dict[str, Any]) -> List[List[str]]:
+    """[[t, c, ref_t, ref_c]] for undeclared joins onto single-column keys (see module docstring)."""
+    tables = schema["tables"]
+    columns = {t: {c for c, _ in info["columns"]} for t, info in tables.items()}
+    keys = {t: info["primary_key"][0] for t, info in tables.items() if len(info["primary_key"]) == 1}
+    for t in tables:  # no declared key: `<x>_id` in table <x> / <x>s is its key
+        for c in columns[t]:
+            if t not in keys and c.endswith("_id") and t in (c[:-3], c[:-3] + "s"):
+                keys[t] = c
+    declared = {(t, c) for t, c, _, _ in schema.get("foreign_keys", [])}
+    out = []
+    for rt, rc in sorted(keys.items()):
+        for t in sorted(tables):
+            if t == rt or rc not in columns[t] or (t, rc) in declared:
+                continue
+            if keys.get(t) == rc and t < rt:
+                continue  # both keyed on it (1:1): recorded once
+            out.append([t, rc, rt, rc])
+    return out
+
+def join_key_groups(schema: Dict[str, Any]) -> List[Tuple[str, ...]]:
+    """Joinable columns as ("ref.col", "t1.col", ...) tuples: the format of customer_helper.KNOWN_JOIN_KEYS."""
+    refs: Dict[str, List[str]] = defaultdict(list)
+    for t, c, rt, rc in schema.get("foreign_keys", []) + schema.get("inferred_keys", []):
+        ref = f"{rt}.{rc}"
+        if f"{t}.{c}" not in refs[ref]:
+            refs[ref].append(f"{t}.{c}")
+    return [(ref, *sorted(members)) for ref, members in sorted(refs.items())]
+
+# ---------------- Clustering ----------------
+def _join_weights(schema: Dict[str, Any]) -> Dict[Tuple[str, str], float]:
+    w: Dict[Tuple[str, str], float] = defaultdict(float)
+    for t, _, rt, _ in schema.get("foreign_keys", []):
+        w[tuple(sorted((t, rt)))] += 1.0  # declared: counted again through its join group below
+    for group in join_key_groups(schema):
+        members = sorted({ref.split(".", 1)[0] for ref in group})
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                w[(a, b)] += 1.0
+    return w
+
+def cluster_tables(schema: Dict[str, Any], max_tables: int = ROUTING_GROUP_MAX_TABLES,
+                   min_linkage: float = ROUTING_MIN_LINKAGE) -> List[List[str]]:
+    """Routing groups (lists of tables), largest first; see the module docstring."""
+    weights = _join_weights(schema)
+    tables = sorted(schema["tables"])
+    degree: Dict[str, int] = defaultdict(int)
+    for a, b in weights:
+        degree[a] += 1
+        degree[b] += 1
+    leaves = [t for t in tables if degree[t] == 1]
+    # 1) average-linkage agglomeration of the other tables (isolated ones stay alone)
+    core = [t for t in tables if t not in set(leaves)]
+    members: Dict[int, frozenset] = {i: frozenset([t]) for i, t in enumerate(core)}
+    index = {t: i for i, t in enumerate(core)}
+    adj: Dict[int, Dict[int, float]] = defaultdict(dict)  # cluster -> {neighbour: summed join weight}
+    for (a, b), w in weights.items():
+        if a in index and b in index:
+            adj[index[a]][index[b]] = adj[index[b]][index[a]] = w
+    next_id = len(members)
+    while True:
+        best = None
+        for a in sorted(adj):
+            for b, w in adj[a].items():
+                if b <= a or len(members[a]) + len(members[b]) > max_tables:
+                    continue
+                link = w / (len(members[a]) * len(members[b]))
+                if link < min_linkage:
+                    continue
+                na, nb = set(adj[a]) - {b}, set(adj[b]) - {a}
+                shared = len(na & nb) / len(na | nb) if na | nb else 0.0
+                if best is None or (link, shared, w) > best[0]:
+                    best = ((link, shared, w), a, b)
+        if best is None:
+            break
+        _, a, b = best
+        merged = next_id
+        next_id += 1
+        members[merged] = members.pop(a) | members.pop(b)
+        for old in (a, b):
+            for n, w in adj.pop(old).items():
+                if n in (a, b):
+                    continue
+                del adj[n][old]
+                adj[merged][n] = adj[n][merged] = adj[merged].get(n, 0.0) + w
+    # 2) tables joined through a single key go with the table they join to (overflow: a sibling group)
+    groups = [set(m) for m in members.values()]
+    home = {t: g for g in groups for t in g}
+    overflow: Dict[int, set] = {}
+    for leaf in leaves:
+        other = next(b if a == leaf else a for a, b in weights if leaf in (a, b))
+        target = home.get(other)
+        if target is None:  # two leaves joined only to each other
+            target = home[other] = set([other])
+            groups.append(target)
+        if len(target) >= max_tables:
+            spill = overflow.get(id(target))
+            if spill is None or len(spill) >= max_tables:
+                spill = overflow[id(target)] = set()
+                groups.append(spill)
+            target = spill
+        target.add(leaf)
+        home[leaf] = target
+    return [sorted(g) for g in sorted(groups, key=lambda g: (-len(g), sorted(g)))]
+
+def _group_name(tables: List[str], schema: Dict[str, Any], taken: set) -> str:
+    referenced = defaultdict(int)
+    for group in join_key_groups(schema):
+        referenced[group[0].split(".", 1)[0]] += len(group) - 1
+    name = max(tables, key=lambda t: (referenced[t], -len(t), t))
+    return name if name not in taken else f"{name}_{len(taken)}"
+
+# ---------------- Catalog ----------------
+def _save(catalog: Dict[str, Any], path: str) -> None:
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+def build_catalog(engine, *, path: str = SCHEMA_CATALOG_PATH, max_tables: int = ROUTING_GROUP_MAX_TABLES,
+                  min_linkage: float = ROUTING_MIN_LINKAGE) -> Dict[str, Any]:
+    """Discover, infer join keys, cluster; writes `path` and returns the catalog."""
+    schema = discover_schema(engine)
+    schema["inferred_keys"] = infer_join_keys(schema)
+    taken: set = set()
+    groups = []
+    for tables in cluster_tables(schema, max_tables, min_linkage):
+        name = _group_name(tables, schema, taken)
+        taken.add(name)
+        groups.append({"name": name, "tables": tables})
+    catalog = dict(schema, version=1, built_at=datetime.now().isoformat(timespec="seconds"),
+                   join_keys=[list(g) for g in join_key_groups(schema)], groups=groups)
+    _save(catalog, path)
+    get_catalog.cache_clear()
+    routing_groups.cache_clear()
+    return catalog
+
+@shared_resource
+def get_catalog() -> Mapping[str, Any]:
+    """The catalog at SCHEMA_CATALOG_PATH (read-only); empty when it hasn't been built."""
+    try:
+        with open(SCHEMA_CATALOG_PATH, "r", encoding="utf-8") as f:
+            return freeze(json.load(f))
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def base_tables() -> List[str]:
+    """Discovered tables, or the tables of DEFAULT_GROUPS."""
+    tables = get_catalog().get("tables")
+    return sorted(tables) if tables else [t for g in DEFAULT_GROUPS for t in g.tables]
+
+def known_join_keys() -> Optional[List[Tuple[str, ...]]]:
+    keys = get_catalog().get("join_keys")
+    return [tuple(k) for k in keys] if keys else None
+
+# ---------------- Routing ----------------
+_DESC_CHARS = 160  # per table, in a group's router description
+
+def _describe(tables: List[str]) -> str:
+    from customer_agent import get_knowledgebase
+    try:
+        kb = get_knowledgebase()
+    except (OSError, EOFError):
+        kb = {}
+    comments = {t: info.get("comment", "") for t, info in get_catalog().get("tables", {}).items()}
+    parts = []
+    for t in tables:
+        desc = str((kb.get(t) or [comments.get(t, "")])[0]).strip()
+        first = re.split(r"(?<=\.)\s", desc, maxsplit=1)[0][:_DESC_CHARS]
+        parts.append(f"{t}: {first}" if first else t)
+    return "; ".join(parts)
+
+@shared_resource
+def routing_groups() -> Tuple[RoutingGroup, ...]:
+    """Routing groups from the catalog (described from the knowledgebase), else DEFAULT_GROUPS."""
+    groups = get_catalog().get("groups")
+    if not groups:
+        return tuple(DEFAULT_GROUPS)
+    return tuple(RoutingGroup(g["name"], g["tables"], _describe(g["tables"])) for g in groups)
+
+def tables_for_groups(names: List[str], max_tables: int = ROUTER_MAX_TABLES) -> List[str]:
+    """Tables of the routed groups, in routing order, deduplicated, at most `max_tables`
+    (falls back to the first group when nothing matched)."""
+    by_name = {g.name: g.tables for g in routing_groups()}
+    picked = [t for n in names for t in by_name.get(str(n).strip(), [])]
+    if not picked:
+        groups = routing_groups()
+        default = next((g for g in groups if g.name == "orders"), groups[0])
+        picked = list(default.tables)
+    seen: set = set()
+    out = [t for t in picked if not (t in seen or seen.add(t))]
+    return out[:max_tables] if max_tables > 0 else out
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "show"
+    if cmd == "build":
+        from config import get_engine
+        cat = build_catalog(get_engine())
+        print(f"✅ {len(cat['tables'])} tables, {len(cat['join_keys'])} join keys "
+              f"({len(cat['inferred_keys'])} inferred), {len(cat['groups'])} groups -> {SCHEMA_CATALOG_PATH}")
+    if cmd in ("build", "show"):
+        for g in routing_groups():
+            print(f"[{g.name}] {', '.join(g.tables)}")
+        for k in known_join_keys() or []:
+            print("  " + " ↔ ".join(k))
+    else:
+        print(__doc__)
@@ -0,0 +1,749 @@
+# service.py
+"""
+Local HTTP service around the pipeline: job queue, worker pool, submit / poll / stream.
+
+- POST /jobs {"question", "user", "max_retries", "timeout_s", "followup_of", "session"} queues a
+  run (or a follow-up of a finished job) and returns 202 {"job_id", ...}. Once the base job is
+  purged (SERVICE_JOB_TTL_S), a follow-up also carrying "previous" (the base result as
+  state_to_json) runs from that instead; ServiceClient.run_followup resends it on the 404. An
+  identical job of the same user that is still queued/running is reused instead (deduplicated);
+  each session (or user without one) counts once as a waiter. A new submit from the same `session` releases that session's previous
+  job (cancelled when nobody else waits on it).
+- GET /jobs/<id> polls; GET /jobs/<id>/stream sends NDJSON events (queued, running, preview with
+  the chart from the sample tables, heartbeat, finished with the result); DELETE /jobs/<id>[?session=&user=]
+  releases the caller's wait (the session's, else the user's) and cancels when nobody else waits.
+- POST /jobs/<id>/export {"fmt", "user"} writes the full result (result_export) under the job
+  owner's caps (only the job's user may export it) and returns its metadata plus a download
+  path; GET /exports/<name> streams the file once and deletes it (exports never fetched go with
+  their job after SERVICE_JOB_TTL_S).
+- Identity: the "user" field from the (trusted, local) caller, or the AUTH_USER_HEADER header when
+  an authenticating proxy sets it, which then wins over the body.
+- GET /health (readiness + queue; 503 when not ready), GET /health/live, GET /metrics (Prometheus).
+- Workers: SERVICE_WORKERS threads (default) or processes (SERVICE_WORKER_MODE=process; running
+  jobs can then only be abandoned, not cancelled). The dispatcher keeps at most
+  SERVICE_USER_CONCURRENCY jobs running per user, picking the least-served user first, and rejects
+  submits beyond SERVICE_USER_MAX_PENDING queued+running jobs per user (429).
+- Results travel as JSON: scalar FinalState fields, DataFrames as base64 Parquet, the figure as
+  Plotly JSON (state_to_json / state_from_json).
+- Finished results are retained per session (or per user without one) up to
+  SESSION_MEMORY_CAP_MB; beyond that the oldest lose their data (df, df_viz, figure) and keep
+  only the scalar fields, which is still enough for export and SQL follow-ups. The newest result
+  is always kept whole. GET /jobs reports retained bytes per session.
+
+ServiceClient is the thin client used by streamlit_chat.py; get_client() talks to SERVICE_URL, or
+starts an embedded service on a free local port when it is empty.
+
+CLI:
+  python service.py [--host H] [--port P] [--workers N] [--mode thread|process]
+"""
+import argparse
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from config import (
+    AUTH_USER_HEADER, SERVICE_HOST, SERVICE_JOB_TTL_S, SERVICE_PORT, SERVICE_URL, SERVICE_USER_CONCURRENCY,
+    SERVICE_USER_MAX_PENDING, SERVICE_WORKER_MODE, SERVICE_WORKERS, SESSION_MEMORY_CAP_MB, WARMUP_ON_START,
+)
+from telemetry import METRICS
+from shared_state import shared_resource
+
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+_FINISHED = ("done", "failed", "cancelled")
+HEARTBEAT_S = 10.0
+
+# ---------------- Result (de)serialization ----------------
+def _df_to_b64(df) -> Optional[str]:
+    import pandas as pd
+    from arrow_results import to_parquet_bytes
+
+    if not isinstance(df, pd.DataFrame):
+        return None
+    return base64.b64encode(to_parquet_bytes(df)).decode("ascii")
+
+def _df_from_b64(data: Optional[str]):
+    import io
+    import pandas as pd
+    import pyarrow.parquet as pq
+    from arrow_results import to_frame
+
+    if not data:
+        return pd.DataFrame()
+    return to_frame(pq.read_table(io.BytesIO(base64.b64decode(data))))
+
+def state_to_json(state: Dict[str, Any]) -> Dict[str, Any]:
+    """FinalState -> JSON-safe dict (df/df_viz as Parquet, the figure as the Plotly JSON it already is)."""
+    out = {k: v for k, v in state.items() if k not in ("df", "python_code_store_variables_dict")}
+    out = json.loads(json.dumps(out, default=str))
+    viz = state.get("python_code_store_variables_dict") or {}
+    out["df"] = _df_to_b64(state.get("df"))
+    out["fig_json"] = viz.get("fig_json")
+    out["df_viz"] = _df_to_b64(viz.get("df_viz"))
+    out["string_viz_result"] = str(viz.get("string_viz_result") or "")
+    return out
+
+def state_from_json(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Inverse of state_to_json; python_code_store_variables_dict is the slim result (result_memory)."""
+    state = {k: v for k, v in data.items() if k not in ("df", "fig_json", "df_viz", "string_viz_result")}
+    state["df"] = _df_from_b64(data.get("df"))
+    state["python_code_store_variables_dict"] = {
+        "fig_json": data.get("fig_json") or None,
+        "df_viz": _df_from_b64(data["df_viz"]) if data.get("df_viz") else None,
+        "string_viz_result": data.get("string_viz_result") or None,
+    }
+    return state
+
+# ---------------- Worker ----------------
+def _init_worker() -> None:
+    if WARMUP_ON_START:
+        from runtime import get_runtime
+        get_runtime().warm_up(background=False)
+
+def execute_job(payload: Dict[str, Any], on_progress=None) -> Dict[str, Any]:
+    """Run one job (top-level so process workers can unpickle it); returns state_to_json(...)."""
+    from runtime import get_runtime
+
+    rt = get_runtime()
+    kw = dict(max_retries=int(payload.get("max_retries", 3)), timeout_s=payload.get("timeout_s"),
+              cancel_key=payload.get("cancel_key"), user=payload.get("user"), on_progress=on_progress)
+    previous = payload.get("previous")
+    if previous is not None:
+        state = rt.run_followup(payload["question"], state_from_json(previous), **kw)
+    else:
+        state = rt.run(payload["question"], **kw)
+    return state_to_json(state)
+
+# ---------------- Jobs & queue ----------------
+class Job:
+    def __init__(self, question: str, user: str, payload: Dict[str, Any], key: str, owner: str = ""):
+        self.id = uuid.uuid4().hex[:16]
+        self.question, self.user, self.payload, self.key = question, user, payload, key
+        self.owner = owner or f"user:{user}"  # session (or user) whose memory cap holds the result
+        self.result_bytes = 0
+        self.evicted = False
+        self.state = "queued"
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error = ""
+        self.waiters = {self.owner}  # sessions/users sharing this job (dedup); cancelled when empty
+        self.exports: List[str] = []  # export files not downloaded yet (deleted on purge)
+        self.events: List[Dict[str, Any]] = [{"event": "queued", "t": self.created}]
+
+    def info(self, with_result: bool = True) -> Dict[str, Any]:
+        out = {
+            "job_id": self.id, "state": self.state, "question": self.question, "user": self.user,
+            "created": self.created, "started": self.started, "finished": self.finished,
+            "queue_s": round((self.started or self.finished or time.time()) - self.created, 3),
+            "run_s": round((self.finished or time.time()) - self.started, 3) if self.started else None,
+            "error": self.error, "result_bytes": self.result_bytes, "evicted": self.evicted,
+        }
+        if with_result and self.state == "done":
+            out["result"] = self.result
+        return out
+
+class RejectedJob(Exception):
+    """Submit refused (per-user pending limit, unknown follow-up base)."""
+
+    def __init__(self, message: str, http_status: int = 429):
+        super().__init__(message)
+        self.http_status = http_status
+
+def _dedup_key(payload: Dict[str, Any]) -> str:
+    q = " ".join(str(payload.get("question", "")).lower().split())
+    # The user is part of the key: a job's result, export rights and export caps belong to its user.
+    ident = [q, payload.get("user"), payload.get("max_retries"), payload.get("timeout_s"), payload.get("followup_of")]
+    return hashlib.sha1(json.dumps(ident, default=str).encode("utf-8")).hexdigest()
+
+class JobQueue:
+    """FIFO queue + dispatcher over a worker pool, with per-user concurrency and dedup."""
+
+    def __init__(self, workers: int = SERVICE_WORKERS, mode: str = SERVICE_WORKER_MODE,
+                 user_concurrency: int = SERVICE_USER_CONCURRENCY,
+                 user_max_pending: int = SERVICE_USER_MAX_PENDING, ttl_s: int = SERVICE_JOB_TTL_S,
+                 memory_cap_mb: float = SESSION_MEMORY_CAP_MB):
+        self.workers = max(1, int(workers))
+        self.mode = "process" if mode == "process" else "thread"
+        self.user_concurrency = max(1, int(user_concurrency))
+        self.user_max_pending = max(1, int(user_max_pending))
+        self.ttl_s = ttl_s
+        self.memory_cap_bytes = int(memory_cap_mb * 2**20)
+        self._cond = threading.Condition()
+        self.jobs: Dict[str, Job] = {}
+        self._queued: List[Job] = []
+        self._inflight: Dict[str, Job] = {}   # dedup key -> queued/running job
+        self._sessions: Dict[str, str] = {}   # session -> last job id
+        self._running: Dict[str, int] = {}    # user -> running jobs
+        self._served: Dict[str, int] = {}     # user -> jobs started (fairness tie-break)
+        self._pool: Executor = (
+            ProcessPoolExecutor(self.workers, initializer=_init_worker, mp_context=multiprocessing.get_context("spawn"))
+            if self.mode == "process" else ThreadPoolExecutor(self.workers, thread_name_prefix="job")
+        )
+        METRICS.set_gauge("service_workers", self.workers, mode=self.mode)
+        self._stop = False
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="job-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    # ---- submit / cancel ----
+    def submit(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        question = str(payload.get("question") or "").strip()
+        if not question:
+            raise RejectedJob("question is required", 400)
+        user = str(payload.get("user") or "anonymous")
+        payload = dict(payload, question=question, user=user)
+        session = payload.pop("session", None)
+        key = _dedup_key(payload)
+        with self._cond:
+            self._purge()
+            if session and self._sessions.get(session) in self.jobs:
+                previous = self.jobs[self._sessions[session]]
+                if previous.key != key:
+                    self._release(previous, "superseded", session)
+            job = self._inflight.get(key)
+            if job is not None:
+                owner = session or f"user:{user}"
+                if owner not in job.waiters:  # a resubmit from the same session is not a second waiter
+                    job.waiters.add(owner)
+                    METRICS.inc("service_dedup_total")
+                deduplicated = True
+            else:
+                pending = sum(1 for j in self._inflight.values() if j.user == user)
+                if pending >= self.user_max_pending:
+                    METRICS.inc("service_rejected_total", reason="user_pending")
+                    raise RejectedJob(f"user {user!r} already has {pending} pending jobs")
+                base = payload.get("followup_of")
+                if base:
+                    prev = self.jobs.get(base)
+                    if prev is not None and prev.state == "done":
+                        payload["previous"] = prev.result
+                    elif prev is not None or not payload.get("previous"):
+                        raise RejectedJob(f"follow-up base job {base!r} is unknown or not finished", 404)
+                    # else: base purged, the client sent its result along
+                job = Job(question, user, payload, key, owner=session or "")
+                self.jobs[job.id] = job
+                self._inflight[key] = job
+                self._queued.append(job)
+                METRICS.inc("service_jobs_submitted_total")
+                deduplicated = False
+            if session:
+                self._sessions[session] = job.id
+            self._publish()
+            self._cond.notify_all()
+            return {"job_id": job.id, "state": job.state, "deduplicated": deduplicated,
+                    "position": self._queued.index(job) + 1 if job in self._queued else 0}
+
+    def cancel(self, job_id: str, owner: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Release `owner`'s wait on the job (None: every waiter, i.e. cancel outright)."""
+        with self._cond:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            self._release(job, "cancelled", owner)
+            return job.info(with_result=False)
+
+    def _release(self, job: Job, reason: str, owner: Optional[str] = None) -> None:
+        """Drop `owner`'s wait (None: all); the last one cancels (queued: removed, running thread:
+        deadline cancel)."""
+        if job.state in _FINISHED:
+            return
+        if owner is None:
+            job.waiters.clear()
+        else:
+            job.waiters.discard(owner)
+        if job.waiters:
+            return
+        METRICS.inc("service_cancel_total", reason=reason, state=job.state)
+        if job.state == "queued":
+            self._queued.remove(job)
+            self._finish(job, "cancelled", error=reason)
+        elif self.mode == "thread":
+            from deadline import cancel_request
+            cancel_request(job.id, reason)  # run() returns a partial result with status "cancelled"
+
+    # ---- dispatch ----
+    def _next_job(self) -> Optional[Job]:
+        if sum(self._running.values()) >= self.workers:
+            return None
+        eligible = [j for j in self._queued if self._running.get(j.user, 0) < self.user_concurrency]
+        if not eligible:
+            return None
+        return min(eligible, key=lambda j: (self._running.get(j.user, 0), self._served.get(j.user, 0), j.created))
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None and not self._stop:
+                    self._cond.wait(timeout=1.0)
+                    job = self._next_job()
+                if self._stop:
+                    return
+                self._queued.remove(job)
+                job.state, job.started = "running", time.time()
+                job.events.append({"event": "running", "t": job.started})
+                self._running[job.user] = self._running.get(job.user, 0) + 1
+                self._served[job.user] = self._served.get(job.user, 0) + 1
+                METRICS.observe("service_queue_wait_seconds", job.started - job.created)
+                self._publish()
+                self._cond.notify_all()
+            payload = dict(job.payload, cancel_key=job.id)
+            # previews need a callback into this process, so only thread workers stream them
+            on_progress = (lambda event, state, job=job: self._progress(job, event, state)) \
+                if self.mode == "thread" else None
+            fut = self._pool.submit(execute_job, payload, on_progress)
+            fut.add_done_callback(lambda f, job=job: self._done(job, f))
+
+    def _done(self, job: Job, fut) -> None:
+        with self._cond:
+            self._running[job.user] -= 1
+            try:
+                result = fut.result()
+            except Exception as e:
+                self._finish(job, "failed", error=f"{type(e).__name__}: {e}"[:600])
+            else:
+                if not job.waiters and self.mode == "process":
+                    self._finish(job, "cancelled", error="cancelled (result discarded)")
+                else:
+                    self._finish(job, "done", result=result)
+            METRICS.observe("service_job_seconds", job.finished - job.started)
+            self._publish()
+            self._cond.notify_all()
+
+    def _progress(self, job: Job, event: str, state: Dict[str, Any]) -> None:
+        ev = {"event": event, "t": time.time(), "state": state_to_json(state)}
+        with self._cond:
+            job.events.append(ev)
+            self._cond.notify_all()
+
+    def _finish(self, job: Job, state: str, result=None, error: str = "") -> None:
+        job.state, job.result, job.error, job.finished = state, result, error, time.time()
+        if self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+        ev = {"event": "finished", "t": job.finished, "state": state, "error": error}
+        if result is not None:
+            ev["status"] = result.get("status", "ok")
+            job.result_bytes = sum(len(result.get(k) or "") for k in ("df", "df_viz", "fig_json"))
+            self._enforce_memory_cap(job.owner)
+        job.events.append(ev)
+        METRICS.inc("service_jobs_total", state=state)
+
+    def _enforce_memory_cap(self, owner: str) -> None:
+        """Evict the owner's oldest retained results beyond SESSION_MEMORY_CAP_MB (keeps the newest)."""
+        if self.memory_cap_bytes <= 0:
+            return
+        retained = sorted((j for j in self.jobs.values() if j.owner == owner and j.result_bytes),
+                          key=lambda j: j.finished or 0)
+        total = sum(j.result_bytes for j in retained)
+        for j in retained[:-1]:
+            if total <= self.memory_cap_bytes:
+                break
+            total -= j.result_bytes
+            j.result = {k: v for k, v in j.result.items() if k not in ("df", "df_viz", "fig_json")}
+            j.result_bytes, j.evicted = 0, True
+            METRICS.inc("service_results_evicted_total")
+
+    def memory(self) -> Dict[str, Any]:
+        """Retained result bytes, total and per session/user."""
+        by_owner: Dict[str, int] = {}
+        for j in self.jobs.values():
+            if j.result_bytes:
+                by_owner[j.owner] = by_owner.get(j.owner, 0) + j.result_bytes
+        return {"retained_bytes": sum(by_owner.values()), "cap_bytes_per_session": self.memory_cap_bytes,
+                "by_session": by_owner}
+
+    def _purge(self) -> None:
+        cutoff = time.time() - self.ttl_s
+        for jid in [j.id for j in self.jobs.values() if j.state in _FINISHED and j.finished < cutoff]:
+            for path in self.jobs.pop(jid).exports:
+                _remove(path)
+
+    def add_export(self, job: Job, path: str) -> None:
+        with self._cond:
+            job.exports.append(path)
+
+    def take_export(self, path: str) -> bool:
+        """Claim an export for its (single) download; False when unknown or already taken."""
+        with self._cond:
+            for job in self.jobs.values():
+                if path in job.exports:
+                    job.exports.remove(path)
+                    return True
+            return False
+
+    def _publish(self) -> None:
+        METRICS.set_gauge("service_jobs", len(self._queued), state="queued")
+        METRICS.set_gauge("service_jobs", sum(self._running.values()), state="running")
+        METRICS.set_gauge("service_retained_result_bytes", sum(j.result_bytes for j in self.jobs.values()))
+
+    # ---- observation ----
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self.jobs.get(job_id)
+
+    def events(self, job_id: str, heartbeat_s: float = HEARTBEAT_S) -> Iterator[Dict[str, Any]]:
+        """Yield the job's events as they happen, then the finished job (with result)."""
+        sent = 0
+        while True:
+            with self._cond:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    return
+                if sent >= len(job.events) and job.state not in _FINISHED:
+                    self._cond.wait(timeout=heartbeat_s)
+                new, sent = job.events[sent:], len(job.events)
+                finished = job.state in _FINISHED
+                info = job.info() if finished else None
+                position = self._queued.index(job) + 1 if job in self._queued else 0
+            for ev in new:
+                yield ev
+            if finished:
+                yield {"event": "result", "job": info}
+                return
+            if not new:
+                yield {"event": "heartbeat", "t": time.time(), "state": job.state, "position": position}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            by_state: Dict[str, int] = {s: 0 for s in JOB_STATES}
+            for j in self.jobs.values():
+                by_state[j.state] += 1
+            return {"mode": self.mode, "workers": self.workers, "queued": len(self._queued),
+                    "running": sum(self._running.values()), "jobs": by_state,
+                    "running_by_user": {u: n for u, n in self._running.items() if n},
+                    "memory": self.memory()}
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+# ---------------- HTTP ----------------
+_EXPORT_DIR = os.path.join(tempfile.gettempdir(), "sqlviz_exports")
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class _Handler(BaseHTTPRequestHandler):
+    queue: JobQueue = None  # set by make_server
+
+    def _json(self, status: int, body: Any) -> None:
+        data = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> Dict[str, Any]:
+        n = int(self.headers.get("Content-Length") or 0)
+        if not n:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(n))
+        except json.JSONDecodeError:
+            return {}
+        return body if isinstance(body, dict) else {}
+
+    def _user(self, body: Dict[str, Any]) -> str:
+        """Requester identity: the proxy's AUTH_USER_HEADER when configured, else the body's user."""
+        if AUTH_USER_HEADER and self.headers.get(AUTH_USER_HEADER):
+            return self.headers[AUTH_USER_HEADER].strip()
+        return str(body.get("user") or "anonymous")
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path == "/jobs":
+            body = self._body()
+            try:
+                self._json(202, self.queue.submit(dict(body, user=self._user(body))))
+            except RejectedJob as e:
+                self._json(e.http_status, {"error": str(e)})
+            return
+        m = re.fullmatch(r"/jobs/(\w+)/export", path)
+        if m:
+            return self._export(m.group(1), self._body())
+        self._json(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        url = urlparse(self.path)
+        m = re.fullmatch(r"/jobs/(\w+)", url.path)
+        qs = {k: v[0] for k, v in parse_qs(url.query).items()}
+        owner = qs.get("session") or f"user:{self._user(qs)}"
+        info = self.queue.cancel(m.group(1), owner) if m else None
+        self._json(200 if info else 404, info or {"error": "unknown job"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path
+        if path == "/health/live":
+            return self._json(200, {"live": True})
+        if path == "/health":
+            from runtime import readiness
+            r = readiness()
+            r["queue"] = self.queue.stats()
+            return self._json(200 if r["ready"] else 503, r)
+        if path == "/metrics":
+            data = METRICS.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if path == "/jobs":
+            return self._json(200, self.queue.stats())
+        m = re.fullmatch(r"/jobs/(\w+)(/stream)?", path)
+        if m:
+            job = self.queue.get(m.group(1))
+            if job is None:
+                return self._json(404, {"error": "unknown job"})
+            if not m.group(2):
+                return self._json(200, job.info())
+            heartbeat = float(parse_qs(url.query).get("heartbeat", [HEARTBEAT_S])[0])
+            return self._stream(job.id, heartbeat)
+        m = re.fullmatch(r"/exports/([\w.]+)", path)
+        if m:
+            path = os.path.join(_EXPORT_DIR, m.group(1))
+            if not self.queue.take_export(path):
+                return self._json(404, {"error": "unknown export"})
+            try:
+                return self._send_file(path)
+            finally:
+                _remove(path)  # one download per export
+        self._json(404, {"error": "not found"})
+
+    def _stream(self, job_id: str, heartbeat_s: float) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        try:
+            for ev in self.queue.events(job_id, heartbeat_s):
+                self.wfile.write((json.dumps(ev, default=str) + "\n").encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client went away; the job keeps running (DELETE cancels it)
+
+    def _export(self, job_id: str, body: Dict[str, Any]) -> None:
+        from deadline import DeadlineExceeded
+        from result_export import EXPORT_FORMATS, export_to_file
+
+        job = self.queue.get(job_id)
+        result = job.result if job is not None and job.state == "done" else None
+        if not result or result.get("result_debug_sql") != "Pass":
+            return self._json(409, {"error": "job has no validated SQL to export"})
+        if self._user(body) != job.user:
+            return self._json(403, {"error": "only the job's user can export it"})
+        fmt = str(body.get("fmt") or "csv")
+        if fmt not in EXPORT_FORMATS:
+            return self._json(400, {"error": f"unsupported export format {fmt!r}; use one of {EXPORT_FORMATS}"})
+        os.makedirs(_EXPORT_DIR, exist_ok=True)
+        name = f"{job_id}_{uuid.uuid4().hex[:8]}.{fmt}"
+        try:
+            res = export_to_file(result["sql"], fmt, user=job.user,
+                                 path=os.path.join(_EXPORT_DIR, name))
+        except ValueError as e:
+            return self._json(400, {"error": str(e)})
+        except DeadlineExceeded as e:
+            return self._json(504, {"error": str(e)})
+        except Exception as e:
+            METRICS.inc("service_export_errors_total", error=type(e).__name__)
+            return self._json(500, {"error": f"export failed: {type(e).__name__}: {e}"})
+        self.queue.add_export(job, res.path)
+        self._json(200, {"download": f"/exports/{name}", "fmt": res.fmt, "mime": res.mime, "rows": res.rows,
+                         "bytes": res.bytes, "truncated": res.truncated, "seconds": res.seconds})
+
+    def _send_file(self, path: str) -> None:
+        if not os.path.isfile(path):
+            return self._json(404, {"error": "unknown export"})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+    def log_message(self, format, *args):
+        pass
+
+def make_server(host: str = SERVICE_HOST, port: int = SERVICE_PORT,
+                queue: Optional[JobQueue] = None) -> ThreadingHTTPServer:
+    handler = type("Handler", (_Handler,), {"queue": queue or JobQueue()})
+    server = ThreadingHTTPServer((host, int(port)), handler)
+    server.daemon_threads = True
+    return server
+
+@shared_resource
+def start_embedded() -> str:
+    """Start a service on a free local port in a daemon thread (once per process); returns its URL."""
+    if WARMUP_ON_START:
+        from runtime import get_runtime
+        get_runtime().warm_up()
+    server = make_server("127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, name="service", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+# ---------------- Client ----------------
+class ServiceError(RuntimeError):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+class ServiceClient:
+    """Thin HTTP client; run()/run_followup() mirror nlq_to_viz_workflow and return a FinalState."""
+
+    def __init__(self, base_url: str, timeout_s: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout_s = timeout_s
+
+    def _request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None,
+                 timeout: Optional[float] = None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"} if data else {})
+        try:
+            return urllib.request.urlopen(req, timeout=timeout or self.timeout_s)
+        except urllib.error.HTTPError as e:
+            try:
+                msg = json.loads(e.read()).get("error", e.reason)
+            except Exception:
+                msg = e.reason
+            raise ServiceError(e.code, msg) from None
+
+    def _json(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        with self._request(method, path, body) as resp:
+            return json.loads(resp.read())
+
+    def submit(self, question: str, *, user: str = "anonymous", max_retries: int = 3,
+               timeout_s: Optional[float] = None, followup_of: Optional[str] = None,
+               session: Optional[str] = None, previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        body = {"question": question, "user": user, "max_retries": int(max_retries), "timeout_s": timeout_s,
+                "followup_of": followup_of, "session": session, "previous": previous}
+        return self._json("POST", "/jobs", {k: v for k, v in body.items() if v is not None})
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        return self._json("GET", f"/jobs/{job_id}")
+
+    def stats(self) -> Dict[str, Any]:
+        return self._json("GET", "/jobs")
+
+    def cancel(self, job_id: str, *, session: Optional[str] = None, user: Optional[str] = None) -> Dict[str, Any]:
+        """Release this session's (else user's) wait on the job; the last waiter cancels it."""
+        query = urlencode({k: v for k, v in (("session", session), ("user", user)) if v})
+        return self._json("DELETE", f"/jobs/{job_id}" + (f"?{query}" if query else ""))
+
+    def events(self, job_id: str, heartbeat_s: float = HEARTBEAT_S) -> Iterator[Dict[str, Any]]:
+        with self._request("GET", f"/jobs/{job_id}/stream?heartbeat={heartbeat_s}",
+                           timeout=heartbeat_s + self.timeout_s) as resp:
+            for line in resp:
+                if line.strip():
+                    yield json.loads(line)
+
+    def wait(self, job_id: str, on_preview=None) -> Dict[str, Any]:
+        """Block until the job finishes; returns its final info (with "result" when done).
+        on_preview(state) gets the sample-based result while the full query runs."""
+        for ev in self.events(job_id):
+            if ev["event"] == "result":
+                return ev["job"]
+            if ev["event"] == "preview" and on_preview is not None:
+                on_preview(state_from_json(ev["state"]))
+        return self.status(job_id)
+
+    def _final(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        if job["state"] != "done":
+            raise ServiceError(500, f"job {job['job_id']} {job['state']}: {job.get('error', '')}")
+        state = state_from_json(job["result"])
+        state["job_id"] = job["job_id"]
+        return state
+
+    def run(self, question: str, on_preview=None, **kw) -> Dict[str, Any]:
+        return self._final(self.wait(self.submit(question, **kw)["job_id"], on_preview=on_preview))
+
+    def run_followup(self, question: str, previous: Dict[str, Any], **kw) -> Dict[str, Any]:
+        try:
+            return self.run(question, followup_of=previous.get("job_id"), **kw)
+        except ServiceError as e:
+            if e.status != 404 or not previous.get("job_id"):
+                raise
+        # the base job outlived SERVICE_JOB_TTL_S on the service: send the previous result along
+        return self.run(question, followup_of=previous["job_id"], previous=state_to_json(previous), **kw)
+
+    def health(self) -> Dict[str, Any]:
+        try:
+            with urllib.request.urlopen(self.base_url + "/health", timeout=self.timeout_s) as resp:
+                return json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            return json.loads(e.read())  # 503: not ready, same body
+
+    def export(self, job_id: str, fmt: str = "csv", user: Optional[str] = None,
+               dest: Optional[str] = None) -> Dict[str, Any]:
+        """Have the service write the full result, then download it to `dest` (default: a temp file
+        the caller deletes once it has used meta["path"]; removed here if the download fails)."""
+        meta = self._json("POST", f"/jobs/{job_id}/export", {"fmt": fmt, "user": user})
+        if dest is None:
+            fd, dest = tempfile.mkstemp(prefix="export_", suffix=f".{fmt}")
+            os.close(fd)
+        try:
+            with self._request("GET", meta["download"], timeout=max(self.timeout_s, 300)) as resp, \
+                    open(dest, "wb") as f:
+                while True:
+                    chunk = resp.read(1 << 20)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+        except BaseException:
+            _remove(dest)
+            raise
+        meta["path"] = dest
+        return meta
+
+@shared_resource
+def get_client() -> ServiceClient:
+    return ServiceClient(SERVICE_URL or start_embedded())
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="HTTP job service for the NLQ → SQL → viz pipeline.")
+    ap.add_argument("--host", default=SERVICE_HOST)
+    ap.add_argument("--port", type=int, default=SERVICE_PORT)
+    ap.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    ap.add_argument("--mode", choices=("thread", "process"), default=SERVICE_WORKER_MODE)
+    args = ap.parse_args(argv)
+
+    if WARMUP_ON_START and args.mode == "thread":
+        from runtime import get_runtime
+        get_runtime().warm_up()
+    queue = JobQueue(workers=args.workers, mode=args.mode)
+    server = make_server(args.host, args.port, queue)
+    print(f"[service] {args.mode} workers={queue.workers} listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        queue.shutdown()
+
+if __name__ == "__main__":
+    main()
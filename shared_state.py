@@ -0,0 +1,71 @@
+# shared_state.py
+"""
+Building blocks for process-wide state that many request threads read at once.
+
+- shared_resource: drop-in for `@lru_cache(maxsize=1)` on resource getters. lru_cache doesn't
+  lock around the build, so two threads that miss at the same time both build: two engines
+  (two connection pools), two LLM rate limiters (twice the TPM budget), the knowledgebase
+  unpickled twice. Here the first caller builds under a per-getter lock, concurrent callers
+  wait for it and get the same object; a failed build is not cached. cache_clear() works as
+  before (the catalog builders use it after rewriting their files).
+- freeze: read-only view of loaded data (dict -> MappingProxyType, list -> FrozenList), so a
+  stray in-place edit by one request raises instead of silently changing what every other
+  request sees. FrozenList keeps list's repr, so prompts built with str() don't change.
+
+Standard library only: config.py imports it.
+"""
+import threading
+from functools import wraps
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Tuple, TypeVar
+
+T = TypeVar("T")
+
+def shared_resource(fn: Callable[..., T]) -> Callable[..., T]:
+    """Build once per distinct (hashable) arguments, thread-safe; see the module docstring."""
+    cache: Dict[Tuple, Any] = {}
+    locks: Dict[Tuple, threading.Lock] = {}
+    guard = threading.Lock()
+
+    @wraps(fn)
+    def getter(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        with guard:
+            lock = locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in cache:
+                cache[key] = fn(*args, **kwargs)
+            return cache[key]
+
+    def cache_clear() -> None:
+        with guard:
+            cache.clear()
+
+    getter.cache_clear = cache_clear
+    return getter
+
+class FrozenList(list):
+    """A list that refuses in-place changes (reads, iteration, repr and pickling are list's)."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("shared read-only data: copy it (list(x)) before changing it")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+def freeze(obj: Any) -> Any:
+    """Recursively read-only view of dicts/lists/tuples; other objects are returned as they are."""
+    if isinstance(obj, dict):
+        return MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return FrozenList(freeze(v) for v in obj)
+    if isinstance(obj, tuple) and not hasattr(obj, "_fields"):
+        return tuple(freeze(v) for v in obj)
+    return obj
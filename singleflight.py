@@ -0,0 +1,129 @@
+# singleflight.py
+"""
+Single-flight coalescing of identical in-flight work.
+
+When a shared dashboard link brings many users in with the same question within seconds,
+only the first caller (the leader) does the work. Callers arriving while it runs (followers)
+wait for its outcome instead of repeating the same LLM calls and queries.
+
+Levels (SINGLEFLIGHT_LEVELS, comma-separated; empty disables coalescing):
+  question  nlq_to_viz_workflow.run: the whole pipeline, keyed by normalized question + retries
+  prompt    rate_limiter: one LLM call, keyed by the rendered messages and model parameters
+  sql       sql_viz_workflow._execute: one database query, keyed by its canonical SQL
+  distinct  fuzzy_wuzzy: DISTINCT-value scans on a cold cache
+
+Semantics:
+- An error raised by the leader is re-raised in every follower, except RequestAborted: the leader's own timeout, cancel or budget says nothing about the follower's
+  request, so followers retry (one becomes the new leader). A MySQL query stopped by KILL QUERY or
+  MAX_EXECUTION_TIME (errors 1317/3024) already surfaces as RequestAborted (execution_backends).
+- A result rejected by `shareable` (e.g. a partial pipeline result) is not handed out;
+  followers then run the work themselves.
+- `clone` gives each follower its own copy of a mutable result (DataFrames, LLM results).
+- Followers wait under their own deadline (deadline.py) and stop on cancel.
+- Metrics: singleflight_total{level,role=leader|follower}, singleflight_errors_shared_total{level},
+  singleflight_retries_total{level} (leader aborted), singleflight_followers{level} (histogram).
+"""
+import hashlib
+import re
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from config import SINGLEFLIGHT_LEVELS
+from deadline import RequestAborted, check_deadline
+from telemetry import METRICS
+
+LEVELS = ("question", "prompt", "sql", "distinct")
+
+def enabled(level: str) -> bool:
+    return level in SINGLEFLIGHT_LEVELS
+
+class _Call:
+    __slots__ = ("done", "result", "error", "shared", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.shared = False
+        self.followers = 0
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key onto one execution."""
+
+    def __init__(self, level: str):
+        self.level = level
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], *,
+           shareable: Optional[Callable[[Any], bool]] = None,
+           clone: Optional[Callable[[Any], Any]] = None) -> Any:
+        if not enabled(self.level):
+            return fn()
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    call.followers += 1
+            if leader:
+                return self._lead(key, call, fn, shareable, clone)
+            METRICS.inc("singleflight_total", level=self.level, role="follower")
+            while not call.done.wait(0.1):
+                check_deadline()
+            if isinstance(call.error, RequestAborted):
+                METRICS.inc("singleflight_retries_total", level=self.level)
+                continue
+            if call.error is not None:
+                METRICS.inc("singleflight_errors_shared_total", level=self.level)
+                raise call.error
+            if not call.shared:
+                return fn()
+            return clone(call.result) if clone is not None else call.result
+
+    def _lead(self, key: Hashable, call: _Call, fn: Callable[[], Any],
+              shareable: Optional[Callable[[Any], bool]], clone: Optional[Callable[[Any], Any]]) -> Any:
+        METRICS.inc("singleflight_total", level=self.level, role="leader")
+        result = None
+        try:
+            result = fn()
+            call.shared = shareable is None or bool(shareable(result))
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                followers = call.followers  # no new followers once the key is gone
+            if call.shared and followers:
+                # followers copy from a snapshot, so the leader may go on mutating its own result
+                call.result = clone(result) if clone is not None else result
+            METRICS.observe("singleflight_followers", followers, level=self.level)
+            call.done.set()
+
+    def inflight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+# ---------------- Keys ----------------
+_LITERAL = re.compile(r"('(?:[^'\\]|\\.|'')*')")
+
+def canonical_sql(sql: str) -> str:
+    """Whitespace/backtick/trailing-semicolon-insensitive form; literals and identifier case are kept."""
+    parts = _LITERAL.split((sql or "").strip().rstrip(";").strip())
+    for i in range(0, len(parts), 2):
+        p = re.sub(r"\s+", " ", parts[i].replace("`", ""))
+        parts[i] = re.sub(r"\s*([(),=<>+\-*/])\s*", r"\1", p)
+    return "".join(parts)
+
+def digest(*parts: Any) -> str:
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+QUESTIONS = SingleFlight("question")
+PROMPTS = SingleFlight("prompt")
+QUERIES = SingleFlight("sql")
+DISTINCT_SCANS = SingleFlight("distinct")
@@ -0,0 +1,374 @@
+# sql_repair.py
+"""
+Deterministic, rule-based repair for common MySQL errors.
+
+sql_validate_and_execute_node calls repair_sql() before paying for an LLM fix. Rules are
+keyed on MySQL error codes and use the knowledgebase schema + KNOWN_JOIN_KEYS:
+
+  1054  Unknown column          → nearest valid column / re-qualify / add the missing join
+  1052  Ambiguous column        → qualify with the first FROM/JOIN table that has it
+  1055  ONLY_FULL_GROUP_BY      → append the offending column to GROUP BY
+  1064  Syntax error            → rename reserved-word aliases, balance parentheses
+  1146  Unknown table           → nearest known table name
+
+Returns None when no rule applies, so the caller falls back to the LLM fixer.
+Every substitution skips string literals. `python sql_repair.py check` runs RULE_CHECKS offline.
+"""
+import difflib
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from telemetry import METRICS
+
+# MySQL reserved words that LLMs like to use as short aliases.
+RESERVED_ALIASES = {
+    "or", "and", "as", "on", "in", "is", "by", "to", "if", "not", "order", "group", "key", "keys",
+    "desc", "asc", "div", "mod", "use", "all", "any", "case", "when", "then", "else", "end",
+    "from", "where", "select", "join", "left", "right", "inner", "outer", "cross", "limit",
+    "having", "union", "with", "window", "rank", "row", "rows", "range", "interval", "read",
+    "values", "status", "int", "char", "condition", "change", "check", "column", "index",
+}
+
+_CLAUSE_END = r"\b(?:where|group\s+by|having|order\s+by|limit|union|window)\b"
+
+class Repair(NamedTuple):
+    sql: str
+    rule: str
+    detail: str
+
+# ---------------- Error parsing ----------------
+def mysql_error_code(err: BaseException) -> Optional[int]:
+    """Extract the MySQL errno from a (SQLAlchemy-wrapped) DB-API error or its message."""
+    orig = getattr(err, "orig", err)
+    code = getattr(orig, "errno", None)
+    if isinstance(code, int):
+        return code
+    args = getattr(orig, "args", ())
+    if args and isinstance(args[0], int):
+        return args[0]
+    m = re.search(r"\b(1\d{3})\s*\(\w{5}\)", str(err)) or re.search(r"\((1\d{3}),", str(err))
+    return int(m.group(1)) if m else None
+
+# ---------------- Schema helpers ----------------
+def knowledgebase_schema() -> Dict[str, List[str]]:
+    """{table: [column names]} from the loaded knowledgebase."""
+    from customer_agent import get_knowledgebase
+    schema: Dict[str, List[str]] = {}
+    for table, entry in get_knowledgebase().items():
+        try:
+            cols = entry[1]
+        except (IndexError, KeyError, TypeError):
+            continue
+        schema[table] = [str(c[0]) for c in cols if isinstance(c, (list, tuple)) and c]
+    return schema
+
+def _mask_strings(sql: str) -> str:
+    """Replace string-literal contents with spaces so regexes only see SQL structure."""
+    return re.sub(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"",
+                  lambda m: m.group(0)[0] + " " * (len(m.group(0)) - 2) + m.group(0)[-1], sql)
+
+def _sub_code(pattern: str, repl: str, sql: str, skip=None) -> str:
+    """re.sub outside string literals: matched on _mask_strings(sql), literals spliced back as written.
+    skip(masked, match) -> True leaves that match alone."""
+    masked = _mask_strings(sql)
+    out, last = [], 0
+    for m in re.finditer(pattern, masked):
+        if skip is not None and skip(masked, m):
+            continue
+        out.append(sql[last:m.start()])
+        out.append(repl)
+        last = m.end()
+    out.append(sql[last:])
+    return "".join(out)
+
+_NOT_ALIAS_BEFORE = {
+    "select", "distinct", "and", "or", "not", "on", "by", "where", "having", "when", "then", "else",
+    "in", "is", "like", "between", "case", "from", "join", "straight_join", "sql_no_cache",
+}
+
+def _is_output_alias(masked: str, m: re.Match) -> bool:
+    """The match names a select-list alias (`expr AS name` / `expr name`), not a column reference."""
+    before = masked[:m.start()]
+    if re.search(r"(?i)\bas\s*$", before):
+        return True
+    prev = re.search(r"([\w`)'\"]+)\s+$", before)
+    if not prev or prev.group(1).lower() in _NOT_ALIAS_BEFORE:
+        return False
+    sel = [s for s, _ in _top_level_positions(masked, r"\bselect\b") if s < m.start()]
+    frm = [s for s, _ in _top_level_positions(masked, r"\bfrom\b") if s < m.start()]
+    return bool(sel) and (not frm or frm[-1] < sel[-1])  # inside the select list
+
+def table_aliases(sql: str) -> Dict[str, str]:
+    """{alias_or_table: table} for every FROM/JOIN reference (a table is its own alias)."""
+    masked = _mask_strings(sql)
+    out: Dict[str, str] = {}
+    for m in re.finditer(r"(?is)\b(?:from|join)\s+`?(\w+)`?(?:\s+(?:as\s+)?`?(\w+)`?)?", masked):
+        table, alias = m.group(1), m.group(2)
+        out[table] = table
+        if alias and not re.match(r"(?i)^(?:on|using|where|group|order|limit|join|left|right|inner|"
+                                  r"cross|straight_join|natural|having|union)$", alias):
+            out[alias] = table
+    return out
+
+def _top_level_positions(masked: str, pattern: str) -> List[Tuple[int, int]]:
+    """Spans of `pattern` that occur at parenthesis depth 0."""
+    depth, spans = 0, []
+    depth_at = []
+    for ch in masked:
+        depth_at.append(depth)
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+    for m in re.finditer(pattern, masked, re.I):
+        if depth_at[m.start()] == 0:
+            spans.append((m.start(), m.end()))
+    return spans
+
+def _is_simple(sql: str) -> bool:
+    """Single SELECT without CTEs/subqueries: safe for structural edits."""
+    masked = _mask_strings(sql)
+    return not re.match(r"(?is)^\s*with\b", masked) and len(re.findall(r"(?i)\bselect\b", masked)) == 1
+
+# ---------------- Rules ----------------
+def _fix_unknown_column(sql: str, msg: str, schema: Dict[str, List[str]], join_pairs) -> Optional[Repair]:
+    m = re.search(r"Unknown column '([^']+)'", msg)
+    if not m:
+        return None
+    ref = m.group(1)
+    qual, col = (ref.rsplit(".", 1) if "." in ref else (None, ref))
+    aliases = table_aliases(sql)
+    in_query = list(dict.fromkeys(aliases.values()))
+    alias_for = {t: a for a, t in aliases.items() if a != t}
+    alias_for.update({t: t for t in in_query if t not in alias_for})
+
+    # 1) Same column lives on another table already in the query → re-qualify.
+    owners = [t for t in in_query if col in schema.get(t, [])]
+    if qual and owners:
+        new = _sub_code(rf"\b{re.escape(qual)}\.`?{re.escape(col)}`?\b", f"{alias_for[owners[0]]}.{col}", sql)
+        if new != sql:
+            return Repair(new, "1054.requalify", f"{ref} -> {alias_for[owners[0]]}.{col}")
+
+    # 2) Column lives on a table that is reachable through a known join key → add the join.
+    if qual and _is_simple(sql):
+        for target, cols in schema.items():
+            if target in in_query or col not in cols:
+                continue
+            for ta, ca, tb, cb in join_pairs:
+                for (src, scol, dst, dcol) in ((ta, ca, tb, cb), (tb, cb, ta, ca)):
+                    if dst != target or src not in in_query:
+                        continue
+                    masked = _mask_strings(sql)
+                    ends = _top_level_positions(masked, _CLAUSE_END)
+                    cut = ends[0][0] if ends else len(sql.rstrip().rstrip(";"))
+                    join = f" JOIN {target} ON {alias_for[src]}.{scol} = {target}.{dcol} "
+                    ref_re = rf"\b{re.escape(qual)}\.`?{re.escape(col)}`?\b"
+                    head = _sub_code(ref_re, f"{target}.{col}", sql[:cut])
+                    body = _sub_code(ref_re, f"{target}.{col}", sql[cut:])
+                    new = head.rstrip() + join + body.lstrip()
+                    return Repair(new, "1054.add_join", f"{ref} via {src}.{scol} = {target}.{dcol}")
+
+    # 3) Typo → nearest column of the referenced (or any joined) table.
+    tables = [aliases[qual]] if qual and qual in aliases else in_query
+    candidates = [c for t in tables for c in schema.get(t, [])]
+    best = difflib.get_close_matches(col, candidates, n=1, cutoff=0.75)
+    if best:
+        target = re.escape(f"{qual}.{col}" if qual else col).replace(r"\.", r"\.`?")
+        new = _sub_code(rf"(?<![\w.]){target}`?\b", f"{qual}.{best[0]}" if qual else best[0], sql)
+        if new != sql:
+            return Repair(new, "1054.nearest_column", f"{ref} -> {best[0]}")
+    return None
+
+def _fix_ambiguous_column(sql: str, msg: str, schema: Dict[str, List[str]], join_pairs) -> Optional[Repair]:
+    m = re.search(r"Column '(\w+)' in \w+ (?:list|clause) is ambiguous", msg)
+    if not m:
+        return None
+    col = m.group(1)
+    aliases = table_aliases(sql)
+    for alias, table in aliases.items():
+        if col in schema.get(table, []) and (alias != table or list(aliases.values()).count(table) == 1):
+            new = _sub_code(rf"(?<![\w.`]){re.escape(col)}\b(?!\s*\()", f"{alias}.{col}", sql,
+                            skip=_is_output_alias)
+            if new != sql:
+                return Repair(new, "1052.qualify", f"{col} -> {alias}.{col}")
+    return None
+
+def _fix_group_by(sql: str, msg: str, schema: Dict[str, List[str]], join_pairs) -> Optional[Repair]:
+    m = re.search(r"nonaggregated column '([^']+)'", msg)
+    if not m or not _is_simple(sql):
+        return None
+    parts = m.group(1).split(".")
+    col = parts[-1]
+    table = parts[-2] if len(parts) >= 2 else None
+    masked = _mask_strings(sql)
+    # Use the reference exactly as written in the query (alias.col or bare col).
+    expr = None
+    for alias, t in table_aliases(sql).items():
+        if table in (None, t, alias) and re.search(rf"\b{re.escape(alias)}\.{re.escape(col)}\b", masked):
+            expr = f"{alias}.{col}"
+            break
+    expr = expr or col
+    gb = _top_level_positions(masked, r"\bgroup\s+by\b")
+    if not gb:
+        return None
+    nxt = [s for s, _ in _top_level_positions(masked, r"\b(?:having|order\s+by|limit|window)\b") if s > gb[0][1]]
+    end = nxt[0] if nxt else len(sql.rstrip().rstrip(";"))
+    existing = sql[gb[0][1]:end].rstrip()
+    if re.search(rf"(?<![\w.]){re.escape(expr)}\b", existing):
+        return None
+    new = sql[:gb[0][1]] + existing + f", {expr} " + sql[end:].lstrip()
+    return Repair(new.rstrip(), "1055.group_by", f"+ {expr}")
+
+def _fix_reserved_alias(sql: str) -> Optional[Repair]:
+    masked = _mask_strings(sql)
+    for m in re.finditer(r"(?is)\b(?:from|join)\s+`?(\w+)`?\s+(?:as\s+)?(\w+)\b", masked):
+        alias = m.group(2)
+        if alias.lower() not in RESERVED_ALIASES or alias.lower() in ("on", "where", "join", "left", "right",
+                                                                      "inner", "cross", "group", "order",
+                                                                      "limit", "having", "union", "using"):
+            continue
+        new_alias = f"{alias.lower()}_t"
+        new = sql[:m.start(2)] + new_alias + sql[m.end(2):]
+        new = _sub_code(rf"(?<![\w.]){re.escape(alias)}\.", f"{new_alias}.", new)
+        return Repair(new, "1064.reserved_alias", f"{alias} -> {new_alias}")
+    # Column aliases: AS order / AS rank → quote with backticks.
+    for m in re.finditer(r"(?i)\bas\s+(\w+)\b", masked):
+        if m.group(1).lower() in RESERVED_ALIASES:
+            new = sql[:m.start(1)] + f"`{m.group(1)}`" + sql[m.end(1):]
+            return Repair(new, "1064.quote_alias", m.group(1))
+    return None
+
+def _fix_parentheses(sql: str) -> Optional[Repair]:
+    masked = _mask_strings(sql)
+    opens, closes = masked.count("("), masked.count(")")
+    if opens == closes:
+        return None
+    body = sql.rstrip().rstrip(";").rstrip()
+    if opens > closes:
+        # A clause keyword inside an unclosed non-subquery paren (e.g. "COUNT(DISTINCT(x) FROM t")
+        # means the ')' belongs right before it; otherwise the missing ')' is trailing.
+        stack: List[int] = []
+        for i, ch in enumerate(masked[:len(body)]):
+            if ch == "(":
+                stack.append(i)
+            elif ch == ")" and stack:
+                stack.pop()
+            elif stack and re.match(r"(?i)\s(?:from|where|group\s+by|order\s+by|limit)\b", masked[i:i + 10]) \
+                    and not re.match(r"(?is)\(\s*select\b", masked[stack[-1]:]):
+                n = 0
+                while stack and not re.match(r"(?is)\(\s*select\b", masked[stack[-1]:]):
+                    stack.pop()
+                    n += 1
+                n = min(n, opens - closes)
+                return Repair(body[:i] + ")" * n + body[i:], "1064.balance_parens", f"+{n} ')' before clause")
+        return Repair(body + ")" * (opens - closes), "1064.balance_parens", f"+{opens - closes} ')'")
+    extra = closes - opens
+    if body.endswith(")" * extra):
+        return Repair(body[: len(body) - extra], "1064.balance_parens", f"-{extra} ')'")
+    return None
+
+def _fix_syntax(sql: str, msg: str, schema: Dict[str, List[str]], join_pairs) -> Optional[Repair]:
+    return _fix_parentheses(sql) or _fix_reserved_alias(sql)
+
+def _fix_unknown_table(sql: str, msg: str, schema: Dict[str, List[str]], join_pairs) -> Optional[Repair]:
+    m = re.search(r"Table '(?:\w+\.)?(\w+)' doesn't exist", msg)
+    if not m:
+        return None
+    best = difflib.get_close_matches(m.group(1), list(schema), n=1, cutoff=0.7)
+    if not best:
+        return None
+    new = _sub_code(rf"(?<![\w.]){re.escape(m.group(1))}\b", best[0], sql)
+    return Repair(new, "1146.nearest_table", f"{m.group(1)} -> {best[0]}") if new != sql else None
+
+RULES = {
+    1054: _fix_unknown_column,
+    1052: _fix_ambiguous_column,
+    1055: _fix_group_by,
+    1064: _fix_syntax,
+    1146: _fix_unknown_table,
+}
+
+def repair_sql(sql: str, err: BaseException, schema: Optional[Dict[str, List[str]]] = None) -> Optional[Repair]:
+    """Propose a deterministic fix for `err`, or None if no rule applies."""
+    code = mysql_error_code(err)
+    rule = RULES.get(code)
+    if rule is None:
+        return None
+    METRICS.inc("sql_local_repair_attempts_total", code=code)
+    if schema is None:
+        schema = knowledgebase_schema()
+    from customer_helper import join_key_pairs
+    try:
+        fix = rule(sql, str(getattr(err, "orig", err)), schema, list(join_key_pairs()))
+    except Exception:
+        fix = None
+    if fix is None or fix.sql.strip() == sql.strip():
+        return None
+    METRICS.inc("sql_local_repair_applied_total", code=code, rule=fix.rule)
+    return fix
+
+# ---------------- Rule checks ----------------
+
+_CHECK_SCHEMA = {
+    "orders": ["order_id", "customer_id", "order_status"],
+    "order_items": ["order_id", "order_item_id", "product_id", "price"],
+    "customers": ["customer_id", "customer_city", "customer_state"],
+}
+_CHECK_JOINS = [("orders", "order_id", "order_items", "order_id"),
+                ("orders", "customer_id", "customers", "customer_id")]
+
+# (errno, MySQL message, broken SQL, expected repaired SQL or None for "no rule applies").
+RULE_CHECKS = [
+    (1054, "Unknown column 'o.customer_city' in 'field list'",
+     "SELECT o.customer_city FROM orders o JOIN customers c ON o.customer_id = c.customer_id "
+     "WHERE c.customer_state <> 'o.customer_city'",
+     "SELECT c.customer_city FROM orders o JOIN customers c ON o.customer_id = c.customer_id "
+     "WHERE c.customer_state <> 'o.customer_city'"),
+    (1054, "Unknown column 'o.price' in 'field list'",
+     "SELECT o.price FROM orders o WHERE o.order_status = 'o.price'",
+     "SELECT order_items.price FROM orders o JOIN order_items ON o.order_id = order_items.order_id "
+     "WHERE o.order_status = 'o.price'"),
+    (1054, "Unknown column 'customer_stat' in 'where clause'",
+     "SELECT customer_city FROM customers WHERE customer_stat = 'customer_stat'",
+     "SELECT customer_city FROM customers WHERE customer_state = 'customer_stat'"),
+    (1052, "Column 'order_id' in field list is ambiguous",
+     "SELECT order_id AS order_id, COUNT(*) FROM orders o JOIN order_items oi ON o.order_id = oi.order_id "
+     "WHERE o.order_status <> 'order_id x' GROUP BY order_id",
+     "SELECT o.order_id AS order_id, COUNT(*) FROM orders o JOIN order_items oi ON o.order_id = oi.order_id "
+     "WHERE o.order_status <> 'order_id x' GROUP BY o.order_id"),
+    (1052, "Column 'customer_id' in field list is ambiguous",
+     "SELECT customer_id customer_id FROM orders o JOIN customers c ON o.customer_id = c.customer_id",
+     "SELECT o.customer_id customer_id FROM orders o JOIN customers c ON o.customer_id = c.customer_id"),
+    (1055, "Expression #1 of SELECT list is not in GROUP BY clause and contains nonaggregated column "
+           "'db.oi.product_id' which is not functionally dependent on columns in GROUP BY clause",
+     "SELECT oi.product_id, COUNT(*) FROM order_items oi GROUP BY oi.order_id",
+     "SELECT oi.product_id, COUNT(*) FROM order_items oi GROUP BY oi.order_id, oi.product_id"),
+    (1064, "You have an error in your SQL syntax",
+     "SELECT or.order_id FROM orders or WHERE or.order_status = 'or.x'",
+     "SELECT or_t.order_id FROM orders or_t WHERE or_t.order_status = 'or.x'"),
+    (1146, "Table 'db.order_item' doesn't exist",
+     "SELECT price FROM order_item WHERE product_id <> 'order_item'",
+     "SELECT price FROM order_items WHERE product_id <> 'order_item'"),
+]
+
+def check_rules() -> List[dict]:
+    """Run every RULE_CHECKS entry against its rule on a fixed schema; needs no database."""
+    report = []
+    for code, msg, sql, expected in RULE_CHECKS:
+        fix = RULES[code](sql, msg, _CHECK_SCHEMA, _CHECK_JOINS)
+        got = fix.sql if fix is not None else None
+        norm = lambda s: " ".join(s.split()) if s is not None else None
+        report.append({"code": code, "sql": sql, "ok": norm(got) == norm(expected),
+                       "got": got, "rule": fix.rule if fix is not None else None})
+    return report
+
+if __name__ == "__main__":
+    import sys
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if cmd != "check":
+        sys.exit(f"unknown command {cmd!r}; use 'check'")
+    results = check_rules()
+    for r in results:
+        print(("✅" if r["ok"] else "❌"), r["code"], r["sql"][:90], "|", r["rule"], "|", r["got"])
+    sys.exit(0 if all(r["ok"] for r in results) else 1)
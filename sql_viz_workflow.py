@@ -1,24 +1,37 @@
 # sql_viz_workflow.py
-from typing import TypedDict, Dict, Any
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor, wait as wait_futures
+from contextlib import contextmanager
+from typing import TypedDict, Dict, Any, Callable, Optional, Tuple
 from langgraph.graph import StateGraph, START, END
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from sqlalchemy import text
 import pandas as pd
 import re
+import time
 import traceback
 
-from config import get_llm, get_engine
+from config import get_llm, get_engine, EXECUTION_BACKEND, PREVIEW_ENABLED, SUMMARY_TABLES_ENABLED
 from prompts import (
     system_prompt_agent_bi_expert_node,
     system_prompt_agent_python_code_data_visualization_generator_node,
     system_prompt_agent_python_code_data_visualization_validator_node,
 )
 from utils import extract_code_block
-
-# Engine & LLM centralized (behavior unchanged)
-engine = get_engine()
-llm = get_llm()
+from sql_repair import repair_sql
+from summary_tables import rewrite_with_rollups
+from sample_tables import rewrite_to_samples, sample_fraction
+from column_stats import column_kind, result_limit
+from result_memory import slim_viz_result
+from singleflight import QUERIES, canonical_sql
+from index_manager import log_query
+from execution_backends import execute as execute_on_backend
+from arrow_results import sample_summary, schema_summary
+from cost_accounting import allowed_retries, at_least
+from deadline import RequestAborted, check_deadline, stage
+from telemetry import METRICS, record_result, span, traced_node
+from shared_state import shared_resource
 
 class AgentState(TypedDict):
     question: str
@@ -35,7 +48,12 @@ class AgentState(TypedDict):
     num_retries_debug_python_code_data_visualization: int
     result_debug_python_code_data_visualization: str
     error_msg_debug_python_code_data_visualization: str
-    python_code_store_variables_dict: dict
+    python_code_store_variables_dict: dict  # slim: fig_json / df_viz / string_viz_result (result_memory)
+    status: str          # "ok" | "timeout" | "cancelled" (deadline.py); later nodes are skipped
+    status_detail: str
+    full_result: Optional[Future]  # full query still running while the chart is built on the sample
+    result_source: str   # "full" | "sample": which data df (and the chart) come from
+    sample_fraction: float
 
 def _only_select(sql: str) -> None:
     if not re.match(r"(?is)^\s*select\b", sql or ""):
@@ -49,7 +67,7 @@ def _wrap_with_limit(sql: str, limit: int = 2000) -> str:
 
 def _explain_safe(sql: str) -> None:
     try:
-        with engine.begin() as conn:
+        with get_engine().begin() as conn:
             conn.execute(text("EXPLAIN " + sql))
     except Exception:
         pass
@@ -86,66 +104,222 @@ Database error message:
 {error}
 """)
 ])
-_sql_fixer_chain = _sql_fixer_prompt | llm | StrOutputParser()
+@shared_resource
+def get_sql_fixer_chain():
+    return _sql_fixer_prompt | get_llm() | StrOutputParser()
+
+MAX_LOCAL_REPAIRS = 3
+# Rollup and sample tables are built on DATABASE_URL only: federated queries read the base tables.
+_ROLLUPS = SUMMARY_TABLES_ENABLED and EXECUTION_BACKEND != "federated"
+_PREVIEWS = PREVIEW_ENABLED and EXECUTION_BACKEND != "federated"
+
+def _execute(sql: str, *, preview: bool = False) -> pd.DataFrame:
+    _only_select(sql)
+    generated_sql = sql
+    if _ROLLUPS and not preview:
+        sql = rewrite_with_rollups(sql)  # same result, read from a rollup when one matches
+    # 2000 rows unless column statistics predict a larger complete result
+    limited_sql = _wrap_with_limit(sql, limit=2000 if preview else result_limit(generated_sql))
+    _explain_safe(limited_sql)
+    t0 = time.perf_counter()
+    # MySQL, or DuckDB snapshots with MySQL fallback; identical queries in flight run once
+    df = QUERIES.do(canonical_sql(limited_sql), lambda: execute_on_backend(limited_sql),
+                    clone=lambda d: d.copy())
+    record_result(df)
+    if not preview:
+        log_query(generated_sql, time.perf_counter() - t0, len(df))  # feeds index_manager
+    return df
+
+# ---------------- Progressive execution: sample first, full query in the background ----------------
+FULL_QUERY_WORKERS = 8
+
+@shared_resource
+def _full_query_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=FULL_QUERY_WORKERS, thread_name_prefix="full-query")
+
+_progress: contextvars.ContextVar[Optional[Callable[[str, Dict[str, Any]], None]]] = \
+    contextvars.ContextVar("progress", default=None)
+
+@contextmanager
+def progress_scope(on_progress: Optional[Callable[[str, Dict[str, Any]], None]]):
+    """Deliver intermediate states (currently the "preview" chart) to `on_progress(event, state)`."""
+    token = _progress.set(on_progress)
+    try:
+        yield
+    finally:
+        _progress.reset(token)
+
+def report_progress(event: str, state: Dict[str, Any]) -> None:
+    fn = _progress.get()
+    if fn is None:
+        return
+    try:
+        fn(event, {k: v for k, v in state.items() if k != "full_result"})
+    except Exception:
+        pass  # a broken listener must not fail the request
+
+def _execute_progressive(sql: str) -> Tuple[pd.DataFrame, Optional[Future]]:
+    """
+    Run `sql` on the *__sample tables and start the full query in the background.
+    Returns (sample df, future of the full df); (full df, None) when there is nothing to preview:
+    previews disabled, a rollup answers the query anyway, no samples, or an empty sample result.
+    A failing preview falls back to the full query, so its error (not the sample's) is reported.
+    """
+    _only_select(sql)
+    preview_sql = rewrite_to_samples(sql) if _PREVIEWS else None
+    if preview_sql is None or (_ROLLUPS and rewrite_with_rollups(sql) != sql):
+        return _execute(sql), None
+    try:
+        with span("sql_preview"):
+            df = _execute(preview_sql, preview=True)
+    except RequestAborted:
+        raise
+    except Exception:
+        METRICS.inc("sample_previews_total", outcome="error")
+        return _execute(sql), None
+    if df.empty:  # e.g. a selective filter: the sample says nothing, wait for the real answer
+        METRICS.inc("sample_previews_total", outcome="empty")
+        return _execute(sql), None
+    METRICS.inc("sample_previews_total", outcome="ok")
+    ctx = contextvars.copy_context()  # deadline, trace and cost ledger follow the full query
+    return df, _full_query_pool().submit(ctx.run, _execute, sql)
+
+def _execute_full(sql: str) -> Tuple[pd.DataFrame, None]:
+    """_execute_progressive's signature without a preview (fixing a failed full query)."""
+    return _execute(sql), None
+
+def _local_repair(sql: str, err: Exception, run=_execute_progressive):
+    """
+    Try deterministic repairs (chained, e.g. two unknown columns) before the LLM fixer.
+    Returns (sql, df, full_result, None) on success, else (last_sql, None, None, last_error).
+    """
+    for _ in range(MAX_LOCAL_REPAIRS):
+        if isinstance(err, RequestAborted):
+            break
+        with span("sql_local_repair"):
+            fix = repair_sql(sql, err)
+        if fix is None:
+            break
+        try:
+            df, full = run(fix.sql)
+            METRICS.inc("sql_local_repair_success_total", rule=fix.rule)
+            return fix.sql, df, full, None
+        except Exception as e2:
+            sql, err = fix.sql, e2
+    METRICS.inc("sql_local_repair_miss_total")
+    return sql, None, None, err
 
 def sql_validate_and_execute_node(state: AgentState) -> AgentState:
     sql_in = (state.get("sql") or "").strip()
     if not sql_in:
         raise ValueError("No SQL provided to the validator. Pass sql=... or generate one before this step.")
+    return _validate_sql(state, sql_in, _execute_progressive)
 
+def _validate_sql(state: AgentState, sql_in: str, run, failed: Optional[Exception] = None) -> AgentState:
+    """
+    Execute `sql_in` with `run` (local repairs, then the LLM fixer) until it passes or the request's
+    SQL retries are used up. `failed`: the error `sql_in` already produced (not run again).
+    """
     for attempt in range(state["num_retries_debug_sql"], state["max_num_retries_debug"] + 1):
         try:
-            _only_select(sql_in)
-            limited_sql = _wrap_with_limit(sql_in, limit=2000)
-            _explain_safe(limited_sql)
-
-            df = pd.read_sql(text(limited_sql), con=get_engine())
+            try:
+                if failed is not None:
+                    err, failed = failed, None
+                    raise err
+                df, full = run(sql_in)
+            except Exception as first_err:
+                sql_in, df, full, err = _local_repair(sql_in, first_err, run)
+                if df is None:
+                    raise err
             state["df"] = df
+            state["full_result"] = full
+            state["result_source"] = "sample" if full is not None else "full"
+            state["sample_fraction"] = sample_fraction() if full is not None else 1.0
             state["result_debug_sql"] = "Pass"
             state["error_msg_debug_sql"] = ""
             state["sql"] = sql_in
             return state
 
         except Exception as e:
+            if isinstance(e, RequestAborted):
+                raise
+            check_deadline()  # e.g. KILL QUERY on cancel: stop instead of asking the fixer
             state["num_retries_debug_sql"] = attempt + 1
             state["result_debug_sql"] = "Not Pass"
             tb = traceback.format_exc(limit=1)
             err_short = (str(e) + " | " + tb)[:600]
             state["error_msg_debug_sql"] = err_short
-
-            sql_in = _sql_fixer_chain.invoke({
-                "question": state["question"],
-                "columns": state.get("columns", ""),
-                "filters": state.get("filters", ""),
-                "sql": sql_in,
-                "error": err_short
-            }).strip()
+            if attempt >= allowed_retries(state["max_num_retries_debug"]):
+                break  # no attempt left to run a fix (fewer under an LLM budget)
+            METRICS.inc("sql_retries_total")
+
+            with span("chain.sql_fixer"):
+                sql_in = get_sql_fixer_chain().invoke({
+                    "question": state["question"],
+                    "columns": state.get("columns", ""),
+                    "filters": state.get("filters", ""),
+                    "sql": sql_in,
+                    "error": err_short
+                }).strip()
     return state
 
+_TEMPORAL_NAME = re.compile(r"(?i)(date|time|day|week|month|quarter|year|period)")
+
+def heuristic_chart(df: pd.DataFrame):
+    """(visualization_request, plotly code) from the result's shape alone, without an LLM:
+    time-like first column (by dtype, column statistics or name) -> line, low-cardinality label ->
+    bar (top 30), one row -> text, anything else -> table."""
+    if df is None or df.empty:
+        return "No rows: report that.", "string_viz_result = 'The query returned no rows.'"
+    cols = list(df.columns)
+    nums = [c for c in cols if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])]
+    dims = [c for c in cols if c not in nums]
+    if len(df) == 1:
+        return ("Single row: show the values as text.",
+                "string_viz_result = ', '.join(f'{c}: {v}' for c, v in df.iloc[0].items())")
+    if not nums or not dims:
+        return "Show the result as a table.", "df_viz = df"
+    x, y = dims[0], nums[0]
+    if pd.api.types.is_datetime64_any_dtype(df[x]) or column_kind(x) == "temporal" or _TEMPORAL_NAME.search(str(x)):
+        return (f"Line chart of {y} over {x}.",
+                f"fig = px.line(df.sort_values({x!r}), x={x!r}, y={y!r}, markers=True)")
+    if df[x].nunique() <= 50:
+        return (f"Bar chart of {y} by {x} (top 30).",
+                f"fig = px.bar(df.sort_values({y!r}, ascending=False).head(30), x={x!r}, y={y!r})")
+    return "Show the result as a table.", "df_viz = df"
+
 def bi_expert_node(state: AgentState) -> AgentState:
+    if at_least("heuristic_chart"):  # LLM budget nearly used: rule-based chart, no BI/viz calls
+        state["visualization_request"] = "[heuristic] " + heuristic_chart(state.get("df"))[0]
+        return state
     prompt = ChatPromptTemplate.from_messages([("system", system_prompt_agent_bi_expert_node)])
-    chain = prompt | llm | StrOutputParser()
+    chain = prompt | get_llm() | StrOutputParser()
     df = state.get("df", pd.DataFrame())
-    response = chain.invoke({
-        "question": state["question"],
-        "query": state["sql"],
-        "df_structure": df.dtypes if not df.empty else "EMPTY",
-        "df_sample": df.head(5) if not df.empty else "EMPTY"
-    }).strip()
+    with span("chain.bi_expert"):
+        response = chain.invoke({
+            "question": state["question"],
+            "query": state["sql"],
+            "df_structure": schema_summary(df),
+            "df_sample": sample_summary(df, 5)
+        }).strip()
     state["visualization_request"] = response
     return state
 
 def viz_code_generator_node(state: AgentState) -> AgentState:
+    if at_least("heuristic_chart"):
+        state["python_code_data_visualization"] = heuristic_chart(state.get("df"))[1]
+        return state
     prompt = ChatPromptTemplate.from_messages([
         ("system", system_prompt_agent_python_code_data_visualization_generator_node)
     ])
-    chain = prompt | llm | StrOutputParser()
+    chain = prompt | get_llm() | StrOutputParser()
     df = state.get("df", pd.DataFrame())
-    response = chain.invoke({
-        "visualization_request": state["visualization_request"],
-        "df_structure": df.dtypes if not df.empty else "EMPTY",
-        "df_sample": df.head(5) if not df.empty else "EMPTY"
-    })
+    with span("chain.viz_code_generator"):
+        response = chain.invoke({
+            "visualization_request": state["visualization_request"],
+            "df_structure": schema_summary(df),
+            "df_sample": sample_summary(df, 5)
+        })
     state["python_code_data_visualization"] = extract_code_block(response, "python").strip()
     return state
 
@@ -167,6 +341,8 @@ def viz_code_validator_node(state: AgentState) -> AgentState:
             df = state.get("df")
             if df is None:
                 df = pd.DataFrame()
+            # chart code may edit df in place; the result (and a follow-up's previous df) must not change
+            df = df.copy()
 
             code_to_run = re.sub(r"state\.get\(\s*['\"]df['\"]\s*\)", "df", code)
             code_to_run = re.sub(r"fig\.show\(\)\s*;?", "", code_to_run)
@@ -174,7 +350,7 @@ def viz_code_validator_node(state: AgentState) -> AgentState:
             exec_globals: Dict[str, Any] = {"df": df, "pd": pd, "px": px, "go": go, "state": {"df": df}}
             exec(code_to_run, exec_globals)
 
-            state["python_code_store_variables_dict"] = exec_globals
+            state["python_code_store_variables_dict"] = slim_viz_result(exec_globals)
             state["result_debug_python_code_data_visualization"] = "Pass"
             state["error_msg_debug_python_code_data_visualization"] = ""
             state["python_code_data_visualization"] = code_to_run
@@ -186,34 +362,136 @@ def viz_code_validator_node(state: AgentState) -> AgentState:
             state["result_debug_python_code_data_visualization"] = "Not Pass"
             err_short = (str(e) + " | " + traceback.format_exc(limit=1))[:800]
             state["error_msg_debug_python_code_data_visualization"] = err_short
+            check_deadline()
+            if attempt >= allowed_retries(state["max_num_retries_debug"]):
+                break
+            METRICS.inc("viz_retries_total")
 
             from langchain_core.prompts import ChatPromptTemplate
             from langchain_core.output_parsers import StrOutputParser
             prompt = ChatPromptTemplate.from_messages([
                 ("system", system_prompt_agent_python_code_data_visualization_validator_node)
             ])
-            chain = prompt | llm | StrOutputParser()
-            fixed = chain.invoke({
-                "python_code_data_visualization": code,
-                "error_msg_debug": err_short
-            })
+            chain = prompt | get_llm() | StrOutputParser()
+            with span("chain.viz_code_fixer"):
+                fixed = chain.invoke({
+                    "python_code_data_visualization": code,
+                    "error_msg_debug": err_short
+                })
             from utils import extract_code_block
             code = extract_code_block(fixed, "python").strip()
     return state
 
-graph = StateGraph(AgentState)
-graph.add_node("sql_validate_and_execute", sql_validate_and_execute_node)
-graph.add_node("bi_expert", bi_expert_node)
-graph.add_node("viz_code_generator", viz_code_generator_node)
-graph.add_node("viz_code_validator", viz_code_validator_node)
-
-graph.add_edge(START, "sql_validate_and_execute")
-graph.add_edge("sql_validate_and_execute", "bi_expert")
-graph.add_edge("bi_expert", "viz_code_generator")
-graph.add_edge("viz_code_generator", "viz_code_validator")
-graph.add_edge("viz_code_validator", END)
-
-app = graph.compile()
+def await_full_result_node(state: AgentState) -> AgentState:
+    """
+    Publish the sample-based chart as a "preview", then wait for the full query and rebuild the
+    answer on its result. A failing full query goes through the usual local repair / SQL fixer
+    path (without another preview); if that fails too the request fails like any SQL error, the
+    sample is never the final answer. Only a timeout/cancel keeps the sample as a partial result.
+    """
+    fut = state.get("full_result")
+    if fut is None:
+        return state
+    report_progress("preview", state)
+    state["full_result"] = None
+    sample, sample_sql = state["df"], state["sql"]
+    with span("sql_full_result"):
+        while not fut.done():
+            check_deadline()
+            wait_futures([fut], timeout=0.25)
+        try:
+            df = fut.result()
+        except RequestAborted:
+            raise
+        except Exception as e:
+            METRICS.inc("sample_previews_total", outcome="full_failed")
+            state.update(df=pd.DataFrame(), python_code_store_variables_dict={})
+            state = _validate_sql(state, state["sql"], _execute_full, failed=e)
+            if state["result_debug_sql"] != "Pass":  # nothing of the sample-based answer stays
+                state.update(result_source="full", sample_fraction=1.0, visualization_request="",
+                             python_code_data_visualization="",
+                             result_debug_python_code_data_visualization="")
+                return state
+            df = state["df"]
+    state["df"], state["result_source"], state["sample_fraction"] = df, "full", 1.0
+    return _chart_full_result(state, sample, sample_sql)
+
+def _chart_full_result(state: AgentState, sample: pd.DataFrame, sample_sql: str) -> AgentState:
+    """Redo the BI → viz part on the full df. When the full result has the sample's SQL, columns and
+    row count (e.g. the same months/categories), the recommendation still fits and only the chart
+    code re-runs; otherwise the BI expert sees the full data and the chart code is regenerated."""
+    df = state["df"]
+    same_shape = (state["sql"] == sample_sql and list(df.columns) == list(sample.columns)
+                  and len(df) == len(sample))
+    if not same_shape:
+        state = bi_expert_node(state)
+        state = viz_code_generator_node(state)
+        state["num_retries_debug_python_code_data_visualization"] = 0
+    elif not state.get("python_code_data_visualization", "").strip():
+        return state
+    else:
+        # one more pass of the sample's chart code (fixer only if that fails)
+        state["num_retries_debug_python_code_data_visualization"] = min(
+            state["num_retries_debug_python_code_data_visualization"], state["max_num_retries_debug"])
+    return viz_code_validator_node(state)
+
+def _node(name: str, fn):
+    """traced_node under the stage's deadline slice. An abort keeps the partial state, records the
+    status and makes the remaining nodes pass the state through unchanged."""
+    def _guarded(state: AgentState) -> AgentState:
+        if state.get("status", "ok") != "ok":
+            return state
+        try:
+            with stage(name):
+                return fn(state)
+        except RequestAborted as e:
+            state["status"], state["status_detail"] = e.status, str(e)
+            return state
+    return traced_node(f"sql_viz.{name}", _guarded)
+
+@shared_resource
+def get_sql_viz_graph():
+    """Compile the SQL → BI → viz graph once, on first use."""
+    graph = StateGraph(AgentState)
+    graph.add_node("sql_validate_and_execute", _node("sql_validate_and_execute", sql_validate_and_execute_node))
+    graph.add_node("bi_expert", _node("bi_expert", bi_expert_node))
+    graph.add_node("viz_code_generator", _node("viz_code_generator", viz_code_generator_node))
+    graph.add_node("viz_code_validator", _node("viz_code_validator", viz_code_validator_node))
+    graph.add_node("await_full_result", _node("await_full_result", await_full_result_node))
+
+    graph.add_edge(START, "sql_validate_and_execute")
+    graph.add_edge("sql_validate_and_execute", "bi_expert")
+    graph.add_edge("bi_expert", "viz_code_generator")
+    graph.add_edge("viz_code_generator", "viz_code_validator")
+    graph.add_edge("viz_code_validator", "await_full_result")
+    graph.add_edge("await_full_result", END)
+
+    return graph.compile()
+
+@shared_resource
+def get_viz_only_graph():
+    """BI → viz part only: re-charts an already validated result (follow-ups like "as a line chart")."""
+    graph = StateGraph(AgentState)
+    graph.add_node("bi_expert", _node("bi_expert", bi_expert_node))
+    graph.add_node("viz_code_generator", _node("viz_code_generator", viz_code_generator_node))
+    graph.add_node("viz_code_validator", _node("viz_code_validator", viz_code_validator_node))
+
+    graph.add_edge(START, "bi_expert")
+    graph.add_edge("bi_expert", "viz_code_generator")
+    graph.add_edge("viz_code_generator", "viz_code_validator")
+    graph.add_edge("viz_code_validator", END)
+
+    return graph.compile()
+
+def __getattr__(name: str):
+    # keeps `sql_viz_workflow.app / engine / llm` working, resolved lazily
+    if name == "app":
+        return get_sql_viz_graph()
+    if name == "engine":
+        return get_engine()
+    if name == "llm":
+        return get_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def run_workflow(
     question: str,
@@ -223,7 +501,24 @@ def run_workflow(
     filters: str = "",
     max_retries: int = 3
 ) -> AgentState:
-    initial: AgentState = {
+    return get_sql_viz_graph().invoke(_initial_state(question, sql, columns, filters, max_retries))
+
+def run_viz_only(
+    question: str,
+    sql: str,
+    df: pd.DataFrame,
+    *,
+    columns: str = "",
+    filters: str = "",
+    max_retries: int = 3
+) -> AgentState:
+    """Skip SQL validation/execution and re-run BI + viz generation on an existing result."""
+    initial = _initial_state(question, sql, columns, filters, max_retries)
+    initial.update(df=df, result_debug_sql="Pass")
+    return get_viz_only_graph().invoke(initial)
+
+def _initial_state(question: str, sql: str, columns: str, filters: str, max_retries: int) -> AgentState:
+    return {
         "question": question,
         "sql": sql,
         "columns": columns or "",
@@ -239,5 +534,9 @@ def run_workflow(
         "result_debug_python_code_data_visualization": "",
         "error_msg_debug_python_code_data_visualization": "",
         "python_code_store_variables_dict": {},
+        "status": "ok",
+        "status_detail": "",
+        "full_result": None,
+        "result_source": "full",
+        "sample_fraction": 1.0,
     }
-    return app.invoke(initial)
@@ -1,29 +1,124 @@
 # streamlit_chat.py
 import json
+import os
+import uuid
 import pandas as pd
 import streamlit as st
 import streamlit.components.v1 as components
 
-from nlq_to_viz_workflow import run as run_full
+from arrow_results import to_csv_bytes, to_parquet_bytes
+from result_export import EXPORT_FORMATS, limits_for
+from config import AUTH_USER_HEADER, REQUEST_TIMEOUT_S
+from result_memory import figure, state_memory
+from service import ServiceError, get_client
+
+# Thin client: questions run as jobs on the HTTP service (SERVICE_URL, else an embedded one).
+client = get_client()
+
+def _current_user() -> str:
+    """Identity for job fairness, export caps and LLM budgets: Streamlit's login, else the
+    AUTH_USER_HEADER set by an authenticating proxy, else the shared "anonymous"."""
+    user = getattr(st, "user", None)
+    if user is not None and user.get("is_logged_in"):
+        return str(user.get("email") or user.get("sub"))
+    if AUTH_USER_HEADER:
+        value = (st.context.headers.get(AUTH_USER_HEADER) or "").strip()
+        if value:
+            return value
+    return "anonymous"
 
 st.set_page_config(page_title="SQL/BI Agent", layout="wide")
 st.title("📊 SQL And Visualization Generator")
 st.markdown("Type a question in English. I’ll generate the SQL, run it, and show the best visualization.")
 
+with st.sidebar.expander("System status"):
+    try:
+        st.json(client.stats())
+    except (ServiceError, OSError) as e:
+        st.error(f"Service unavailable: {e}")
+    if st.button("Check readiness"):
+        st.json(client.health())
+
+with st.sidebar.expander("Memory"):
+    _last = st.session_state.get("last_state")
+    if _last is not None:
+        st.caption("Last result held by this page (bytes)")
+        st.json(state_memory(_last))
+    try:
+        _mem = client.stats().get("memory", {})
+        st.caption(f"Results retained by the service for this session: "
+                   f"{_mem.get('by_session', {}).get(st.session_state.get('session_key', ''), 0) / 2**20:.1f} MB "
+                   f"(cap {_mem.get('cap_bytes_per_session', 0) / 2**20:.0f} MB)")
+    except (ServiceError, OSError):
+        pass
+
 question = st.text_input("Your question", placeholder="e.g., What is the monthly trend of total sales?")
+previous_state = st.session_state.get("last_state")
+followup = st.checkbox(
+    "Follow-up on the previous answer (e.g., “break that down by state”, “show it as a line chart”)",
+    value=previous_state is not None,
+    disabled=previous_state is None,
+)
 
 with st.expander("Advanced (optional)"):
     max_retries = st.number_input("Max retries (SQL & Viz)", min_value=0, max_value=6, value=3, step=1)
+    user_id = _current_user()
+    st.caption(f"Signed in as: {user_id} (job fairness, export limits and LLM budget)")
+    timeout_s = st.number_input("Time budget per question (s, 0 = none)", min_value=0,
+                                value=int(REQUEST_TIMEOUT_S), step=10)
+
+# Resubmitting (or a rerun while a question is still running) cancels this session's previous job.
+session_key = st.session_state.setdefault("session_key", uuid.uuid4().hex)
+
+def _show_preview(preview_state):
+    """Chart of the sample tables' result, replaced once the full result arrives."""
+    d = preview_state.get("python_code_store_variables_dict", {}) or {}
+    with preview_slot.container():
+        st.caption(f"Preview of the shape only, computed on a ~{preview_state.get('sample_fraction', 0):.0%} "
+                   "sample: sums and counts are the sample's own values, not estimates of the answer. "
+                   "The full query is still running…")
+        if d.get("fig_json"):
+            st.plotly_chart(figure(d), use_container_width=True)
+        elif isinstance(d.get("df_viz"), pd.DataFrame):
+            st.dataframe(d["df_viz"], use_container_width=True)
+        elif d.get("string_viz_result"):
+            st.markdown(d["string_viz_result"])
 
 if st.button("Run", type="primary"):
     if not question.strip():
         st.warning("Please enter a question.")
     else:
+        preview_slot = st.empty()
         with st.spinner("Thinking, generating SQL, validating, and visualizing…"):
-            state = run_full(question, max_retries=max_retries)
+            kw = dict(user=user_id, max_retries=max_retries, timeout_s=timeout_s, session=session_key,
+                      on_preview=_show_preview)
+            try:
+                if followup and previous_state is not None:
+                    state = client.run_followup(question, previous_state, **kw)
+                else:
+                    state = client.run(question, **kw)
+            except (ServiceError, OSError) as e:
+                st.error(f"The request failed: {e}")
+                st.stop()
+        preview_slot.empty()
+        st.session_state["last_state"] = state
+        # Kept across reruns so the full export below can re-run the job's validated SQL.
+        st.session_state["export_job"] = state["job_id"] if state.get("result_debug_sql") == "Pass" else ""
+        st.session_state.pop("export_result", None)
+
+        if state.get("status", "ok") != "ok":
+            st.warning(f"Partial result ({state['status']}): {state.get('status_detail', '')}")
+        if (state.get("memory") or {}).get("trimmed"):
+            st.info("The result was larger than the per-request memory cap; only its first rows are kept.")
+        if state.get("result_source") == "sample":
+            st.warning(f"Sample values only: the full query did not finish, so this shows the "
+                       f"~{state.get('sample_fraction', 0):.0%} sample's own result. Sums and counts "
+                       "are not scaled and are not estimates of the answer.")
 
         c1, c2 = st.columns([0.45, 0.55])
         with c1:
+            if state.get("followup_kind", "new") != "new":
+                st.caption(f"Follow-up handled as: {state['followup_kind'].replace('_', ' ')}")
             st.subheader("Generated SQL")
             st.code(state["sql"], language="sql")
 
@@ -74,10 +169,21 @@ if st.button("Run", type="primary"):
             if state.get("error_msg_debug_sql"):
                 st.error(state["error_msg_debug_sql"])
 
+            with st.expander("Timing breakdown"):
+                st.caption(f"Trace id: {state.get('trace_id', '')}")
+                st.json(state.get("timings", {}))
+
+            cost = state.get("cost") or {}
+            if cost:
+                with st.expander(f"LLM cost: ${cost.get('usd', 0):.4f} · "
+                                 f"{cost.get('prompt_tokens', 0) + cost.get('completion_tokens', 0):,} tokens"
+                                 + ("" if cost.get("mode", "full") == "full" else f" · degraded: {cost['mode']}")):
+                    st.json(cost)
+
         with c2:
             st.subheader("Result")
             d = state.get("python_code_store_variables_dict", {}) or {}
-            fig = d.get("fig")
+            fig = figure(d)
             df_viz = d.get("df_viz")
             text_v = d.get("string_viz_result")
 
@@ -97,11 +203,52 @@ if st.button("Run", type="primary"):
                 download_df = state["df"]
 
             if download_df is not None:
-                csv_bytes = download_df.to_csv(index=False).encode("utf-8")
                 st.download_button(
-                    "Download results (CSV)",
-                    data=csv_bytes,
+                    "Download preview (CSV)",
+                    data=to_csv_bytes(download_df),
                     file_name="results.csv",
                     mime="text/csv",
                     use_container_width=True
                 )
+                st.download_button(
+                    "Download preview (Parquet)",
+                    data=to_parquet_bytes(download_df),
+                    file_name="results.parquet",
+                    mime="application/vnd.apache.parquet",
+                    use_container_width=True
+                )
+
+# ---------- Full-result export (not limited to the 2000-row preview) ----------
+if st.session_state.get("export_job"):
+    with st.expander("Export full result"):
+        limits = limits_for(user_id)
+        st.caption(f"Streams the complete result of the validated SQL (up to {limits.max_rows:,} rows / "
+                   f"{limits.max_bytes / 2**20:.0f} MB for this user).")
+        fmt = st.selectbox("Format", EXPORT_FORMATS)
+        if st.button("Prepare export"):
+            with st.spinner("Exporting…"):
+                try:
+                    res = client.export(st.session_state["export_job"], fmt, user=user_id)
+                except (ServiceError, OSError) as e:
+                    st.error(f"The export failed: {e}")
+                    res = None
+                if res is not None:
+                    # the download button holds the bytes anyway: drop the client's temp copy right away
+                    try:
+                        with open(res["path"], "rb") as f:
+                            res["data"] = f.read()
+                    finally:
+                        os.remove(res.pop("path"))
+                st.session_state["export_result"] = res
+        res = st.session_state.get("export_result")
+        if res is not None:
+            if res["truncated"]:
+                st.warning(f"Export stopped at the limit for this user ({res['rows']:,} rows, "
+                           f"{res['bytes'] / 2**20:.1f} MB).")
+            st.download_button(
+                f"Download full result ({res['fmt'].upper()}, {res['rows']:,} rows)",
+                data=res["data"],
+                file_name=f"results.{res['fmt']}",
+                mime=res["mime"],
+                use_container_width=True
+            )
@@ -0,0 +1,104 @@
+# structured_output.py
+"""
+Structured-output mode for the extraction chains (router, subquestion, column and filter selection).
+
+The prompts ask for JSON in free text; with STRUCTURED_OUTPUT=1 the same prompts are sent with a
+strict JSON schema (`response_format` json_schema via llm.with_structured_output), so the model
+cannot answer with prose or half a list. The parsed object is converted back to the list shape the
+pipeline already consumes (e.g. [["subquestion", "table"], ...]) and returned as JSON text, so
+downstream parsing (utils_parsing.parse_nested_list) is a plain json.loads.
+
+Fallbacks:
+- the model's answer doesn't match the schema: its raw text goes through the free-text parser;
+- the deployment rejects json_schema (400 on response_format): structured mode is switched off for
+  the process and the free-text chain is used from then on.
+
+Metrics: structured_output_total{stage,outcome=parsed|invalid|unsupported}; free-text parsing is
+counted separately as llm_parse_total{stage,outcome=json|extracted|failed} (utils_parsing).
+"""
+import json
+from typing import Any, Dict
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from config import STRUCTURED_OUTPUT, get_llm
+from telemetry import METRICS
+
+def _array_of(item_props: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "type": "array",
+        "items": {"type": "object", "properties": item_props,
+                  "required": list(item_props), "additionalProperties": False},
+    }
+
+def _obj(title: str, props: Dict[str, Any]) -> Dict[str, Any]:
+    return {"title": title, "type": "object", "properties": props,
+            "required": list(props), "additionalProperties": False}
+
+_STR = {"type": "string"}
+
+# stage -> (JSON schema, converter to the list shape the free-text prompt asks for)
+SCHEMAS: Dict[str, tuple] = {
+    "router": (
+        _obj("routed_agents", {"agents": {"type": "array", "items": _STR}}),
+        lambda d: list(d["agents"]),
+    ),
+    "subquestion": (
+        _obj("subquestions", {"subquestions": _array_of({"subquestion": _STR, "table": _STR})}),
+        lambda d: [[x["subquestion"], x["table"]] for x in d["subquestions"]],
+    ),
+    "column": (
+        _obj("selected_columns", {"columns": _array_of({"column": _STR, "description": _STR})}),
+        lambda d: [[x["column"], x["description"]] for x in d["columns"]],
+    ),
+    "filter": (
+        _obj("filters", {"has_filters": {"type": "boolean"},
+                         "filters": _array_of({"table": _STR, "column": _STR, "predicate": _STR})}),
+        lambda d: (["yes", *[[x["table"], x["column"], x["predicate"]] for x in d["filters"]]]
+                   if d["has_filters"] and d["filters"] else ["no"]),
+    ),
+}
+
+_supported = {"value": STRUCTURED_OUTPUT}  # switched off on the first schema rejection
+
+def structured_enabled() -> bool:
+    return _supported["value"]
+
+def _rejects_schema(err: Exception) -> bool:
+    import openai
+    msg = str(err).lower()
+    return (isinstance(err, (openai.BadRequestError, NotImplementedError))
+            and any(k in msg for k in ("response_format", "json_schema", "structured")))
+
+def extraction_chain(prompt: Runnable, stage: str) -> Runnable:
+    """`prompt` (inputs | template) -> LLM -> str, in structured mode when the deployment allows it."""
+    schema, to_list = SCHEMAS[stage]
+    text_chain = prompt | get_llm() | StrOutputParser()
+    structured = prompt | get_llm().with_structured_output(
+        schema, method="json_schema", strict=True, include_raw=True)
+
+    def run(inputs: Dict[str, Any], config=None) -> str:
+        if not structured_enabled():
+            return text_chain.invoke(inputs, config=config)
+        try:
+            out = structured.invoke(inputs, config=config)
+        except Exception as e:
+            if not _rejects_schema(e):
+                raise
+            _supported["value"] = False
+            METRICS.inc("structured_output_total", stage=stage, outcome="unsupported")
+            return text_chain.invoke(inputs, config=config)
+        parsed = out.get("parsed")
+        if parsed is not None and out.get("parsing_error") is None:
+            try:
+                result = to_list(parsed)
+            except (KeyError, TypeError):
+                result = None
+            if result is not None:
+                METRICS.inc("structured_output_total", stage=stage, outcome="parsed")
+                return json.dumps(result, ensure_ascii=False)
+        METRICS.inc("structured_output_total", stage=stage, outcome="invalid")
+        return str(getattr(out.get("raw"), "content", "") or "")
+
+    return RunnableLambda(run, name=f"extract_{stage}")
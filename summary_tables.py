@@ -0,0 +1,560 @@
+# summary_tables.py
+"""
+Pre-aggregated summary tables (rollups) with transparent query rewriting.
+
+- ROLLUPS defines each rollup: the base tables/joins it covers, its dimensions and its
+  re-aggregatable measures, plus the SQL that builds it.
+- build_summary_tables(engine) (re)builds them atomically; the tables_creation loader calls it
+  after every load so rollups never drift from the raw tables.
+- rewrite_with_rollups(sql) rewrites a generated aggregate query to read from a rollup when the
+  query's joins, filters, GROUP BY and aggregates are all answerable from it; otherwise it
+  returns the SQL unchanged.
+- verify_rewrites(engine) is the equivalence harness: it runs every VERIFY_QUERIES entry both
+  ways on the loaded dataset and compares the results.
+- verify_fixture() runs the same harness without a database server: a small seeded Olist-shaped
+  fixture (with the NULL payments and undelivered orders that trip rollup measures) is loaded
+  into in-process DuckDB, the rollups are built there and the MySQL queries are transpiled.
+
+CLI:
+  python summary_tables.py build
+  python summary_tables.py verify            # against DATABASE_URL
+  python summary_tables.py verify-fixture    # no credentials needed
+"""
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from telemetry import METRICS
+from shared_state import shared_resource
+
+@dataclass(frozen=True)
+class Measure:
+    column_sql: str            # expression over the rollup's columns
+    exact_grain_only: bool = False   # e.g. COUNT(DISTINCT ...) can't be re-aggregated
+
+@dataclass(frozen=True)
+class Rollup:
+    name: str
+    tables: FrozenSet[str]
+    joins: FrozenSet[Tuple[str, str]]          # normalized equality pairs (sorted)
+    dimensions: Dict[str, str]                 # normalized expr -> rollup column
+    measures: Dict[str, Measure]               # normalized aggregate expr -> re-aggregation
+    build_sql: str
+    allowed_where: FrozenSet[str] = field(default_factory=frozenset)
+
+def _pair(a: str, b: str) -> Tuple[str, str]:
+    return tuple(sorted((a, b)))  # type: ignore[return-value]
+
+_MONTH = "date_format(orders.order_purchase_timestamp,'%Y-%m')"
+_DELIVERY_DAYS = "timestampdiff(day,orders.order_purchase_timestamp,orders.order_delivered_customer_date)"
+
+ROLLUPS: Dict[str, Rollup] = {r.name: r for r in [
+    Rollup(
+        name="rollup_monthly_sales",
+        tables=frozenset({"orders", "order_payments"}),
+        joins=frozenset({_pair("orders.order_id", "order_payments.order_id")}),
+        dimensions={_MONTH: "month"},
+        measures={
+            "sum(order_payments.payment_value)": Measure("SUM(total_sales)"),
+            "count(*)": Measure("SUM(n_rows)"),
+            "count(order_payments.payment_value)": Measure("SUM(n_payments)"),
+            "avg(order_payments.payment_value)": Measure("SUM(total_sales) / SUM(n_payments)"),
+            "count(distinct orders.order_id)": Measure("MAX(n_orders)", exact_grain_only=True),
+            "count(distinct order_payments.order_id)": Measure("MAX(n_orders)", exact_grain_only=True),
+        },
+        build_sql="""
+            SELECT DATE_FORMAT(o.order_purchase_timestamp, '%Y-%m') AS month,
+                   SUM(p.payment_value) AS total_sales,
+                   COUNT(p.payment_value) AS n_payments,
+                   COUNT(*) AS n_rows,
+                   COUNT(DISTINCT o.order_id) AS n_orders
+            FROM orders o JOIN order_payments p ON o.order_id = p.order_id
+            GROUP BY DATE_FORMAT(o.order_purchase_timestamp, '%Y-%m')
+        """,
+    ),
+    Rollup(
+        name="rollup_seller_orders",
+        tables=frozenset({"order_items"}),
+        joins=frozenset(),
+        dimensions={"order_items.seller_id": "seller_id"},
+        measures={
+            "count(distinct order_items.order_id)": Measure("MAX(n_orders)", exact_grain_only=True),
+            "count(*)": Measure("SUM(n_items)"),
+            "count(order_items.order_id)": Measure("SUM(n_items)"),
+            "sum(order_items.price)": Measure("SUM(total_price)"),
+            "sum(order_items.freight_value)": Measure("SUM(total_freight)"),
+            "avg(order_items.price)": Measure("SUM(total_price) / SUM(n_items)"),
+        },
+        build_sql="""
+            SELECT seller_id,
+                   COUNT(DISTINCT order_id) AS n_orders,
+                   COUNT(*) AS n_items,
+                   SUM(price) AS total_price,
+                   SUM(freight_value) AS total_freight
+            FROM order_items
+            GROUP BY seller_id
+        """,
+    ),
+    Rollup(
+        name="rollup_category_revenue",
+        tables=frozenset({"order_items", "products", "category_translation"}),
+        joins=frozenset({
+            _pair("order_items.product_id", "products.product_id"),
+            _pair("products.product_category_name", "category_translation.product_category_name"),
+        }),
+        dimensions={
+            "category_translation.product_category_name_english": "product_category_name_english",
+            "products.product_category_name": "product_category_name",
+            "category_translation.product_category_name": "product_category_name",
+        },
+        measures={
+            "sum(order_items.price)": Measure("SUM(revenue)"),
+            "sum(order_items.price+order_items.freight_value)": Measure("SUM(revenue_with_freight)"),
+            "count(*)": Measure("SUM(n_items)"),
+            "count(order_items.order_id)": Measure("SUM(n_items)"),
+            "avg(order_items.price)": Measure("SUM(revenue) / SUM(n_items)"),
+            "count(distinct order_items.order_id)": Measure("MAX(n_orders)", exact_grain_only=True),
+        },
+        build_sql="""
+            SELECT p.product_category_name AS product_category_name,
+                   ct.product_category_name_english AS product_category_name_english,
+                   SUM(oi.price) AS revenue,
+                   SUM(oi.price + oi.freight_value) AS revenue_with_freight,
+                   COUNT(*) AS n_items,
+                   COUNT(DISTINCT oi.order_id) AS n_orders
+            FROM order_items oi
+            JOIN products p ON oi.product_id = p.product_id
+            JOIN category_translation ct ON p.product_category_name = ct.product_category_name
+            GROUP BY p.product_category_name, ct.product_category_name_english
+        """,
+    ),
+    Rollup(
+        name="rollup_monthly_delivery",
+        tables=frozenset({"orders"}),
+        joins=frozenset(),
+        dimensions={_MONTH: "month"},
+        measures={
+            f"avg({_DELIVERY_DAYS})": Measure("SUM(sum_delivery_days) / SUM(n_delivered)"),
+            f"sum({_DELIVERY_DAYS})": Measure("SUM(sum_delivery_days)"),
+            f"count({_DELIVERY_DAYS})": Measure("SUM(n_delivered)"),
+            f"max({_DELIVERY_DAYS})": Measure("MAX(max_delivery_days)"),
+            f"min({_DELIVERY_DAYS})": Measure("MIN(min_delivery_days)"),
+        },
+        # These measures ignore NULL timestamps, so the usual NOT NULL guards don't change them.
+        allowed_where=frozenset({
+            "orders.order_delivered_customer_date is not null",
+            "orders.order_purchase_timestamp is not null",
+        }),
+        build_sql=f"""
+            SELECT DATE_FORMAT(order_purchase_timestamp, '%Y-%m') AS month,
+                   SUM(TIMESTAMPDIFF(DAY, order_purchase_timestamp, order_delivered_customer_date)) AS sum_delivery_days,
+                   COUNT(TIMESTAMPDIFF(DAY, order_purchase_timestamp, order_delivered_customer_date)) AS n_delivered,
+                   MAX(TIMESTAMPDIFF(DAY, order_purchase_timestamp, order_delivered_customer_date)) AS max_delivery_days,
+                   MIN(TIMESTAMPDIFF(DAY, order_purchase_timestamp, order_delivered_customer_date)) AS min_delivery_days
+            FROM orders
+            GROUP BY DATE_FORMAT(order_purchase_timestamp, '%Y-%m')
+        """,
+    ),
+]}
+
+# ---------------- Build / refresh ----------------
+def build_summary_tables(engine, names: Optional[List[str]] = None) -> Dict[str, int]:
+    """(Re)build rollups via CREATE TABLE ... AS SELECT + atomic RENAME. Returns row counts."""
+    counts: Dict[str, int] = {}
+    with engine.begin() as conn:
+        for name in names or list(ROLLUPS):
+            r = ROLLUPS[name]
+            dims = sorted(set(r.dimensions.values()))
+            conn.execute(text(f"DROP TABLE IF EXISTS {name}__new"))
+            conn.execute(text(f"CREATE TABLE {name}__new AS {r.build_sql.strip()}"))
+            conn.execute(text(f"ALTER TABLE {name}__new ADD INDEX ix_{name}_dims ({', '.join(dims)})"))
+            exists = conn.execute(text(
+                "SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t"), {"t": name}).scalar()
+            if exists:
+                conn.execute(text(f"RENAME TABLE {name} TO {name}__old, {name}__new TO {name}"))
+                conn.execute(text(f"DROP TABLE {name}__old"))
+            else:
+                conn.execute(text(f"RENAME TABLE {name}__new TO {name}"))
+            counts[name] = int(conn.execute(text(f"SELECT COUNT(*) FROM {name}")).scalar() or 0)
+            print(f"✅ Built summary table: {name} ({counts[name]} rows)")
+    available_rollups.cache_clear()
+    return counts
+
+def rollup_columns(r: Rollup) -> FrozenSet[str]:
+    """Columns the rollup's build SQL produces."""
+    return frozenset(re.findall(r"(?i)\bAS (\w+)\s*(?:,|\n|$)", r.build_sql)) | frozenset(r.dimensions.values())
+
+@shared_resource
+def available_rollups() -> FrozenSet[str]:
+    """Rollups that exist in the connected database with every column the current definition
+    needs (a table built by an older definition is skipped until rebuilt); cached, cleared on rebuild."""
+    from config import get_engine
+    try:
+        with get_engine().connect() as conn:
+            rows = conn.execute(text(
+                "SELECT TABLE_NAME, COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE 'rollup\\_%'")).fetchall()
+    except Exception:
+        return frozenset()
+    columns: Dict[str, set] = {}
+    for table, column in rows:
+        columns.setdefault(table, set()).add(column.lower())
+    return frozenset(name for name, r in ROLLUPS.items()
+                     if name in columns and {c.lower() for c in rollup_columns(r)} <= columns[name])
+
+# ---------------- Normalization / parsing ----------------
+_LITERAL = r"('(?:[^'\\]|\\.|'')*')"
+_KEYWORDS = {"on", "where", "join", "inner", "left", "right", "cross", "group", "order", "limit",
+             "having", "using", "natural", "straight_join", "union"}
+_SQL_WORDS = _KEYWORDS | {
+    "select", "from", "by", "as", "and", "or", "not", "null", "is", "distinct", "asc", "desc", "in",
+    "between", "like", "case", "when", "then", "else", "end", "interval", "true", "false",
+    "microsecond", "second", "minute", "hour", "day", "week", "month", "quarter", "year",
+}
+
+def _normalize(sql: str) -> str:
+    """Lowercase outside string literals, drop backticks, collapse whitespace, resolve aliases."""
+    s = (sql or "").strip().rstrip(";")
+    parts = re.split(_LITERAL, s)
+    for i in range(0, len(parts), 2):
+        p = parts[i].replace("`", "").lower()
+        p = re.sub(r"\s+", " ", p)
+        p = re.sub(r"\s*([(,=<>+\-])\s*", r"\1", p)
+        p = re.sub(r"\s+\)", ")", p)
+        parts[i] = p
+
+    # FROM/JOIN alias declarations → {alias: table}
+    code = " ".join(parts[0::2])
+    aliases: Dict[str, str] = {}
+    for m in re.finditer(r"\b(?:from|join) (\w+)(?: as)? (\w+)\b", code):
+        if m.group(2) not in _KEYWORDS:
+            aliases[m.group(2)] = m.group(1)
+    for i in range(0, len(parts), 2):
+        p = parts[i]
+        for alias, table in aliases.items():
+            p = re.sub(rf"\b((?:from|join) {table})(?: as)? {alias}\b", r"\1", p)
+            p = re.sub(rf"(?<![\w.]){alias}\.", f"{table}.", p)
+        parts[i] = p
+
+    # Single-table queries: qualify bare column names so they compare equal to table.column.
+    code = " ".join(parts[0::2])
+    tables = re.findall(r"\b(?:from|join) (\w+)", code)
+    if len(tables) == 1:
+        out_aliases = set(re.findall(r"\bas (\w+)", code)) | set(re.findall(r"\) (\w+)", code))
+        skip = _SQL_WORDS | out_aliases | {tables[0]}
+        qualify = lambda m: m.group(1) if m.group(1) in skip else f"{tables[0]}.{m.group(1)}"
+        for i in range(0, len(parts), 2):
+            head, sep, tail = parts[i].partition(" from ")
+            head = re.sub(r"(?<![\w.])([a-z_]\w*)(?![\w.(])", qualify, head)
+            tail = re.sub(r"(?<![\w.])([a-z_]\w*)(?![\w.(])", qualify, tail) if sep else tail
+            if sep:
+                tail = re.sub(rf"^{tables[0]}\.{tables[0]}\b", tables[0], tail)
+            parts[i] = head + sep + tail
+    return re.sub(r"\s+", " ", "".join(parts)).strip()
+
+def _split_top(s: str, sep: str = ",") -> List[str]:
+    """Split on `sep` at parenthesis depth 0, ignoring string literals."""
+    out, depth, cur, quote = [], 0, [], False
+    for ch in s:
+        if ch == "'":
+            quote = not quote
+        elif not quote and ch == "(":
+            depth += 1
+        elif not quote and ch == ")":
+            depth -= 1
+        if ch == sep and depth == 0 and not quote:
+            out.append("".join(cur).strip())
+            cur = []
+        else:
+            cur.append(ch)
+    if "".join(cur).strip():
+        out.append("".join(cur).strip())
+    return out
+
+_SHAPE = re.compile(
+    r"^select (?P<sel>.+?) from (?P<frm>.+?)"
+    r"(?: where (?P<where>.+?))?"
+    r"(?: group by (?P<gb>.+?))?"
+    r"(?: order by (?P<ob>.+?))?"
+    r"(?: limit (?P<lim>\d+(?:,\d+)?))?$"
+)
+
+def _parse(norm: str):
+    masked = re.sub(_LITERAL, lambda m: "'" + "x" * (len(m.group(0)) - 2) + "'", norm)
+    if masked.count("select") != 1 or masked.startswith("select distinct") \
+            or re.search(r"\b(?:having|union|with)\b", masked):
+        return None
+    m = _SHAPE.match(masked)
+    if not m:
+        return None
+    # Map the masked spans back to the real (literal-preserving) text.
+    g = {k: (norm[m.start(k):m.end(k)] if m.group(k) is not None else None) for k in m.groupdict()}
+
+    tables, joins = set(), set()
+    chunks = re.split(r" (?:inner )?join ", g["frm"])
+    if re.search(r"\b(?:left|right|cross|outer|natural)\b|,", " ".join(chunks)):
+        return None
+    tables.add(chunks[0].strip())
+    for ch in chunks[1:]:
+        jm = re.match(r"^(\w+) on (.+)$", ch.strip())
+        if not jm:
+            return None
+        tables.add(jm.group(1))
+        for cond in re.split(r" and ", jm.group(2)):
+            cm = re.match(r"^\(?([\w.]+)=([\w.]+)\)?$", cond.strip())
+            if not cm:
+                return None
+            joins.add(_pair(cm.group(1), cm.group(2)))
+
+    items = []
+    for raw in _split_top(g["sel"]):
+        am = re.match(r"^(.+?)(?: as)? (\w+)$", raw)
+        items.append((am.group(1).strip(), am.group(2)) if am else (raw.strip(), None))
+    return {
+        "items": items,
+        "tables": frozenset(tables),
+        "joins": frozenset(joins),
+        "where": [w.strip() for w in re.split(r" and ", g["where"])] if g["where"] else [],
+        "group_by": _split_top(g["gb"]) if g["gb"] else [],
+        "order_by": _split_top(g["ob"]) if g["ob"] else [],
+        "limit": g["lim"],
+    }
+
+def parse_query(sql: str) -> Optional[dict]:
+    """Normalized shape of a single-SELECT query (items, tables, joins, where, group_by, ...), or None."""
+    return _parse(_normalize(sql))
+
+def _original_select_texts(sql: str) -> List[str]:
+    """Select-list item texts as written (MySQL names unaliased columns by this text)."""
+    s = (sql or "").strip().rstrip(";")
+    m = re.search(r"(?is)^\s*select\s+(.*?)\s+from\s", s)
+    return [t.strip() for t in _split_top(m.group(1))] if m else []
+
+# ---------------- Rewriting ----------------
+def _rewrite_for(r: Rollup, q: dict, original_items: List[str]) -> Optional[str]:
+    if q["tables"] != r.tables or q["joins"] != r.joins:
+        return None
+    if any(w not in r.allowed_where for w in q["where"]):
+        return None
+
+    alias_expr = {a: e for e, a in q["items"] if a}
+    group_exprs = []
+    for gexpr in q["group_by"]:
+        e = alias_expr.get(gexpr, gexpr)
+        if re.fullmatch(r"\d+", gexpr) and int(gexpr) <= len(q["items"]):
+            e = q["items"][int(gexpr) - 1][0]
+        if e not in r.dimensions:
+            return None
+        group_exprs.append(r.dimensions[e])
+    exact_grain = set(group_exprs) == set(r.dimensions.values())
+
+    out_items, out_names = [], []
+    for idx, (expr, alias) in enumerate(q["items"]):
+        name = alias or (original_items[idx] if idx < len(original_items) else expr)
+        if not alias and re.fullmatch(r"[\w`]+(?:\.[\w`]+)*", name):
+            name = name.split(".")[-1]  # MySQL labels a bare column reference by its column name
+        if expr in r.dimensions:
+            col = r.dimensions[expr]
+            if col not in group_exprs:
+                return None  # non-grouped dimension → not a valid aggregate query
+            out = col
+        elif expr in r.measures:
+            meas = r.measures[expr]
+            if meas.exact_grain_only and not exact_grain:
+                return None
+            out = meas.column_sql
+        else:
+            return None
+        out_items.append(f"{out} AS `{name.replace('`', '')}`")
+        out_names.append((expr, name))
+
+    order_out = []
+    for ob in q["order_by"]:
+        om = re.match(r"^(.+?)(?: (asc|desc))?$", ob)
+        key, direction = om.group(1), om.group(2)
+        if key in alias_expr or re.fullmatch(r"\d+", key):
+            ref = key
+        else:
+            named = [n for e, n in out_names if e == key]
+            if named:
+                ref = f"`{named[0]}`"
+            elif key in r.dimensions and r.dimensions[key] in group_exprs:
+                ref = r.dimensions[key]
+            elif key in r.measures and not (r.measures[key].exact_grain_only and not exact_grain):
+                ref = r.measures[key].column_sql
+            else:
+                return None
+        order_out.append(ref + (f" {direction.upper()}" if direction else ""))
+
+    sql = f"SELECT {', '.join(out_items)} FROM {r.name}"
+    if group_exprs:
+        sql += f" GROUP BY {', '.join(dict.fromkeys(group_exprs))}"
+    if order_out:
+        sql += f" ORDER BY {', '.join(order_out)}"
+    if q["limit"]:
+        sql += f" LIMIT {q['limit']}"
+    return sql
+
+def rewrite_with_rollups(sql: str, available: Optional[FrozenSet[str]] = None) -> str:
+    """Return SQL reading from a matching rollup, or the input unchanged."""
+    available = available_rollups() if available is None else available
+    if not available:
+        return sql
+    q = _parse(_normalize(sql))
+    if q is None:
+        return sql
+    original_items = _original_select_texts(sql)
+    for name in sorted(available):
+        new = _rewrite_for(ROLLUPS[name], q, original_items)
+        if new:
+            METRICS.inc("rollup_rewrites_total", rollup=name)
+            return new
+    METRICS.inc("rollup_rewrite_misses_total")
+    return sql
+
+# ---------------- Equivalence harness ----------------
+VERIFY_QUERIES = [
+    """SELECT DATE_FORMAT(o.order_purchase_timestamp, '%Y-%m') AS month, SUM(p.payment_value) AS total_sales
+       FROM orders o JOIN order_payments p ON o.order_id = p.order_id
+       GROUP BY month ORDER BY month""",
+    """SELECT DATE_FORMAT(orders.order_purchase_timestamp, '%Y-%m') AS month,
+              COUNT(DISTINCT orders.order_id) AS num_orders, AVG(order_payments.payment_value) AS avg_payment
+       FROM orders INNER JOIN order_payments ON orders.order_id = order_payments.order_id
+       GROUP BY DATE_FORMAT(orders.order_purchase_timestamp, '%Y-%m')
+       ORDER BY num_orders DESC LIMIT 5""",
+    """SELECT oi.seller_id, COUNT(DISTINCT oi.order_id) AS order_count
+       FROM order_items oi GROUP BY oi.seller_id ORDER BY order_count DESC LIMIT 10""",
+    """SELECT seller_id, SUM(price) AS revenue, COUNT(*) AS items
+       FROM order_items GROUP BY seller_id ORDER BY revenue DESC""",
+    """SELECT DATE_FORMAT(o.order_purchase_timestamp, '%Y-%m') AS month, COUNT(*) AS payments,
+              COUNT(p.payment_value) AS valued_payments
+       FROM orders o JOIN order_payments p ON o.order_id = p.order_id
+       GROUP BY month ORDER BY month""",
+    """SELECT ct.product_category_name_english AS category, SUM(oi.price) AS revenue
+       FROM order_items oi JOIN products p ON oi.product_id = p.product_id
+       JOIN category_translation ct ON p.product_category_name = ct.product_category_name
+       GROUP BY ct.product_category_name_english ORDER BY revenue DESC LIMIT 10""",
+    """SELECT DATE_FORMAT(o.order_purchase_timestamp, '%Y-%m') AS month,
+              AVG(TIMESTAMPDIFF(DAY, o.order_purchase_timestamp, o.order_delivered_customer_date)) AS avg_delivery_days
+       FROM orders o
+       WHERE o.order_delivered_customer_date IS NOT NULL AND o.order_purchase_timestamp IS NOT NULL
+       GROUP BY month ORDER BY month""",
+]
+
+def _frames_equal(a, b, ordered: bool, rtol: float = 1e-6) -> Tuple[bool, str]:
+    import pandas as pd
+
+    if list(a.columns) != list(b.columns):
+        return False, f"columns differ: {list(a.columns)} vs {list(b.columns)}"
+    if len(a) != len(b):
+        return False, f"row counts differ: {len(a)} vs {len(b)}"
+    a, b = a.copy(), b.copy()
+    for df in (a, b):
+        for c in df.columns:
+            conv = pd.to_numeric(df[c], errors="coerce")
+            if conv.notna().sum() == df[c].notna().sum():
+                df[c] = conv.astype(float)
+    if not ordered:
+        a = a.sort_values(list(a.columns)).reset_index(drop=True)
+        b = b.sort_values(list(b.columns)).reset_index(drop=True)
+    try:
+        pd.testing.assert_frame_equal(a.reset_index(drop=True), b.reset_index(drop=True),
+                                      check_dtype=False, rtol=rtol)
+    except AssertionError as e:
+        return False, str(e).splitlines()[0]
+    return True, ""
+
+def verify_rewrites(engine, queries: Optional[List[str]] = None, read=None) -> List[dict]:
+    """Run each query raw and rewritten; report whether the results are identical.
+    `read(sql) -> DataFrame` replaces pd.read_sql on `engine` (verify_fixture uses DuckDB)."""
+    import pandas as pd
+
+    if read is None:
+        read = lambda sql: pd.read_sql(text(sql), con=engine)
+    report = []
+    available = frozenset(ROLLUPS)
+    for sql in queries or VERIFY_QUERIES:
+        rewritten = rewrite_with_rollups(sql, available=available)
+        entry = {"sql": " ".join(sql.split()), "rewritten": rewritten if rewritten != sql else None}
+        if rewritten == sql:
+            entry.update(ok=False, reason="no rollup matched")
+        else:
+            raw = read(sql)
+            new = read(rewritten)
+            # With LIMIT, ties in ORDER BY may legitimately pick different rows; compare ordered.
+            ok, reason = _frames_equal(raw, new, ordered=bool(re.search(r"(?i)\border\s+by\b", sql)))
+            entry.update(ok=ok, reason=reason)
+        report.append(entry)
+    return report
+
+def fixture_tables(seed: int = 0, n_orders: int = 400):
+    """Seeded Olist-shaped DataFrames covering every rollup, including NULL payment values,
+    undelivered orders and categories without a translation."""
+    import random
+
+    import pandas as pd
+
+    rnd = random.Random(seed)
+    categories = [f"cat_{i}" for i in range(8)]
+    products = pd.DataFrame({"product_id": [f"p{i}" for i in range(60)],
+                             "product_category_name": [rnd.choice(categories + [None]) for _ in range(60)]})
+    translation = pd.DataFrame({"product_category_name": categories[:6],
+                                "product_category_name_english": [f"category {i}" for i in range(6)]})
+    orders, payments, items = [], [], []
+    start = pd.Timestamp("2017-01-01")
+    for i in range(n_orders):
+        bought = start + pd.Timedelta(minutes=rnd.randrange(60 * 24 * 540))
+        delivered = bought + pd.Timedelta(hours=rnd.randrange(24, 24 * 40)) if rnd.random() < 0.85 else None
+        orders.append({"order_id": f"o{i}", "customer_id": f"c{rnd.randrange(150)}",
+                       "order_status": "delivered" if delivered is not None else "shipped",
+                       "order_purchase_timestamp": bought, "order_delivered_customer_date": delivered})
+        for seq in range(1, rnd.choice([1, 1, 1, 2, 3]) + 1):
+            payments.append({"order_id": f"o{i}", "payment_sequential": seq,
+                             "payment_type": rnd.choice(["credit_card", "boleto", "voucher"]),
+                             "payment_value": None if rnd.random() < 0.08 else round(rnd.uniform(5, 500), 2)})
+        for item in range(1, rnd.choice([1, 1, 2, 3]) + 1):
+            items.append({"order_id": f"o{i}", "order_item_id": item, "product_id": f"p{rnd.randrange(60)}",
+                          "seller_id": f"s{rnd.randrange(25)}", "price": round(rnd.uniform(5, 300), 2),
+                          "freight_value": round(rnd.uniform(0, 40), 2)})
+    return {"orders": pd.DataFrame(orders), "order_payments": pd.DataFrame(payments),
+            "order_items": pd.DataFrame(items), "products": products, "category_translation": translation}
+
+def verify_fixture(seed: int = 0, queries: Optional[List[str]] = None) -> List[dict]:
+    """verify_rewrites on fixture_tables(seed) in in-process DuckDB, rollups built from their
+    definitions; needs no database server or credentials."""
+    import duckdb
+
+    from execution_backends import DUCKDB_COLLATION, transpile_mysql_to_duckdb
+
+    con = duckdb.connect(":memory:")
+    try:
+        con.execute(f"SET default_collation = '{DUCKDB_COLLATION}'")
+        for name, df in fixture_tables(seed).items():
+            con.register(f"{name}__df", df)
+            con.execute(f"CREATE TABLE {name} AS SELECT * FROM {name}__df")
+        for name, r in ROLLUPS.items():
+            con.execute(f"CREATE TABLE {name} AS {transpile_mysql_to_duckdb(r.build_sql)}")
+        return verify_rewrites(None, queries, read=lambda sql: con.execute(transpile_mysql_to_duckdb(sql)).df())
+    finally:
+        con.close()
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    if cmd == "build":
+        from config import get_engine
+        build_summary_tables(get_engine())
+    elif cmd in ("verify", "verify-fixture"):
+        if cmd == "verify":
+            from config import get_engine
+            results = verify_rewrites(get_engine())
+        else:
+            results = verify_fixture()
+        for r in results:
+            print(("✅" if r["ok"] else "❌"), r["sql"][:100], "|", r["reason"] or r["rewritten"])
+        sys.exit(0 if all(r["ok"] for r in results) else 1)
+    else:
+        sys.exit(f"unknown command {cmd!r}; use 'build', 'verify' or 'verify-fixture'")
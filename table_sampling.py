@@ -0,0 +1,219 @@
+# table_sampling.py
+"""
+Row sampling whose cost scales with the sample size, not the table size.
+
+`ORDER BY RAND() LIMIT n` sorts the whole table; on tens of millions of rows that is minutes
+per table. sample_table(engine, table, n) picks a strategy per table instead:
+
+  reservoir  small tables (<= SAMPLE_MAX_SCAN_ROWS by INFORMATION_SCHEMA estimate) or tables
+             without a usable key: stream `SELECT *` through a server-side cursor and keep a
+             uniform reservoir (Algorithm R). The scan stops at SAMPLE_MAX_SCAN_ROWS, so on
+             keyless big tables the sample is uniform over that prefix only (reported as such).
+  pk_range   n random points between MIN and MAX of the leading primary-key column, one index
+             seek each (`key >= point ORDER BY key LIMIT 1`, all in one UNION ALL query).
+             Integer keys and hash-like string keys (e.g. the 32-hex-digit Olist ids) are close to
+             uniform over their range, so this is close to a uniform row sample. String keys are
+             interpolated over the character classes seen in MIN/MAX.
+  block      like pk_range, but each seek reads a run of `block_rows` consecutive rows: fewer
+             seeks for big samples (e.g. column statistics), at the price of clustering.
+
+Seeds are reproducible: the same (seed, table, n) draws the same points. Every call returns the
+time it took and how many rows it touched (SampleResult), and is observed as
+table_sample_seconds{strategy} / table_sample_rows_scanned_total.
+
+Used by build_knowledgebase.py (KB_SAMPLE_SEED) and column_stats.py.
+
+CLI:
+  python table_sampling.py <table> [n] [--strategy auto|reservoir|pk_range|block] [--seed S]
+"""
+import argparse
+import math
+import random
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+
+from config import KB_SAMPLE_SEED, SAMPLE_MAX_SCAN_ROWS
+from telemetry import METRICS, span
+
+STRATEGIES = ("auto", "reservoir", "pk_range", "block")
+BLOCK_ROWS = 100
+BLOCK_THRESHOLD = 1000   # auto: samples above this many rows use block instead of pk_range
+_SEEK_ROUNDS = 3         # pk_range/block: extra rounds when seeks land on the same rows
+_SEEKS_PER_QUERY = 200   # index seeks UNIONed into one statement
+
+@dataclass
+class SampleResult:
+    table: str
+    strategy: str
+    df: pd.DataFrame
+    seconds: float
+    rows_scanned: int
+    table_rows: int          # INFORMATION_SCHEMA estimate (exact for reservoir scans that finished)
+    complete: bool = False   # the sample is the whole table
+
+    def summary(self) -> str:
+        return (f"{self.table}: {len(self.df)} rows via {self.strategy} in {self.seconds:.2f}s "
+                f"(scanned {self.rows_scanned:,} of ~{self.table_rows:,})")
+
+def _rng(seed: int, table: str) -> random.Random:
+    return random.Random((int(seed) << 32) ^ zlib.crc32(table.encode("utf-8")))
+
+# ---------------- Table metadata ----------------
+def _table_rows(conn, table: str) -> int:
+    return int(conn.execute(text(
+        "SELECT TABLE_ROWS FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t"
+    ), {"t": table}).scalar() or 0)
+
+def _key_column(conn, table: str) -> Optional[Tuple[str, str]]:
+    """(leading primary-key column, DATA_TYPE), or None."""
+    row = conn.execute(text("""
+        SELECT k.COLUMN_NAME, c.DATA_TYPE
+        FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE k
+        JOIN INFORMATION_SCHEMA.COLUMNS c
+          ON c.TABLE_SCHEMA = k.TABLE_SCHEMA AND c.TABLE_NAME = k.TABLE_NAME AND c.COLUMN_NAME = k.COLUMN_NAME
+        WHERE k.TABLE_SCHEMA = DATABASE() AND k.TABLE_NAME = :t
+          AND k.CONSTRAINT_NAME = 'PRIMARY' AND k.ORDINAL_POSITION = 1
+    """), {"t": table}).fetchone()
+    return (row[0], str(row[1]).lower()) if row else None
+
+# ---------------- Strategies ----------------
+def _reservoir(engine, table: str, n: int, rng: random.Random, max_scan: int) -> Tuple[pd.DataFrame, int, bool]:
+    """(sample, rows read, whether the scan reached the end of the table)."""
+    keep: List[Any] = []
+    seen = 0
+    finished = True
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=1000).execute(
+            text(f"SELECT * FROM `{table}`"))
+        columns = list(result.keys())
+        for row in result:
+            if seen >= max_scan:
+                finished = False
+                break
+            if len(keep) < n:
+                keep.append(tuple(row))
+            else:
+                j = rng.randrange(seen + 1)
+                if j < n:
+                    keep[j] = tuple(row)
+            seen += 1
+        result.close()
+    return pd.DataFrame(keep, columns=columns), seen, finished
+
+_INT_TYPES = {"tinyint", "smallint", "mediumint", "int", "integer", "bigint"}
+_PREFIX = 10  # string keys are interpolated on their first 10 characters
+_CLASSES = ("0123456789", "abcdefghijklmnopqrstuvwxyz", "ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+
+def _alphabet(lo: str, hi: str) -> str:
+    """Characters the keys are assumed to use: per character class seen in MIN/MAX, the span
+    between the smallest and largest seen (so 32-hex-digit ids get 0-9a-f), plus anything else seen."""
+    seen = set(lo + hi)
+    chars = set(seen)
+    for cls in _CLASSES:
+        idx = [cls.index(c) for c in seen if c in cls]
+        if idx:
+            chars.update(cls[min(idx):max(idx) + 1])
+    return "".join(sorted(chars))
+
+def _str_to_int(s: str, alphabet: str) -> int:
+    v = 0
+    for c in s[:_PREFIX].ljust(_PREFIX, alphabet[0]):
+        v = v * len(alphabet) + alphabet.index(c)
+    return v
+
+def _int_to_str(v: int, alphabet: str) -> str:
+    out = []
+    for _ in range(_PREFIX):
+        v, d = divmod(v, len(alphabet))
+        out.append(alphabet[d])
+    return "".join(reversed(out))
+
+def _points(lo: Any, hi: Any, k: int, rng: random.Random, integer: bool) -> List[Any]:
+    if integer:
+        return [rng.randint(int(lo), int(hi)) for _ in range(k)]
+    lo, hi = str(lo), str(hi)
+    alphabet = _alphabet(lo, hi)
+    a, b = _str_to_int(lo, alphabet), _str_to_int(hi, alphabet)
+    if b <= a:
+        return [lo] * k
+    return [_int_to_str(rng.randint(a, b), alphabet) for _ in range(k)]
+
+def _seek(engine, table: str, key: Tuple[str, str], n: int, per_seek: int,
+          rng: random.Random) -> Tuple[pd.DataFrame, int]:
+    col, dtype = key
+    with engine.connect() as conn:
+        lo, hi = conn.execute(text(f"SELECT MIN(`{col}`), MAX(`{col}`) FROM `{table}`")).fetchone()
+    if lo is None:
+        return pd.DataFrame(), 0
+    frames: List[pd.DataFrame] = []
+    got, scanned = 0, 0
+    for _ in range(_SEEK_ROUNDS):
+        seeks = math.ceil((n - got) / per_seek)
+        pts = _points(lo, hi, seeks, rng, dtype in _INT_TYPES)
+        for start in range(0, len(pts), _SEEKS_PER_QUERY):
+            batch = pts[start:start + _SEEKS_PER_QUERY]
+            parts = [f"SELECT * FROM (SELECT * FROM `{table}` WHERE `{col}` >= :p{i} "
+                     f"ORDER BY `{col}` LIMIT {per_seek}) AS s{i}" for i in range(len(batch))]
+            df = pd.read_sql(text(" UNION ALL ".join(parts)), con=engine,
+                             params={f"p{i}": p for i, p in enumerate(batch)})
+            scanned += len(df)
+            frames.append(df)
+        sample = pd.concat(frames, ignore_index=True).drop_duplicates(ignore_index=True)
+        got = len(sample)
+        if got >= n:
+            break
+    sample = pd.concat(frames, ignore_index=True).drop_duplicates(ignore_index=True)
+    return sample.head(n), scanned
+
+# ---------------- Entry point ----------------
+def choose_strategy(table_rows: int, n: int, key: Optional[Tuple[str, str]],
+                    max_scan: int = SAMPLE_MAX_SCAN_ROWS) -> str:
+    if table_rows <= max_scan or key is None:
+        return "reservoir"
+    return "block" if n > BLOCK_THRESHOLD else "pk_range"
+
+def sample_table(engine, table: str, n: int = 100, *, seed: int = KB_SAMPLE_SEED, strategy: str = "auto",
+                 max_scan: int = SAMPLE_MAX_SCAN_ROWS, block_rows: int = BLOCK_ROWS) -> SampleResult:
+    """About `n` rows of `table`; see the module docstring for the strategies."""
+    if strategy not in STRATEGIES:
+        raise ValueError(f"unknown sampling strategy {strategy!r}; use one of {STRATEGIES}")
+    t0 = time.perf_counter()
+    with engine.connect() as conn:
+        table_rows = _table_rows(conn, table)
+        key = _key_column(conn, table)
+    if strategy == "auto":
+        strategy = choose_strategy(table_rows, n, key, max_scan)
+    elif strategy != "reservoir" and key is None:
+        strategy = "reservoir"  # nothing to seek on
+    rng = _rng(seed, table)
+    complete = False
+    with span("db.table_sample", table=table, strategy=strategy):
+        if strategy == "reservoir":
+            df, scanned, finished = _reservoir(engine, table, n, rng, max(max_scan, n))
+            if finished:
+                table_rows = scanned
+                complete = scanned <= n
+        else:
+            df, scanned = _seek(engine, table, key, n, block_rows if strategy == "block" else 1, rng)
+    seconds = time.perf_counter() - t0
+    METRICS.observe("table_sample_seconds", seconds, strategy=strategy)
+    METRICS.inc("table_sample_rows_scanned_total", scanned, strategy=strategy)
+    return SampleResult(table, strategy, df, seconds, scanned, table_rows, complete)
+
+if __name__ == "__main__":
+    from config import get_engine
+
+    ap = argparse.ArgumentParser(description="Sample rows from a table and report the cost.")
+    ap.add_argument("table")
+    ap.add_argument("n", nargs="?", type=int, default=100)
+    ap.add_argument("--strategy", default="auto", choices=STRATEGIES)
+    ap.add_argument("--seed", type=int, default=KB_SAMPLE_SEED)
+    args = ap.parse_args()
+    res = sample_table(get_engine(), args.table, args.n, seed=args.seed, strategy=args.strategy)
+    print(res.summary())
+    print(res.df.head(10).to_string())
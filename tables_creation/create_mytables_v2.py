@@ -1,5 +1,28 @@
 # create_mytables_v2.py
+"""
+Bulk loader for the Olist CSVs.
+
+- Streams each CSV in large chunks (--chunk-rows) instead of materializing it whole.
+- Inserts with large executemany batches (mysql-connector rewrites them into multi-row
+  INSERTs), or with LOAD DATA LOCAL INFILE (--method infile).
+- Loads independent tables in parallel (--workers).
+- Tables are created bare; index/key creation is deferred to the post-load step.
+- Modes: replace (drop + reload), append (insert everything), incremental (insert only rows
+  whose natural key is not present yet, via a staging table).
+- Reports rows/second per table.
+
+Usage:
+  python create_mytables_v2.py                       # full replace, executemany, 4 workers
+  python create_mytables_v2.py --mode incremental --tables orders order_items
+  python create_mytables_v2.py --method infile       # needs local_infile=1 on the server
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Dict, List, Optional
+
 import pandas as pd
 from sqlalchemy import create_engine, text
 from sqlalchemy.types import String, Integer, DateTime, DECIMAL, Text
@@ -13,169 +36,322 @@ DB_HOST = "localhost"
 DB_PORT = 3306
 DB_NAME = "txt2sql_v2"
 
-def p(name: str) -> str:
-    """Absolute path to a CSV under DATA_DIR; raises if missing."""
-    path = DATA_DIR / name
-    if not path.exists():
-        raise FileNotFoundError(f"CSV not found: {path}")
-    return str(path)
+CHUNK_ROWS = 50_000
+BATCH_ROWS = 5_000
 
-print(f"📁 Using DATA_DIR: {DATA_DIR}")
-
-# ---------- CREATE DB IF NEEDED ----------
-server_engine = create_engine(f"mysql+mysqlconnector://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}")
-with server_engine.begin() as conn:
-    conn.execute(text(
-        f"CREATE DATABASE IF NOT EXISTS {DB_NAME} "
-        "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"
-    ))
-print(f"✅ Ensured database exists: {DB_NAME}")
-
-# ---------- CONNECT TO TARGET DB ----------
-engine = create_engine(f"mysql+mysqlconnector://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
-
-# ---- ORDERS ----
-orders = pd.read_csv(
-    p('olist_orders_dataset.csv'),
-    parse_dates=[
-        'order_purchase_timestamp','order_approved_at',
-        'order_delivered_carrier_date','order_delivered_customer_date',
-        'order_estimated_delivery_date'
-    ]
-)
-orders.to_sql(
-    'orders', engine, if_exists='replace', index=False,
-    dtype={
-        'order_id': String(64),
-        'customer_id': String(64),
-        'order_status': String(32),
-        'order_purchase_timestamp': DateTime(),
-        'order_approved_at': DateTime(),
-        'order_delivered_carrier_date': DateTime(),
-        'order_delivered_customer_date': DateTime(),
-        'order_estimated_delivery_date': DateTime(),
+# ---------- TABLE SPECS ----------
+# key = natural key (used for incremental loads and, after load, for primary keys)
+TABLES: Dict[str, dict] = {
+    "orders": {
+        "csv": "olist_orders_dataset.csv",
+        "key": ["order_id"],
+        "parse_dates": [
+            'order_purchase_timestamp', 'order_approved_at',
+            'order_delivered_carrier_date', 'order_delivered_customer_date',
+            'order_estimated_delivery_date',
+        ],
+        "dtype": {
+            'order_id': String(64),
+            'customer_id': String(64),
+            'order_status': String(32),
+            'order_purchase_timestamp': DateTime(),
+            'order_approved_at': DateTime(),
+            'order_delivered_carrier_date': DateTime(),
+            'order_delivered_customer_date': DateTime(),
+            'order_estimated_delivery_date': DateTime(),
+        },
     },
-    chunksize=50, method='multi'
-)
-print("✅ Loaded: orders")
-
-# ---- ORDER_PAYMENTS ----
-op = pd.read_csv(p('olist_order_payments_dataset.csv'))
-op.to_sql(
-    'order_payments', engine, if_exists='replace', index=False,
-    dtype={
-        'order_id': String(64),
-        'payment_sequential': Integer(),
-        'payment_type': String(32),
-        'payment_installments': Integer(),
-        'payment_value': DECIMAL(12, 2),
+    "order_payments": {
+        "csv": "olist_order_payments_dataset.csv",
+        "key": ["order_id", "payment_sequential"],
+        "dtype": {
+            'order_id': String(64),
+            'payment_sequential': Integer(),
+            'payment_type': String(32),
+            'payment_installments': Integer(),
+            'payment_value': DECIMAL(12, 2),
+        },
     },
-    chunksize=50, method='multi'
-)
-print("✅ Loaded: order_payments")
-
-# ---- ORDER_ITEMS ----
-oi = pd.read_csv(p('olist_order_items_dataset.csv'), parse_dates=['shipping_limit_date'])
-oi.to_sql(
-    'order_items', engine, if_exists='replace', index=False,
-    dtype={
-        'order_id': String(64),
-        'order_item_id': Integer(),
-        'product_id': String(64),
-        'seller_id': String(64),
-        'shipping_limit_date': DateTime(),
-        'price': DECIMAL(12, 2),
-        'freight_value': DECIMAL(12, 2),
+    "order_items": {
+        "csv": "olist_order_items_dataset.csv",
+        "key": ["order_id", "order_item_id"],
+        "parse_dates": ['shipping_limit_date'],
+        "dtype": {
+            'order_id': String(64),
+            'order_item_id': Integer(),
+            'product_id': String(64),
+            'seller_id': String(64),
+            'shipping_limit_date': DateTime(),
+            'price': DECIMAL(12, 2),
+            'freight_value': DECIMAL(12, 2),
+        },
     },
-    chunksize=50, method='multi'
-)
-print("✅ Loaded: order_items")
-
-# ---- ORDER_REVIEWS ----
-orv = pd.read_csv(
-    p('olist_order_reviews_dataset.csv'),
-    parse_dates=['review_creation_date','review_answer_timestamp']
-)
-orv.to_sql(
-    'order_reviews', engine, if_exists='replace', index=False,
-    dtype={
-        'review_id': String(64),
-        'order_id': String(64),
-        'review_score': Integer(),
-        'review_comment_title': String(255),
-        # Use Text() for long messages
-        'review_comment_message': Text(),
-        'review_creation_date': DateTime(),
-        'review_answer_timestamp': DateTime(),
+    "order_reviews": {
+        "csv": "olist_order_reviews_dataset.csv",
+        "key": ["review_id", "order_id"],
+        "parse_dates": ['review_creation_date', 'review_answer_timestamp'],
+        "dtype": {
+            'review_id': String(64),
+            'order_id': String(64),
+            'review_score': Integer(),
+            'review_comment_title': String(255),
+            # Use Text() for long messages
+            'review_comment_message': Text(),
+            'review_creation_date': DateTime(),
+            'review_answer_timestamp': DateTime(),
+        },
     },
-    chunksize=50, method='multi'
-)
-print("✅ Loaded: order_reviews")
-
-# ---- CUSTOMER ----
-cust = pd.read_csv(p('olist_customers_dataset.csv'))
-cust.to_sql(
-    'customer', engine, if_exists='replace', index=False,
-    dtype={
-        'customer_id': String(64),
-        'customer_unique_id': String(64),
-        'customer_zip_code_prefix': Integer(),
-        'customer_city': String(128),
-        'customer_state': String(4),
+    "customer": {
+        "csv": "olist_customers_dataset.csv",
+        "key": ["customer_id"],
+        "dtype": {
+            'customer_id': String(64),
+            'customer_unique_id': String(64),
+            'customer_zip_code_prefix': Integer(),
+            'customer_city': String(128),
+            'customer_state': String(4),
+        },
     },
-    chunksize=50, method='multi'
-)
-print("✅ Loaded: customer")
-
-# ---- PRODUCTS ----
-prod = pd.read_csv(p('olist_products_dataset.csv'))
-for col in [
-    'product_name_lenght','product_description_lenght','product_photos_qty',
-    'product_weight_g','product_length_cm','product_height_cm','product_width_cm'
-]:
-    prod[col] = pd.to_numeric(prod[col], errors='coerce').astype('Int64')
-
-prod.to_sql(
-    'products', engine, if_exists='replace', index=False,
-    dtype={
-        'product_id': String(64),
-        'product_category_name': String(128),
-        'product_name_lenght': Integer(),
-        'product_description_lenght': Integer(),
-        'product_photos_qty': Integer(),
-        'product_weight_g': Integer(),
-        'product_length_cm': Integer(),
-        'product_height_cm': Integer(),
-        'product_width_cm': Integer(),
+    "products": {
+        "csv": "olist_products_dataset.csv",
+        "key": ["product_id"],
+        "int_columns": [
+            'product_name_lenght', 'product_description_lenght', 'product_photos_qty',
+            'product_weight_g', 'product_length_cm', 'product_height_cm', 'product_width_cm',
+        ],
+        "dtype": {
+            'product_id': String(64),
+            'product_category_name': String(128),
+            'product_name_lenght': Integer(),
+            'product_description_lenght': Integer(),
+            'product_photos_qty': Integer(),
+            'product_weight_g': Integer(),
+            'product_length_cm': Integer(),
+            'product_height_cm': Integer(),
+            'product_width_cm': Integer(),
+        },
     },
-    chunksize=50, method='multi'
-)
-print("✅ Loaded: products")
-
-# ---- SELLERS ----
-sel = pd.read_csv(p('olist_sellers_dataset.csv'))
-sel.to_sql(
-    'sellers', engine, if_exists='replace', index=False,
-    dtype={
-        'seller_id': String(64),
-        'seller_zip_code_prefix': Integer(),
-        'seller_city': String(128),
-        'seller_state': String(4),
+    "sellers": {
+        "csv": "olist_sellers_dataset.csv",
+        "key": ["seller_id"],
+        "dtype": {
+            'seller_id': String(64),
+            'seller_zip_code_prefix': Integer(),
+            'seller_city': String(128),
+            'seller_state': String(4),
+        },
     },
-    chunksize=50, method='multi'
-)
-print("✅ Loaded: sellers")
-
-# ---- CATEGORY_TRANSLATION ----
-ct = pd.read_csv(p('product_category_name_translation.csv'))
-ct.to_sql(
-    'category_translation', engine, if_exists='replace', index=False,
-    dtype={
-        'product_category_name': String(128),
-        'product_category_name_english': String(128),
+    "category_translation": {
+        "csv": "product_category_name_translation.csv",
+        "key": ["product_category_name"],
+        "dtype": {
+            'product_category_name': String(128),
+            'product_category_name_english': String(128),
+        },
     },
-    chunksize=50, method='multi'
-)
-print("✅ Loaded: category_translation")
+}
+
+def p(name: str) -> str:
+    """Absolute path to a CSV under DATA_DIR; raises if missing."""
+    path = DATA_DIR / name
+    if not path.exists():
+        raise FileNotFoundError(f"CSV not found: {path}")
+    return str(path)
+
+def server_url() -> str:
+    return f"mysql+mysqlconnector://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}"
+
+def make_engine(local_infile: bool = False, pool_size: int = 4):
+    connect_args = {"allow_local_infile": True} if local_infile else {}
+    return create_engine(f"{server_url()}/{DB_NAME}", connect_args=connect_args,
+                         pool_size=pool_size, max_overflow=pool_size)
+
+# ---------- Helpers ----------
+def _prepare(chunk: pd.DataFrame, spec: dict) -> pd.DataFrame:
+    for col in spec.get("int_columns", []):
+        chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype('Int64')
+    return chunk
+
+def _rows(chunk: pd.DataFrame) -> List[tuple]:
+    """DataFrame → DB-API tuples (NaN/NaT → None, Timestamps → datetime)."""
+    obj = chunk.astype(object).where(pd.notna(chunk), None)
+    for col in chunk.columns:
+        if pd.api.types.is_datetime64_any_dtype(chunk[col]):
+            obj[col] = [v.to_pydatetime() if v is not None else None for v in obj[col]]
+    return list(obj.itertuples(index=False, name=None))
+
+def _create_table(engine, target: str, spec: dict, columns: List[str]) -> None:
+    """Create an empty table with the spec's column types and no indexes."""
+    empty = pd.DataFrame({c: pd.Series(dtype="object") for c in columns})
+    empty.to_sql(target, engine, if_exists='replace', index=False,
+                 dtype={c: t for c, t in spec["dtype"].items() if c in columns})
+
+def _table_exists(conn, table: str) -> bool:
+    return bool(conn.execute(text(
+        "SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t"
+    ), {"t": table}).scalar())
+
+def _insert_executemany(engine, target: str, spec: dict, chunk_rows: int, batch_rows: int,
+                        fresh: bool = False) -> int:
+    """Batched INSERTs. Only into a `fresh` (just created, empty) table are unique/foreign-key
+    checks skipped; they are restored before the pooled connection goes back."""
+    total = 0
+    reader = pd.read_csv(p(spec["csv"]), parse_dates=spec.get("parse_dates") or False, chunksize=chunk_rows)
+    raw = engine.raw_connection()
+    cur = None
+    try:
+        cur = raw.cursor()
+        if fresh:
+            cur.execute("SET SESSION unique_checks = 0")
+            cur.execute("SET SESSION foreign_key_checks = 0")
+        sql = None
+        for chunk in reader:
+            chunk = _prepare(chunk, spec)
+            if sql is None:
+                cols = ", ".join(f"`{c}`" for c in chunk.columns)
+                marks = ", ".join(["%s"] * len(chunk.columns))
+                sql = f"INSERT INTO `{target}` ({cols}) VALUES ({marks})"
+            rows = _rows(chunk)
+            for i in range(0, len(rows), batch_rows):
+                cur.executemany(sql, rows[i:i + batch_rows])
+            raw.commit()
+            total += len(rows)
+    finally:
+        try:
+            if cur is not None:
+                if fresh:
+                    cur.execute("SET SESSION unique_checks = 1")
+                    cur.execute("SET SESSION foreign_key_checks = 1")
+                cur.close()
+        finally:
+            raw.close()
+    return total
+
+def _insert_infile(engine, target: str, spec: dict, columns: List[str]) -> int:
+    """LOAD DATA LOCAL INFILE; empty CSV fields become NULL."""
+    variables = ", ".join(f"@v{i}" for i in range(len(columns)))
+    sets = ", ".join(f"`{c}` = NULLIF(@v{i}, '')" for i, c in enumerate(columns))
+    path = p(spec["csv"]).replace("\\", "/")
+    with engine.begin() as conn:
+        res = conn.execute(text(
+            f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE `{target}` "
+            "CHARACTER SET utf8mb4 FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+            f"LINES TERMINATED BY '\\n' IGNORE 1 LINES ({variables}) SET {sets}"
+        ))
+        return int(res.rowcount or 0)
+
+def load_table(engine, table: str, *, mode: str = "replace", method: str = "executemany",
+               chunk_rows: int = CHUNK_ROWS, batch_rows: int = BATCH_ROWS) -> dict:
+    """Load one table; returns {"table", "rows", "seconds", "rows_per_s"}."""
+    spec = TABLES[table]
+    columns = list(pd.read_csv(p(spec["csv"]), nrows=0).columns)
+    t0 = time.perf_counter()
+
+    with engine.connect() as conn:
+        exists = _table_exists(conn, table)
+    if mode == "replace" or not exists:
+        _create_table(engine, table, spec, columns)
+    target = table
+    if mode == "incremental" and exists:
+        target = f"{table}__stage"
+        _create_table(engine, target, spec, columns)
+
+    if method == "infile":
+        rows = _insert_infile(engine, target, spec, columns)
+    else:
+        fresh = mode == "replace" or not exists or target != table
+        rows = _insert_executemany(engine, target, spec, chunk_rows, batch_rows, fresh=fresh)
+
+    if target != table:
+        on = " AND ".join(f"t.`{k}` <=> s.`{k}`" for k in spec["key"])
+        cols = ", ".join(f"s.`{c}`" for c in columns)
+        with engine.begin() as conn:
+            res = conn.execute(text(
+                f"INSERT INTO `{table}` ({', '.join(f'`{c}`' for c in columns)}) "
+                f"SELECT {cols} FROM `{target}` s LEFT JOIN `{table}` t ON {on} "
+                f"WHERE t.`{spec['key'][0]}` IS NULL"
+            ))
+            staged, rows = rows, int(res.rowcount or 0)
+            conn.execute(text(f"DROP TABLE `{target}`"))
+        print(f"   {table}: {staged} staged, {rows} new")
+
+    secs = time.perf_counter() - t0
+    stats = {"table": table, "rows": rows, "seconds": round(secs, 2),
+             "rows_per_s": round(rows / secs, 1) if secs else 0.0}
+    print(f"✅ Loaded: {table}  {rows} rows in {stats['seconds']}s ({stats['rows_per_s']} rows/s)")
+    return stats
+
+def post_load(engine, tables: List[str]) -> None:
+    """
+    Work deferred until all data is in: primary keys + join/filter indexes (bulk-built once
+    instead of maintained row by row), summary tables, the *__sample preview tables, the column
+    statistics of changed tables, the schema catalog (join keys, routing groups) and, if present,
+    the DuckDB snapshots (rebuilt so they match the raw tables).
+    """
+    sys.path.insert(0, str(BASE_DIR.parent))
+    from index_manager import ensure_indexes
+    from summary_tables import build_summary_tables
+    from sample_tables import build_sample_tables
+    from column_stats import refresh_catalog
+    from schema_catalog import build_catalog
+
+    for a in ensure_indexes(engine):
+        print(f"🔑 [{a['reason']}] {a['status']}: {a['ddl']} ({a['seconds']}s)")
+    build_summary_tables(engine)
+    build_sample_tables(engine)
+    refreshed = [t for t, status in refresh_catalog(engine).items() if status == "refreshed"]
+    print(f"📊 Column statistics refreshed for {len(refreshed)} tables")
+    schema = build_catalog(engine)
+    print(f"🔎 Schema catalog: {len(schema['tables'])} tables, {len(schema['groups'])} routing groups")
+
+    # Keep DuckDB Parquet snapshots in step with MySQL when they are in use.
+    from execution_backends import DUCKDB_SNAPSHOT_DIR, snapshot_tables
+    if Path(DUCKDB_SNAPSHOT_DIR).is_dir():
+        counts = snapshot_tables(engine, DUCKDB_SNAPSHOT_DIR)
+        print(f"🦆 Refreshed {len(counts)} Parquet snapshots in {DUCKDB_SNAPSHOT_DIR}")
+
+def load_all(tables: Optional[List[str]] = None, *, mode: str = "replace", method: str = "executemany",
+             workers: int = 4, chunk_rows: int = CHUNK_ROWS, batch_rows: int = BATCH_ROWS) -> List[dict]:
+    tables = tables or list(TABLES)
+    print(f"📁 Using DATA_DIR: {DATA_DIR}")
+
+    # ---------- CREATE DB IF NEEDED ----------
+    server_engine = create_engine(server_url())
+    with server_engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE DATABASE IF NOT EXISTS {DB_NAME} "
+            "CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci"
+        ))
+    print(f"✅ Ensured database exists: {DB_NAME}")
+
+    engine = make_engine(local_infile=(method == "infile"), pool_size=max(1, workers))
+    t0 = time.perf_counter()
+    results: List[dict] = []
+    # Tables have no foreign keys between them, so they load independently.
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(load_table, engine, t, mode=mode, method=method,
+                               chunk_rows=chunk_rows, batch_rows=batch_rows): t for t in tables}
+        for fut in as_completed(futures):
+            results.append(fut.result())
+
+    post_load(engine, tables)
+    wall = time.perf_counter() - t0
+    total = sum(r["rows"] for r in results)
+    print(f"🎉 {len(results)} tables ({total} rows) loaded into {DB_NAME} in {wall:.1f}s "
+          f"({total / wall if wall else 0:.0f} rows/s overall, mode={mode}, method={method}).")
+    return results
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Load the Olist CSVs into MySQL.")
+    ap.add_argument("--mode", choices=["replace", "append", "incremental"], default="replace")
+    ap.add_argument("--method", choices=["executemany", "infile"], default="executemany")
+    ap.add_argument("--tables", nargs="*", choices=list(TABLES), help="subset of tables (default: all)")
+    ap.add_argument("--workers", type=int, default=4, help="tables loaded in parallel")
+    ap.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="CSV rows read per chunk")
+    ap.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="rows per executemany batch")
+    args = ap.parse_args(argv)
+    load_all(args.tables, mode=args.mode, method=args.method, workers=args.workers,
+             chunk_rows=args.chunk_rows, batch_rows=args.batch_rows)
 
-print(f"🎉 All tables loaded into {DB_NAME} with correct types.")
+if __name__ == "__main__":
+    main()
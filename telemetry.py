@@ -0,0 +1,316 @@
+# telemetry.py
+"""
+Lightweight tracing + metrics for the NLQ → SQL → Viz pipeline.
+
+- span(name): times a block, records it on the active request trace and in the
+  `stage_duration_seconds` histogram.
+- request_trace(): one trace per question; on exit its spans are appended to the
+  JSONL trace file (TRACE_FILE, off unless set) and a per-stage timing breakdown is available.
+- METRICS: process-wide counters/gauges/histograms rendered in Prometheus text format,
+  served by start_metrics_server() on /metrics.
+"""
+import json
+import threading
+import time
+import uuid
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from config import TRACE_FILE, METRICS_PORT
+from shared_state import shared_resource
+
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+def _label_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape_label(v: str) -> str:
+    """Label value escaping of the Prometheus text format: backslash, double quote, newline."""
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt_labels(key: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{_escape_label(v)}"' for k, v in items)
+    return "{" + body + "}"
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and histograms keyed by (name, labels)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._gauges: Dict[str, Dict[tuple, float]] = {}
+        self._hists: Dict[str, Dict[tuple, List[float]]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._hists.setdefault(name, {})
+            # layout: [count, sum, bucket_0, ..., bucket_n]
+            h = series.setdefault(key, [0.0, 0.0] + [0.0] * len(_DEFAULT_BUCKETS))
+            h[0] += 1
+            h[1] += value
+            for i, b in enumerate(_DEFAULT_BUCKETS):
+                if value <= b:
+                    h[2 + i] += 1
+
+    def counter_value(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": {n: {str(dict(k)): v for k, v in s.items()} for n, s in self._counters.items()},
+                "gauges": {n: {str(dict(k)): v for k, v in s.items()} for n, s in self._gauges.items()},
+                "histograms": {
+                    n: {str(dict(k)): {"count": h[0], "sum": h[1]} for k, h in s.items()}
+                    for n, s in self._hists.items()
+                },
+            }
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, v in series.items():
+                    lines.append(f"{name}{_fmt_labels(key)} {v}")
+            for name, series in sorted(self._gauges.items()):
+                lines.append(f"# TYPE {name} gauge")
+                for key, v in series.items():
+                    lines.append(f"{name}{_fmt_labels(key)} {v}")
+            for name, series in sorted(self._hists.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, h in series.items():
+                    for i, b in enumerate(_DEFAULT_BUCKETS):
+                        le = "+Inf" if b == float("inf") else str(b)
+                        lines.append(f"{name}_bucket{_fmt_labels(key, ('le', le))} {h[2 + i]}")
+                    lines.append(f"{name}_count{_fmt_labels(key)} {h[0]}")
+                    lines.append(f"{name}_sum{_fmt_labels(key)} {h[1]}")
+        return "\n".join(lines) + "\n"
+
+METRICS = MetricsRegistry()
+
+# ---------------- Traces & spans ----------------
+class Trace:
+    def __init__(self, **attrs):
+        self.trace_id = uuid.uuid4().hex
+        self.attrs = attrs
+        self.started = time.time()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self.spans.append(record)
+
+    def timings(self) -> Dict[str, float]:
+        """Per-stage wall time in seconds (spans with the same name are summed)."""
+        out: Dict[str, float] = {}
+        with self._lock:
+            for s in self.spans:
+                out[s["name"]] = round(out.get(s["name"], 0.0) + s["duration_s"], 6)
+        return out
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("span", default=None)
+_file_lock = threading.Lock()
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+def current_span_name() -> Optional[str]:
+    return _current_span.get()
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block; nested spans record their parent span name."""
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    start = time.perf_counter()
+    started_at = time.time()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        dur = time.perf_counter() - start
+        _current_span.reset(token)
+        METRICS.observe("stage_duration_seconds", dur, stage=name)
+        if error:
+            METRICS.inc("stage_errors_total", stage=name, error=error)
+        tr = _current_trace.get()
+        if tr is not None:
+            rec = {"name": name, "parent": parent, "start": started_at, "duration_s": round(dur, 6)}
+            if attrs:
+                rec["attrs"] = attrs
+            if error:
+                rec["error"] = error
+            tr.add(rec)
+
+def _write_trace(tr: Trace, total_s: float, status: str) -> None:
+    if not TRACE_FILE:
+        return
+    rec = {
+        "trace_id": tr.trace_id,
+        "start": tr.started,
+        "duration_s": round(total_s, 6),
+        "status": status,
+        "attrs": tr.attrs,
+        "timings": tr.timings(),
+        "spans": tr.spans,
+    }
+    try:
+        with _file_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, default=str, ensure_ascii=False) + "\n")
+    except OSError:
+        pass
+
+@contextmanager
+def request_trace(**attrs):
+    """Open a trace for one request; the trace is written to TRACE_FILE on exit."""
+    tr = Trace(**attrs)
+    token = _current_trace.set(tr)
+    start = time.perf_counter()
+    status = "ok"
+    METRICS.inc("requests_total")
+    try:
+        yield tr
+    except BaseException as e:
+        status = type(e).__name__
+        METRICS.inc("request_errors_total", error=status)
+        raise
+    finally:
+        total = time.perf_counter() - start
+        _current_trace.reset(token)
+        METRICS.observe("request_duration_seconds", total)
+        _write_trace(tr, total, status)
+
+def traced_node(name: str, fn: Callable) -> Callable:
+    """Wrap a LangGraph node function in a span."""
+    @wraps(fn)
+    def _wrapped(state):
+        with span(name):
+            return fn(state)
+    return _wrapped
+
+# ---------------- Counters helpers ----------------
+def record_result(df) -> None:
+    """Count rows/bytes of a fetched DataFrame."""
+    try:
+        rows = int(len(df))
+        nbytes = int(df.memory_usage(deep=True).sum())
+    except Exception:
+        return
+    METRICS.inc("db_rows_fetched_total", rows)
+    METRICS.inc("db_bytes_fetched_total", nbytes)
+    tr = _current_trace.get()
+    if tr is not None:
+        tr.add({"name": "db.result", "parent": _current_span.get(), "start": time.time(),
+                "duration_s": 0.0, "attrs": {"rows": rows, "bytes": nbytes}})
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """Counts LLM calls and token usage (labelled by the enclosing span)."""
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        METRICS.inc("llm_calls_total", stage=_current_span.get() or "none")
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        METRICS.inc("llm_calls_total", stage=_current_span.get() or "none")
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+        stage = _current_span.get() or "none"
+        for kind in ("prompt_tokens", "completion_tokens"):
+            n = usage.get(kind)
+            if n:
+                METRICS.inc("llm_tokens_total", n, kind=kind.replace("_tokens", ""), stage=stage)
+
+    def on_llm_error(self, error, **kwargs):
+        METRICS.inc("llm_errors_total", error=type(error).__name__)
+
+# ---------------- DB instrumentation ----------------
+def instrument_engine(engine) -> None:
+    """Attach SQLAlchemy event hooks that time every cursor execute, and time pool checkouts
+    (db_pool_checkout_seconds: waiting for a free pooled connection, or opening a new one)."""
+    from sqlalchemy import event
+
+    if getattr(engine, "_telemetry_instrumented", False):
+        return
+
+    raw_connection = engine.raw_connection
+
+    def _timed_raw_connection(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return raw_connection(*args, **kwargs)
+        finally:
+            METRICS.observe("db_pool_checkout_seconds", time.perf_counter() - t0)
+
+    engine.raw_connection = _timed_raw_connection
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_telemetry_t0", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("_telemetry_t0") or []
+        if not stack:
+            return
+        dur = time.perf_counter() - stack.pop()
+        kind = (statement or "").lstrip().split(" ", 1)[0].upper() or "UNKNOWN"
+        METRICS.inc("db_queries_total", kind=kind)
+        METRICS.observe("db_query_seconds", dur, kind=kind)
+        tr = _current_trace.get()
+        if tr is not None:
+            tr.add({"name": "db.query", "parent": _current_span.get(), "start": time.time() - dur,
+                    "duration_s": round(dur, 6), "attrs": {"kind": kind, "sql": (statement or "")[:500]}})
+
+    engine._telemetry_instrumented = True
+
+# ---------------- Prometheus endpoint ----------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = METRICS.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@shared_resource
+def start_metrics_server(port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics on a daemon thread (once per process). Port 0 disables it."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -4,33 +4,86 @@ import json
 import re
 from typing import List
 
-def parse_nested_list(text: str) -> list:
+from telemetry import METRICS
+
+_MAX_CANDIDATES = 16  # bracketed spans tried per text, so a chatty answer stays linear-time
+_CLOSERS = {"[": "]", "{": "}"}
+
+def _literal(candidate: str):
+    try:
+        return json.loads(candidate)
+    except (ValueError, RecursionError):
+        pass
+    try:
+        return ast.literal_eval(candidate)  # single-quoted / Python-style answers
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+def _balanced_end(s: str, i: int) -> int:
+    """Index of the bracket closing the one at s[i] (strings and escapes respected), or -1."""
+    stack = [_CLOSERS[s[i]]]
+    quote = ""
+    j = i + 1
+    n = len(s)
+    while j < n:
+        c = s[j]
+        if quote:
+            if c == "\\":
+                j += 1
+            elif c == quote:
+                quote = ""
+        elif c in "\"'":
+            quote = c
+        elif c in _CLOSERS:
+            stack.append(_CLOSERS[c])
+        elif c in "]}":
+            if c != stack.pop():
+                return -1
+            if not stack:
+                return j
+        j += 1
+    return -1
+
+def extract_json(text: str, kind: type = list):
     """
-    Parse a model output that should be a JSON/Python nested list.
-    Tries JSON, then Python literal, then extracts the first top-level list from text.
-    Always returns a list (possibly empty).
+    First bracketed JSON (or Python-literal) value of type `kind` embedded in free text, or None.
+    One pass per candidate and at most _MAX_CANDIDATES candidates, so there is no regex backtracking.
     """
-    if not text:
+    s = text or ""
+    opener = "[" if kind is list else "{"
+    start = s.find(opener)
+    for _ in range(_MAX_CANDIDATES):
+        if start < 0:
+            return None
+        end = _balanced_end(s, start)
+        if end >= 0:  # an unclosed opener (e.g. "[see note" in prose) may precede the real value
+            obj = _literal(s[start:end + 1])
+            if isinstance(obj, kind):
+                return obj
+        start = s.find(opener, start + 1)
+    return None
+
+def parse_nested_list(text: str, stage: str = "unknown") -> list:
+    """
+    Parse a model output that should be a JSON/Python (nested) list.
+    Tries the whole text as JSON, then extracts the first embedded list (extract_json).
+    Always returns a list (possibly empty); outcomes are counted as llm_parse_total{stage,outcome}
+    with outcome json | extracted | failed.
+    """
+    if not text or not text.strip():
+        METRICS.inc("llm_parse_total", stage=stage, outcome="failed")
         return []
     s = text.strip()
     try:
         obj = json.loads(s)
-        return obj if isinstance(obj, list) else []
-    except Exception:
+        if isinstance(obj, list):
+            METRICS.inc("llm_parse_total", stage=stage, outcome="json")
+            return obj
+    except (ValueError, RecursionError):
         pass
-    try:
-        obj = ast.literal_eval(s)
-        return obj if isinstance(obj, list) else []
-    except Exception:
-        pass
-    m = re.search(r"\[\s*\[.*?\]\s*(,\s*\[.*?\]\s*)*\]", s, re.DOTALL)
-    if m:
-        try:
-            obj = ast.literal_eval(m.group(0))
-            return obj if isinstance(obj, list) else []
-        except Exception:
-            return []
-    return []
+    obj = extract_json(s, list)
+    METRICS.inc("llm_parse_total", stage=stage, outcome="failed" if obj is None else "extracted")
+    return obj if obj is not None else []
 
 def normalize_subquestions(entries: list) -> List[List[str]]:
     """